@@ -0,0 +1,266 @@
+import smartpy as sp
+
+# Token transfer and math helpers shared by the contracts, loaded with
+# sp.io.import_script_from_url("file:Library/ContractLibrary.py") from the repository root
+
+# Parameter of the FA2 transfer entrypoint
+FA2_TRANSFER = sp.TList(
+    sp.TRecord(
+        from_ = sp.TAddress,
+        txs = sp.TList(sp.TRecord(amount = sp.TNat, to_ = sp.TAddress, token_id = sp.TNat).layout(("to_", ("token_id", "amount"))))
+    )
+)
+
+# Parameter of the FA1.2 transfer entrypoint
+FA12_TRANSFER = sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value")))
+
+# Parameters of the FA2 update_operators entrypoint
+FA2_OPERATOR = sp.TRecord(owner = sp.TAddress, operator = sp.TAddress, token_id = sp.TNat).layout(("owner", ("operator", "token_id")))
+
+FA2_UPDATE_OPERATORS = sp.TList(sp.TVariant(add_operator = FA2_OPERATOR, remove_operator = FA2_OPERATOR))
+
+# Parameter of the FA1.2 approve entrypoint
+FA12_APPROVE = sp.TRecord(spender = sp.TAddress, value = sp.TNat).layout(("spender", "value"))
+
+class ContractLibrary(sp.Contract):
+    """Provides utility functions
+
+    Contracts inherit it next to their ErrorMessages class, TransferToken fails with the
+    ZeroTransfer message of the contract.
+    """
+
+    def TransferFATwoTokens(self, sender, receiver, amount, tokenAddress, id):
+        """Transfers FA2 tokens
+
+        Args:
+            sender: sender address
+            receiver: receiver address
+            amount: amount of tokens to be transferred
+            tokenAddress: address of the FA2 contract
+            id: id of token to be transferred
+        """
+
+        transferHandle = sp.contract(FA2_TRANSFER, tokenAddress, entry_point = "transfer").open_some()
+
+        sp.transfer(
+            [sp.record(from_ = sender, txs = [sp.record(to_ = receiver, token_id = id, amount = amount)])],
+            sp.mutez(0),
+            transferHandle
+        )
+
+    def TransferFATokens(self, sender, receiver, amount, tokenAddress):
+        """Transfers FA1.2 tokens
+
+        Args:
+            sender: sender address
+            receiver: receiver address
+            amount: amount of tokens to be transferred
+            tokenAddress: address of the FA1.2 contract
+        """
+
+        transferHandle = sp.contract(FA12_TRANSFER, tokenAddress, entry_point = "transfer").open_some()
+
+        sp.transfer(sp.record(from_ = sender, to_ = receiver, value = amount), sp.mutez(0), transferHandle)
+
+    def TransferToken(self, sender, receiver, amount, tokenAddress, id, faTwoFlag):
+        """Generic function to transfer any type of tokens, zero amounts are rejected
+
+        Args:
+            sender: sender address
+            receiver: receiver address
+            amount: amount of tokens to be transferred
+            tokenAddress: address of the token contract
+            id: id of token to be transfered (for FA2 tokens)
+            faTwoFlag: boolean describing whether the token contract is FA2 or not
+        """
+
+        sp.verify(amount > 0, self.ZeroTransfer)
+
+        sp.if faTwoFlag:
+
+            self.TransferFATwoTokens(sender, receiver, amount, tokenAddress, id)
+
+        sp.else:
+
+            self.TransferFATokens(sender, receiver, amount, tokenAddress)
+
+    def ApproveToken(self, spender, amount, tokenAddress, id, faTwoFlag):
+        """Allows spender to pull tokens held by the contract
+
+        FA1.2 allowances are reset to 0 before being set, as FA1.2 tokens reject unsafe allowance changes.
+        FA2 tokens get spender added as operator for the token id.
+
+        Args:
+            spender: address allowed to transfer the tokens
+            amount: amount of FA1.2 tokens allowed
+            tokenAddress: address of the token contract
+            id: id of token to be approved (for FA2 tokens)
+            faTwoFlag: boolean describing whether the token contract is FA2 or not
+        """
+
+        sp.if faTwoFlag:
+
+            operatorHandle = sp.contract(FA2_UPDATE_OPERATORS, tokenAddress, entry_point = "update_operators").open_some()
+
+            sp.transfer([sp.variant("add_operator", sp.record(owner = sp.self_address, operator = spender, token_id = id))], sp.mutez(0), operatorHandle)
+
+        sp.else:
+
+            approveHandle = sp.contract(FA12_APPROVE, tokenAddress, entry_point = "approve").open_some()
+
+            sp.transfer(sp.record(spender = spender, value = sp.nat(0)), sp.mutez(0), approveHandle)
+
+            sp.transfer(sp.record(spender = spender, value = amount), sp.mutez(0), approveHandle)
+
+    @sp.global_lambda
+    def square_root(x):
+        """Calculates the integer square root of a nat
+
+        Newton iterations from x decrease to floor(sqrt(x)) and stop there, so no sign or
+        result check is compiled.
+
+        Args:
+            x : nat whose square root is to be determined
+        Returns:
+            square root of x
+        """
+
+        sp.set_type(x, sp.TNat)
+
+        y = sp.local('y', x)
+
+        sp.while y.value * y.value > x:
+
+            y.value = (x // y.value + y.value) // 2
+
+        sp.result(y.value)
+
+class LPLedger:
+    """FA1.2 entrypoints of the LP token, added to an exchange holding the LP ledger itself
+
+    The exchange stores the balances and approvals big maps, names its LP total supply field
+    in LPSupplyField and fails with the Insufficient, NotAllowed and UnsafeAllowanceChange
+    messages of its ErrorMessages class.
+    """
+
+    def AddLedger(self):
+        """Adds the ledger storage, entrypoints and views to the exchange, called from its __init__
+        """
+
+        self.update_initial_storage(
+            balances = sp.big_map(tkey = sp.TAddress, tvalue = sp.TNat),
+            approvals = sp.big_map(tkey = sp.TAddress, tvalue = sp.TMap(sp.TAddress, sp.TNat))
+        )
+
+        self.transfer = sp.entry_point(LPLedger.transfer)
+        self.approve = sp.entry_point(LPLedger.approve)
+        self.getBalance = sp.utils.view(sp.TNat)(LPLedger.getBalance)
+        self.getAllowance = sp.utils.view(sp.TNat)(LPLedger.getAllowance)
+        self.getTotalSupply = sp.utils.view(sp.TNat)(LPLedger.getTotalSupply)
+
+    def transfer(self, params):
+        """Transfers LP tokens, from_ must be the sender or have approved the sender
+
+        Args:
+            from_: account the LP tokens are taken from
+            to_: account credited with the LP tokens
+            value: amount of LP tokens
+        """
+
+        sp.set_type(params, FA12_TRANSFER)
+
+        sp.if params.from_ != sp.sender:
+
+            approvals = sp.local('approvals', self.data.approvals.get(params.from_, sp.map(tkey = sp.TAddress, tvalue = sp.TNat)))
+
+            allowance = sp.local('allowance', approvals.value.get(sp.sender, sp.nat(0)))
+
+            sp.verify(allowance.value >= params.value, self.NotAllowed)
+
+            approvals.value[sp.sender] = sp.as_nat(allowance.value - params.value)
+
+            self.data.approvals[params.from_] = approvals.value
+
+        fromBalance = sp.local('fromBalance', self.data.balances.get(params.from_, sp.nat(0)))
+
+        sp.verify(fromBalance.value >= params.value, self.Insufficient)
+
+        self.data.balances[params.from_] = sp.as_nat(fromBalance.value - params.value)
+
+        self.data.balances[params.to_] = self.data.balances.get(params.to_, sp.nat(0)) + params.value
+
+    def approve(self, params):
+        """Approves a spender, a nonzero allowance can only be set back to zero first
+
+        Args:
+            spender: account allowed to transfer the LP tokens of the sender
+            value: amount of LP tokens allowed
+        """
+
+        sp.set_type(params, FA12_APPROVE)
+
+        approvals = sp.local('approvals', self.data.approvals.get(sp.sender, sp.map(tkey = sp.TAddress, tvalue = sp.TNat)))
+
+        sp.verify((approvals.value.get(params.spender, sp.nat(0)) == 0) | (params.value == 0), self.UnsafeAllowanceChange)
+
+        approvals.value[params.spender] = params.value
+
+        self.data.approvals[sp.sender] = approvals.value
+
+    def getBalance(self, params):
+
+        sp.set_type(params, sp.TAddress)
+
+        sp.result(self.data.balances.get(params, sp.nat(0)))
+
+    def getAllowance(self, params):
+
+        sp.set_type(params, sp.TRecord(owner = sp.TAddress, spender = sp.TAddress))
+
+        sp.result(self.data.approvals.get(params.owner, sp.map(tkey = sp.TAddress, tvalue = sp.TNat)).get(params.spender, sp.nat(0)))
+
+    def getTotalSupply(self, params):
+
+        sp.set_type(params, sp.TUnit)
+
+        sp.result(getattr(self.data, self.LPSupplyField))
+
+if "templates" not in __name__:
+
+    class LibraryTester(ContractLibrary):
+
+        ZeroTransfer = "Zero_Amount_Transfer"
+
+        def __init__(self):
+
+            self.init(root = sp.nat(0))
+
+        @sp.entry_point
+        def squareRoot(self, x):
+
+            self.data.root = self.square_root(x)
+
+        @sp.entry_point
+        def transfer(self, params):
+
+            self.TransferToken(sp.self_address, params.receiver, params.amount, params.tokenAddress, params.id, params.faTwoFlag)
+
+    @sp.add_test(name = "Contract Library")
+    def test():
+
+        scenario = sp.test_scenario()
+        scenario.h1("Contract Library")
+
+        alice = sp.test_account("Alice")
+        token = sp.address("KT1Tezooo1zzSmartPyzzSTATiCzzzwwBFA1")
+
+        c1 = LibraryTester()
+        scenario += c1
+
+        for x in [0, 1, 2, 3, 4, 15, 16, 17, 10 ** 12 - 1, 10 ** 12, 2 ** 128 + 1]:
+
+            c1.squareRoot(x).run(sender = alice)
+            scenario.verify(c1.data.root * c1.data.root <= x)
+            scenario.verify(x < (c1.data.root + 1) * (c1.data.root + 1))
+
+        c1.transfer(receiver = alice.address, amount = 0, tokenAddress = token, id = 0, faTwoFlag = False).run(sender = alice, valid = False)
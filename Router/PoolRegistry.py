@@ -0,0 +1,349 @@
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Curve types of the registered pools
+AMM_CURVE = 1
+
+FLAT_CURVE = 2
+
+POOL_INFO = sp.TRecord(
+    token1Address = sp.TAddress,
+    token1Id = sp.TNat,
+    token1Check = sp.TBool,
+    token2Address = sp.TAddress,
+    token2Id = sp.TNat,
+    token2Check = sp.TBool,
+    curve = sp.TNat
+)
+
+POOL_STATE = sp.TRecord(
+    token1_pool = sp.TNat,
+    token2_pool = sp.TNat,
+    lpFee = sp.TNat,
+    # Divisor of the swapped amount like lpFee, none for curves charging no system fee
+    systemFee = sp.TOption(sp.TNat),
+    token1Precision = sp.TNat,
+    token2Precision = sp.TNat
+)
+
+PAIR_KEY = sp.TRecord(tokenA = sp.TAddress, idA = sp.TNat, tokenB = sp.TAddress, idB = sp.TNat, curve = sp.TNat)
+
+TOKEN_KEY = sp.TRecord(tokenAddress = sp.TAddress, tokenId = sp.TNat)
+
+class ErrorMessages:
+    """Specifies the different Error Types in the contracts
+    """
+    def make(s):
+        """Generates standard error messages prepending contract name (PlentyRegistry_)
+        Args:
+            s: error message string
+        Returns:
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
+        """
+
+        message = "PlentyRegistry_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
+
+
+    NotAdmin = make("Not_Admin")
+
+    InvalidCurve = make("Invalid_Curve")
+
+    InvalidPair = make("Invalid_Pair")
+
+    PoolExists = make("Pool_Already_Registered")
+
+    PoolNotFound = make("Pool_Not_Registered")
+
+    InvalidView = make("Invalid_Pool_View")
+
+class PoolRegistry(ErrorMessages, sp.Contract):
+
+    def __init__(self,_admin):
+
+        """Initialize the contract storage
+
+        Storage:
+            admin: registry admin address
+            poolIndex: pool address of every pair and curve, keyed by the ordered pair (tokenA, idA) < (tokenB, idB)
+            pools: tokens and curve of every registered pool
+            tokenPools: registered pools trading each token
+            poolCount: number of registered pools
+        """
+
+        self.init(
+            admin = _admin,
+            poolIndex = sp.big_map(tkey = PAIR_KEY, tvalue = sp.TAddress),
+            pools = sp.big_map(tkey = sp.TAddress, tvalue = POOL_INFO),
+            tokenPools = sp.big_map(tkey = TOKEN_KEY, tvalue = sp.TSet(sp.TAddress)),
+            poolCount = sp.nat(0)
+        )
+
+    def PairKey(token1Address, token1Id, token2Address, token2Id, curve):
+        """Builds the poolIndex key of a pair, independent of the token order
+
+        Args:
+            token1Address: contract address of the first token
+            token1Id: token id of the first token
+            token2Address: contract address of the second token
+            token2Id: token id of the second token
+            curve: curve type of the pool
+        Returns:
+            PAIR_KEY record with the smaller token first
+        """
+
+        sp.verify((token1Address != token2Address) | (token1Id != token2Id), ErrorMessages.InvalidPair)
+
+        pairKey = sp.local('pairKey', sp.record(tokenA = token1Address, idA = token1Id, tokenB = token2Address, idB = token2Id, curve = curve))
+
+        sp.if (token2Address < token1Address) | ((token2Address == token1Address) & (token2Id < token1Id)):
+
+            pairKey.value = sp.record(tokenA = token2Address, idA = token2Id, tokenB = token1Address, idB = token1Id, curve = curve)
+
+        return pairKey.value
+
+    def AddTokenPool(self, tokenKey, pool):
+
+        sp.if ~self.data.tokenPools.contains(tokenKey):
+
+            self.data.tokenPools[tokenKey] = sp.set([])
+
+        self.data.tokenPools[tokenKey].add(pool)
+
+    @sp.entry_point
+    def RegisterPool(self,params):
+        """Admin function to register an AMM or FlatCurve pool
+
+        The pool must answer the getPoolState view read by getPoolsState, so factory pools, whose
+        getPoolState view takes a pool id, are rejected.
+
+        Args:
+            pool: address of the pool contract
+            token1Address: contract address of token 1 of the pool
+            token1Id: token id of token 1 of the pool
+            token1Check: boolean describing whether token 1 is FA2
+            token2Address: contract address of token 2 of the pool
+            token2Id: token id of token 2 of the pool
+            token2Check: boolean describing whether token 2 is FA2
+            curve: curve type of the pool, AMM_CURVE or FLAT_CURVE
+        """
+
+        sp.set_type(params, sp.TRecord(pool = sp.TAddress, info = POOL_INFO))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify((params.info.curve == AMM_CURVE) | (params.info.curve == FLAT_CURVE), ErrorMessages.InvalidCurve)
+
+        sp.verify(~self.data.pools.contains(params.pool), ErrorMessages.PoolExists)
+
+        sp.verify(sp.view("getPoolState", params.pool, sp.unit, t = POOL_STATE).is_some(), ErrorMessages.InvalidView)
+
+        pairKey = PoolRegistry.PairKey(params.info.token1Address, params.info.token1Id, params.info.token2Address, params.info.token2Id, params.info.curve)
+
+        sp.verify(~self.data.poolIndex.contains(pairKey), ErrorMessages.PoolExists)
+
+        self.data.poolIndex[pairKey] = params.pool
+
+        self.data.pools[params.pool] = params.info
+
+        self.AddTokenPool(sp.record(tokenAddress = params.info.token1Address, tokenId = params.info.token1Id), params.pool)
+
+        self.AddTokenPool(sp.record(tokenAddress = params.info.token2Address, tokenId = params.info.token2Id), params.pool)
+
+        self.data.poolCount += 1
+
+    @sp.entry_point
+    def RemovePool(self,pool):
+        """Admin function to remove a deprecated pool
+
+        Args:
+            pool: address of the registered pool
+        """
+
+        sp.set_type(pool, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify(self.data.pools.contains(pool), ErrorMessages.PoolNotFound)
+
+        info = sp.local('info', self.data.pools[pool])
+
+        del self.data.poolIndex[PoolRegistry.PairKey(info.value.token1Address, info.value.token1Id, info.value.token2Address, info.value.token2Id, info.value.curve)]
+
+        del self.data.pools[pool]
+
+        self.data.tokenPools[sp.record(tokenAddress = info.value.token1Address, tokenId = info.value.token1Id)].remove(pool)
+
+        self.data.tokenPools[sp.record(tokenAddress = info.value.token2Address, tokenId = info.value.token2Id)].remove(pool)
+
+        self.data.poolCount = sp.as_nat(self.data.poolCount - 1)
+
+    @sp.entry_point
+    def ChangeAdmin(self,adminAddress):
+        """Admin function to Update Admin Address
+
+        Args:
+            adminAddress: Upgrades adminAddress to new MultiSig or DAO
+        """
+
+        sp.set_type(adminAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.admin = adminAddress
+
+    @sp.onchain_view()
+    def getPool(self,params):
+        """View function to find the pool of a pair, in any token order
+
+        Args:
+            token1Address: contract address of the first token
+            token1Id: token id of the first token
+            token2Address: contract address of the second token
+            token2Id: token id of the second token
+            curve: curve type of the pool
+        Returns:
+            sp.TOption(sp.TAddress): pool address, None when no pool is registered
+        """
+
+        sp.set_type(params, sp.TRecord(token1Address = sp.TAddress, token1Id = sp.TNat, token2Address = sp.TAddress, token2Id = sp.TNat, curve = sp.TNat))
+
+        sp.result(self.data.poolIndex.get_opt(PoolRegistry.PairKey(params.token1Address, params.token1Id, params.token2Address, params.token2Id, params.curve)))
+
+    @sp.onchain_view()
+    def getPoolInfo(self,pool):
+        """View function to get the tokens and curve of a registered pool
+
+        Args:
+            pool: address of the registered pool
+        Returns:
+            POOL_INFO: tokens of the pool in the pool order and its curve type
+        """
+
+        sp.set_type(pool, sp.TAddress)
+
+        sp.verify(self.data.pools.contains(pool), ErrorMessages.PoolNotFound)
+
+        sp.result(self.data.pools[pool])
+
+    @sp.onchain_view()
+    def getTokenPools(self,params):
+        """View function to get the registered pools trading a token
+
+        Args:
+            tokenAddress: contract address of the token
+            tokenId: token id of the token
+        Returns:
+            sp.TSet(sp.TAddress): registered pools trading the token
+        """
+
+        sp.set_type(params, TOKEN_KEY)
+
+        sp.result(self.data.tokenPools.get(params, sp.set([], t = sp.TAddress)))
+
+    @sp.onchain_view()
+    def getPoolsState(self,pools):
+        """View function to get the reserves and fees of a list of registered pools in one call
+
+        Reserves and fees are read from the getPoolState view of every pool.
+
+        Args:
+            pools: addresses of registered pools
+        Returns:
+            sp.TList(sp.TRecord(pool, info, state)): tokens, curve, reserves and fees of every pool, in the requested order
+        """
+
+        sp.set_type(pools, sp.TList(sp.TAddress))
+
+        result = sp.local('result', sp.list([], t = sp.TRecord(pool = sp.TAddress, info = POOL_INFO, state = POOL_STATE)))
+
+        sp.for pool in pools:
+
+            sp.verify(self.data.pools.contains(pool), ErrorMessages.PoolNotFound)
+
+            state = sp.view("getPoolState", pool, sp.unit, t = POOL_STATE).open_some(ErrorMessages.InvalidView)
+
+            result.value.push(sp.record(pool = pool, info = self.data.pools[pool], state = state))
+
+        sp.result(result.value.rev())
+
+
+if "templates" not in __name__:
+    @sp.add_test(name = "Plenty Pool Registry")
+    def test():
+
+        VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+        VolatileSwapFactory = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwapFactory.py")
+        TokenToToken = sp.io.import_script_from_url("file:StableSwap/TokenToToken.py")
+
+        scenario = sp.test_scenario()
+        scenario.h1("Pool Registry Contract")
+
+        scenario.table_of_contents()
+
+        # Deployment Accounts
+        adminAddress = sp.test_account("Admin").address
+        lpTokenAddress = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd")
+
+        plentyAddress = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+        wrapAddress = sp.address("KT1AFA2mwNUMNd4SsujE1YYp29vd8BZejyKW")
+
+        registry = PoolRegistry(adminAddress)
+        scenario += registry
+
+        pool = VolatileSwap.AMM(adminAddress,plentyAddress,0,False,wrapAddress,0,True,500,1000,lpTokenAddress)
+        scenario += pool
+
+        flatPool = TokenToToken.FlatCurve(0,0,0,0,True,False,1,1,wrapAddress,plentyAddress,0,1000,lpTokenAddress,adminAddress)
+        scenario += flatPool
+
+        factory = VolatileSwapFactory.AMMFactory(adminAddress)
+        scenario += factory
+
+        info = sp.record(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = wrapAddress, token2Id = 0, token2Check = True, curve = AMM_CURVE)
+
+        scenario.h2("Registering Pools")
+
+        registry.RegisterPool(pool = pool.address, info = info).run(sender = sp.test_account("Bob"), valid = False)
+        registry.RegisterPool(pool = pool.address, info = info).run(sender = adminAddress)
+
+        # One pool per pair and curve
+        registry.RegisterPool(pool = flatPool.address, info = info).run(sender = adminAddress, valid = False)
+        registry.RegisterPool(pool = flatPool.address, info = sp.record(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = wrapAddress, token2Id = 0, token2Check = True, curve = 3)).run(sender = adminAddress, valid = False)
+        registry.RegisterPool(pool = flatPool.address, info = sp.record(token1Address = wrapAddress, token1Id = 0, token1Check = True, token2Address = plentyAddress, token2Id = 0, token2Check = False, curve = FLAT_CURVE)).run(sender = adminAddress)
+
+        # Factory pools have no getPoolState view without a pool id
+        registry.RegisterPool(pool = factory.address, info = sp.record(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = wrapAddress, token2Id = 1, token2Check = True, curve = AMM_CURVE)).run(sender = adminAddress, valid = False, exception = ErrorMessages.InvalidView)
+
+        scenario.verify(registry.data.poolCount == 2)
+
+        scenario.h2("Pool Lookup")
+
+        # Lookups do not depend on the token order
+        scenario.verify(registry.getPool(sp.record(token1Address = wrapAddress, token1Id = 0, token2Address = plentyAddress, token2Id = 0, curve = AMM_CURVE)).open_some() == pool.address)
+        scenario.verify(registry.getPool(sp.record(token1Address = plentyAddress, token1Id = 0, token2Address = wrapAddress, token2Id = 0, curve = FLAT_CURVE)).open_some() == flatPool.address)
+        scenario.verify(registry.getTokenPools(sp.record(tokenAddress = plentyAddress, tokenId = 0)).contains(flatPool.address))
+        scenario.verify(registry.getPoolInfo(pool.address).curve == AMM_CURVE)
+
+        scenario.verify(sp.len(registry.getPoolsState([pool.address, flatPool.address])) == 2)
+        scenario.verify(pool.getPoolState().systemFee == sp.some(1000))
+
+        scenario.h2("Removing Pools")
+
+        registry.RemovePool(flatPool.address).run(sender = adminAddress)
+
+        scenario.verify(registry.data.poolCount == 1)
+        scenario.verify(registry.getPool(sp.record(token1Address = plentyAddress, token1Id = 0, token2Address = wrapAddress, token2Id = 0, curve = FLAT_CURVE)).is_none())
+
+        # Adding Compilation Target
+        sp.add_compilation_target(
+            "PoolRegistry",
+            PoolRegistry(
+            adminAddress
+            ))
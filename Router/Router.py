@@ -0,0 +1,329 @@
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Multi-hop Router over the pools of the Pool Registry, every pool pays its output straight to the next pool
+
+MAX_HOPS = 5
+
+POOL_INFO = sp.TRecord(
+    token1Address = sp.TAddress,
+    token1Id = sp.TNat,
+    token1Check = sp.TBool,
+    token2Address = sp.TAddress,
+    token2Id = sp.TNat,
+    token2Check = sp.TBool,
+    curve = sp.TNat
+)
+
+HOP = sp.TRecord(pool = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat)
+
+PENDING_HOP = sp.TRecord(pool = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat, recipient = sp.TAddress)
+
+ROUTER_SWAP = sp.TRecord(tokenAmountIn = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat, payer = sp.TOption(sp.TAddress))
+
+class ErrorMessages:
+    """Specifies the different Error Types in the contracts
+    """
+    def make(s):
+        """Generates standard error messages prepending contract name (PlentyRouter_)
+        Args:
+            s: error message string
+        Returns:
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
+        """
+
+        message = "PlentyRouter_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
+
+
+    NotAdmin = make("Not_Admin")
+
+    Paused = make("Paused_State")
+
+    LockCheck = make("Invalid_CallBack")
+
+    InvalidCaller = make("Invalid_Caller")
+
+    InvalidPath = make("Invalid_Path")
+
+    InvalidPair = make("Invalid_Pair")
+
+    InvalidView = make("Invalid_Registry_View")
+
+    InsufficientTokenOut = make("Higher_Slippage")
+
+class Router(ErrorMessages, sp.Contract):
+
+    def __init__(self,_admin,_registryAddress):
+
+        """Initialize the contract storage
+
+        Storage:
+            admin: router admin address
+            registryAddress: Pool Registry listing the pools allowed in a route
+            paused: boolean describing whether contract is paused
+            Locked: boolean describing whether a route is being executed
+            pendingHops: hops of the route being executed which are not swapped yet
+            currentPool: pool of the hop being executed, the only caller allowed in RouteCallback
+            minimumTokenOut: minimum amount of token expected from the route being executed
+        """
+
+        self.init(
+            admin = _admin,
+            registryAddress = _registryAddress,
+            paused = False,
+            Locked = False,
+            pendingHops = sp.list([], t = PENDING_HOP),
+            currentPool = sp.none,
+            minimumTokenOut = sp.nat(0)
+        )
+
+    def CallPool(self, hop, amount, payer):
+        """Swaps one hop of the route in its pool
+
+        Args:
+            hop: PENDING_HOP record of the hop
+            amount: amount of tokens swapped in the pool
+            payer: user paying the tokens for the first hop, None for the next hops
+        """
+
+        self.data.currentPool = sp.some(hop.pool)
+
+        swapHandle = sp.contract(ROUTER_SWAP, hop.pool, "RouterSwap").open_some()
+
+        sp.transfer(
+            sp.record(tokenAmountIn = amount, recipient = hop.recipient, requiredTokenAddress = hop.requiredTokenAddress, requiredTokenId = hop.requiredTokenId, payer = payer),
+            sp.mutez(0),
+            swapHandle
+        )
+
+    @sp.entry_point
+    def Route(self,params):
+        """Function for Users to Swap through a path of registered AMM and FlatCurve pools
+
+        Only the first pool pulls tokens from the user, which needs the usual allowance for that pool.
+        Every other pool is paid by the previous pool of the path and the last pool pays the recipient.
+
+        Args:
+            path: hops of the route, each hop giving the pool and the token expected from the pool
+            tokenAmountIn: amount of tokens sent by user to the first pool of the path
+            MinimumTokenOut: minimum amount of token expected by user from the last pool of the path
+            recipient: address that will receive the swapped out tokens
+        """
+
+        sp.set_type(params, sp.TRecord(path = sp.TList(HOP), tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress))
+
+        sp.verify(~self.data.paused, ErrorMessages.Paused)
+
+        sp.verify(~self.data.Locked, ErrorMessages.LockCheck)
+
+        sp.verify((sp.len(params.path) > 0) & (sp.len(params.path) <= MAX_HOPS), ErrorMessages.InvalidPath)
+
+        # Validating the path from the last hop, so that every hop knows the pool it pays
+        hops = sp.local('hops', sp.list([], t = PENDING_HOP))
+
+        recipient = sp.local('recipient', params.recipient)
+
+        # Token expected by the hop after the current one
+        nextTokenIn = sp.local('nextTokenIn', sp.none)
+
+        sp.for hop in params.path.rev():
+
+            info = sp.view("getPoolInfo", self.data.registryAddress, hop.pool, t = POOL_INFO).open_some(ErrorMessages.InvalidView)
+
+            tokenIn = sp.local('tokenIn', sp.record(tokenAddress = info.token1Address, tokenId = info.token1Id))
+
+            sp.if (hop.requiredTokenAddress == info.token1Address) & (hop.requiredTokenId == info.token1Id):
+
+                tokenIn.value = sp.record(tokenAddress = info.token2Address, tokenId = info.token2Id)
+
+            sp.else:
+
+                sp.verify((hop.requiredTokenAddress == info.token2Address) & (hop.requiredTokenId == info.token2Id), ErrorMessages.InvalidPair)
+
+            sp.if nextTokenIn.value.is_some():
+
+                sp.verify(
+                    (nextTokenIn.value.open_some().tokenAddress == hop.requiredTokenAddress) & (nextTokenIn.value.open_some().tokenId == hop.requiredTokenId),
+                    ErrorMessages.InvalidPath
+                )
+
+            hops.value.push(sp.record(pool = hop.pool, requiredTokenAddress = hop.requiredTokenAddress, requiredTokenId = hop.requiredTokenId, recipient = recipient.value))
+
+            recipient.value = hop.pool
+
+            nextTokenIn.value = sp.some(tokenIn.value)
+
+        self.data.Locked = True
+
+        self.data.minimumTokenOut = params.MinimumTokenOut
+
+        with sp.match_cons(hops.value) as firstHop:
+
+            self.data.pendingHops = firstHop.tail
+
+            self.CallPool(firstHop.head, params.tokenAmountIn, sp.some(sp.sender))
+
+    @sp.entry_point
+    def RouteCallback(self,tokenOut):
+        """Callback from the pool of the current hop with the amount it sent to the next pool or the recipient
+
+        Args:
+            tokenOut: amount of tokens swapped out of the current pool
+        """
+
+        sp.set_type(tokenOut, sp.TNat)
+
+        sp.verify(self.data.Locked, ErrorMessages.LockCheck)
+
+        sp.verify(self.data.currentPool == sp.some(sp.sender), ErrorMessages.InvalidCaller)
+
+        with sp.match_cons(self.data.pendingHops) as nextHop:
+
+            self.data.pendingHops = nextHop.tail
+
+            self.CallPool(nextHop.head, tokenOut, sp.none)
+
+        sp.else:
+
+            # Last hop of the route
+            sp.verify(tokenOut >= self.data.minimumTokenOut, ErrorMessages.InsufficientTokenOut)
+
+            self.data.Locked = False
+
+            self.data.currentPool = sp.none
+
+            self.data.minimumTokenOut = sp.nat(0)
+
+    @sp.entry_point(lazify = True)
+    def ChangeRegistry(self,registryAddress):
+        """Admin function to Update the Pool Registry
+
+        Args:
+            registryAddress: new Pool Registry address
+        """
+
+        sp.set_type(registryAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.registryAddress = registryAddress
+
+    @sp.entry_point(lazify = True)
+    def ChangeState(self):
+        """Admin function to toggle contract state
+        """
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.paused = ~ self.data.paused
+
+    @sp.entry_point(lazify = True)
+    def ChangeAdmin(self,adminAddress):
+        """Admin function to Update Admin Address
+
+        Args:
+            adminAddress: Upgrades adminAddress to new MultiSig or DAO
+        """
+
+        sp.set_type(adminAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.admin = adminAddress
+
+
+if "templates" not in __name__:
+    @sp.add_test(name = "Plenty Router")
+    def test():
+
+        PoolRegistry = sp.io.import_script_from_url("file:Router/PoolRegistry.py")
+        VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+
+        scenario = sp.test_scenario()
+        scenario.h1("Router Contract")
+
+        scenario.table_of_contents()
+
+        # Deployment Accounts
+        adminAddress = sp.test_account("Admin").address
+        alice = sp.test_account("Alice")
+
+        plentyAddress = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+        wrapAddress = sp.address("KT1AFA2mwNUMNd4SsujE1YYp29vd8BZejyKW")
+        ctezAddress = sp.address("KT1SjXiUX63QvdNMcM2m492f7kuf8JxXRLp4")
+        lpTokenAddress = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd")
+
+        registry = PoolRegistry.PoolRegistry(adminAddress)
+        scenario += registry
+
+        router = Router(adminAddress, registry.address)
+        scenario += router
+
+        wrapPool = VolatileSwap.AMM(adminAddress,plentyAddress,0,False,wrapAddress,0,True,500,1000,lpTokenAddress)
+        scenario += wrapPool
+
+        ctezPool = VolatileSwap.AMM(adminAddress,plentyAddress,0,False,ctezAddress,0,False,500,1000,lpTokenAddress)
+        scenario += ctezPool
+
+        scenario.h2("Registering Pools")
+
+        registry.RegisterPool(pool = wrapPool.address, info = sp.record(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = wrapAddress, token2Id = 0, token2Check = True, curve = PoolRegistry.AMM_CURVE)).run(sender = adminAddress)
+        registry.RegisterPool(pool = ctezPool.address, info = sp.record(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = ctezAddress, token2Id = 0, token2Check = False, curve = PoolRegistry.AMM_CURVE)).run(sender = adminAddress)
+
+        wrapPool.ChangeRouter(sp.some(router.address)).run(sender = adminAddress)
+        ctezPool.ChangeRouter(sp.some(router.address)).run(sender = adminAddress)
+
+        wrapPool.AddLiquidity(token1_max = 1000000, token2_max = 2000000, recipient = alice.address).run(sender = alice)
+        ctezPool.AddLiquidity(token1_max = 1000000, token2_max = 1000000, recipient = alice.address).run(sender = alice)
+
+        scenario.h2("Routing")
+
+        # Pools only accept RouterSwap from the Router
+        wrapPool.RouterSwap(tokenAmountIn = 20000, recipient = alice.address, requiredTokenAddress = plentyAddress, requiredTokenId = 0, payer = sp.some(alice.address)).run(sender = alice, valid = False)
+
+        # wrap -> PLENTY -> ctez, PLENTY goes straight from the first pool to the second one
+        router.Route(
+            path = [
+                sp.record(pool = wrapPool.address, requiredTokenAddress = plentyAddress, requiredTokenId = 0),
+                sp.record(pool = ctezPool.address, requiredTokenAddress = ctezAddress, requiredTokenId = 0)
+            ],
+            tokenAmountIn = 20000, MinimumTokenOut = 9000, recipient = alice.address
+        ).run(sender = alice)
+
+        scenario.verify(~router.data.Locked)
+        scenario.verify(ctezPool.data.token2_pool < 1000000)
+
+        # Broken token continuity between hops
+        router.Route(
+            path = [
+                sp.record(pool = wrapPool.address, requiredTokenAddress = wrapAddress, requiredTokenId = 0),
+                sp.record(pool = ctezPool.address, requiredTokenAddress = ctezAddress, requiredTokenId = 0)
+            ],
+            tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = alice.address
+        ).run(sender = alice, valid = False)
+
+        # Higher slippage than allowed fails the whole route
+        router.Route(
+            path = [
+                sp.record(pool = wrapPool.address, requiredTokenAddress = plentyAddress, requiredTokenId = 0),
+                sp.record(pool = ctezPool.address, requiredTokenAddress = ctezAddress, requiredTokenId = 0)
+            ],
+            tokenAmountIn = 20000, MinimumTokenOut = 20000, recipient = alice.address
+        ).run(sender = alice, valid = False)
+
+        router.RouteCallback(100).run(sender = alice, valid = False)
+
+        # Adding Compilation Target
+        sp.add_compilation_target(
+            "Router",
+            Router(
+            adminAddress,
+            sp.address("KT1X1LgNkQShpF9nRLYw3Dgdy4qp38MX617z")
+            ))
@@ -1,5 +1,13 @@
+import os
+
 import smartpy as sp
 
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
+
 INITIAL_LIQUIDITY = 1000
 
 class ErrorMessages:
@@ -8,10 +16,13 @@ class ErrorMessages:
         Args:
             s: error message string
         Returns:
-            standardized error message
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
         """
         
-        return ("FlatSwap_" + s)
+        message = "FlatSwap_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
      
     NotAdmin = make("Not_Admin")
 
@@ -45,12 +56,15 @@ class ErrorMessages:
 
     InvalidRatio = make("Invalid_LP_Ratio")
 
+    LockCheck = make("Invalid_CallBack")
 
-class TezToCtez(sp.Contract, ErrorMessages):
+
+class TezToCtez(ErrorMessages, Library.ContractLibrary):
     def __init__(self, tezPool, ctezPool, lqtTotal, ctezAddress, lpFee, lqtAddress, admin, ctez_admin):
         self.init(tezPool = tezPool, ctezPool = ctezPool, lqtTotal= lqtTotal, ctezAddress=ctezAddress,
                   lpFee=lpFee, lqtAddress=lqtAddress, admin = admin, paused = False, Locked = False,
-                  ctez_admin = ctez_admin, recipient = sp.none, tradeAmount = sp.none, minAmount = sp.none)
+                  ctez_admin = ctez_admin, recipient = sp.none, tradeAmount = sp.none, minAmount = sp.none,
+                  stateVersion = sp.nat(0))
 
     def tez_transfer(self, to, amount):
         sp.set_type(to,sp.TAddress)
@@ -116,16 +130,6 @@ class TezToCtez(sp.Contract, ErrorMessages):
         dy_approx = sp.local("dy_approx",self.newton_dx_to_dy(sp.record(x = params.target * params.cash, y= params.tez<<48, dx = params.target * params.dx.open_some(), rounds = 5)))
         return dy_approx.value>>48
 
-    @sp.global_lambda
-    def square_root(x): 
-        sp.verify(x >= 0, message = ErrorMessages.NegativeValue)
-        y = sp.local('y', x)
-        sp.while y.value * y.value > x:
-            y.value = (x // y.value + y.value) // 2
-        sp.verify((y.value * y.value <= x) & (x < (y.value + 1) * (y.value + 1)))
-        sp.result(y.value)
-
-        
     @sp.entry_point
     def default(self):
 
@@ -156,7 +160,7 @@ class TezToCtez(sp.Contract, ErrorMessages):
             tezDeposited.value = sp.utils.mutez_to_nat(sp.amount)
             cashDeposited.value = params.maxCashDeposited
         
-        sp.verify(lqtMinted.value > 0)
+        sp.verify(lqtMinted.value > 0, ErrorMessages.LqtMinted)
         sp.verify(cashDeposited.value <= params.maxCashDeposited, ErrorMessages.MaxCash)
         sp.verify(lqtMinted.value >= params.minLqtMinted, ErrorMessages.LqtMinted)
 
@@ -165,6 +169,7 @@ class TezToCtez(sp.Contract, ErrorMessages):
         self.cash_transfer(sp.record(from_ = sp.sender, to_ = sp.self_address, value = cashDeposited.value))
         self.mint(sp.record(address=params.owner, value= lqtMinted.value))
         self.data.lqtTotal = self.data.lqtTotal + lqtMinted.value
+        self.data.stateVersion += 1
         
 
     @sp.entry_point
@@ -187,6 +192,7 @@ class TezToCtez(sp.Contract, ErrorMessages):
         self.data.tezPool = abs(self.data.tezPool - tezWithdrawn.value)
         self.data.ctezPool = abs(self.data.ctezPool - cashWithdrawn.value)
         self.data.lqtTotal = abs(self.data.lqtTotal - params.lqtBurned)
+        self.data.stateVersion += 1
         self.burn(sp.record(address=sp.sender, value= params.lqtBurned))
         self.cash_transfer(sp.record(from_ = sp.self_address, to_ = sp.sender, value = cashWithdrawn.value))
         self.tez_transfer(sp.sender, sp.utils.nat_to_mutez(tezWithdrawn.value))
@@ -222,10 +228,10 @@ class TezToCtez(sp.Contract, ErrorMessages):
     @sp.entry_point
     def tez_to_ctez_callback(self, target):
         sp.set_type(target, sp.TNat)
-        sp.verify(self.data.Locked)
-        sp.verify(self.data.recipient.is_some())
-        sp.verify(self.data.tradeAmount.is_some())
-        sp.verify(self.data.minAmount.is_some())
+        sp.verify(self.data.Locked, ErrorMessages.LockCheck)
+        sp.verify(self.data.recipient.is_some(), ErrorMessages.LockCheck)
+        sp.verify(self.data.tradeAmount.is_some(), ErrorMessages.LockCheck)
+        sp.verify(self.data.minAmount.is_some(), ErrorMessages.LockCheck)
         cashBoughtWithoutFee = self.trade_dtez_for_dcash(sp.record(tez = self.data.tezPool, cash = self.data.ctezPool, dx = self.data.tradeAmount, target = target))
         fee = sp.local("fee", cashBoughtWithoutFee / self.data.lpFee)
         cashBought = abs(cashBoughtWithoutFee - fee.value)
@@ -233,6 +239,7 @@ class TezToCtez(sp.Contract, ErrorMessages):
         sp.verify(cashBought<self.data.ctezPool, ErrorMessages.CashExceed)
         self.data.tezPool = self.data.tezPool + self.data.tradeAmount.open_some()
         self.data.ctezPool = abs(self.data.ctezPool - cashBought)
+        self.data.stateVersion += 1
         self.cash_transfer(sp.record(from_ = sp.self_address, to_ = self.data.recipient.open_some(), value = cashBought))
 
         self.data.recipient = sp.none
@@ -273,10 +280,10 @@ class TezToCtez(sp.Contract, ErrorMessages):
     @sp.entry_point
     def ctez_to_tez_callback(self, target):
         sp.set_type(target, sp.TNat)
-        sp.verify(self.data.Locked)
-        sp.verify(self.data.recipient.is_some())
-        sp.verify(self.data.tradeAmount.is_some())
-        sp.verify(self.data.minAmount.is_some())
+        sp.verify(self.data.Locked, ErrorMessages.LockCheck)
+        sp.verify(self.data.recipient.is_some(), ErrorMessages.LockCheck)
+        sp.verify(self.data.tradeAmount.is_some(), ErrorMessages.LockCheck)
+        sp.verify(self.data.minAmount.is_some(), ErrorMessages.LockCheck)
         tezBoughtWithoutFee = self.trade_dcash_for_dtez(sp.record(cash = self.data.ctezPool, tez = self.data.tezPool, dx = self.data.tradeAmount, target= target))
         fee = sp.local("fee", tezBoughtWithoutFee / self.data.lpFee)
         tezBought = abs(tezBoughtWithoutFee - fee.value)
@@ -284,6 +291,7 @@ class TezToCtez(sp.Contract, ErrorMessages):
         sp.verify(tezBought<self.data.tezPool, ErrorMessages.TezExceed)
         self.data.tezPool = abs(self.data.tezPool - tezBought)
         self.data.ctezPool = self.data.ctezPool + self.data.tradeAmount.open_some()
+        self.data.stateVersion += 1
         self.cash_transfer(sp.record(from_ = self.data.recipient.open_some(), to_ = sp.self_address, value = self.data.tradeAmount.open_some()))
         self.tez_transfer(self.data.recipient.open_some(), sp.utils.nat_to_mutez(tezBought))
 
@@ -293,25 +301,25 @@ class TezToCtez(sp.Contract, ErrorMessages):
         self.data.Locked = ~ self.data.Locked
 
 
-    @sp.entry_point 
+    @sp.entry_point(lazify = True)
     def ChangeState(self):
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
         self.data.paused = ~ self.data.paused
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeAdmin(self,adminAddress): 
         sp.set_type(adminAddress, sp.TAddress)
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
         self.data.admin = adminAddress
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeBakerAddress(self,newBakerAddress):
 
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
 
         sp.set_delegate(newBakerAddress)
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeLockState(self):
 
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
@@ -326,6 +334,11 @@ class TezToCtez(sp.Contract, ErrorMessages):
         )
         sp.result(reserve)
 
+    @sp.onchain_view()
+    def getStateVersion(self):
+        # Increased by every swap and liquidity update, the target read from ctez is not covered
+        sp.result(self.data.stateVersion)
+
 
 if "templates" not in __name__:
     @sp.add_test(name = "TezToCtez")
@@ -1,68 +1,17 @@
-import smartpy as sp
-
-INITIAL_LIQUIDITY =  1000
-
-class ContractLibrary(sp.Contract):
-    
-    def TransferFATwoTokens(sender,receiver,amount,tokenAddress,id):
-
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = receiver,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(sender,receiver,amount,tokenAddress):
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = receiver,
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
+import os
 
-    def TransferToken(sender, receiver, amount, tokenAddress, id, faTwoFlag):
-
-        sp.verify(amount > 0 , ErrorMessages.ZeroTransfer)
-
-        sp.if faTwoFlag: 
+import smartpy as sp
 
-            ContractLibrary.TransferFATwoTokens(sender, receiver, amount , tokenAddress, id )
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
 
-        sp.else: 
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
 
-            ContractLibrary.TransferFATokens(sender, receiver, amount, tokenAddress)
+INITIAL_LIQUIDITY =  1000
 
-    @sp.global_lambda
-    def square_root(x): 
-        sp.verify(x >= 0, message = ErrorMessages.NegativeValue)
-        y = sp.local('y', x)
-        sp.while y.value * y.value > x:
-            y.value = (x // y.value + y.value) // 2
-        sp.verify((y.value * y.value <= x) & (x < (y.value + 1) * (y.value + 1)))
-        sp.result(y.value)
+# Fixed point scale of the cumulative prices
+PRICE_PRECISION = 10 ** 18
 
 class ErrorMessages:
     def make(s): 
@@ -70,9 +19,12 @@ class ErrorMessages:
         Args:
             s: error message string
         Returns:
-            standardized error message
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
         """
-        return ("FlatSwap_" + s)
+        message = "FlatSwap_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
      
     NotAdmin = make("Not_Admin")
 
@@ -108,22 +60,44 @@ class ErrorMessages:
 
     TezExceed = make("Tez_Bought_Exceeds_Pool")
 
+    NotRouter = make("Not_Router")
+
+    NotAllowed = make("Not_Allowed")
+
+    UnsafeAllowanceChange = make("Unsafe_Allowance_Change")
+
 # set precision of higher decimal token as 1 and lower token precision as 10 to the power of difference of both token's decimals.
-class FlatCurve(ErrorMessages, ContractLibrary):
-    def __init__(self, token1Pool, token2Pool, token1Id, token2Id, token1Check, token2Check, token1Precision, token2Precision, token1Address, token2Address, lqtTotal, lpFee, lqtAddress, admin):
+class FlatCurve(ErrorMessages, Library.ContractLibrary):
+    # LP total supply returned by getTotalSupply of the embedded ledger
+    LPSupplyField = "lqtTotal"
 
+    def __init__(self, token1Pool, token2Pool, token1Id, token2Id, token1Check, token2Check, token1Precision, token2Precision, token1Address, token2Address, lqtTotal, lpFee, lqtAddress, admin, embeddedLedger = False):
+        # With embeddedLedger the exchange is itself the FA1.2 LP token and lqtAddress is unused
+        self.embeddedLedger = embeddedLedger
         self.init(token1Pool= token1Pool, token2Pool= token2Pool, token1Id= token1Id, token2Id= token2Id,
                   token1Check= token1Check, token2Check= token2Check, token1Precision= token1Precision, token2Precision= token2Precision,
                   token1Address = token1Address, token2Address= token2Address,
-                  lqtTotal= lqtTotal, lpFee= lpFee, lqtAddress=lqtAddress, admin = admin, paused = False)
+                  lqtTotal= lqtTotal, lpFee= lpFee, lqtAddress=lqtAddress, admin = admin, paused = False,
+                  routerAddress = sp.none, stateVersion = sp.nat(0),
+                  token1PriceCumulative = sp.nat(0), token2PriceCumulative = sp.nat(0), blockTimestampLast = sp.timestamp(0))
+        if self.embeddedLedger:
+            Library.LPLedger.AddLedger(self)
 
     def burn(self,burnData):
-        c = sp.contract(sp.TRecord(address = sp.TAddress, value = sp.TNat), self.data.lqtAddress, entry_point="burn").open_some()
-        sp.transfer(burnData,sp.mutez(0),c)
+        if self.embeddedLedger:
+            ownerBalance = sp.local('ownerBalance', self.data.balances.get(burnData.address, sp.nat(0)))
+            sp.verify(ownerBalance.value >= burnData.value, ErrorMessages.Insufficient)
+            self.data.balances[burnData.address] = sp.as_nat(ownerBalance.value - burnData.value)
+        else:
+            c = sp.contract(sp.TRecord(address = sp.TAddress, value = sp.TNat), self.data.lqtAddress, entry_point="burn").open_some()
+            sp.transfer(burnData,sp.mutez(0),c)
 
     def mint(self,mintData):
-        c = sp.contract(sp.TRecord(address = sp.TAddress, value = sp.TNat), self.data.lqtAddress, entry_point="mint").open_some()
-        sp.transfer(mintData,sp.mutez(0),c)
+        if self.embeddedLedger:
+            self.data.balances[mintData.address] = self.data.balances.get(mintData.address, sp.nat(0)) + mintData.value
+        else:
+            c = sp.contract(sp.TRecord(address = sp.TAddress, value = sp.TNat), self.data.lqtAddress, entry_point="mint").open_some()
+            sp.transfer(mintData,sp.mutez(0),c)
     
     def util(self, x, y):
         sp.set_type(x, sp.TNat)
@@ -161,6 +135,34 @@ class FlatCurve(ErrorMessages, ContractLibrary):
         dy = self.newton(sp.record(x = params.x, y = params.y, dx = params.dx, dy = sp.nat(0), u = u, n = params.rounds))
         return dy
 
+    def current_cumulative_prices(self):
+        # Marginal price of the curve is du/dx / du/dy, with du/dx = 8((x+y)^7 - (x-y)^7) and du/dy = 8((x+y)^7 + (x-y)^7)
+        cumulative = sp.local('cumulative', sp.record(token1PriceCumulative = self.data.token1PriceCumulative, token2PriceCumulative = self.data.token2PriceCumulative))
+        sp.if (sp.now > self.data.blockTimestampLast) & (self.data.token1Pool != 0) & (self.data.token2Pool != 0):
+            elapsed = sp.local('elapsed', sp.as_nat(sp.now - self.data.blockTimestampLast))
+            x = self.data.token1Pool * self.data.token1Precision
+            y = self.data.token2Pool * self.data.token2Precision
+            plus = x + y
+            minus = x - y
+            plus_2 = plus * plus
+            minus_2 = minus * minus
+            plus_7 = sp.local('plus_7', plus_2 * plus_2 * plus_2 * plus)
+            minus_7 = sp.local('minus_7', minus_2 * minus_2 * minus_2 * minus)
+            du_dx = sp.local('du_dx', abs(sp.to_int(plus_7.value) - minus_7.value))
+            du_dy = sp.local('du_dy', abs(sp.to_int(plus_7.value) + minus_7.value))
+            # Prices in token units, the reserves being scaled by their precisions
+            cumulative.value.token1PriceCumulative += du_dx.value * self.data.token1Precision * PRICE_PRECISION * elapsed.value / (du_dy.value * self.data.token2Precision)
+            cumulative.value.token2PriceCumulative += du_dy.value * self.data.token2Precision * PRICE_PRECISION * elapsed.value / (du_dx.value * self.data.token1Precision)
+        return cumulative.value
+
+    def update_cumulative_prices(self):
+        # Called before the reserves change, at most once per block with the reserves left by the previous block
+        sp.if sp.now > self.data.blockTimestampLast:
+            cumulative = self.current_cumulative_prices()
+            self.data.token1PriceCumulative = cumulative.token1PriceCumulative
+            self.data.token2PriceCumulative = cumulative.token2PriceCumulative
+            self.data.blockTimestampLast = sp.now
+
     @sp.entry_point 
     def add_liquidity(self,params): 
         """Allows users to add liquidity to the pool and gain LP tokens
@@ -171,6 +173,7 @@ class FlatCurve(ErrorMessages, ContractLibrary):
             recipient: account address that will be credited with the LP tokens
         """
         sp.set_type(params, sp.TRecord(token1_max = sp.TNat, token2_max = sp.TNat, recipient = sp.TAddress))
+        self.update_cumulative_prices()
         token1Amount = sp.local('token1Amount', sp.nat(0))
         token2Amount = sp.local('token2Amount', sp.nat(0))
         liquidity = sp.local('liquidity', sp.nat(0))
@@ -197,15 +200,16 @@ class FlatCurve(ErrorMessages, ContractLibrary):
             token1Amount.value = params.token1_max
             token2Amount.value = params.token2_max
             
-        sp.verify(liquidity.value > 0 )
-        sp.verify(token1Amount.value <= params.token1_max )
-        sp.verify(token2Amount.value <= params.token2_max )
+        sp.verify(liquidity.value > 0, ErrorMessages.LqtMinted)
+        sp.verify(token1Amount.value <= params.token1_max, ErrorMessages.MaxCash)
+        sp.verify(token2Amount.value <= params.token2_max, ErrorMessages.MaxCash)
 
         # Transfer Funds to Exchange 
-        ContractLibrary.TransferToken(sp.sender, sp.self_address, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
-        ContractLibrary.TransferToken(sp.sender, sp.self_address, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.TransferToken(sp.sender, sp.self_address, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+        self.TransferToken(sp.sender, sp.self_address, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
         self.data.token1Pool += token1Amount.value
         self.data.token2Pool += token2Amount.value
+        self.data.stateVersion += 1
 
         # Mint LP Tokens
         self.data.lqtTotal += liquidity.value
@@ -224,26 +228,74 @@ class FlatCurve(ErrorMessages, ContractLibrary):
         sp.set_type(params, sp.TRecord(lpAmount = sp.TNat ,token1_min = sp.TNat, token2_min = sp.TNat, recipient = sp.TAddress))
         sp.verify(self.data.lqtTotal != sp.nat(0), message = ErrorMessages.NotInitialized)
         sp.verify(params.lpAmount <= self.data.lqtTotal, message = ErrorMessages.Insufficient)
+        self.update_cumulative_prices()
 
         token1Amount = sp.local('token1Amount', sp.nat(0))
         token2Amount = sp.local('token2Amount', sp.nat(0))
 
         token1Amount.value = (params.lpAmount * self.data.token1Pool) / self.data.lqtTotal
         token2Amount.value = (params.lpAmount * self.data.token2Pool) / self.data.lqtTotal
-        sp.verify(token1Amount.value >= params.token1_min)
-        sp.verify(token2Amount.value >= params.token2_min)
+        sp.verify(token1Amount.value >= params.token1_min, ErrorMessages.MinCash)
+        sp.verify(token2Amount.value >= params.token2_min, ErrorMessages.MinCash)
 
         # Subtracting Values  
         self.data.token1Pool = sp.as_nat(self.data.token1Pool - token1Amount.value)
         self.data.token2Pool = sp.as_nat(self.data.token2Pool - token2Amount.value)  
         self.data.lqtTotal = sp.as_nat(self.data.lqtTotal - params.lpAmount)
+        self.data.stateVersion += 1
         
         # Burning LP Tokens  
         self.burn(sp.record(address=sp.sender, value= params.lpAmount))
 
         # Sending Tokens 
-        ContractLibrary.TransferToken(sp.self_address, params.recipient, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
-        ContractLibrary.TransferToken(sp.self_address, params.recipient, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.TransferToken(sp.self_address, params.recipient, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+        self.TransferToken(sp.self_address, params.recipient, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+
+    def swap_tokens(self, tokenAmountIn, minTokenOut, recipient, requiredTokenAddress, requiredTokenId, payer):
+        """Swaps tokens in the pool and sends the swapped out tokens to the recipient
+
+        Args:
+            tokenAmountIn: amount of tokens that needs to be swapped
+            minTokenOut: minimum amount of token expected after swap
+            recipient: address that will receive the swapped out tokens
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+            payer: optional address the tokens are pulled from, None when the previous pool of a route already sent them
+        Returns:
+            amount of tokens sent to the recipient
+        """
+        sp.verify(~self.data.paused, ErrorMessages.Paused)
+        sp.verify(tokenAmountIn >sp.nat(0), ErrorMessages.ZeroTransfer)
+        self.update_cumulative_prices()
+        sp.verify(((requiredTokenAddress == self.data.token1Address) & (requiredTokenId == self.data.token1Id)) | 
+        ((requiredTokenAddress == self.data.token2Address) & (requiredTokenId == self.data.token2Id)), ErrorMessages.InvalidPair)
+        token1PoolNew = sp.local("token1PoolNew", self.data.token1Pool * self.data.token1Precision)
+        token2PoolNew = sp.local("token2PoolNew", self.data.token2Pool * self.data.token2Precision)
+        tokenBought = sp.local("tokenBought", sp.nat(0))
+        sp.if (requiredTokenAddress == self.data.token1Address) & (requiredTokenId == self.data.token1Id): 
+            tokenBoughtWithoutFee = self.newton_dx_to_dy(sp.record(x = token2PoolNew.value, y = token1PoolNew.value, dx = tokenAmountIn * self.data.token2Precision, rounds = 5))
+            fee = sp.local("fee", tokenBoughtWithoutFee/self.data.lpFee)
+            tokenBought.value = abs(tokenBoughtWithoutFee - fee.value) / self.data.token1Precision
+            sp.verify(tokenBought.value>=minTokenOut , ErrorMessages.MinCash)
+            sp.verify(tokenBought.value<self.data.token1Pool, ErrorMessages.CashExceed)
+            self.data.token1Pool= abs(self.data.token1Pool - tokenBought.value)
+            self.data.token2Pool= self.data.token2Pool + tokenAmountIn
+            sp.if payer.is_some():
+                self.TransferToken(payer.open_some(), sp.self_address, tokenAmountIn, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+            self.TransferToken(sp.self_address, recipient, tokenBought.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+        sp.else :
+            tokenBoughtWithoutFee = self.newton_dx_to_dy(sp.record(x = token1PoolNew.value, y = token2PoolNew.value, dx = tokenAmountIn * self.data.token1Precision, rounds = 5))
+            fee = sp.local("fee", tokenBoughtWithoutFee/self.data.lpFee)
+            tokenBought.value = abs(tokenBoughtWithoutFee - fee.value) / self.data.token2Precision
+            sp.verify(tokenBought.value>=minTokenOut, ErrorMessages.MinCash)
+            sp.verify(tokenBought.value<self.data.token2Pool, ErrorMessages.CashExceed)
+            self.data.token2Pool= abs(self.data.token2Pool - tokenBought.value)
+            self.data.token1Pool= self.data.token1Pool + tokenAmountIn
+            sp.if payer.is_some():
+                self.TransferToken(payer.open_some(), sp.self_address, tokenAmountIn, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+            self.TransferToken(sp.self_address, recipient, tokenBought.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.data.stateVersion += 1
+        return tokenBought.value
 
     @sp.entry_point
     def swap(self,params):
@@ -257,44 +309,43 @@ class FlatCurve(ErrorMessages, ContractLibrary):
             requiredTokenId: id of the token that is expected to be returned after swap
         """
         sp.set_type(params,sp.TRecord(minTokenOut = sp.TNat, recipient = sp.TAddress, tokenAmountIn = sp.TNat, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat))
-        sp.verify(~self.data.paused, ErrorMessages.Paused)
-        sp.verify(params.tokenAmountIn >sp.nat(0), ErrorMessages.ZeroTransfer)
-        sp.verify(((params.requiredTokenAddress == self.data.token1Address) & (params.requiredTokenId == self.data.token1Id)) | 
-        ((params.requiredTokenAddress == self.data.token2Address) & (params.requiredTokenId == self.data.token2Id)), ErrorMessages.InvalidPair)
-        token1PoolNew = sp.local("token1PoolNew", self.data.token1Pool * self.data.token1Precision)
-        token2PoolNew = sp.local("token2PoolNew", self.data.token2Pool * self.data.token2Precision)
-        sp.if (params.requiredTokenAddress == self.data.token1Address) & (params.requiredTokenId == self.data.token1Id): 
-            tokenBoughtWithoutFee = self.newton_dx_to_dy(sp.record(x = token2PoolNew.value, y = token1PoolNew.value, dx = params.tokenAmountIn * self.data.token2Precision, rounds = 5))
-            fee = sp.local("fee", tokenBoughtWithoutFee/self.data.lpFee)
-            tokenBought = abs(tokenBoughtWithoutFee - fee.value) / self.data.token1Precision
-            sp.verify(tokenBought>=params.minTokenOut , ErrorMessages.MinCash)
-            sp.verify(tokenBought<self.data.token1Pool, ErrorMessages.CashExceed)
-            self.data.token1Pool= abs(self.data.token1Pool - tokenBought)
-            self.data.token2Pool= self.data.token2Pool + params.tokenAmountIn
-            ContractLibrary.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token2Address, self.data.token2Id, self.data.token2Check)
-            ContractLibrary.TransferToken(sp.self_address, params.recipient, tokenBought, self.data.token1Address, self.data.token1Id, self.data.token1Check)
-        sp.else :
-            tokenBoughtWithoutFee = self.newton_dx_to_dy(sp.record(x = token1PoolNew.value, y = token2PoolNew.value, dx = params.tokenAmountIn * self.data.token1Precision, rounds = 5))
-            fee = sp.local("fee", tokenBoughtWithoutFee/self.data.lpFee)
-            tokenBought = abs(tokenBoughtWithoutFee - fee.value) / self.data.token2Precision
-            sp.verify(tokenBought>=params.minTokenOut, ErrorMessages.MinCash)
-            sp.verify(tokenBought<self.data.token2Pool, ErrorMessages.CashExceed)
-            self.data.token2Pool= abs(self.data.token2Pool - tokenBought)
-            self.data.token1Pool= self.data.token1Pool + params.tokenAmountIn
-            ContractLibrary.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token1Address, self.data.token1Id, self.data.token1Check)
-            ContractLibrary.TransferToken(sp.self_address, params.recipient, tokenBought, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.swap_tokens(params.tokenAmountIn, params.minTokenOut, params.recipient, params.requiredTokenAddress, params.requiredTokenId, sp.some(sp.sender))
 
-    @sp.entry_point 
+    @sp.entry_point
+    def RouterSwap(self,params):
+        """Router function to Swap one hop of a route, the swapped out amount is sent back to the Router
+
+        Args:
+            tokenAmountIn: amount of tokens that needs to be swapped
+            recipient: address that will receive the swapped out tokens, the next pool of the route or the user
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+            payer: user paying the tokens for the first hop, None for the next hops which are paid by the previous pool
+        """
+        sp.set_type(params, sp.TRecord(tokenAmountIn = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat, payer = sp.TOption(sp.TAddress)))
+        sp.verify(self.data.routerAddress == sp.some(sp.sender), ErrorMessages.NotRouter)
+        tokenOut = self.swap_tokens(params.tokenAmountIn, sp.nat(0), params.recipient, params.requiredTokenAddress, params.requiredTokenId, params.payer)
+        # Minimum out of the whole route is checked by the Router
+        c = sp.contract(sp.TNat, sp.sender, entry_point="RouteCallback").open_some()
+        sp.transfer(tokenOut, sp.mutez(0), c)
+
+    @sp.entry_point(lazify = True)
     def ChangeState(self):
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
         self.data.paused = ~ self.data.paused
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeAdmin(self,adminAddress): 
         sp.set_type(adminAddress, sp.TAddress)
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
         self.data.admin = adminAddress
 
+    @sp.entry_point(lazify = True)
+    def ChangeRouter(self,routerAddress): 
+        sp.set_type(routerAddress, sp.TOption(sp.TAddress))
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+        self.data.routerAddress = routerAddress
+
     @sp.onchain_view()
     def getReserveBalance(self): 
         reserve = sp.record(
@@ -303,6 +354,34 @@ class FlatCurve(ErrorMessages, ContractLibrary):
         )
         sp.result(reserve)
 
+    @sp.onchain_view()
+    def getPoolState(self):
+        # Same record as the AMM getPoolState, both fees are divisors of the swapped amount
+        # systemFee is none as the flat curve charges no system fee, there is no divisor to report
+        sp.result(sp.record(
+            token1_pool = self.data.token1Pool,
+            token2_pool = self.data.token2Pool,
+            lpFee = self.data.lpFee,
+            systemFee = sp.none,
+            token1Precision = self.data.token1Precision,
+            token2Precision = self.data.token2Precision
+        ))
+
+    @sp.onchain_view()
+    def getStateVersion(self):
+        # Increased by every swap and liquidity update, unchanged version means unchanged quotes
+        sp.result(self.data.stateVersion)
+
+    @sp.onchain_view()
+    def getCumulativePrices(self):
+        # Average price of token1 in token2 between two reads: delta token1PriceCumulative / delta timestamp / PRICE_PRECISION
+        cumulative = self.current_cumulative_prices()
+        sp.result(sp.record(
+            token1PriceCumulative = cumulative.token1PriceCumulative,
+            token2PriceCumulative = cumulative.token2PriceCumulative,
+            timestamp = sp.now
+        ))
+
 
 if "templates" not in __name__:
     @sp.add_test(name = "FlatCurve")
@@ -327,4 +406,70 @@ if "templates" not in __name__:
 
         scenario.h1("Token to token flat curve")
         
-        scenario += c1
\ No newline at end of file
+        scenario += c1
+
+        # The flat curve charges no system fee, its pool state reports no divisor
+        scenario.verify(c1.getPoolState().systemFee.is_none())
+
+        c2 = FlatCurve(token1Pool= sp.nat(0), token2Pool= sp.nat(0), 
+        token1Id= sp.nat(0), token2Id= sp.nat(0), 
+        token1Check= True, token2Check= True, 
+        token1Precision = sp.nat(1), token2Precision= sp.nat(1), 
+        token1Address = token1Address, token2Address= token2Address, 
+        lpFee = sp.nat(500),  lqtTotal= sp.nat(0), lqtAddress= lqtTokenAddress, admin = adminAddress, embeddedLedger = True)
+
+        scenario.h2("Flat curve holding its LP ledger")
+
+        scenario += c2
+        scenario.h2("Cumulative Prices")
+
+        # Empty reserves add nothing, the first update only sets the timestamp
+        c1.add_liquidity(token1_max = 1000000, token2_max = 1000000, recipient = bob.address).run(sender = bob, now = sp.timestamp(100))
+        scenario.verify(c1.data.token1PriceCumulative == 0)
+        scenario.verify(c1.data.blockTimestampLast == sp.timestamp(100))
+
+        # 60 seconds at the balanced price of 1
+        c1.swap(tokenAmountIn = 10000, minTokenOut = 0, recipient = bob.address, requiredTokenAddress = token1Address, requiredTokenId = 0).run(sender = bob, now = sp.timestamp(160))
+        scenario.verify(c1.data.token1PriceCumulative == 60 * PRICE_PRECISION)
+        scenario.verify(c1.data.token2PriceCumulative == 60 * PRICE_PRECISION)
+
+        # Prices are only updated once per block, with the reserves left by the previous block
+        c1.swap(tokenAmountIn = 20000, minTokenOut = 0, recipient = bob.address, requiredTokenAddress = token1Address, requiredTokenId = 0).run(sender = bob, now = sp.timestamp(160))
+        scenario.verify(c1.data.token1PriceCumulative == 60 * PRICE_PRECISION)
+        scenario.verify((c1.data.token1Pool == 970060) & (c1.data.token2Pool == 1030000))
+
+        # Next block accumulates the marginal prices of the reserves left by both swaps, token1 being slightly dearer
+        c1.swap(tokenAmountIn = 10000, minTokenOut = 0, recipient = bob.address, requiredTokenAddress = token2Address, requiredTokenId = 0).run(sender = bob, now = sp.timestamp(220))
+        scenario.verify(c1.data.token1PriceCumulative == 120000000002605537008)
+        scenario.verify(c1.data.token2PriceCumulative == 119999999997394462991)
+        scenario.verify(c1.data.blockTimestampLast == sp.timestamp(220))
+
+        # The view adds the time elapsed since the last update, none at the update block
+        scenario.verify(c1.getCumulativePrices().token1PriceCumulative == c1.data.token1PriceCumulative)
+        scenario.verify(c1.getCumulativePrices().token2PriceCumulative == c1.data.token2PriceCumulative)
+
+        scenario.h2("Embedded LP Ledger")
+
+        # Liquidity is minted in the ledger of the exchange
+        c2.add_liquidity(token1_max = 1000000, token2_max = 1000000, recipient = bob.address).run(sender = bob)
+        scenario.verify(c2.data.lqtTotal == 2000000)
+        scenario.verify(c2.data.balances[bob.address] == 1999000)
+
+        c2.transfer(from_ = bob.address, to_ = cat.address, value = 500000).run(sender = bob)
+        scenario.verify(c2.data.balances[cat.address] == 500000)
+
+        # Transfers from another account need an allowance, nonzero allowances are set back to zero first
+        c2.transfer(from_ = bob.address, to_ = cat.address, value = 100000).run(sender = cat, valid = False, exception = ErrorMessages.NotAllowed)
+        c2.approve(spender = cat.address, value = 100000).run(sender = bob)
+        c2.approve(spender = cat.address, value = 200000).run(sender = bob, valid = False, exception = ErrorMessages.UnsafeAllowanceChange)
+        c2.transfer(from_ = bob.address, to_ = cat.address, value = 100000).run(sender = cat)
+        scenario.verify(c2.data.approvals[bob.address][cat.address] == 0)
+        scenario.verify(c2.data.balances[cat.address] == 600000)
+        c2.transfer(from_ = cat.address, to_ = bob.address, value = 600001).run(sender = cat, valid = False, exception = ErrorMessages.Insufficient)
+
+        # Removing liquidity burns from the ledger, the total supply follows
+        c2.remove_liquidity(lpAmount = 600000, token1_min = 0, token2_min = 0, recipient = cat.address).run(sender = cat)
+        scenario.verify(c2.data.balances[cat.address] == 0)
+        scenario.verify(c2.data.lqtTotal == 1400000)
+        scenario.verify((c2.data.token1Pool == 700000) & (c2.data.token2Pool == 700000))
+        c2.remove_liquidity(lpAmount = 1, token1_min = 0, token2_min = 0, recipient = cat.address).run(sender = cat, valid = False, exception = ErrorMessages.Insufficient)
@@ -1,5 +1,13 @@
+import os
+
 import smartpy as sp
 
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
+
 # Staking Contract for FA1.2 Stake Tokens 
 DECIMAL = 1000000000000000000 # 18 DECIMALs 
 
@@ -9,23 +17,76 @@ MULTIPLIER = 1000000000000 # 12 DECIMALS
 # Specify the Token ID of the FA2 StakedToken 
 TOKEN_ID = 0
 
-class Staking(sp.Contract): 
+# Max Number of Reward Streams that can be Distributed at once 
+MAX_REWARD_STREAMS = 5
+
+class ErrorMessages:
+    """Specifies the different Error Types in the contracts
+    """
+    def make(s):
+        """Generates the error messages, kept as deployed since clients match on them
+        Args:
+            s: error message string
+        Returns:
+            error message, its nat code when PLENTY_ERROR_CODES is set
+        """
+
+        message = s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
+
+
+    NotStaked = make("User has not Staked")
+
+    Paused = make("Contract is not accepting New Staking Orders")
+
+    PeriodFinished = make("Users can't stake after period finish")
+
+    ZeroStake = make("Cannot Stake Amount Less than 1")
+
+    NoStake = make("Sender has not Staked any amount")
+
+    InvalidMapKey = make("Map Key does not Exist for the User")
+
+    LotExceeded = make("Request Amount is greater than Lot Amount")
+
+    InvalidAccount = make("Invalid Account")
+
+    InvalidStream = make("Reward Stream does not Exist")
+
+    MaxStreams = make("Max Reward Streams Reached")
+
+    RecoverStakeToken = make("Admin trying to recover the staked tokens")
+
+    NotAdmin = make("Invalid User")
+
+    ZeroFee = make("Fee Should be Greater than 0")
+
+class Staking(ErrorMessages, Library.ContractLibrary): 
 
     def __init__(self,_admin,_stakeToken,_rewardToken,_faTwoCheck):
 
         self.init(
             totalSupply = sp.nat(0),
-            rewardRate = sp.nat(0), 
-            rewardPerTokenStored = sp.nat(0),
+            # Stream 0 distributes the Reward Token, Partner Tokens are added with AddRewardStream
+            rewardStreams = 
+                sp.map(
+                    l = {
+                        0 : sp.record(token = _rewardToken, tokenId = sp.nat(0), faTwoCheck = False, rewardRate = sp.nat(0), rewardPerTokenStored = sp.nat(0), periodFinish = sp.nat(0), lastUpdateTime = sp.nat(0))
+                    },
+                    tvalue = sp.TRecord(token = sp.TAddress, tokenId = sp.TNat, faTwoCheck = sp.TBool, rewardRate = sp.TNat, rewardPerTokenStored = sp.TNat, periodFinish = sp.TNat, lastUpdateTime = sp.TNat),
+                    tkey = sp.TNat
+                ),
+            streamCounter = sp.nat(1),
+            # Latest Period Finish among all the Reward Streams 
             periodFinish = sp.nat(0),
-            lastUpdateTime = sp.nat(0),
             unstakeFee = {1 : 4, 2 : 8, 3 : 10}, 
             stakeToken = _stakeToken, 
-            rewardToken = _rewardToken,
             admin = _admin,
             balances = 
                 sp.big_map(
-                    tvalue = sp.TRecord(balance = sp.TNat, rewards = sp.TNat, userRewardPerTokenPaid = sp.TNat, counter = sp.TNat ,InvestMap = sp.TMap(sp.TNat, sp.TRecord(amount = sp.TNat, level = sp.TNat))),
+                    tvalue = sp.TRecord(balance = sp.TNat, rewards = sp.TMap(sp.TNat, sp.TNat), userRewardPerTokenPaid = sp.TMap(sp.TNat, sp.TNat), counter = sp.TNat ,InvestMap = sp.TMap(sp.TNat, sp.TRecord(amount = sp.TNat, level = sp.TNat))),
                     tkey = sp.TAddress
                 ),
             paused = False,
@@ -37,77 +98,68 @@ class Staking(sp.Contract):
 
     @sp.sub_entry_point 
     def UpdateReward(self,address): 
-        
-        LastUpdate = sp.local('LastUpdate',sp.nat(0))
-
-        sp.if sp.level > self.data.periodFinish: 
-        
-            LastUpdate.value = self.data.periodFinish
-        
-        sp.else: 
 
-            LastUpdate.value  = sp.level
-        
-        sp.if self.data.totalSupply != sp.nat(0): 
+        # Settles every Reward Stream in a single pass over the map 
+        sp.for stream in self.data.rewardStreams.items(): 
 
-            Result = sp.local('Result',sp.nat(0))
+            LastUpdate = sp.local('LastUpdate',sp.nat(0))
 
-            Result.value += sp.as_nat(LastUpdate.value - self.data.lastUpdateTime)
+            sp.if sp.level > stream.value.periodFinish: 
             
-            Result.value = Result.value * DECIMAL * self.data.rewardRate 
+                LastUpdate.value = stream.value.periodFinish
+            
+            sp.else: 
 
-            Result.value = (Result.value) / (self.data.totalSupply)            
+                LastUpdate.value  = sp.level
 
-            self.data.rewardPerTokenStored += Result.value
+            RewardPerToken = sp.local('RewardPerToken', stream.value.rewardPerTokenStored)
+            
+            sp.if self.data.totalSupply != sp.nat(0): 
 
-        
-        self.data.lastUpdateTime =  LastUpdate.value
+                Result = sp.local('Result',sp.nat(0))
 
-        sp.if address != sp.self_address: 
+                Result.value += sp.as_nat(LastUpdate.value - stream.value.lastUpdateTime)
+                
+                Result.value = Result.value * DECIMAL * stream.value.rewardRate 
 
-            self.data.balances[address].rewards += (self.data.balances[address].balance * sp.as_nat( self.data.rewardPerTokenStored  - self.data.balances[address].userRewardPerTokenPaid) ) / abs(DECIMAL)
+                Result.value = (Result.value) / (self.data.totalSupply)            
 
-            self.data.balances[address].userRewardPerTokenPaid = self.data.rewardPerTokenStored
+                RewardPerToken.value += Result.value
 
-    
-    @sp.entry_point
-    def GetReward(self):
+            self.data.rewardStreams[stream.key].rewardPerTokenStored = RewardPerToken.value
+            
+            self.data.rewardStreams[stream.key].lastUpdateTime =  LastUpdate.value
 
-        sp.verify(self.data.balances.contains(sp.sender), message = "User has not Staked")
+            sp.if address != sp.self_address: 
 
-        self.UpdateReward(sp.sender)
+                UserRewardPerTokenPaid = sp.local('UserRewardPerTokenPaid', self.data.balances[address].userRewardPerTokenPaid.get(stream.key, sp.nat(0)))
 
-        lastTimeReward = sp.local('lastTimeReward',sp.nat(0))
+                self.data.balances[address].rewards[stream.key] = self.data.balances[address].rewards.get(stream.key, sp.nat(0)) + (self.data.balances[address].balance * sp.as_nat( RewardPerToken.value  - UserRewardPerTokenPaid.value) ) / abs(DECIMAL)
 
-        sp.if sp.level > self.data.periodFinish: 
-        
-            lastTimeReward.value = self.data.periodFinish
-        
-        sp.else: 
+                self.data.balances[address].userRewardPerTokenPaid[stream.key] = RewardPerToken.value
 
-            lastTimeReward.value = sp.level 
-        
-        RewardPerToken = sp.local('RewardPerToken', self.data.rewardPerTokenStored)
-
-        sp.if self.data.totalSupply != sp.nat(0):
+    
+    @sp.entry_point
+    def GetReward(self):
 
-            Difference = sp.local('Difference', sp.as_nat(lastTimeReward.value - self.data.lastUpdateTime))
+        sp.verify(self.data.balances.contains(sp.sender), message = ErrorMessages.NotStaked)
 
-            Difference.value = (Difference.value * self.data.rewardRate * DECIMAL ) / abs(DECIMAL) + self.data.rewardPerTokenStored
+        # Settled rewards of every stream are up to date after UpdateReward 
+        self.UpdateReward(sp.sender)
 
-            RewardPerToken.value = Difference.value 
+        sp.for reward in self.data.balances[sp.sender].rewards.items(): 
 
-        getReward = sp.local('getReward',self.data.balances[sp.sender].balance)
+            sp.if reward.value > sp.nat(0): 
 
-        getReward.value *= sp.as_nat(RewardPerToken.value - self.data.balances[sp.sender].userRewardPerTokenPaid)
+                self.data.balances[sp.sender].rewards[reward.key] = 0 
 
-        getReward.value = getReward.value / abs(DECIMAL) + self.data.balances[sp.sender].rewards
+                sp.if self.data.rewardStreams[reward.key].faTwoCheck: 
 
-        sp.if getReward.value > sp.nat(0): 
+                    self.TransferFATwoTokens(sp.self_address, sp.sender, reward.value, self.data.rewardStreams[reward.key].token, self.data.rewardStreams[reward.key].tokenId)
 
-            self.data.balances[sp.sender].rewards = 0 
+                sp.else: 
 
-            self.TransferFATokens(sp.self_address, sp.sender, getReward.value, self.data.rewardToken)
+                    self.TransferFATokens(sp.self_address, sp.sender, reward.value, self.data.rewardStreams[reward.key].token)
 
 
     @sp.entry_point
@@ -115,14 +167,14 @@ class Staking(sp.Contract):
 
         sp.set_type(params, sp.TRecord(amount = sp.TNat))
         
-        sp.verify(~self.data.paused, message = "Contract is not accepting New Staking Orders")
+        sp.verify(~self.data.paused, message = ErrorMessages.Paused)
         
-        sp.verify(sp.level <= self.data.periodFinish, message = "Users can't stake after period finish")
+        sp.verify(sp.level <= self.data.periodFinish, message = ErrorMessages.PeriodFinished)
 
         self.addAddressIfNecessary(sp.sender)
         self.UpdateReward(sp.sender)
         
-        sp.verify(params.amount > 0 , message = "Cannot Stake Amount Less than 1")
+        sp.verify(params.amount > 0 , message = ErrorMessages.ZeroStake)
         
         # Transfer Stake Tokens
 
@@ -150,10 +202,10 @@ class Staking(sp.Contract):
 
         sp.set_type(params, sp.TRecord(MapKey = sp.TNat, Amount = sp.TNat))
 
-        sp.verify(self.data.balances.contains(sp.sender), message = "Sender has not Staked any amount")
-        sp.verify(self.data.balances[sp.sender].InvestMap.contains(params.MapKey), message = "Map Key does not Exist for the User")
+        sp.verify(self.data.balances.contains(sp.sender), message = ErrorMessages.NoStake)
+        sp.verify(self.data.balances[sp.sender].InvestMap.contains(params.MapKey), message = ErrorMessages.InvalidMapKey)
 
-        sp.verify(self.data.balances[sp.sender].InvestMap[params.MapKey].amount >= params.Amount, message ="Request Amount is greater than Lot Amount")
+        sp.verify(self.data.balances[sp.sender].InvestMap[params.MapKey].amount >= params.Amount, message = ErrorMessages.LotExceeded)
 
         # Update Reward Modifer 
         self.UpdateReward(sp.sender)
@@ -209,78 +261,97 @@ class Staking(sp.Contract):
             self.TransferFATokens(sp.self_address, sp.sender, PaymentAmount.value, self.data.stakeToken)
 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def AddReward(self,params):
         
-        sp.set_type(params, sp.TRecord(reward = sp.TNat, blocks = sp.TNat))
+        sp.set_type(params, sp.TRecord(streamId = sp.TNat, reward = sp.TNat, blocks = sp.TNat))
+
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.InvalidAccount)
 
-        sp.verify(sp.sender == self.data.admin, message = "Invalid Account")
+        sp.verify(self.data.rewardStreams.contains(params.streamId), message = ErrorMessages.InvalidStream)
         
         self.UpdateReward(sp.self_address)
     
-        sp.if sp.level >= self.data.periodFinish: 
+        sp.if sp.level >= self.data.rewardStreams[params.streamId].periodFinish: 
 
-            self.data.rewardRate = (params.reward)/(params.blocks)
+            self.data.rewardStreams[params.streamId].rewardRate = (params.reward)/(params.blocks)
 
         sp.else: 
 
-            DurationLeft = sp.local('DurationLeft', sp.as_nat(self.data.periodFinish - sp.level))
-            LeftOver = sp.local('LeftOver',DurationLeft.value * self.data.rewardRate)
+            DurationLeft = sp.local('DurationLeft', sp.as_nat(self.data.rewardStreams[params.streamId].periodFinish - sp.level))
+            LeftOver = sp.local('LeftOver',DurationLeft.value * self.data.rewardStreams[params.streamId].rewardRate)
             
-            self.data.rewardRate =  ( LeftOver.value + params.reward ) / ( params.blocks )
+            self.data.rewardStreams[params.streamId].rewardRate =  ( LeftOver.value + params.reward ) / ( params.blocks )
+
+        self.data.rewardStreams[params.streamId].lastUpdateTime = sp.level
+
+        self.data.rewardStreams[params.streamId].periodFinish = sp.level + params.blocks
 
-        self.data.lastUpdateTime = sp.level
+        sp.if self.data.rewardStreams[params.streamId].periodFinish > self.data.periodFinish: 
 
-        self.data.periodFinish = sp.level + params.blocks
+            self.data.periodFinish = self.data.rewardStreams[params.streamId].periodFinish
+
+    @sp.entry_point(lazify = True)
+    def AddRewardStream(self,params): 
+
+        sp.set_type(params, sp.TRecord(token = sp.TAddress, tokenId = sp.TNat, faTwoCheck = sp.TBool))
+
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.InvalidAccount)
+
+        sp.verify(sp.len(self.data.rewardStreams) < MAX_REWARD_STREAMS, message = ErrorMessages.MaxStreams)
+
+        self.data.rewardStreams[self.data.streamCounter] = sp.record(token = params.token, tokenId = params.tokenId, faTwoCheck = params.faTwoCheck, rewardRate = sp.nat(0), rewardPerTokenStored = sp.nat(0), periodFinish = sp.nat(0), lastUpdateTime = sp.nat(0))
+
+        self.data.streamCounter += 1 
         
 
     def addAddressIfNecessary(self, address):
         
         sp.if ~ self.data.balances.contains(address):
-            self.data.balances[address] = sp.record(balance = 0, rewards = 0, userRewardPerTokenPaid = 0, counter = 0, InvestMap = sp.map())
+            self.data.balances[address] = sp.record(balance = 0, rewards = sp.map(), userRewardPerTokenPaid = sp.map(), counter = 0, InvestMap = sp.map())
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def RecoverExcessToken(self,params):
         
         sp.set_type(params, sp.TRecord(address = sp.TAddress, value = sp.TNat, token = sp.TAddress, type = sp.TNat, id = sp.TNat))
 
         # Verification for admin 
-        sp.verify(sp.sender == self.data.admin, message = "Invalid Account")
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.InvalidAccount)
 
         sp.if params.type == sp.nat(1): 
 
-            sp.verify( (params.address != self.data.stakeToken) | (params.id != TOKEN_ID) , message = "Admin trying to recover the staked tokens")
+            sp.verify( (params.address != self.data.stakeToken) | (params.id != TOKEN_ID) , message = ErrorMessages.RecoverStakeToken)
         
             self.TransferFATwoTokens(sp.self_address, params.address, params.value, params.token, params.id)
 
         sp.else: 
 
-            sp.verify(params.address != self.data.stakeToken, message= "Admin trying to recover the staked tokens")
+            sp.verify(params.address != self.data.stakeToken, message = ErrorMessages.RecoverStakeToken)
         
             self.TransferFATokens(sp.self_address, params.address, params.value, params.token)
 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeAdmin(self,address):
 
         sp.set_type(address, sp.TAddress)
-        sp.verify(sp.sender == self.data.admin, message = "Invalid User")
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.NotAdmin)
 
         self.data.admin = address
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeState(self):
 
-        sp.verify(sp.sender == self.data.admin, message = "Invalid User")
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.NotAdmin)
 
         self.data.paused = ~ self.data.paused 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeUnstakeFee(self,params):
 
         sp.set_type(params, sp.TRecord(cycles = sp.TNat, fee = sp.TNat, blocksPerCycle = sp.TNat, defaultFee = sp.TNat))
 
-        sp.verify(sp.sender == self.data.admin, message = "Invalid User")
+        sp.verify(sp.sender == self.data.admin, message = ErrorMessages.NotAdmin)
 
         self.data.unstakeFee[params.cycles] = params.fee
 
@@ -288,12 +359,12 @@ class Staking(sp.Contract):
 
         self.data.defaultUnstakeFee = params.defaultFee 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def WithdrawFee(self):
 
-        sp.verify(self.data.totalFee > 0, message = "Fee Should be Greater than 0")
+        sp.verify(self.data.totalFee > 0, message = ErrorMessages.ZeroFee)
 
-        sp.verify(sp.sender == self.data.admin ,message= "Invalid User")
+        sp.verify(sp.sender == self.data.admin ,message = ErrorMessages.NotAdmin)
 
         PaymentAmount = sp.local('PaymentAmount', self.data.totalFee)
 
@@ -308,46 +379,6 @@ class Staking(sp.Contract):
             self.TransferFATokens(sp.self_address, sp.sender, PaymentAmount.value, self.data.stakeToken)
 
 
-    def TransferFATwoTokens(self,sender,reciever,amount,tokenAddress,id):
-
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = reciever,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(self,sender,reciever,amount,tokenAddress): 
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = reciever, 
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
-
-
 if "templates" not in __name__:
     @sp.add_test(name = "Staking Contract")
     def test():
@@ -361,6 +392,7 @@ if "templates" not in __name__:
         admin = sp.address("KT1GpTEq4p2XZ8w9p5xM7Wayyw5VR7tb3UaW")
         stakeTokenAddress = sp.address("KT1AFA2mwNUMNd4SsujE1YYp29vd8BZejyKW")
         rewardTokenAddress = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+        partnerTokenAddress = sp.address("KT1HZW9FWJt6aU8x4nr6UiBry2eUCA7xEFb1")
 
         stakeTokenFaTwoCheck = True
 
@@ -386,7 +418,16 @@ if "templates" not in __name__:
         staking.stake(amount = 1  * DECIMAL).run(sender = alice , level = 10, valid = False)
 
         # Admin Contract has Added Reward and Users can Start Staking
-        staking.AddReward(reward = 10000 * DECIMAL, blocks = 100).run(sender = admin, level = 100)
+        staking.AddReward(streamId = 0, reward = 10000 * DECIMAL, blocks = 100).run(sender = admin, level = 100)
+
+        # Admin Added a Partner Token Reward Stream 
+        staking.AddRewardStream(token = partnerTokenAddress, tokenId = 0, faTwoCheck = True).run(sender = admin)
+
+        staking.AddRewardStream(token = partnerTokenAddress, tokenId = 0, faTwoCheck = True).run(sender = alice, valid = False)
+
+        staking.AddReward(streamId = 1, reward = 500 * DECIMAL, blocks = 50).run(sender = admin, level = 100)
+
+        staking.AddReward(streamId = 7, reward = 500 * DECIMAL, blocks = 50).run(sender = admin, level = 100, valid = False)
         
         # Alice and Bob started Staking 
         staking.stake(amount = 100 * DECIMAL ).run(sender = alice , level = 100)
@@ -394,7 +435,7 @@ if "templates" not in __name__:
         staking.stake(amount = 100 * DECIMAL ).run(sender = tezsure, level = 150 )
 
         # Admin added Reward in between 
-        staking.AddReward(reward = 10000 * DECIMAL, blocks = 100).run(sender = admin, level = 300)
+        staking.AddReward(streamId = 0, reward = 10000 * DECIMAL, blocks = 100).run(sender = admin, level = 300)
 
         # Alice and Bob Unstaked their amounts 
         staking.unstake(MapKey = 0 , Amount = 50 * DECIMAL).run(sender = alice, level = 400)
@@ -402,9 +443,12 @@ if "templates" not in __name__:
         staking.unstake(MapKey = 0 , Amount = 100 * DECIMAL).run(sender = bob , level = 400)
         staking.unstake(MapKey = 0 , Amount = 100 * DECIMAL).run(sender = tezsure , level = 400)
 
-        # Alice and Bob Harvested 
+        # Alice and Bob Harvested both Reward Streams in one call
         staking.GetReward().run(sender = alice, level = 401 )    
 
+        scenario.verify(staking.data.balances[alice.address].rewards[0] == 0)
+        scenario.verify(staking.data.balances[alice.address].rewards[1] == 0)
+
         # Calling GetReward After Rewards were recived 
         staking.GetReward().run(sender = alice, level = 401)
         
@@ -0,0 +1,749 @@
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
+
+# Auto-Compounding Vault holding one shared position in the Staking Contract
+
+# Responses of the FA2 balance_of entrypoint
+BALANCE_RESPONSES = sp.TList(sp.TRecord(request = sp.TRecord(owner = sp.TAddress, token_id = sp.TNat).layout(("owner", "token_id")), balance = sp.TNat).layout(("request", "balance")))
+
+class ErrorMessages:
+    """Specifies the different Error Types in the contracts
+    """
+    def make(s):
+        """Generates standard error messages prepending contract name (PlentyVault_)
+        Args:
+            s: error message string
+        Returns:
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
+        """
+
+        message = "PlentyVault_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
+
+
+    NotAdmin = make("Not_Admin")
+
+    Paused = make("Paused_State")
+
+    LockCheck = make("Invalid_CallBack")
+
+    InvalidCaller = make("Invalid_Caller")
+
+    Insufficient = make("Insufficient_Shares")
+
+    ZeroTransfer = make("Zero_Amount_Transfer")
+
+    ZeroShares = make("Zero_Shares_Minted")
+
+    InvalidToken = make("Invalid_Token")
+
+    NotKeeper = make("Not_Keeper")
+
+class Vault(ErrorMessages, Library.ContractLibrary):
+
+    def __init__(self,_admin,_stakingAddress,_ammAddress,_lpTokenAddress,_rewardTokenAddress,_pairTokenAddress,_pairTokenId,_pairTokenCheck,_rewardIsToken1):
+
+        """Initialize the contract storage
+
+        Storage:
+            admin: vault admin address
+            keeper: address allowed to harvest besides the admin, the admin at origination
+            stakingAddress: Staking Contract where the vault holds its position
+            ammAddress: AMM Contract used for compounding the rewards
+            lpTokenAddress: LP token of the AMM, staked in the Staking Contract
+            rewardTokenAddress: FA1.2 Reward Token of the Staking Contract (stream 0), one of the AMM tokens
+            pairTokenAddress: contract address for the other token of the AMM
+            pairTokenId: token id for the other token of the AMM
+            pairTokenCheck: boolean describing whether the other token of the AMM is FA2
+            rewardIsToken1: boolean describing whether the Reward Token is token 1 of the AMM
+            totalShares: total vault shares issued
+            totalStaked: LP tokens backing the shares, staked or pending, share price is totalStaked / totalShares
+            pendingLP: LP tokens deposited since the last harvest, staked by the next harvest
+            shares: vault shares held by each user
+            lots: LP amount staked in each Staking lot, keyed by Staking MapKey
+            firstLot: oldest Staking lot still holding LP tokens
+            nextLot: MapKey the Staking Contract will assign to the next stake
+            paused: boolean describing whether deposits are paused
+            Locked: boolean check for callback functions of harvest and withdraw
+            recipientAddress: address receiving the LP tokens of a pending withdrawal
+            minimumTokenOut: minimum pair tokens expected from the swap of a pending harvest
+            liquidityAmount: Reward Tokens of a pending harvest kept for adding liquidity
+        """
+
+        self.init(
+            admin = _admin,
+            keeper = _admin,
+            stakingAddress = _stakingAddress,
+            ammAddress = _ammAddress,
+            lpTokenAddress = _lpTokenAddress,
+            rewardTokenAddress = _rewardTokenAddress,
+            pairTokenAddress = _pairTokenAddress,
+            pairTokenId = _pairTokenId,
+            pairTokenCheck = _pairTokenCheck,
+            rewardIsToken1 = _rewardIsToken1,
+            totalShares = sp.nat(0),
+            totalStaked = sp.nat(0),
+            pendingLP = sp.nat(0),
+            shares = sp.big_map(tkey = sp.TAddress, tvalue = sp.TNat),
+            lots = sp.big_map(tkey = sp.TNat, tvalue = sp.TNat),
+            firstLot = sp.nat(0),
+            nextLot = sp.nat(0),
+            paused = False,
+            Locked = False,
+            recipientAddress = sp.none,
+            minimumTokenOut = sp.none,
+            liquidityAmount = sp.none
+        )
+
+    def StakeLP(self,amount):
+        """Stakes LP tokens held by the vault as a new Staking lot
+
+        Args:
+            amount: amount of LP tokens to be staked
+        """
+
+        self.ApproveToken(self.data.stakingAddress, amount, self.data.lpTokenAddress, sp.nat(0), False)
+
+        stakeHandle = sp.contract(
+            sp.TRecord(amount = sp.TNat),
+            self.data.stakingAddress,
+            "stake"
+            ).open_some()
+
+        sp.transfer(sp.record(amount = amount), sp.mutez(0), stakeHandle)
+
+        self.data.lots[self.data.nextLot] = amount
+
+        self.data.nextLot += 1
+
+    def UnstakeLP(self,amount):
+        """Unstakes LP tokens from the oldest Staking lots first, which carry the lowest unstake fee
+
+        Args:
+            amount: amount of LP tokens to be unstaked
+        """
+
+        unstakeHandle = sp.contract(
+            sp.TRecord(MapKey = sp.TNat, Amount = sp.TNat),
+            self.data.stakingAddress,
+            "unstake"
+            ).open_some()
+
+        remaining = sp.local('remaining', amount)
+
+        sp.while remaining.value > 0:
+
+            lotAmount = sp.local('lotAmount', self.data.lots[self.data.firstLot])
+
+            sp.if lotAmount.value <= remaining.value:
+
+                sp.transfer(sp.record(MapKey = self.data.firstLot, Amount = lotAmount.value), sp.mutez(0), unstakeHandle)
+
+                del self.data.lots[self.data.firstLot]
+
+                self.data.firstLot += 1
+
+                remaining.value = sp.as_nat(remaining.value - lotAmount.value)
+
+            sp.else:
+
+                sp.transfer(sp.record(MapKey = self.data.firstLot, Amount = remaining.value), sp.mutez(0), unstakeHandle)
+
+                self.data.lots[self.data.firstLot] = sp.as_nat(lotAmount.value - remaining.value)
+
+                remaining.value = sp.nat(0)
+
+    def RequestBalance(self,tokenAddress,callback):
+        """Requests the FA1.2 balance of the vault, answered on the given callback entrypoint
+
+        Args:
+            tokenAddress: address of the FA1.2 contract
+            callback: name of the entrypoint receiving the balance
+        """
+
+        param = (sp.self_address, sp.self_entry_point(entry_point = callback))
+
+        contractHandle = sp.contract(
+            sp.TPair(sp.TAddress, sp.TContract(sp.TNat)),
+            tokenAddress,
+            "getBalance",
+        ).open_some()
+
+        sp.transfer(param, sp.mutez(0), contractHandle)
+
+    def RequestFATwoBalance(self,tokenAddress,tokenId,callback):
+        """Requests the FA2 balance of the vault for a token id, answered on the given callback entrypoint
+
+        Args:
+            tokenAddress: address of the FA2 contract
+            tokenId: id of the token
+            callback: name of the entrypoint receiving the balance_of responses
+        """
+
+        contractHandle = sp.contract(
+            sp.TRecord(requests = sp.TList(sp.TRecord(owner = sp.TAddress, token_id = sp.TNat).layout(("owner", "token_id"))), callback = sp.TContract(BALANCE_RESPONSES)).layout(("requests", "callback")),
+            tokenAddress,
+            "balance_of",
+        ).open_some()
+
+        sp.transfer(sp.record(requests = [sp.record(owner = sp.self_address, token_id = tokenId)], callback = sp.self_entry_point(entry_point = callback)), sp.mutez(0), contractHandle)
+
+    def AddHarvestLiquidity(self,pairBalance):
+        """Adds the Reward Tokens kept by the pending harvest and every pair token of the vault as liquidity
+
+        Args:
+            pairBalance: pair token balance of the vault, the swap output and the pair tokens left by the previous harvests
+        """
+
+        rewardAmount = sp.local('rewardAmount', self.data.liquidityAmount.open_some())
+
+        self.ApproveToken(self.data.ammAddress, pairBalance, self.data.pairTokenAddress, self.data.pairTokenId, self.data.pairTokenCheck)
+
+        liquidityHandle = sp.contract(
+            sp.TRecord(token1_max = sp.TNat, token2_max = sp.TNat, recipient = sp.TAddress),
+            self.data.ammAddress,
+            "AddLiquidity"
+            ).open_some()
+
+        sp.if self.data.rewardIsToken1:
+
+            sp.transfer(sp.record(token1_max = rewardAmount.value, token2_max = pairBalance, recipient = sp.self_address), sp.mutez(0), liquidityHandle)
+
+        sp.else:
+
+            sp.transfer(sp.record(token1_max = pairBalance, token2_max = rewardAmount.value, recipient = sp.self_address), sp.mutez(0), liquidityHandle)
+
+        self.data.liquidityAmount = sp.none
+
+        self.RequestBalance(self.data.lpTokenAddress, 'stake_callback')
+
+    @sp.entry_point
+    def Deposit(self,amount):
+        """Allows users to deposit LP tokens into the vault and gain vault shares
+
+        Deposits are held by the vault and staked by the next harvest in a single Staking lot, so the
+        Staking lots of the vault grow with the harvests and not with the deposits.
+
+        Args:
+            amount: amount of LP tokens to be deposited
+        """
+
+        sp.set_type(amount, sp.TNat)
+
+        sp.verify(~self.data.paused, ErrorMessages.Paused)
+
+        sp.verify(~self.data.Locked, ErrorMessages.LockCheck)
+
+        sharesMinted = sp.local('sharesMinted', amount)
+
+        sp.if self.data.totalShares != sp.nat(0):
+
+            sharesMinted.value = (amount * self.data.totalShares) / self.data.totalStaked
+
+        sp.verify(sharesMinted.value > 0, ErrorMessages.ZeroShares)
+
+        self.TransferToken(sp.sender, sp.self_address, amount, self.data.lpTokenAddress, sp.nat(0), False)
+
+        self.data.pendingLP += amount
+
+        self.data.shares[sp.sender] = self.data.shares.get(sp.sender, sp.nat(0)) + sharesMinted.value
+
+        self.data.totalShares += sharesMinted.value
+
+        self.data.totalStaked += amount
+
+    @sp.entry_point
+    def Withdraw(self,shares):
+        """Allows users to burn their vault shares and get back LP tokens, net of the Staking unstake fee
+
+        LP tokens pending since the last harvest are paid first, without fee, then the oldest Staking lots are unstaked.
+
+        Args:
+            shares: amount of vault shares to be burned
+        """
+
+        sp.set_type(shares, sp.TNat)
+
+        sp.verify(~self.data.Locked, ErrorMessages.LockCheck)
+
+        sp.verify((shares > 0) & (self.data.shares.get(sp.sender, sp.nat(0)) >= shares), ErrorMessages.Insufficient)
+
+        lpAmount = sp.local('lpAmount', (shares * self.data.totalStaked) / self.data.totalShares)
+
+        sp.verify(lpAmount.value > 0, ErrorMessages.ZeroTransfer)
+
+        self.data.shares[sp.sender] = sp.as_nat(self.data.shares[sp.sender] - shares)
+
+        self.data.totalShares = sp.as_nat(self.data.totalShares - shares)
+
+        self.data.totalStaked = sp.as_nat(self.data.totalStaked - lpAmount.value)
+
+        sp.if lpAmount.value <= self.data.pendingLP:
+
+            self.data.pendingLP = sp.as_nat(self.data.pendingLP - lpAmount.value)
+
+            self.TransferFATokens(sp.self_address, sp.sender, lpAmount.value, self.data.lpTokenAddress)
+
+        sp.else:
+
+            self.UnstakeLP(sp.as_nat(lpAmount.value - self.data.pendingLP))
+
+            self.data.pendingLP = sp.nat(0)
+
+            # LP tokens are sent to the user once the vault knows the amount received after fee
+
+            self.data.Locked = True
+
+            self.data.recipientAddress = sp.some(sp.sender)
+
+            self.RequestBalance(self.data.lpTokenAddress, 'withdraw_callback')
+
+    @sp.entry_point
+    def withdraw_callback(self,lpBalance):
+        """Callback function from the LP Token Contract sending the unstaked LP tokens to the user
+
+        The LP tokens still pending for the next harvest stay in the vault.
+
+        Args:
+            lpBalance: LP token balance of the vault
+        """
+
+        sp.set_type(lpBalance, sp.TNat)
+
+        sp.verify(sp.sender == self.data.lpTokenAddress, ErrorMessages.InvalidCaller)
+
+        sp.verify(self.data.Locked & self.data.recipientAddress.is_some(), ErrorMessages.LockCheck)
+
+        sp.if lpBalance > self.data.pendingLP:
+
+            self.TransferFATokens(sp.self_address, self.data.recipientAddress.open_some(), sp.as_nat(lpBalance - self.data.pendingLP), self.data.lpTokenAddress)
+
+        self.data.Locked = False
+
+        self.data.recipientAddress = sp.none
+
+    @sp.entry_point
+    def Harvest(self,minimumTokenOut):
+        """Harvests the vault rewards and compounds them into the Staking position for all users at once
+
+        Only the admin and the keeper can harvest, as the minimum out of the reward swap is chosen by the caller.
+        Rewards are claimed once the vault has staked, the first harvest only stakes the pending deposits.
+        Staking keeps the vault account after its lots are unstaked, so the rewards settled by the unstakes
+        are still claimed when every lot is withdrawn.
+
+        Args:
+            minimumTokenOut: minimum amount of pair tokens expected when swapping half of the rewards
+        """
+
+        sp.set_type(minimumTokenOut, sp.TNat)
+
+        sp.verify((sp.sender == self.data.admin) | (sp.sender == self.data.keeper), ErrorMessages.NotKeeper)
+
+        sp.verify(~self.data.Locked, ErrorMessages.LockCheck)
+
+        self.data.Locked = True
+
+        self.data.minimumTokenOut = sp.some(minimumTokenOut)
+
+        sp.if self.data.nextLot == sp.nat(0):
+
+            # GetReward fails with NotStaked until the first lot, the pending deposits are staked directly
+
+            self.RequestBalance(self.data.lpTokenAddress, 'stake_callback')
+
+        sp.else:
+
+            rewardHandle = sp.contract(
+                sp.TUnit,
+                self.data.stakingAddress,
+                "GetReward"
+            ).open_some()
+
+            sp.transfer(sp.unit, sp.mutez(0), rewardHandle)
+
+            self.RequestBalance(self.data.rewardTokenAddress, 'harvest_callback')
+
+    @sp.entry_point
+    def harvest_callback(self,rewardBalance):
+        """Callback function from the Reward Token Contract swapping half of the rewards for pair tokens
+
+        Args:
+            rewardBalance: Reward Token balance of the vault
+        """
+
+        sp.set_type(rewardBalance, sp.TNat)
+
+        sp.verify(sp.sender == self.data.rewardTokenAddress, ErrorMessages.InvalidCaller)
+
+        sp.verify(self.data.Locked & self.data.minimumTokenOut.is_some(), ErrorMessages.LockCheck)
+
+        sp.if rewardBalance > 1:
+
+            swapAmount = sp.local('swapAmount', rewardBalance / 2)
+
+            self.data.liquidityAmount = sp.some(sp.as_nat(rewardBalance - swapAmount.value))
+
+            self.ApproveToken(self.data.ammAddress, rewardBalance, self.data.rewardTokenAddress, sp.nat(0), False)
+
+            swapHandle = sp.contract(
+                sp.TRecord(tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat),
+                self.data.ammAddress,
+                "Swap"
+                ).open_some()
+
+            sp.transfer(sp.record(tokenAmountIn = swapAmount.value, MinimumTokenOut = self.data.minimumTokenOut.open_some(), recipient = sp.self_address, requiredTokenAddress = self.data.pairTokenAddress, requiredTokenId = self.data.pairTokenId), sp.mutez(0), swapHandle)
+
+            # Liquidity is added with the pair tokens actually held after the swap
+
+            sp.if self.data.pairTokenCheck:
+
+                self.RequestFATwoBalance(self.data.pairTokenAddress, self.data.pairTokenId, 'pair_fa2_callback')
+
+            sp.else:
+
+                self.RequestBalance(self.data.pairTokenAddress, 'pair_callback')
+
+        sp.else:
+
+            # Nothing to compound, the pending deposits are staked all the same
+
+            self.RequestBalance(self.data.lpTokenAddress, 'stake_callback')
+
+    @sp.entry_point
+    def pair_callback(self,pairBalance):
+        """Callback function from an FA1.2 pair Token Contract adding the harvest liquidity
+
+        Args:
+            pairBalance: pair token balance of the vault
+        """
+
+        sp.set_type(pairBalance, sp.TNat)
+
+        sp.verify(sp.sender == self.data.pairTokenAddress, ErrorMessages.InvalidCaller)
+
+        sp.verify(self.data.Locked & self.data.liquidityAmount.is_some(), ErrorMessages.LockCheck)
+
+        self.AddHarvestLiquidity(pairBalance)
+
+    @sp.entry_point
+    def pair_fa2_callback(self,responses):
+        """Callback function from an FA2 pair Token Contract adding the harvest liquidity
+
+        Args:
+            responses: balance_of responses, the pair token balance of the vault
+        """
+
+        sp.set_type(responses, BALANCE_RESPONSES)
+
+        sp.verify(sp.sender == self.data.pairTokenAddress, ErrorMessages.InvalidCaller)
+
+        sp.verify(self.data.Locked & self.data.liquidityAmount.is_some(), ErrorMessages.LockCheck)
+
+        pairBalance = sp.local('pairBalance', sp.nat(0))
+
+        sp.for response in responses:
+
+            sp.if (response.request.owner == sp.self_address) & (response.request.token_id == self.data.pairTokenId):
+
+                pairBalance.value = response.balance
+
+        self.AddHarvestLiquidity(pairBalance.value)
+
+    @sp.entry_point
+    def stake_callback(self,lpBalance):
+        """Callback function from the LP Token Contract staking the LP tokens minted by the harvest
+
+        The minted LP tokens and the deposits pending since the last harvest are staked as one Staking lot.
+        Shares are left untouched, so the share price of every user rises with the compounded LP tokens.
+
+        Args:
+            lpBalance: LP token balance of the vault
+        """
+
+        sp.set_type(lpBalance, sp.TNat)
+
+        sp.verify(sp.sender == self.data.lpTokenAddress, ErrorMessages.InvalidCaller)
+
+        sp.verify(self.data.Locked & self.data.minimumTokenOut.is_some(), ErrorMessages.LockCheck)
+
+        sp.if lpBalance > 0:
+
+            self.StakeLP(lpBalance)
+
+            self.data.totalStaked += sp.as_nat(lpBalance - self.data.pendingLP)
+
+            self.data.pendingLP = sp.nat(0)
+
+        self.data.Locked = False
+
+        self.data.minimumTokenOut = sp.none
+
+    @sp.entry_point(lazify = True)
+    def ChangeState(self):
+        """Admin function to toggle contract state, withdrawals and harvests are always allowed
+        """
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.paused = ~ self.data.paused
+
+    @sp.entry_point(lazify = True)
+    def ChangeAdmin(self,adminAddress):
+        """Admin function to Update Admin Address
+
+        Args:
+            adminAddress: Upgrades adminAddress to new MultiSig or DAO
+        """
+
+        sp.set_type(adminAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.admin = adminAddress
+
+    @sp.entry_point(lazify = True)
+    def ChangeKeeper(self,keeperAddress):
+        """Admin function to Update the Keeper Address allowed to harvest
+
+        Args:
+            keeperAddress: new keeper address
+        """
+
+        sp.set_type(keeperAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.keeper = keeperAddress
+
+    @sp.entry_point(lazify = True)
+    def RecoverExcessToken(self,params):
+        """Admin function to Recover tokens which are not compounded by the vault, such as partner reward streams
+
+        Args:
+            tokenAddress : Token Address which would be recovered
+            reciever : Address which would be receiving the funds
+            tokenId : Id used in case of FA2
+            amount : Recover Amount Value
+            faTwoCheck : Boolean parameter for Fa1.2 or Fa2
+        """
+
+        sp.set_type(params, sp.TRecord( tokenAddress = sp.TAddress, reciever = sp.TAddress, tokenId = sp.TNat, amount = sp.TNat, faTwoCheck = sp.TBool ))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify((params.tokenAddress != self.data.lpTokenAddress) & (params.tokenAddress != self.data.rewardTokenAddress), ErrorMessages.InvalidToken)
+
+        self.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
+
+    @sp.onchain_view()
+    def getSharePrice(self):
+        """View function to get the LP tokens backing the vault shares
+
+        Returns:
+            sp.TRecord(totalStaked = sp.TNat, totalShares = sp.TNat): LP tokens staked and vault shares issued
+        """
+
+        sp.result(sp.record(totalStaked = self.data.totalStaked, totalShares = self.data.totalShares))
+
+
+if "templates" not in __name__:
+    @sp.add_test(name = "Plenty Vault Contract")
+    def test():
+
+        scenario = sp.test_scenario()
+        scenario.h1("Auto-Compounding Vault Contract")
+
+        scenario.table_of_contents()
+
+        # Deployment Accounts
+        adminAddress = sp.address("KT19eGoVGhXHkTSQT9Dfrm4z4QHUa4RttabH")
+        stakingAddress = sp.address("KT1GpTEq4p2XZ8w9p5xM7Wayyw5VR7tb3UaW")
+        ammAddress = sp.address("KT1X1LgNkQShpF9nRLYw3Dgdy4qp38MX617z")
+        lpTokenAddress = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd")
+
+        # Reward Token is PLENTY, token 1 of the AMM
+        rewardTokenAddress = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+
+        pairTokenAddress = sp.address("KT1AFA2mwNUMNd4SsujE1YYp29vd8BZejyKW")
+        pairTokenId = 0
+        pairTokenCheck = True
+
+        alice = sp.test_account("Alice")
+        bob   = sp.test_account("Robert")
+
+        vault = Vault(adminAddress,stakingAddress,ammAddress,lpTokenAddress,rewardTokenAddress,pairTokenAddress,pairTokenId,pairTokenCheck,True)
+        scenario += vault
+
+        # Alice and Bob Deposit LP Tokens
+        vault.Deposit(1000).run(sender = alice)
+        vault.Deposit(500).run(sender = bob)
+
+        # Deposits wait for the next harvest, no Staking lot is opened
+        scenario.verify(vault.data.totalShares == 1500)
+        scenario.verify(vault.data.pendingLP == 1500)
+        scenario.verify(vault.data.nextLot == 0)
+
+        # Only the admin and the keeper harvest
+        vault.Harvest(40).run(sender = bob, valid = False)
+        vault.ChangeKeeper(bob.address).run(sender = bob, valid = False)
+        vault.ChangeKeeper(bob.address).run(sender = adminAddress)
+
+        # The first harvest has no reward to claim and stakes the deposits as the first lot
+        vault.Harvest(40).run(sender = bob)
+
+        vault.Deposit(500).run(sender = bob, valid = False)
+
+        vault.harvest_callback(100).run(sender = alice, valid = False)
+
+        vault.stake_callback(1500).run(sender = lpTokenAddress)
+
+        scenario.verify(vault.data.totalStaked == 1500)
+        scenario.verify(vault.data.pendingLP == 0)
+        scenario.verify(vault.data.lots[0] == 1500)
+
+        # Harvest compounds for everyone
+        vault.Harvest(40).run(sender = bob)
+
+        vault.harvest_callback(100).run(sender = rewardTokenAddress)
+
+        scenario.verify(vault.data.liquidityAmount == sp.some(50))
+
+        # Liquidity is added with the pair balance after the swap, above the minimum out
+        pairBalance = [sp.record(request = sp.record(owner = vault.address, token_id = sp.nat(pairTokenId)), balance = sp.nat(45))]
+        vault.pair_fa2_callback(pairBalance).run(sender = alice, valid = False)
+        vault.pair_fa2_callback(pairBalance).run(sender = pairTokenAddress)
+
+        scenario.verify(vault.data.liquidityAmount.is_none())
+
+        # The 150 minted LP tokens are staked as a new lot
+        vault.stake_callback(150).run(sender = lpTokenAddress)
+
+        scenario.verify(vault.data.totalStaked == 1650)
+        scenario.verify(vault.data.totalShares == 1500)
+        scenario.verify(vault.data.pendingLP == 0)
+        scenario.verify(vault.data.nextLot == 2)
+        scenario.verify(vault.data.lots[1] == 150)
+
+        # Alice Withdraws her Shares, unstaking from the oldest lots
+        vault.Withdraw(1000).run(sender = alice)
+
+        scenario.verify(vault.data.totalStaked == 550)
+        scenario.verify(vault.data.firstLot == 0)
+        scenario.verify(vault.data.lots[0] == 400)
+
+        vault.withdraw_callback(1090).run(sender = lpTokenAddress)
+
+        vault.Withdraw(1).run(sender = alice, valid = False)
+
+        # Withdrawals are paid from the pending deposits first, without unstaking
+        vault.Deposit(500).run(sender = bob)
+
+        scenario.verify(vault.data.pendingLP == 500)
+
+        vault.Withdraw(400).run(sender = bob)
+
+        scenario.verify(vault.data.pendingLP == 60)
+        scenario.verify(vault.data.lots[0] == 400)
+        scenario.verify(~vault.data.Locked)
+
+        scenario.h2("Harvest with the Staking Contract")
+
+        Staking = sp.io.import_script_from_url("file:Staking/staking.py")
+        VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+        xPlentyToken = sp.io.import_script_from_url("file:xPlenty/xPlentyTokenContract.py")
+
+        tokenAdmin = sp.test_account("Token Admin")
+
+        def token(symbol):
+
+            return xPlentyToken.FA12(
+                tokenAdmin.address,
+                config = xPlentyToken.FA12_config(),
+                token_metadata = {"decimals" : "18", "name" : symbol, "symbol" : symbol},
+                contract_metadata = {"" : "ipfs://bafkreicpstxib2vfup4yf7vxsulnwlwp3774agelle6u4nw7ztajwnfaxy"}
+            )
+
+        plenty = token("PLENTY")
+        scenario += plenty
+
+        pairToken = token("PAIR")
+        scenario += pairToken
+
+        # The exchange holds the LP ledger and is the LP token of the Staking Contract and the vault
+        amm = VolatileSwap.AMM(adminAddress,plenty.address,0,False,pairToken.address,0,False,500,1000,lpTokenAddress,True)
+        scenario += amm
+
+        staking = Staking.Staking(adminAddress,amm.address,plenty.address,False)
+        scenario += staking
+
+        stakedVault = Vault(adminAddress,staking.address,amm.address,amm.address,plenty.address,pairToken.address,0,False,True)
+        scenario += stakedVault
+
+        plenty.mint(address = alice.address, value = 1000000).run(sender = tokenAdmin)
+        plenty.mint(address = staking.address, value = 100000).run(sender = tokenAdmin)
+        pairToken.mint(address = alice.address, value = 4000000).run(sender = tokenAdmin)
+
+        plenty.approve(spender = amm.address, value = 1000000).run(sender = alice)
+        pairToken.approve(spender = amm.address, value = 4000000).run(sender = alice)
+
+        amm.AddLiquidity(token1_max = 1000000, token2_max = 4000000, recipient = alice.address).run(sender = alice)
+
+        # 100 PLENTY per block until level 1100
+        staking.AddReward(streamId = 0, reward = 100000, blocks = 1000).run(sender = adminAddress, level = 100)
+
+        amm.approve(spender = stakedVault.address, value = 100000).run(sender = alice)
+        stakedVault.Deposit(100000).run(sender = alice, level = 101)
+
+        # The first harvest stakes the deposit without calling GetReward
+        stakedVault.Harvest(0).run(sender = adminAddress, level = 110)
+
+        scenario.verify(~stakedVault.data.Locked)
+        scenario.verify(stakedVault.data.nextLot == 1)
+        scenario.verify(stakedVault.data.lots[0] == 100000)
+        scenario.verify(stakedVault.data.pendingLP == 0)
+        scenario.verify(stakedVault.data.totalStaked == 100000)
+        scenario.verify(staking.data.balances[stakedVault.address].balance == 100000 * Staking.MULTIPLIER)
+
+        # The second harvest claims the 4000 PLENTY earned over 40 blocks and compounds them as a new lot
+        stakedVault.Harvest(0).run(sender = adminAddress, level = 150)
+
+        scenario.verify(~stakedVault.data.Locked)
+        scenario.verify(stakedVault.data.liquidityAmount.is_none())
+        scenario.verify(stakedVault.data.nextLot == 2)
+        scenario.verify(stakedVault.data.lots[1] > 0)
+        scenario.verify(stakedVault.data.totalStaked == 100000 + stakedVault.data.lots[1])
+        scenario.verify(plenty.data.balances[staking.address] == 96000)
+
+        # Alice withdraws every share, both lots are unstaked net of the unstake fee
+        stakedVault.Withdraw(100000).run(sender = alice, level = 200)
+
+        scenario.verify(~stakedVault.data.Locked)
+        scenario.verify(stakedVault.data.firstLot == 2)
+        scenario.verify(stakedVault.data.totalShares == 0)
+        scenario.verify(stakedVault.data.totalStaked == 0)
+        scenario.verify(amm.data.balances[stakedVault.address] == 0)
+        scenario.verify(amm.data.balances[alice.address] > 1899000 + 75000)
+
+        # Adding Compilation Target
+        sp.add_compilation_target(
+            "Vault",
+            Vault(
+            adminAddress,
+            stakingAddress,
+            ammAddress,
+            lpTokenAddress,
+            rewardTokenAddress,
+            pairTokenAddress,
+            pairTokenId,
+            pairTokenCheck,
+            True
+            ))
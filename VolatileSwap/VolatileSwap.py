@@ -1,7 +1,18 @@
-import smartpy as sp 
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
 
 INITIAL_LIQUIDITY = 1000
 
+# Fixed point scale of the cumulative prices
+PRICE_PRECISION = 10 ** 18
+
 class ErrorMessages:
     """Specifies the different Error Types in the contracts
     """
@@ -10,10 +21,13 @@ class ErrorMessages:
         Args:
             s: error message string
         Returns:
-            standardized error message
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
         """
 
-        return ("PLentySwap_" + s)
+        message = "PLentySwap_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
 
     
     NotAdmin = make("Not_Admin")
@@ -40,114 +54,22 @@ class ErrorMessages:
 
     ZeroTransfer = make("Zero_Amount_Transfer")
 
-class ContractLibrary(sp.Contract,ErrorMessages):
-    """Provides utility functions 
-    """
-
-    def TransferFATwoTokens(sender,receiver,amount,tokenAddress,id):
-        """Transfers FA2 tokens
-        
-        Args:
-            sender: sender address
-            receiver: receiver address
-            amount: amount of tokens to be transferred
-            tokenAddress: address of the FA2 contract
-            id: id of token to be transferred
-        """
-
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = receiver,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(sender,reciever,amount,tokenAddress): 
-        """Transfers FA1.2 tokens
-        
-        Args:
-            sender: sender address
-            reciever: reciever address
-            amount: amount of tokens to be transferred
-            tokenAddress: address of the FA1.2 contract
-        """
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = reciever, 
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
-
-    def TransferToken(sender, receiver, amount, tokenAddress,id, faTwoFlag): 
-        """Generic function to transfer any type of tokens
-        
-        Args:
-            sender: sender address
-            reciever: reciever address
-            amount: amount of tokens to be transferred
-            tokenAddress: address of the token contract
-            id: id of token to be transfered (for FA2 tokens)
-            faTwoFlag: boolean describing whether the token contract is FA2 or not
-        """
-
-        sp.verify(amount > 0 , ErrorMessages.ZeroTransfer)
-
-        sp.if faTwoFlag: 
+    NotRouter = make("Not_Router")
 
-            ContractLibrary.TransferFATwoTokens(sender, receiver, amount , tokenAddress, id )
+    NotAllowed = make("Not_Allowed")
 
-        sp.else: 
+    UnsafeAllowanceChange = make("Unsafe_Allowance_Change")
 
-            ContractLibrary.TransferFATokens(sender, receiver, amount, tokenAddress)
-
-        
-    @sp.global_lambda
-    def square_root(x): 
-        """Calculates the square root of a given integer
-        
-        Args:
-            x : integer whose square root is to be determined
-        Returns:
-            square root of x
-        """
+    ZeroLiquidity = make("Zero_Liquidity")
 
-        sp.verify(x >= 0, message = ErrorMessages.NegativeValue)
-        
-        y = sp.local('y', x)
-        
-        sp.while y.value * y.value > x:
-        
-            y.value = (x // y.value + y.value) // 2
-        
-        sp.verify((y.value * y.value <= x) & (x < (y.value + 1) * (y.value + 1)))
+    MaxTokenExceed = make("Max_Token_Exceeded")
 
-        sp.result(y.value)
+class AMM(ErrorMessages, Library.ContractLibrary):
 
-class AMM(ContractLibrary):
+    # LP total supply returned by getTotalSupply of the embedded ledger
+    LPSupplyField = "totalSupply"
 
-    def __init__(self,_admin,_token1Address,_token1Id,_token1Check,_token2Address,_token2Id,_token2Check,_lpFee,_systemFee,_lpTokenAddress):
+    def __init__(self,_admin,_token1Address,_token1Id,_token1Check,_token2Address,_token2Id,_token2Check,_lpFee,_systemFee,_lpTokenAddress,_embeddedLedger = False):
 
         """Initialize the contract storage
         
@@ -159,7 +81,7 @@ class AMM(ContractLibrary):
             token2Address: contract address for second token used in the amm
             token2Id: token id for second token used in the amm
             token2Check: boolean describing whether second token used in the amm is FA2
-            lpTokenAddress: contract address for the LP tokens used in the amm
+            lpTokenAddress: contract address for the LP tokens used in the amm, unused with the embedded ledger
             lpFee: % fee for the LP 
             systemFee: % fee for the AMM System
             token1_pool: total liquidity of token 1
@@ -169,8 +91,20 @@ class AMM(ContractLibrary):
             token1_Fee: total system fee accumulated in token 1
             token2_Fee: total system fee accumulated in token 2
             maxSwapLimit: max % of total liquidity that can be swapped in one go
+            routerAddress: router allowed to swap through RouterSwap
+            stateVersion: counter increased by every swap, liquidity and fee update
+            token1_priceCumulative: sum over time of the price of token 1 in token 2, scaled by PRICE_PRECISION
+            token2_priceCumulative: sum over time of the price of token 2 in token 1, scaled by PRICE_PRECISION
+            blockTimestampLast: timestamp of the last cumulative price update
+            balances: LP token balances, only with the embedded ledger
+            approvals: LP token allowances, only with the embedded ledger
+
+        With _embeddedLedger the exchange holds the LP ledger and is itself the FA1.2 LP token,
+        so adding and removing liquidity does not call a separate LP token contract.
         """
 
+        self.embeddedLedger = _embeddedLedger
+
         self.init(
             admin = _admin, 
             token1Address = _token1Address, 
@@ -188,28 +122,136 @@ class AMM(ContractLibrary):
             paused = False,
             token1_Fee = sp.nat(0), 
             token2_Fee = sp.nat(0),
-            maxSwapLimit = sp.nat(40)
+            maxSwapLimit = sp.nat(40),
+            routerAddress = sp.none,
+            stateVersion = sp.nat(0),
+            token1_priceCumulative = sp.nat(0),
+            token2_priceCumulative = sp.nat(0),
+            blockTimestampLast = sp.timestamp(0)
         )
 
+        if self.embeddedLedger: 
 
-    @sp.entry_point
-    def Swap(self,params): 
-        """ Function for Users to Swap their assets to get the required Token 
+            Library.LPLedger.AddLedger(self)
+
+    def MintLP(self, recipient, value):
+        """Mints LP tokens in the embedded ledger or through the LP token contract
         
         Args:
-            tokenAmountIn: amount of tokens sent by user that needs to be swapped
-            MinimumTokenOut: minimum amount of token expected by user after swap 
-            recipient: address that will receive the swapped out tokens 
+            recipient: account credited with the LP tokens
+            value: amount of LP tokens
+        """
+
+        if self.embeddedLedger: 
+
+            self.data.balances[recipient] = self.data.balances.get(recipient, sp.nat(0)) + value
+
+        else: 
+
+            mintParam = sp.record(
+                address = recipient, 
+                value = value
+            )
+
+            mintHandle = sp.contract(
+                sp.TRecord(address = sp.TAddress, value = sp.TNat),
+                self.data.lpTokenAddress,
+                "mint"
+                ).open_some()
+
+            sp.transfer(mintParam, sp.mutez(0), mintHandle)
+
+    def BurnLP(self, owner, value):
+        """Burns LP tokens in the embedded ledger or through the LP token contract
+        
+        Args:
+            owner: account the LP tokens are burned from
+            value: amount of LP tokens
+        """
+
+        if self.embeddedLedger: 
+
+            ownerBalance = sp.local('ownerBalance', self.data.balances.get(owner, sp.nat(0)))
+
+            sp.verify(ownerBalance.value >= value, ErrorMessages.Insufficient)
+
+            self.data.balances[owner] = sp.as_nat(ownerBalance.value - value)
+
+        else: 
+
+            burnParam = sp.record(
+                address = owner, 
+                value = value
+            )
+
+            burnHandle = sp.contract(
+                sp.TRecord(address = sp.TAddress, value = sp.TNat),
+                self.data.lpTokenAddress,
+                "burn"
+                ).open_some()
+
+            sp.transfer(burnParam, sp.mutez(0), burnHandle)
+
+    def CurrentCumulativePrices(self):
+        """Cumulative prices at the current block, the reserves being unchanged since the last update
+        
+        Returns:
+            sp.TRecord(token1_priceCumulative = sp.TNat, token2_priceCumulative = sp.TNat)
+        """
+
+        cumulative = sp.local('cumulative', sp.record(
+            token1_priceCumulative = self.data.token1_priceCumulative,
+            token2_priceCumulative = self.data.token2_priceCumulative
+        ))
+
+        sp.if (sp.now > self.data.blockTimestampLast) & (self.data.token1_pool != 0) & (self.data.token2_pool != 0): 
+
+            elapsed = sp.local('elapsed', sp.as_nat(sp.now - self.data.blockTimestampLast))
+
+            cumulative.value.token1_priceCumulative += self.data.token2_pool * PRICE_PRECISION * elapsed.value / self.data.token1_pool
+
+            cumulative.value.token2_priceCumulative += self.data.token1_pool * PRICE_PRECISION * elapsed.value / self.data.token2_pool
+
+        return cumulative.value
+
+    def UpdateCumulativePrices(self):
+        """Adds the prices of the reserves held since the last update to the cumulative prices
+        
+        Called before the reserves change. The timestamp is the same for the whole block, so the
+        prices are accumulated once per block with the reserves left by the previous block.
+        """
+
+        sp.if sp.now > self.data.blockTimestampLast: 
+
+            cumulative = self.CurrentCumulativePrices()
+
+            self.data.token1_priceCumulative = cumulative.token1_priceCumulative
+
+            self.data.token2_priceCumulative = cumulative.token2_priceCumulative
+
+            self.data.blockTimestampLast = sp.now
+
+
+    def SwapTokens(self, tokenAmountIn, MinimumTokenOut, recipient, requiredTokenAddress, requiredTokenId, payer):
+        """Swaps tokens in the pool and sends the swapped out tokens to the recipient
+
+        Args:
+            tokenAmountIn: amount of tokens that needs to be swapped
+            MinimumTokenOut: minimum amount of token expected after swap
+            recipient: address that will receive the swapped out tokens
             requiredTokenAddress: contract address of the token that is expected to be returned after swap
             requiredTokenId: id of the token that is expected to be returned after swap
+            payer: optional address the tokens are pulled from, None when the previous pool of a route already sent them
+        Returns:
+            amount of tokens sent to the recipient
         """
 
-        sp.set_type(params, sp.TRecord(tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat))
-
         sp.verify( ~self.data.paused, ErrorMessages.Paused)
 
-        sp.verify( ( (params.requiredTokenAddress == self.data.token1Address) & (params.requiredTokenId == self.data.token1Id)) | 
-        ( (params.requiredTokenAddress == self.data.token2Address)  & (params.requiredTokenId == self.data.token2Id)), ErrorMessages.InvalidPair)
+        self.UpdateCumulativePrices()
+
+        sp.verify( ( (requiredTokenAddress == self.data.token1Address) & (requiredTokenId == self.data.token1Id)) | 
+        ( (requiredTokenAddress == self.data.token2Address)  & (requiredTokenId == self.data.token2Id)), ErrorMessages.InvalidPair)
 
         requiredTokenAmount = sp.local('requiredTokenAmount', sp.nat(0))
         SwapTokenPool = sp.local('SwapTokenPool', sp.nat(0))
@@ -219,7 +261,7 @@ class AMM(ContractLibrary):
 
         tokenTransfer = sp.local('tokenTransfer', sp.nat(0))
 
-        sp.if (params.requiredTokenAddress == self.data.token1Address) & (params.requiredTokenId == self.data.token1Id): 
+        sp.if (requiredTokenAddress == self.data.token1Address) & (requiredTokenId == self.data.token1Id): 
 
             requiredTokenAmount.value = self.data.token2_pool
             SwapTokenPool.value = self.data.token1_pool
@@ -230,49 +272,96 @@ class AMM(ContractLibrary):
             SwapTokenPool.value = self.data.token2_pool
 
 
-        sp.verify(params.tokenAmountIn * 100 <= requiredTokenAmount.value * self.data.maxSwapLimit, ErrorMessages.SwapLimitExceed)
+        sp.verify(tokenAmountIn * 100 <= requiredTokenAmount.value * self.data.maxSwapLimit, ErrorMessages.SwapLimitExceed)
 
-        lpfee.value = params.tokenAmountIn / self.data.lpFee
+        lpfee.value = tokenAmountIn / self.data.lpFee
 
-        systemfee.value = params.tokenAmountIn / self.data.systemFee
+        systemfee.value = tokenAmountIn / self.data.systemFee
         
         Invariant = sp.local('Invariant', self.data.token1_pool * self.data.token2_pool)
 
-        Invariant.value = Invariant.value / sp.as_nat( (requiredTokenAmount.value + params.tokenAmountIn) - ( lpfee.value + systemfee.value) )
+        Invariant.value = Invariant.value / sp.as_nat( (requiredTokenAmount.value + tokenAmountIn) - ( lpfee.value + systemfee.value) )
 
         tokenTransfer.value = sp.as_nat(SwapTokenPool.value - Invariant.value)
 
-        sp.verify(tokenTransfer.value >= params.MinimumTokenOut, ErrorMessages.InsufficientTokenOut)
+        sp.verify(tokenTransfer.value >= MinimumTokenOut, ErrorMessages.InsufficientTokenOut)
 
         sp.verify(systemfee.value > 0 , ErrorMessages.InvalidFee)
 
-        sp.if (params.requiredTokenAddress == self.data.token1Address) & (params.requiredTokenId == self.data.token1Id): 
+        sp.if (requiredTokenAddress == self.data.token1Address) & (requiredTokenId == self.data.token1Id): 
 
             self.data.token1_pool = Invariant.value
 
-            self.data.token2_pool += sp.as_nat(params.tokenAmountIn - systemfee.value)
+            self.data.token2_pool += sp.as_nat(tokenAmountIn - systemfee.value)
 
             self.data.token2_Fee += systemfee.value
 
             # Transfer tokens to Exchange
-            ContractLibrary.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+            sp.if payer.is_some(): 
+
+                self.TransferToken(payer.open_some(), sp.self_address, tokenAmountIn, self.data.token2Address, self.data.token2Id, self.data.token2Check)
 
             # Transfer tokens to the recipient 
-            ContractLibrary.TransferToken(sp.self_address, params.recipient, tokenTransfer.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+            self.TransferToken(sp.self_address, recipient, tokenTransfer.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
 
         sp.else: 
 
             self.data.token2_pool = Invariant.value
 
-            self.data.token1_pool += sp.as_nat(params.tokenAmountIn - systemfee.value)
+            self.data.token1_pool += sp.as_nat(tokenAmountIn - systemfee.value)
 
             self.data.token1_Fee += systemfee.value
 
             # Transfer Tokens to Exchange
-            ContractLibrary.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+            sp.if payer.is_some(): 
+
+                self.TransferToken(payer.open_some(), sp.self_address, tokenAmountIn, self.data.token1Address, self.data.token1Id, self.data.token1Check)
 
             # Transfer Tokens to the recipient
-            ContractLibrary.TransferToken(sp.self_address, params.recipient, tokenTransfer.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+            self.TransferToken(sp.self_address, recipient, tokenTransfer.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+
+        self.data.stateVersion += 1
+
+        return tokenTransfer.value
+
+    @sp.entry_point
+    def Swap(self,params): 
+        """ Function for Users to Swap their assets to get the required Token 
+        
+        Args:
+            tokenAmountIn: amount of tokens sent by user that needs to be swapped
+            MinimumTokenOut: minimum amount of token expected by user after swap 
+            recipient: address that will receive the swapped out tokens 
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+        """
+
+        sp.set_type(params, sp.TRecord(tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat))
+
+        self.SwapTokens(params.tokenAmountIn, params.MinimumTokenOut, params.recipient, params.requiredTokenAddress, params.requiredTokenId, sp.some(sp.sender))
+
+    @sp.entry_point
+    def RouterSwap(self,params): 
+        """Router function to Swap one hop of a route, the swapped out amount is sent back to the Router
+
+        Args:
+            tokenAmountIn: amount of tokens that needs to be swapped
+            recipient: address that will receive the swapped out tokens, the next pool of the route or the user
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+            payer: user paying the tokens for the first hop, None for the next hops which are paid by the previous pool
+        """
+
+        sp.set_type(params, sp.TRecord(tokenAmountIn = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat, payer = sp.TOption(sp.TAddress)))
+
+        sp.verify(self.data.routerAddress == sp.some(sp.sender), ErrorMessages.NotRouter)
+
+        tokenOut = self.SwapTokens(params.tokenAmountIn, sp.nat(0), params.recipient, params.requiredTokenAddress, params.requiredTokenId, params.payer)
+
+        # Minimum out of the whole route is checked by the Router
+        callbackHandle = sp.contract(sp.TNat, sp.sender, "RouteCallback").open_some()
+
+        sp.transfer(tokenOut, sp.mutez(0), callbackHandle)
 
     @sp.entry_point 
     def AddLiquidity(self,params): 
@@ -285,6 +374,8 @@ class AMM(ContractLibrary):
         """
 
         sp.set_type(params, sp.TRecord(token1_max = sp.TNat, token2_max = sp.TNat, recipient = sp.TAddress))
+
+        self.UpdateCumulativePrices()
         
         token1Amount = sp.local('token1Amount', sp.nat(0))
 
@@ -331,37 +422,144 @@ class AMM(ContractLibrary):
             token2Amount.value = params.token2_max
             
 
-        sp.verify(liquidity.value > 0 )
+        sp.verify(liquidity.value > 0, ErrorMessages.ZeroLiquidity)
 
-        sp.verify(token1Amount.value <= params.token1_max )
+        sp.verify(token1Amount.value <= params.token1_max, ErrorMessages.MaxTokenExceed)
 
-        sp.verify(token2Amount.value <= params.token2_max )
+        sp.verify(token2Amount.value <= params.token2_max, ErrorMessages.MaxTokenExceed)
         
         # Transfer Funds to Exchange 
         
-        ContractLibrary.TransferToken(sp.sender, sp.self_address, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+        self.TransferToken(sp.sender, sp.self_address, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
 
-        ContractLibrary.TransferToken(sp.sender, sp.self_address, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.TransferToken(sp.sender, sp.self_address, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
 
         self.data.token1_pool += token1Amount.value
 
         self.data.token2_pool += token2Amount.value
 
+        self.data.stateVersion += 1
+
         # Mint LP Tokens
         self.data.totalSupply += liquidity.value
 
-        mintParam = sp.record(
-            address = params.recipient, 
-            value = liquidity.value
-        )
+        self.MintLP(params.recipient, liquidity.value)
+
+    @sp.entry_point 
+    def ZapIn(self,params): 
+        """Allows users to add liquidity with only one of the two tokens
+        
+        Part of the tokens is swapped inside the pool for the other token, without any token transfer,
+        and the rest is added as liquidity together with the swapped out tokens. The swapped part s
+        is the root of g*h*s^2 + R*(1 + g)*s - A*R = 0, with A the amount sent, R the pool of the
+        token sent, g = 1 - 1/lpFee - 1/systemFee the part of a swap entering the invariant and
+        h = 1 - 1/systemFee the part added to the pool, so that the liquidity added after the swap
+        matches the ratio of the pool.
+
+        Args:
+            tokenAddress: contract address of the token sent
+            tokenId: id of the token sent
+            tokenAmountIn: amount of tokens sent
+            minLpOut: minimum amount of LP tokens expected by the user
+            recipient: account address that will be credited with the LP tokens
+        """
+
+        sp.set_type(params, sp.TRecord(tokenAddress = sp.TAddress, tokenId = sp.TNat, tokenAmountIn = sp.TNat, minLpOut = sp.TNat, recipient = sp.TAddress))
+
+        sp.verify( ~self.data.paused, ErrorMessages.Paused)
+
+        sp.verify(self.data.totalSupply != sp.nat(0), ErrorMessages.NotInitialized)
+
+        sp.verify(params.tokenAmountIn > 0, ErrorMessages.ZeroTransfer)
+
+        sp.verify( ( (params.tokenAddress == self.data.token1Address) & (params.tokenId == self.data.token1Id)) | 
+        ( (params.tokenAddress == self.data.token2Address)  & (params.tokenId == self.data.token2Id)), ErrorMessages.InvalidPair)
+
+        self.UpdateCumulativePrices()
 
-        mintHandle = sp.contract(
-            sp.TRecord(address = sp.TAddress, value = sp.TNat),
-            self.data.lpTokenAddress,
-            "mint"
-            ).open_some()
+        tokenInPool = sp.local('tokenInPool', self.data.token2_pool)
 
-        sp.transfer(mintParam, sp.mutez(0), mintHandle)
+        tokenOutPool = sp.local('tokenOutPool', self.data.token1_pool)
+
+        sp.if (params.tokenAddress == self.data.token1Address) & (params.tokenId == self.data.token1Id): 
+
+            tokenInPool.value = self.data.token1_pool
+
+            tokenOutPool.value = self.data.token2_pool
+
+        # Closed form of the swapped part, in integers with D = lpFee * systemFee, G = g * D and H = h * systemFee
+        feeProduct = sp.local('feeProduct', self.data.lpFee * self.data.systemFee)
+
+        swapFactor = sp.local('swapFactor', sp.as_nat(feeProduct.value - self.data.lpFee - self.data.systemFee))
+
+        poolFactor = sp.local('poolFactor', sp.as_nat(self.data.systemFee - 1))
+
+        linearTerm = sp.local('linearTerm', tokenInPool.value * self.data.systemFee * (feeProduct.value + swapFactor.value))
+
+        discriminant = sp.local('discriminant', linearTerm.value * linearTerm.value + 4 * swapFactor.value * poolFactor.value * params.tokenAmountIn * tokenInPool.value * feeProduct.value * self.data.systemFee)
+
+        swapAmount = sp.local('swapAmount', sp.as_nat(self.square_root(discriminant.value) - linearTerm.value) / (2 * swapFactor.value * poolFactor.value))
+
+        sp.verify(swapAmount.value * 100 <= tokenInPool.value * self.data.maxSwapLimit, ErrorMessages.SwapLimitExceed)
+
+        # Internal swap, same math as SwapTokens
+        lpfee = sp.local('lpfee', swapAmount.value / self.data.lpFee)
+
+        systemfee = sp.local('systemfee', swapAmount.value / self.data.systemFee)
+
+        sp.verify(systemfee.value > 0 , ErrorMessages.InvalidFee)
+
+        Invariant = sp.local('Invariant', (tokenInPool.value * tokenOutPool.value) / sp.as_nat( (tokenInPool.value + swapAmount.value) - ( lpfee.value + systemfee.value) ))
+
+        tokenOutAmount = sp.local('tokenOutAmount', sp.as_nat(tokenOutPool.value - Invariant.value))
+
+        tokenInPool.value += sp.as_nat(swapAmount.value - systemfee.value)
+
+        tokenOutPool.value = Invariant.value
+
+        # Liquidity added with the rest of the tokens sent and the swapped out tokens
+        depositAmount = sp.local('depositAmount', sp.as_nat(params.tokenAmountIn - swapAmount.value))
+
+        liquidity = sp.local('liquidity', (depositAmount.value * self.data.totalSupply) / tokenInPool.value)
+
+        sp.if (tokenOutAmount.value * self.data.totalSupply) / tokenOutPool.value < liquidity.value: 
+
+            liquidity.value = (tokenOutAmount.value * self.data.totalSupply) / tokenOutPool.value
+
+        sp.verify(liquidity.value > 0, ErrorMessages.InvalidRatio)
+
+        sp.verify(liquidity.value >= params.minLpOut, ErrorMessages.InsufficientTokenOut)
+
+        tokenInPool.value += depositAmount.value
+
+        tokenOutPool.value += tokenOutAmount.value
+
+        sp.if (params.tokenAddress == self.data.token1Address) & (params.tokenId == self.data.token1Id): 
+
+            self.data.token1_pool = tokenInPool.value
+
+            self.data.token2_pool = tokenOutPool.value
+
+            self.data.token1_Fee += systemfee.value
+
+            self.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+
+        sp.else: 
+
+            self.data.token2_pool = tokenInPool.value
+
+            self.data.token1_pool = tokenOutPool.value
+
+            self.data.token2_Fee += systemfee.value
+
+            self.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+
+        self.data.stateVersion += 1
+
+        # Mint LP Tokens
+        self.data.totalSupply += liquidity.value
+
+        self.MintLP(params.recipient, liquidity.value)
 
     @sp.entry_point 
     def RemoveLiquidity(self,params): 
@@ -379,6 +577,8 @@ class AMM(ContractLibrary):
         sp.verify(self.data.totalSupply != sp.nat(0), message = ErrorMessages.NotInitialized)
 
         sp.verify(params.lpAmount <= self.data.totalSupply, message = ErrorMessages.Insufficient)
+
+        self.UpdateCumulativePrices()
         
         token1Amount = sp.local('token1Amount', sp.nat(0))
 
@@ -392,9 +592,9 @@ class AMM(ContractLibrary):
 
         # Values should be greater than  Minimum threshold  
 
-        sp.verify(token1Amount.value >= params.token1_min)
+        sp.verify(token1Amount.value >= params.token1_min, ErrorMessages.InsufficientTokenOut)
 
-        sp.verify(token2Amount.value >= params.token2_min)
+        sp.verify(token2Amount.value >= params.token2_min, ErrorMessages.InsufficientTokenOut)
 
         # Subtracting Values  
 
@@ -403,29 +603,20 @@ class AMM(ContractLibrary):
         self.data.token2_pool = sp.as_nat( self.data.token2_pool - token2Amount.value )
 
         self.data.totalSupply = sp.as_nat( self.data.totalSupply - params.lpAmount )
+
+        self.data.stateVersion += 1
         
         # Burning LP Tokens  
         
-        burnParam = sp.record(
-            address = sp.sender, 
-            value = params.lpAmount
-        )
-
-        burnHandle = sp.contract(
-            sp.TRecord(address = sp.TAddress, value = sp.TNat),
-            self.data.lpTokenAddress,
-            "burn"
-            ).open_some()
-
-        sp.transfer(burnParam, sp.mutez(0), burnHandle)
+        self.BurnLP(sp.sender, params.lpAmount)
 
         # Sending Plenty and Tokens 
 
-        ContractLibrary.TransferToken(sp.self_address, params.recipient, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
+        self.TransferToken(sp.self_address, params.recipient, token1Amount.value, self.data.token1Address, self.data.token1Id, self.data.token1Check)
 
-        ContractLibrary.TransferToken(sp.self_address, params.recipient, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
+        self.TransferToken(sp.self_address, params.recipient, token2Amount.value, self.data.token2Address, self.data.token2Id, self.data.token2Check)
 
-    @sp.entry_point 
+    @sp.entry_point(lazify = True)
     def ModifyFee(self,params):
 
         """Admin function to modify the LP and System Fees
@@ -440,13 +631,15 @@ class AMM(ContractLibrary):
 
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
 
-        sp.verify( (params.lpFee > 50) & (params.systemFee > 50))
+        sp.verify( (params.lpFee > 50) & (params.systemFee > 50), ErrorMessages.InvalidFeeAmount)
 
         self.data.lpFee = params.lpFee 
 
         self.data.systemFee = params.systemFee
 
-    @sp.entry_point 
+        self.data.stateVersion += 1
+
+    @sp.entry_point(lazify = True)
     def ChangeState(self):
         """Admin function to toggle contract state
         
@@ -460,7 +653,7 @@ class AMM(ContractLibrary):
 
         self.data.paused = ~ self.data.paused
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeAdmin(self,adminAddress): 
         """Admin function to Update Admin Address
         
@@ -474,7 +667,7 @@ class AMM(ContractLibrary):
 
         self.data.admin = adminAddress
 
-    @sp.entry_point 
+    @sp.entry_point(lazify = True)
     def ModifyMaxSwapAmount(self,amount): 
         """Admin function to modify the max swap limit
         
@@ -487,7 +680,22 @@ class AMM(ContractLibrary):
 
         self.data.maxSwapLimit = amount
 
-    @sp.entry_point 
+        self.data.stateVersion += 1
+
+    @sp.entry_point(lazify = True)
+    def ChangeRouter(self,routerAddress): 
+        """Admin function to set the Router allowed to call RouterSwap
+        
+        Args:
+            routerAddress: new router address, None to disable RouterSwap
+        """ 
+        sp.set_type(routerAddress, sp.TOption(sp.TAddress))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.routerAddress = routerAddress
+
+    @sp.entry_point(lazify = True)
     def WithdrawSystemFee(self,address): 
         """Admin function to withdraw system fee
         
@@ -500,15 +708,17 @@ class AMM(ContractLibrary):
 
         sp.if self.data.token1_Fee != sp.nat(0): 
 
-            ContractLibrary.TransferToken(sp.self_address, address, self.data.token1_Fee, self.data.token1Address, self.data.token1Id, self.data.token1Check )
+            self.TransferToken(sp.self_address, address, self.data.token1_Fee, self.data.token1Address, self.data.token1Id, self.data.token1Check )
             
         sp.if self.data.token2_Fee != sp.nat(0): 
 
-            ContractLibrary.TransferToken(sp.self_address, address, self.data.token2_Fee, self.data.token2Address, self.data.token2Id, self.data.token2Check )
+            self.TransferToken(sp.self_address, address, self.data.token2_Fee, self.data.token2Address, self.data.token2Id, self.data.token2Check )
         
         self.data.token1_Fee = sp.nat(0)
 
         self.data.token2_Fee = sp.nat(0)
+
+        self.data.stateVersion += 1
     
 
     @sp.utils.view(sp.TRecord(token1_pool = sp.TNat, token2_pool = sp.TNat))
@@ -565,6 +775,60 @@ class AMM(ContractLibrary):
 
         sp.result(exchangeFee)
 
+    @sp.onchain_view()
+    def getPoolState(self):
+        """View function to get the reserves and fees needed to quote a swap, read by the Pool Registry
+
+        Returns:
+            sp.TRecord(token1_pool, token2_pool, lpFee, systemFee, token1Precision, token2Precision): reserves, fees and unit precisions (always 1)
+
+        lpFee and systemFee are divisors of the swapped amount, systemFee is an option as curves without a system fee report none.
+        """
+
+        sp.result(
+            sp.record(
+                token1_pool = self.data.token1_pool,
+                token2_pool = self.data.token2_pool,
+                lpFee = self.data.lpFee,
+                systemFee = sp.some(self.data.systemFee),
+                token1Precision = sp.nat(1),
+                token2Precision = sp.nat(1)
+            )
+        )
+
+    @sp.onchain_view()
+    def getStateVersion(self):
+        """View function to get the state version, increased by every swap, liquidity and fee update
+
+        Quotes computed from the pool state stay valid as long as the version is unchanged.
+
+        Returns:
+            sp.TNat: current state version
+        """
+
+        sp.result(self.data.stateVersion)
+
+    @sp.onchain_view()
+    def getCumulativePrices(self):
+        """View function to get the cumulative prices at the current block, for time weighted average prices
+        
+        The average price of token 1 in token 2 between two reads is
+        (token1_priceCumulative2 - token1_priceCumulative1) / (timestamp2 - timestamp1) / PRICE_PRECISION
+
+        Returns:
+            sp.TRecord(token1_priceCumulative, token2_priceCumulative, timestamp): cumulative prices and the timestamp they are computed at
+        """
+
+        cumulative = self.CurrentCumulativePrices()
+
+        sp.result(
+            sp.record(
+                token1_priceCumulative = cumulative.token1_priceCumulative,
+                token2_priceCumulative = cumulative.token2_priceCumulative,
+                timestamp = sp.now
+            )
+        )
+
 
 if "templates" not in __name__:
     @sp.add_test(name = "Plenty Swap Contract")
@@ -594,6 +858,121 @@ if "templates" not in __name__:
         Exchange = AMM(adminAddress,token1Address,token1Id,token1Check,token2Address,token2Id,token2Check,liquidityProviderFee,systemFee,lpTokenAddress)
         scenario += Exchange
 
+        scenario.h2("Exchange holding its LP ledger")
+
+        EmbeddedExchange = AMM(adminAddress,token1Address,token1Id,token1Check,token2Address,token2Id,token2Check,liquidityProviderFee,systemFee,lpTokenAddress,True)
+        scenario += EmbeddedExchange
+
+        scenario.verify(EmbeddedExchange.data.totalSupply == 0)
+
+        scenario.h2("Cumulative Prices")
+
+        alice = sp.test_account("Alice")
+
+        # Empty reserves add nothing, the first update only sets the timestamp
+        Exchange.AddLiquidity(token1_max = 1000000, token2_max = 2000000, recipient = alice.address).run(sender = alice, now = sp.timestamp(100))
+
+        scenario.verify(Exchange.data.token1_priceCumulative == 0)
+        scenario.verify(Exchange.data.blockTimestampLast == sp.timestamp(100))
+
+        # 60 seconds at 2 token2 per token1
+        Exchange.Swap(tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = alice.address, requiredTokenAddress = token1Address, requiredTokenId = token1Id).run(sender = alice, now = sp.timestamp(160))
+
+        scenario.verify(Exchange.data.token1_priceCumulative == 120 * PRICE_PRECISION)
+        scenario.verify(Exchange.data.token2_priceCumulative == 30 * PRICE_PRECISION)
+        scenario.verify(Exchange.data.blockTimestampLast == sp.timestamp(160))
+
+        # Prices are only updated once per block, with the reserves left by the previous block
+        Exchange.Swap(tokenAmountIn = 20000, MinimumTokenOut = 0, recipient = alice.address, requiredTokenAddress = token1Address, requiredTokenId = token1Id).run(sender = alice, now = sp.timestamp(160))
+
+        scenario.verify(Exchange.data.token1_priceCumulative == 120 * PRICE_PRECISION)
+        scenario.verify(Exchange.data.token2_priceCumulative == 30 * PRICE_PRECISION)
+        scenario.verify((Exchange.data.token1_pool == 985264) & (Exchange.data.token2_pool == 2029970))
+
+        # Next block accumulates the reserves left by both swaps
+        Exchange.Swap(tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = alice.address, requiredTokenAddress = token2Address, requiredTokenId = token2Id).run(sender = alice, now = sp.timestamp(220))
+
+        scenario.verify(Exchange.data.token1_priceCumulative == 120 * PRICE_PRECISION + 2029970 * PRICE_PRECISION * 60 // 985264)
+        scenario.verify(Exchange.data.token2_priceCumulative == 30 * PRICE_PRECISION + 985264 * PRICE_PRECISION * 60 // 2029970)
+
+        # The view adds the time elapsed since the last update, none at the update block
+        scenario.verify(Exchange.getCumulativePrices().token1_priceCumulative == Exchange.data.token1_priceCumulative)
+        scenario.verify(Exchange.getCumulativePrices().token2_priceCumulative == Exchange.data.token2_priceCumulative)
+
+        scenario.h2("Embedded LP Ledger")
+
+        bob = sp.test_account("Bob")
+
+        # Liquidity is minted in the ledger of the exchange
+        EmbeddedExchange.AddLiquidity(token1_max = 1000000, token2_max = 4000000, recipient = alice.address).run(sender = alice)
+
+        scenario.verify(EmbeddedExchange.data.totalSupply == 2000000)
+        scenario.verify(EmbeddedExchange.data.balances[alice.address] == 1999000)
+
+        EmbeddedExchange.transfer(from_ = alice.address, to_ = bob.address, value = 500000).run(sender = alice)
+
+        scenario.verify(EmbeddedExchange.data.balances[alice.address] == 1499000)
+        scenario.verify(EmbeddedExchange.data.balances[bob.address] == 500000)
+
+        # Transfers from another account need an allowance
+        EmbeddedExchange.transfer(from_ = alice.address, to_ = bob.address, value = 100000).run(sender = bob, valid = False, exception = ErrorMessages.NotAllowed)
+
+        EmbeddedExchange.approve(spender = bob.address, value = 100000).run(sender = alice)
+
+        # Nonzero allowances are set back to zero first
+        EmbeddedExchange.approve(spender = bob.address, value = 200000).run(sender = alice, valid = False, exception = ErrorMessages.UnsafeAllowanceChange)
+
+        EmbeddedExchange.transfer(from_ = alice.address, to_ = bob.address, value = 100000).run(sender = bob)
+
+        scenario.verify(EmbeddedExchange.data.approvals[alice.address][bob.address] == 0)
+        scenario.verify(EmbeddedExchange.data.balances[bob.address] == 600000)
+
+        EmbeddedExchange.transfer(from_ = bob.address, to_ = alice.address, value = 600001).run(sender = bob, valid = False, exception = ErrorMessages.Insufficient)
+
+        # Removing liquidity burns from the ledger, the total supply follows
+        EmbeddedExchange.RemoveLiquidity(lpAmount = 600000, token1_min = 0, token2_min = 0, recipient = bob.address).run(sender = bob)
+
+        scenario.verify(EmbeddedExchange.data.balances[bob.address] == 0)
+        scenario.verify(EmbeddedExchange.data.totalSupply == 1400000)
+        scenario.verify((EmbeddedExchange.data.token1_pool == 700000) & (EmbeddedExchange.data.token2_pool == 2800000))
+
+        EmbeddedExchange.RemoveLiquidity(lpAmount = 1, token1_min = 0, token2_min = 0, recipient = bob.address).run(sender = bob, valid = False, exception = ErrorMessages.Insufficient)
+
+        scenario.h2("Zap In")
+
+        ZapExchange = AMM(adminAddress,token1Address,token1Id,token1Check,token2Address,token2Id,token2Check,liquidityProviderFee,systemFee,lpTokenAddress)
+        scenario += ZapExchange
+
+        # Pool without liquidity has no ratio to match
+        ZapExchange.ZapIn(tokenAddress = token1Address, tokenId = token1Id, tokenAmountIn = 100000, minLpOut = 0, recipient = alice.address).run(sender = alice, valid = False, exception = ErrorMessages.NotInitialized)
+
+        ZapExchange.AddLiquidity(token1_max = 1000000, token2_max = 1000000, recipient = alice.address).run(sender = alice)
+
+        scenario.verify(ZapExchange.data.totalSupply == 1000000)
+
+        ZapExchange.ZapIn(tokenAddress = token1Address, tokenId = token1Id, tokenAmountIn = 0, minLpOut = 0, recipient = alice.address).run(sender = alice, valid = False, exception = ErrorMessages.ZeroTransfer)
+
+        # 48883 of the 100000 token1 are swapped for 46473 token2, added back to the pool with the other 51117 token1
+        ZapExchange.ZapIn(tokenAddress = token1Address, tokenId = token1Id, tokenAmountIn = 100000, minLpOut = 48737, recipient = alice.address).run(sender = alice, valid = False, exception = ErrorMessages.InsufficientTokenOut)
+
+        ZapExchange.ZapIn(tokenAddress = token1Address, tokenId = token1Id, tokenAmountIn = 100000, minLpOut = 48736, recipient = alice.address).run(sender = alice)
+
+        scenario.verify(ZapExchange.data.token1_pool == 1099952)
+        scenario.verify(ZapExchange.data.token2_pool == 1000000)
+        scenario.verify(ZapExchange.data.token1_Fee == 48)
+        scenario.verify(ZapExchange.data.totalSupply == 1048736)
+
+        # Same split from the token2 side
+        ZapExchange.ZapIn(tokenAddress = token2Address, tokenId = token2Id, tokenAmountIn = 50000, minLpOut = 25860, recipient = alice.address).run(sender = alice)
+
+        scenario.verify(ZapExchange.data.token1_pool == 1099952)
+        scenario.verify(ZapExchange.data.token2_pool == 1049976)
+        scenario.verify(ZapExchange.data.token2_Fee == 24)
+        scenario.verify(ZapExchange.data.totalSupply == 1074596)
+
+        # The swapped part is bounded by maxSwapLimit like a swap
+        ZapExchange.ZapIn(tokenAddress = token1Address, tokenId = token1Id, tokenAmountIn = 2000000, minLpOut = 0, recipient = alice.address).run(sender = alice, valid = False, exception = ErrorMessages.SwapLimitExceed)
+
         # Adding Compilation Target 
         sp.add_compilation_target(
             "Exchange",
@@ -608,4 +987,20 @@ if "templates" not in __name__:
             liquidityProviderFee,
             systemFee,
             lpTokenAddress
-            ))
\ No newline at end of file
+            ))
+
+        sp.add_compilation_target(
+            "ExchangeEmbeddedLedger",
+            AMM(
+            adminAddress,
+            token1Address,
+            token1Id,
+            token1Check,
+            token2Address,
+            token2Id,
+            token2Check,
+            liquidityProviderFee,
+            systemFee,
+            lpTokenAddress,
+            True
+            ))
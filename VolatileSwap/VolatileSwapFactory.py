@@ -0,0 +1,740 @@
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
+
+# Volatile Swap pools sharing a single contract, every pool keeps the AMM math of VolatileSwap.py
+
+INITIAL_LIQUIDITY = 1000
+
+POOL = sp.TRecord(
+    token1Address = sp.TAddress,
+    token1Id = sp.TNat,
+    token1Check = sp.TBool,
+    token2Address = sp.TAddress,
+    token2Id = sp.TNat,
+    token2Check = sp.TBool,
+    lpTokenAddress = sp.TAddress,
+    lpFee = sp.TNat,
+    systemFee = sp.TNat,
+    token1_pool = sp.TNat,
+    token2_pool = sp.TNat,
+    totalSupply = sp.TNat,
+    token1_Fee = sp.TNat,
+    token2_Fee = sp.TNat,
+    maxSwapLimit = sp.TNat,
+    paused = sp.TBool
+)
+
+PAIR_KEY = sp.TRecord(tokenA = sp.TAddress, idA = sp.TNat, tokenB = sp.TAddress, idB = sp.TNat)
+
+HOP = sp.TRecord(poolId = sp.TNat, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat)
+
+class ErrorMessages:
+    """Specifies the different Error Types in the contracts
+    """
+    def make(s):
+        """Generates standard error messages prepending contract name (PlentySwapFactory_)
+        Args:
+            s: error message string
+        Returns:
+            standardized error message, its nat code when PLENTY_ERROR_CODES is set
+        """
+
+        message = "PlentySwapFactory_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
+
+
+    NotAdmin = make("Not_Admin")
+
+    Insufficient = make("Insufficient_Balance")
+
+    NotInitialized = make("Not_Initialized")
+
+    Paused = make("Paused_State")
+
+    InsufficientTokenOut = make("Higher_Slippage")
+
+    InvalidFee = make("Zero System Fee")
+
+    InvalidFeeAmount = make("Invalid_Fee_Value")
+
+    InvalidPair = make("Invalid_Pair")
+
+    NegativeValue = make("Negative_Value")
+
+    SwapLimitExceed = make("SwapLimitExceed")
+
+    InvalidRatio = make("Invalid_LP_Ratio")
+
+    ZeroTransfer = make("Zero_Amount_Transfer")
+
+    PoolNotFound = make("Pool_Not_Found")
+
+    PoolExists = make("Pool_Already_Exists")
+
+    InvalidPath = make("Invalid_Path")
+
+    ZeroLiquidity = make("Zero_Liquidity")
+
+    MaxTokenExceed = make("Max_Token_Exceeded")
+
+class AMMFactory(ErrorMessages, Library.ContractLibrary):
+
+    def __init__(self,_admin):
+
+        """Initialize the contract storage
+
+        Storage:
+            admin: factory admin address
+            pools: storage of every pool, keyed by pool id
+            pairIndex: pool id of every pair, keyed by the ordered pair (tokenA, idA) < (tokenB, idB)
+            poolCounter: id of the next pool
+            paused: boolean describing whether every pool of the factory is paused
+        """
+
+        self.init(
+            admin = _admin,
+            pools = sp.big_map(tkey = sp.TNat, tvalue = POOL),
+            pairIndex = sp.big_map(tkey = PAIR_KEY, tvalue = sp.TNat),
+            poolCounter = sp.nat(0),
+            paused = False
+        )
+
+    def PairKey(token1Address, token1Id, token2Address, token2Id):
+        """Builds the pairIndex key of a pair, independent of the token order
+
+        Args:
+            token1Address: contract address of the first token
+            token1Id: token id of the first token
+            token2Address: contract address of the second token
+            token2Id: token id of the second token
+        Returns:
+            PAIR_KEY record with the smaller token first
+        """
+
+        pairKey = sp.local('pairKey', sp.record(tokenA = token1Address, idA = token1Id, tokenB = token2Address, idB = token2Id))
+
+        sp.if (token2Address < token1Address) | ((token2Address == token1Address) & (token2Id < token1Id)):
+
+            pairKey.value = sp.record(tokenA = token2Address, idA = token2Id, tokenB = token1Address, idB = token1Id)
+
+        return pairKey.value
+
+    def IsTokenOne(pool, tokenAddress, tokenId):
+        """Checks which token of the pool is given, fails for tokens outside of the pool
+
+        Args:
+            pool: pool storage
+            tokenAddress: contract address of the token
+            tokenId: token id of the token
+        Returns:
+            True for token 1 of the pool, False for token 2
+        """
+
+        sp.verify( ( (tokenAddress == pool.token1Address) & (tokenId == pool.token1Id)) |
+        ( (tokenAddress == pool.token2Address)  & (tokenId == pool.token2Id)), ErrorMessages.InvalidPair)
+
+        return (tokenAddress == pool.token1Address) & (tokenId == pool.token1Id)
+
+    def SwapPool(self, poolId, tokenAmountIn, requiredTokenAddress, requiredTokenId):
+        """Applies a swap to the storage of a pool without transferring any tokens
+
+        The pool storage is read once and written back once.
+
+        Args:
+            poolId: id of the pool
+            tokenAmountIn: amount of tokens swapped in the pool
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+        Returns:
+            sp.TRecord(amountOut, tokenIn, tokenOut): amount of tokens out of the pool, token swapped in and token swapped out,
+            each token as sp.TRecord(tokenAddress, tokenId, faTwoFlag)
+        """
+
+        sp.verify(self.data.pools.contains(poolId), ErrorMessages.PoolNotFound)
+
+        pool = sp.local('pool', self.data.pools[poolId])
+
+        sp.verify( ~pool.value.paused, ErrorMessages.Paused)
+
+        requiredTokenOne = sp.local('requiredTokenOne', AMMFactory.IsTokenOne(pool.value, requiredTokenAddress, requiredTokenId))
+
+        requiredTokenAmount = sp.local('requiredTokenAmount', pool.value.token1_pool)
+        SwapTokenPool = sp.local('SwapTokenPool', pool.value.token2_pool)
+
+        sp.if requiredTokenOne.value:
+
+            requiredTokenAmount.value = pool.value.token2_pool
+            SwapTokenPool.value = pool.value.token1_pool
+
+        sp.verify(tokenAmountIn * 100 <= requiredTokenAmount.value * pool.value.maxSwapLimit, ErrorMessages.SwapLimitExceed)
+
+        lpfee = sp.local('lpfee', tokenAmountIn / pool.value.lpFee)
+
+        systemfee = sp.local('systemfee', tokenAmountIn / pool.value.systemFee)
+
+        sp.verify(systemfee.value > 0 , ErrorMessages.InvalidFee)
+
+        Invariant = sp.local('Invariant', pool.value.token1_pool * pool.value.token2_pool)
+
+        Invariant.value = Invariant.value / sp.as_nat( (requiredTokenAmount.value + tokenAmountIn) - ( lpfee.value + systemfee.value) )
+
+        tokenTransfer = sp.local('tokenTransfer', sp.as_nat(SwapTokenPool.value - Invariant.value))
+
+        token1 = sp.record(tokenAddress = pool.value.token1Address, tokenId = pool.value.token1Id, faTwoFlag = pool.value.token1Check)
+
+        token2 = sp.record(tokenAddress = pool.value.token2Address, tokenId = pool.value.token2Id, faTwoFlag = pool.value.token2Check)
+
+        swapResult = sp.local('swapResult', sp.record(amountOut = tokenTransfer.value, tokenIn = token1, tokenOut = token2))
+
+        sp.if requiredTokenOne.value:
+
+            pool.value.token1_pool = Invariant.value
+
+            pool.value.token2_pool += sp.as_nat(tokenAmountIn - systemfee.value)
+
+            pool.value.token2_Fee += systemfee.value
+
+            swapResult.value = sp.record(amountOut = tokenTransfer.value, tokenIn = token2, tokenOut = token1)
+
+        sp.else:
+
+            pool.value.token2_pool = Invariant.value
+
+            pool.value.token1_pool += sp.as_nat(tokenAmountIn - systemfee.value)
+
+            pool.value.token1_Fee += systemfee.value
+
+        self.data.pools[poolId] = pool.value
+
+        return swapResult.value
+
+    @sp.entry_point(lazify = True)
+    def AddPool(self,params):
+        """Admin function to create a new pool
+
+        The factory must be allowed to mint and burn the LP token of the pool.
+
+        Args:
+            token1Address: contract address for first token used in the pool
+            token1Id: token id for first token used in the pool
+            token1Check: boolean describing whether first token used in the pool is FA2
+            token2Address: contract address for second token used in the pool
+            token2Id: token id for second token used in the pool
+            token2Check: boolean describing whether second token used in the pool is FA2
+            lpTokenAddress: contract address for the LP tokens of the pool
+            lpFee: % fee for the LP
+            systemFee: % fee for the AMM System
+        """
+
+        sp.set_type(params, sp.TRecord(token1Address = sp.TAddress, token1Id = sp.TNat, token1Check = sp.TBool, token2Address = sp.TAddress, token2Id = sp.TNat, token2Check = sp.TBool, lpTokenAddress = sp.TAddress, lpFee = sp.TNat, systemFee = sp.TNat))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify((params.token1Address != params.token2Address) | (params.token1Id != params.token2Id), ErrorMessages.InvalidPair)
+
+        sp.verify( (params.lpFee > 50) & (params.systemFee > 50), ErrorMessages.InvalidFeeAmount)
+
+        pairKey = AMMFactory.PairKey(params.token1Address, params.token1Id, params.token2Address, params.token2Id)
+
+        sp.verify(~self.data.pairIndex.contains(pairKey), ErrorMessages.PoolExists)
+
+        self.data.pools[self.data.poolCounter] = sp.record(
+            token1Address = params.token1Address,
+            token1Id = params.token1Id,
+            token1Check = params.token1Check,
+            token2Address = params.token2Address,
+            token2Id = params.token2Id,
+            token2Check = params.token2Check,
+            lpTokenAddress = params.lpTokenAddress,
+            lpFee = params.lpFee,
+            systemFee  = params.systemFee,
+            token1_pool = sp.nat(0),
+            token2_pool = sp.nat(0),
+            totalSupply = sp.nat(0),
+            token1_Fee = sp.nat(0),
+            token2_Fee = sp.nat(0),
+            maxSwapLimit = sp.nat(40),
+            paused = False
+        )
+
+        self.data.pairIndex[pairKey] = self.data.poolCounter
+
+        self.data.poolCounter += 1
+
+    @sp.entry_point
+    def Swap(self,params):
+        """ Function for Users to Swap their assets to get the required Token
+
+        Args:
+            poolId: id of the pool
+            tokenAmountIn: amount of tokens sent by user that needs to be swapped
+            MinimumTokenOut: minimum amount of token expected by user after swap
+            recipient: address that will receive the swapped out tokens
+            requiredTokenAddress: contract address of the token that is expected to be returned after swap
+            requiredTokenId: id of the token that is expected to be returned after swap
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat))
+
+        sp.verify( ~self.data.paused, ErrorMessages.Paused)
+
+        swap = sp.local('swap', self.SwapPool(params.poolId, params.tokenAmountIn, params.requiredTokenAddress, params.requiredTokenId))
+
+        sp.verify(swap.value.amountOut >= params.MinimumTokenOut, ErrorMessages.InsufficientTokenOut)
+
+        # Transfer tokens to Exchange
+        self.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, swap.value.tokenIn.tokenAddress, swap.value.tokenIn.tokenId, swap.value.tokenIn.faTwoFlag)
+
+        # Transfer tokens to the recipient
+        self.TransferToken(sp.self_address, params.recipient, swap.value.amountOut, swap.value.tokenOut.tokenAddress, swap.value.tokenOut.tokenId, swap.value.tokenOut.faTwoFlag)
+
+    @sp.entry_point
+    def MultiSwap(self,params):
+        """ Function for Users to Swap through several pools of the factory in one call
+
+        Intermediate tokens stay in the factory, only the input and the final output are transferred.
+
+        Args:
+            path: hops of the route, each hop giving the pool id and the token expected from the pool
+            tokenAmountIn: amount of tokens sent by user to the first pool of the path
+            MinimumTokenOut: minimum amount of token expected by user from the last pool of the path
+            recipient: address that will receive the swapped out tokens
+        """
+
+        sp.set_type(params, sp.TRecord(path = sp.TList(HOP), tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress))
+
+        sp.verify( ~self.data.paused, ErrorMessages.Paused)
+
+        sp.verify(sp.len(params.path) > 0, ErrorMessages.InvalidPath)
+
+        amount = sp.local('amount', params.tokenAmountIn)
+
+        tokenIn = sp.local('tokenIn', sp.none)
+
+        # Token expected from the previous hop
+        tokenOut = sp.local('tokenOut', sp.none)
+
+        sp.for hop in params.path:
+
+            swap = self.SwapPool(hop.poolId, amount.value, hop.requiredTokenAddress, hop.requiredTokenId)
+
+            sp.if tokenOut.value.is_some():
+
+                sp.verify( (swap.tokenIn.tokenAddress == tokenOut.value.open_some().tokenAddress) & (swap.tokenIn.tokenId == tokenOut.value.open_some().tokenId), ErrorMessages.InvalidPath)
+
+            sp.else:
+
+                tokenIn.value = sp.some(swap.tokenIn)
+
+            amount.value = swap.amountOut
+
+            tokenOut.value = sp.some(swap.tokenOut)
+
+        sp.verify(amount.value >= params.MinimumTokenOut, ErrorMessages.InsufficientTokenOut)
+
+        # Transfer tokens to Exchange
+        self.TransferToken(sp.sender, sp.self_address, params.tokenAmountIn, tokenIn.value.open_some().tokenAddress, tokenIn.value.open_some().tokenId, tokenIn.value.open_some().faTwoFlag)
+
+        # Transfer tokens to the recipient
+        self.TransferToken(sp.self_address, params.recipient, amount.value, tokenOut.value.open_some().tokenAddress, tokenOut.value.open_some().tokenId, tokenOut.value.open_some().faTwoFlag)
+
+    @sp.entry_point
+    def AddLiquidity(self,params):
+        """Allows users to add liquidity to a pool and gain LP tokens
+
+        Args:
+            poolId: id of the pool
+            token1_max: max amount of token 1 that the user wants to supply to the pool
+            token2_max: max amount of token 2 that the user wants to supply to the pool
+            recipient: account address that will be credited with the LP tokens
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, token1_max = sp.TNat, token2_max = sp.TNat, recipient = sp.TAddress))
+
+        sp.verify(self.data.pools.contains(params.poolId), ErrorMessages.PoolNotFound)
+
+        pool = sp.local('pool', self.data.pools[params.poolId])
+
+        token1Amount = sp.local('token1Amount', sp.nat(0))
+
+        token2Amount = sp.local('token2Amount', sp.nat(0))
+
+        liquidity = sp.local('liquidity', sp.nat(0))
+
+        sp.if pool.value.totalSupply != sp.nat(0):
+
+            sp.if (params.token1_max * pool.value.token2_pool) / pool.value.token1_pool <= params.token2_max:
+
+                token1Amount.value = params.token1_max
+
+                token2Amount.value = (params.token1_max * pool.value.token2_pool ) / pool.value.token1_pool
+
+
+            sp.if (params.token2_max * pool.value.token1_pool) / pool.value.token2_pool <= params.token1_max:
+
+                token2Amount.value = params.token2_max
+
+                token1Amount.value = (params.token2_max * pool.value.token1_pool) / pool.value.token2_pool
+
+
+            sp.verify(token1Amount.value > 0, ErrorMessages.InvalidRatio )
+
+            sp.verify(token2Amount.value > 0, ErrorMessages.InvalidRatio )
+
+            sp.if ( token1Amount.value * pool.value.totalSupply ) / pool.value.token1_pool < ( token2Amount.value * pool.value.totalSupply) / pool.value.token2_pool:
+
+                liquidity.value = ( token1Amount.value * pool.value.totalSupply ) / pool.value.token1_pool
+
+            sp.else:
+
+                liquidity.value = ( token2Amount.value * pool.value.totalSupply) / pool.value.token2_pool
+
+        sp.else:
+
+            liquidity.value = sp.as_nat( self.square_root( params.token1_max * params.token2_max ) - INITIAL_LIQUIDITY )
+
+            pool.value.totalSupply += INITIAL_LIQUIDITY
+
+            token1Amount.value = params.token1_max
+
+            token2Amount.value = params.token2_max
+
+
+        sp.verify(liquidity.value > 0, ErrorMessages.ZeroLiquidity)
+
+        sp.verify(token1Amount.value <= params.token1_max, ErrorMessages.MaxTokenExceed)
+
+        sp.verify(token2Amount.value <= params.token2_max, ErrorMessages.MaxTokenExceed)
+
+        # Transfer Funds to Exchange
+
+        self.TransferToken(sp.sender, sp.self_address, token1Amount.value, pool.value.token1Address, pool.value.token1Id, pool.value.token1Check)
+
+        self.TransferToken(sp.sender, sp.self_address, token2Amount.value, pool.value.token2Address, pool.value.token2Id, pool.value.token2Check)
+
+        pool.value.token1_pool += token1Amount.value
+
+        pool.value.token2_pool += token2Amount.value
+
+        # Mint LP Tokens
+        pool.value.totalSupply += liquidity.value
+
+        self.data.pools[params.poolId] = pool.value
+
+        mintParam = sp.record(
+            address = params.recipient,
+            value = liquidity.value
+        )
+
+        mintHandle = sp.contract(
+            sp.TRecord(address = sp.TAddress, value = sp.TNat),
+            pool.value.lpTokenAddress,
+            "mint"
+            ).open_some()
+
+        sp.transfer(mintParam, sp.mutez(0), mintHandle)
+
+    @sp.entry_point
+    def RemoveLiquidity(self,params):
+        """Allows users to remove their liquidity from a pool by burning their LP tokens
+
+        Args:
+            poolId: id of the pool
+            lpAmount: amount of LP tokens to be burned
+            token1_min: minimum amount of token 1 expected by the user upon burning given LP tokens
+            token2_min: minimum amount of token 2 expected by the user upon burning given LP tokens
+            recipient: account address that will be credited with the tokens removed from the pool
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, lpAmount = sp.TNat ,token1_min = sp.TNat, token2_min = sp.TNat, recipient = sp.TAddress))
+
+        sp.verify(self.data.pools.contains(params.poolId), ErrorMessages.PoolNotFound)
+
+        pool = sp.local('pool', self.data.pools[params.poolId])
+
+        sp.verify(pool.value.totalSupply != sp.nat(0), message = ErrorMessages.NotInitialized)
+
+        sp.verify(params.lpAmount <= pool.value.totalSupply, message = ErrorMessages.Insufficient)
+
+        # Computing the Tokens Provided for removing Liquidity
+
+        token1Amount = sp.local('token1Amount', (params.lpAmount * pool.value.token1_pool) / pool.value.totalSupply)
+
+        token2Amount = sp.local('token2Amount', (params.lpAmount * pool.value.token2_pool) / pool.value.totalSupply)
+
+        # Values should be greater than  Minimum threshold
+
+        sp.verify(token1Amount.value >= params.token1_min, ErrorMessages.InsufficientTokenOut)
+
+        sp.verify(token2Amount.value >= params.token2_min, ErrorMessages.InsufficientTokenOut)
+
+        # Subtracting Values
+
+        pool.value.token1_pool = sp.as_nat( pool.value.token1_pool - token1Amount.value )
+
+        pool.value.token2_pool = sp.as_nat( pool.value.token2_pool - token2Amount.value )
+
+        pool.value.totalSupply = sp.as_nat( pool.value.totalSupply - params.lpAmount )
+
+        self.data.pools[params.poolId] = pool.value
+
+        # Burning LP Tokens
+
+        burnParam = sp.record(
+            address = sp.sender,
+            value = params.lpAmount
+        )
+
+        burnHandle = sp.contract(
+            sp.TRecord(address = sp.TAddress, value = sp.TNat),
+            pool.value.lpTokenAddress,
+            "burn"
+            ).open_some()
+
+        sp.transfer(burnParam, sp.mutez(0), burnHandle)
+
+        # Sending Tokens
+
+        self.TransferToken(sp.self_address, params.recipient, token1Amount.value, pool.value.token1Address, pool.value.token1Id, pool.value.token1Check)
+
+        self.TransferToken(sp.self_address, params.recipient, token2Amount.value, pool.value.token2Address, pool.value.token2Id, pool.value.token2Check)
+
+    @sp.entry_point(lazify = True)
+    def ModifyFee(self,params):
+
+        """Admin function to modify the LP and System Fees of a pool
+
+        Max Fee can be 2% Hardcoded for each of the parameter
+        Args:
+            poolId: id of the pool
+            lpFee: new % fee for the liquidity providers
+            systemFee: new % fee for the amm system
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, lpFee = sp.TNat, systemFee = sp.TNat))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify(self.data.pools.contains(params.poolId), ErrorMessages.PoolNotFound)
+
+        sp.verify( (params.lpFee > 50) & (params.systemFee > 50), ErrorMessages.InvalidFeeAmount)
+
+        self.data.pools[params.poolId].lpFee = params.lpFee
+
+        self.data.pools[params.poolId].systemFee = params.systemFee
+
+    @sp.entry_point(lazify = True)
+    def ModifyMaxSwapAmount(self,params):
+        """Admin function to modify the max swap limit of a pool
+
+        Args:
+            poolId: id of the pool
+            amount: new max % of total liquidity that can be swapped
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, amount = sp.TNat))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify(self.data.pools.contains(params.poolId), ErrorMessages.PoolNotFound)
+
+        self.data.pools[params.poolId].maxSwapLimit = params.amount
+
+    @sp.entry_point(lazify = True)
+    def ChangePoolState(self,poolId):
+        """Admin function to toggle the state of a single pool
+
+        Args:
+            poolId: id of the pool
+        """
+
+        sp.set_type(poolId, sp.TNat)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify(self.data.pools.contains(poolId), ErrorMessages.PoolNotFound)
+
+        self.data.pools[poolId].paused = ~ self.data.pools[poolId].paused
+
+    @sp.entry_point(lazify = True)
+    def ChangeState(self):
+        """Admin function to toggle the state of every pool
+
+        UsesCases
+        - Potential Exploit Detected
+        - Depreciating the Contract
+        """
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.paused = ~ self.data.paused
+
+    @sp.entry_point(lazify = True)
+    def ChangeAdmin(self,adminAddress):
+        """Admin function to Update Admin Address
+
+        Args:
+            adminAddress: Upgrades adminAddress to new MultiSig or DAO
+        """
+
+        sp.set_type(adminAddress, sp.TAddress)
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        self.data.admin = adminAddress
+
+    @sp.entry_point(lazify = True)
+    def WithdrawSystemFee(self,params):
+        """Admin function to withdraw the system fee of a pool
+
+        Args:
+            poolId: id of the pool
+            address: account address where the systems fees will be transfered to
+        """
+
+        sp.set_type(params, sp.TRecord(poolId = sp.TNat, address = sp.TAddress))
+
+        sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
+
+        sp.verify(self.data.pools.contains(params.poolId), ErrorMessages.PoolNotFound)
+
+        pool = sp.local('pool', self.data.pools[params.poolId])
+
+        sp.if pool.value.token1_Fee != sp.nat(0):
+
+            self.TransferToken(sp.self_address, params.address, pool.value.token1_Fee, pool.value.token1Address, pool.value.token1Id, pool.value.token1Check )
+
+        sp.if pool.value.token2_Fee != sp.nat(0):
+
+            self.TransferToken(sp.self_address, params.address, pool.value.token2_Fee, pool.value.token2Address, pool.value.token2Id, pool.value.token2Check )
+
+        self.data.pools[params.poolId].token1_Fee = sp.nat(0)
+
+        self.data.pools[params.poolId].token2_Fee = sp.nat(0)
+
+    @sp.onchain_view()
+    def getPoolId(self,params):
+        """View function to find the pool of a pair, in any token order
+
+        Args:
+            token1Address: contract address of the first token
+            token1Id: token id of the first token
+            token2Address: contract address of the second token
+            token2Id: token id of the second token
+        Returns:
+            sp.TOption(sp.TNat): pool id, None when the factory has no pool for the pair
+        """
+
+        sp.set_type(params, sp.TRecord(token1Address = sp.TAddress, token1Id = sp.TNat, token2Address = sp.TAddress, token2Id = sp.TNat))
+
+        sp.result(self.data.pairIndex.get_opt(AMMFactory.PairKey(params.token1Address, params.token1Id, params.token2Address, params.token2Id)))
+
+    @sp.onchain_view()
+    def getPoolState(self,poolId):
+        """View function to get the reserves and fees needed to quote a swap in a pool
+
+        Args:
+            poolId: id of the pool
+        Returns:
+            sp.TRecord(token1_pool, token2_pool, lpFee, systemFee, token1Precision, token2Precision): same record as the AMM getPoolState view
+        """
+
+        sp.set_type(poolId, sp.TNat)
+
+        sp.verify(self.data.pools.contains(poolId), ErrorMessages.PoolNotFound)
+
+        pool = self.data.pools[poolId]
+
+        sp.result(
+            sp.record(
+                token1_pool = pool.token1_pool,
+                token2_pool = pool.token2_pool,
+                lpFee = pool.lpFee,
+                systemFee = sp.some(pool.systemFee),
+                token1Precision = sp.nat(1),
+                token2Precision = sp.nat(1)
+            )
+        )
+
+
+if "templates" not in __name__:
+    @sp.add_test(name = "Plenty Swap Factory Contract")
+    def test():
+
+        scenario = sp.test_scenario()
+        scenario.h1("PlentySwap Factory Contract")
+
+        scenario.table_of_contents()
+
+        # Deployment Accounts
+        adminAddress = sp.test_account("Admin").address
+        alice = sp.test_account("Alice")
+
+        plentyAddress = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+        wrapAddress = sp.address("KT1AFA2mwNUMNd4SsujE1YYp29vd8BZejyKW")
+        ctezAddress = sp.address("KT1SjXiUX63QvdNMcM2m492f7kuf8JxXRLp4")
+
+        factory = AMMFactory(adminAddress)
+        scenario += factory
+
+        scenario.h2("Adding Pools")
+
+        factory.AddPool(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = wrapAddress, token2Id = 0, token2Check = True, lpTokenAddress = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd"), lpFee = 500, systemFee = 1000).run(sender = adminAddress)
+        factory.AddPool(token1Address = plentyAddress, token1Id = 0, token1Check = False, token2Address = ctezAddress, token2Id = 0, token2Check = False, lpTokenAddress = sp.address("KT1UNBvCJXiwJY6tmHM7CJUVwNPew53XkSfh"), lpFee = 500, systemFee = 1000).run(sender = adminAddress)
+
+        # One pool per pair, in any token order
+        factory.AddPool(token1Address = wrapAddress, token1Id = 0, token1Check = True, token2Address = plentyAddress, token2Id = 0, token2Check = False, lpTokenAddress = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd"), lpFee = 500, systemFee = 1000).run(sender = adminAddress, valid = False)
+
+        scenario.verify(factory.data.poolCounter == 2)
+        scenario.verify(factory.getPoolId(sp.record(token1Address = ctezAddress, token1Id = 0, token2Address = plentyAddress, token2Id = 0)).open_some() == 1)
+
+        scenario.h2("Adding Liquidity")
+
+        factory.AddLiquidity(poolId = 0, token1_max = 1000000, token2_max = 2000000, recipient = alice.address).run(sender = alice)
+        factory.AddLiquidity(poolId = 1, token1_max = 1000000, token2_max = 1000000, recipient = alice.address).run(sender = alice)
+
+        scenario.h2("Swapping")
+
+        factory.Swap(poolId = 0, tokenAmountIn = 10000, MinimumTokenOut = 19000, recipient = alice.address, requiredTokenAddress = wrapAddress, requiredTokenId = 0).run(sender = alice)
+        factory.Swap(poolId = 0, tokenAmountIn = 10000, MinimumTokenOut = 19000, recipient = alice.address, requiredTokenAddress = ctezAddress, requiredTokenId = 0).run(sender = alice, valid = False)
+
+        # wrap -> PLENTY -> ctez without moving PLENTY
+        factory.MultiSwap(
+            path = [
+                sp.record(poolId = 0, requiredTokenAddress = plentyAddress, requiredTokenId = 0),
+                sp.record(poolId = 1, requiredTokenAddress = ctezAddress, requiredTokenId = 0)
+            ],
+            tokenAmountIn = 20000, MinimumTokenOut = 9000, recipient = alice.address
+        ).run(sender = alice)
+
+        # Broken token continuity between hops
+        factory.MultiSwap(
+            path = [
+                sp.record(poolId = 0, requiredTokenAddress = wrapAddress, requiredTokenId = 0),
+                sp.record(poolId = 1, requiredTokenAddress = ctezAddress, requiredTokenId = 0)
+            ],
+            tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = alice.address
+        ).run(sender = alice, valid = False)
+
+        scenario.h2("Removing Liquidity")
+
+        factory.RemoveLiquidity(poolId = 1, lpAmount = 500000, token1_min = 0, token2_min = 0, recipient = alice.address).run(sender = alice)
+
+        factory.ChangePoolState(0).run(sender = adminAddress)
+        factory.Swap(poolId = 0, tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = alice.address, requiredTokenAddress = wrapAddress, requiredTokenId = 0).run(sender = alice, valid = False)
+
+        # Adding Compilation Target
+        sp.add_compilation_target(
+            "ExchangeFactory",
+            AMMFactory(
+            adminAddress
+            ))
@@ -0,0 +1,176 @@
+# Benchmark cases, read by benchmarks/targets.py (compiled by SmartPy) and by tools/bench.py
+# Plain Python, no smartpy import, so both can load it
+
+# Caller of every benchmarked entrypoint, bootstrap1 and bootstrap2 of the octez-client mockup
+SENDER = "tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx"
+RECEIVER = "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN"
+
+# Addresses compiled into the storages, replaced by the addresses the roles are originated at,
+# target being the contract of the point
+PLACEHOLDERS = {
+    "token1": "KT1BvoVmqhTdpNiiykSMp1Wqpuh28fKs29qQ",
+    "token2": "KT1MbgHBRPe3Ak8MMiZwEfXUtPjK5sy4VdFp",
+    "target": "KT1KSoZhSKqwEfzV8Z8jPZSVZyp1Q5PuatUk",
+}
+
+# Sweeps
+POOL_SIZES = [10 ** 6, 10 ** 12, 10 ** 18]
+TRADE_SHARES = [1000, 100, 10]  # trade of pool // share, 0.1%, 1% and 10% of the pool
+LOT_COUNTS = [1, 10, 50]  # Staking lots (InvestMap entries) of the caller
+CHECKPOINT_COUNTS = [1, 16, 256]  # xPlenty checkpoints of the caller
+
+# Stake of each lot
+LOT_AMOUNT = 10 ** 18
+
+# ctez target of 1, Q48 fixed point
+CTEZ_TARGET = 2 ** 48
+
+# Token supply of the sender, and the balance or allowance given to a point target when the
+# amount does not depend on the point
+SUPPLY = 10 ** 30
+FUNDING = 10 ** 21
+
+# Setup calls of the tokens, the FA1.2 xPlenty token contract of the repository. The
+# repository has no FA2 token contract, every benchmarked pool trades FA1.2 tokens.
+def fund(role, amount):
+    """Transfer of tokens from the sender to the point target, for the tokens it pays out
+    """
+
+    return {"role": role, "entrypoint": "transfer", "parameter": 'Pair "%s" (Pair "{target}" %s)' % (SENDER, amount)}
+
+
+def approve(role):
+    """Allowance of the point target on the tokens of the sender, for the tokens it pulls
+    """
+
+    return {"role": role, "entrypoint": "approve", "parameter": 'Pair "{target}" %d' % FUNDING}
+
+
+# Every case originates the shared targets of its roles (token, viewer) and the target
+# built for the point, runs the setup of the case and calls entrypoint of the point target.
+# A setup step is a call from the sender to a role, or to the point target, or the
+# origination of a target as a new role. A parameter is either a Michelson template,
+# formatted with the point and the originated addresses, or None for the
+# <build>_<point>_<case> expression target.
+CASES = [
+    {
+        "name": "amm_swap",
+        "build": "amm",
+        "grid": {"pool": POOL_SIZES, "trade": TRADE_SHARES},
+        "roles": {"token1": "token", "token2": "token"},
+        # Sells token 1 for token 2
+        "setup": [fund("token2", "{pool}"), approve("token1")],
+        "entrypoint": "Swap",
+        "parameter": None,
+    },
+    {
+        "name": "flat_swap",
+        "build": "flat",
+        "grid": {"pool": POOL_SIZES, "trade": TRADE_SHARES},
+        "roles": {"token1": "token", "token2": "token"},
+        "setup": [fund("token2", "{pool}"), approve("token1")],
+        "entrypoint": "swap",
+        "parameter": None,
+    },
+    {
+        "name": "ctez_callback",
+        "build": "ctez",
+        "grid": {"pool": POOL_SIZES, "trade": TRADE_SHARES},
+        "roles": {"token1": "token"},
+        "setup": [fund("token1", "{pool}")],
+        "entrypoint": "tez_to_ctez_callback",
+        "parameter": str(CTEZ_TARGET),
+    },
+    {
+        "name": "staking_stake",
+        "build": "staking",
+        "grid": {"lots": LOT_COUNTS},
+        "roles": {"token1": "token", "token2": "token"},
+        "setup": [approve("token1")],
+        "entrypoint": "stake",
+        "parameter": str(LOT_AMOUNT),
+    },
+    {
+        "name": "staking_unstake",
+        "build": "staking",
+        "grid": {"lots": LOT_COUNTS},
+        "roles": {"token1": "token", "token2": "token"},
+        "setup": [fund("token1", FUNDING)],
+        "entrypoint": "unstake",
+        "parameter": None,
+    },
+    {
+        "name": "staking_get_reward",
+        "build": "staking",
+        "grid": {"lots": LOT_COUNTS},
+        "roles": {"token1": "token", "token2": "token"},
+        "setup": [fund("token2", FUNDING)],
+        "entrypoint": "GetReward",
+        "parameter": "Unit",
+    },
+    {
+        "name": "xplenty_buy",
+        "build": "xplenty_exchange",
+        "grid": {"pool": POOL_SIZES},
+        # token1 is PLENTY and token2 xPlenty, minted by the exchange of the point
+        "roles": {"token1": "token", "token2": "token"},
+        "setup": [
+            {"originate": "xplenty_reward_manager", "role": "rewardManager"},
+            {"role": "target", "entrypoint": "changeRewardManager", "parameter": '"{rewardManager}"'},
+            {"role": "token2", "entrypoint": "updateExchangeAddress", "parameter": '"{target}"'},
+            fund("token1", "{pool}"),
+            approve("token1"),
+        ],
+        # buy asks the PLENTY balance of the exchange, buy_callback is measured with it
+        "entrypoint": "buy",
+        "parameter": None,
+    },
+    {
+        "name": "xplenty_transfer",
+        "build": "xplenty_token",
+        "grid": {"checkpoints": CHECKPOINT_COUNTS},
+        "roles": {},
+        "setup": [],
+        "entrypoint": "transfer",
+        "parameter": 'Pair "%s" (Pair "%s" 1)' % (SENDER, RECEIVER),
+    },
+    {
+        "name": "xplenty_get_prior_balance",
+        "build": "xplenty_token",
+        "grid": {"checkpoints": CHECKPOINT_COUNTS},
+        "roles": {"viewer": "viewer"},
+        "setup": [],
+        # Level 0 is below the level of the mockup and forces the binary search
+        "entrypoint": "getPriorBalance",
+        "parameter": 'Pair (Pair "%s" 0) "{viewer}%%target"' % SENDER,
+    },
+]
+
+
+def points(case):
+    """Every point of the grid of a case, as dicts of the swept values
+    """
+
+    result = [{}]
+    for name, values in case["grid"].items():
+        result = [dict(point, **{name: value}) for point in result for value in values]
+    return result
+
+
+def point_name(build, point):
+    """Name of the compilation target of a point, for example amm_pool1000000_trade1000
+    """
+
+    return "_".join([build] + ["%s%d" % (name, value) for name, value in sorted(point.items())])
+
+
+def builds():
+    """Every (build, point) compiled for the cases, once per build and point
+    """
+
+    seen = []
+    for case in CASES:
+        for point in points(case):
+            if (case["build"], point) not in seen:
+                seen.append((case["build"], point))
+    return seen
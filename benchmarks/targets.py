@@ -0,0 +1,197 @@
+# Compilation targets of the benchmark suite, compiled from the repository root by tools/bench.py
+#   ~/smartpy-cli/SmartPy.sh compile benchmarks/targets.py <output-directory>
+# One target per contract of the repository for the code and storage sizes, and one per
+# point of the benchmark cases of benchmarks/cases.py with the storage of that point.
+
+import smartpy as sp
+
+Cases = sp.io.import_script_from_url("file:benchmarks/cases.py")
+VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+VolatileSwapFactory = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwapFactory.py")
+TokenToToken = sp.io.import_script_from_url("file:StableSwap/TokenToToken.py")
+TezToToken = sp.io.import_script_from_url("file:StableSwap/TezToToken.py")
+Staking = sp.io.import_script_from_url("file:Staking/staking.py")
+Vault = sp.io.import_script_from_url("file:Vault/vault.py")
+PoolRegistry = sp.io.import_script_from_url("file:Router/PoolRegistry.py")
+Router = sp.io.import_script_from_url("file:Router/Router.py")
+xPlentyExchange = sp.io.import_script_from_url("file:xPlenty/xPlentyExchange.py")
+xPlentyRewardManager = sp.io.import_script_from_url("file:xPlenty/xPlentyRewardManager.py")
+xPlentyToken = sp.io.import_script_from_url("file:xPlenty/xPlentyTokenContract.py")
+
+SENDER = sp.address(Cases.SENDER)
+TOKEN1 = sp.address(Cases.PLACEHOLDERS["token1"])
+TOKEN2 = sp.address(Cases.PLACEHOLDERS["token2"])
+TARGET = sp.address(Cases.PLACEHOLDERS["target"])
+
+TOKEN_METADATA = {
+    "decimals" : "18",
+    "name" : "xPLENTY",
+    "symbol" : "xPLENTY",
+}
+
+CONTRACT_METADATA = {
+    "" : "ipfs://bafkreicpstxib2vfup4yf7vxsulnwlwp3774agelle6u4nw7ztajwnfaxy",
+}
+
+def xplenty_token():
+
+    return xPlentyToken.FA12(
+        SENDER,
+        config = xPlentyToken.FA12_config(),
+        token_metadata = TOKEN_METADATA,
+        contract_metadata = CONTRACT_METADATA
+    )
+
+def token():
+    """xPlenty FA1.2 token holding the supply of the sender, the token of every role
+    """
+
+    contract = xplenty_token()
+    contract.update_initial_storage(
+        balances = sp.big_map(l = {SENDER : sp.nat(Cases.SUPPLY)}, tkey = sp.TAddress, tvalue = sp.TNat),
+        approvals = sp.big_map(l = {SENDER : sp.map(tkey = sp.TAddress, tvalue = sp.TNat)}, tkey = sp.TAddress, tvalue = sp.TMap(sp.TAddress, sp.TNat)),
+        totalSupply = sp.nat(Cases.SUPPLY)
+    )
+    return contract
+
+def amm(point):
+
+    contract = VolatileSwap.AMM(SENDER, TOKEN1, 0, False, TOKEN2, 0, False, 1000, 1000, TOKEN1)
+    contract.update_initial_storage(token1_pool = sp.nat(point["pool"]), token2_pool = sp.nat(point["pool"]), totalSupply = sp.nat(point["pool"]))
+    return contract
+
+def flat(point):
+
+    return TokenToToken.FlatCurve(point["pool"], point["pool"], 0, 0, False, False, 1, 1, TOKEN1, TOKEN2, point["pool"], 1000, TOKEN1, SENDER)
+
+def ctez(point):
+
+    # Locked by tez_to_ctez, waiting for the target
+    contract = TezToToken.TezToCtez(point["pool"], point["pool"], point["pool"], TOKEN1, 1000, TOKEN1, SENDER, SENDER)
+    contract.update_initial_storage(
+        Locked = True,
+        recipient = sp.some(SENDER),
+        tradeAmount = sp.some(sp.nat(point["pool"] // point["trade"])),
+        minAmount = sp.some(sp.nat(0))
+    )
+    return contract
+
+def staking(point):
+
+    lots = point["lots"]
+    contract = Staking.Staking(SENDER, TOKEN1, TOKEN2, False)
+    contract.update_initial_storage(
+        totalSupply = sp.nat(lots * Cases.LOT_AMOUNT * Staking.MULTIPLIER),
+        periodFinish = sp.nat(10 ** 9),
+        rewardStreams = sp.map(
+            l = {
+                0 : sp.record(token = TOKEN2, tokenId = sp.nat(0), faTwoCheck = False, rewardRate = sp.nat(10 ** 6), rewardPerTokenStored = sp.nat(0), periodFinish = sp.nat(10 ** 9), lastUpdateTime = sp.nat(0))
+            },
+            tvalue = sp.TRecord(token = sp.TAddress, tokenId = sp.TNat, faTwoCheck = sp.TBool, rewardRate = sp.TNat, rewardPerTokenStored = sp.TNat, periodFinish = sp.TNat, lastUpdateTime = sp.TNat),
+            tkey = sp.TNat
+        ),
+        balances = sp.big_map(
+            l = {
+                SENDER : sp.record(
+                    balance = sp.nat(lots * Cases.LOT_AMOUNT * Staking.MULTIPLIER),
+                    rewards = sp.map({0 : sp.nat(0)}),
+                    userRewardPerTokenPaid = sp.map({0 : sp.nat(0)}),
+                    counter = sp.nat(lots),
+                    InvestMap = sp.map({lot : sp.record(amount = sp.nat(Cases.LOT_AMOUNT), level = sp.nat(0)) for lot in range(lots)})
+                )
+            },
+            tvalue = sp.TRecord(balance = sp.TNat, rewards = sp.TMap(sp.TNat, sp.TNat), userRewardPerTokenPaid = sp.TMap(sp.TNat, sp.TNat), counter = sp.TNat ,InvestMap = sp.TMap(sp.TNat, sp.TRecord(amount = sp.TNat, level = sp.TNat))),
+            tkey = sp.TAddress
+        )
+    )
+    return contract
+
+def xplenty_exchange(point):
+
+    # xPlenty supply of the PLENTY balance the exchange is funded with
+    contract = xPlentyExchange.SwapContract(SENDER, TOKEN1, TOKEN2)
+    contract.update_initial_storage(totalSupply = sp.nat(point["pool"]))
+    return contract
+
+def xplenty_checkpoints(point):
+
+    count = point["checkpoints"]
+    contract = xplenty_token()
+    contract.update_initial_storage(
+        balances = sp.big_map(l = {SENDER : sp.nat(Cases.LOT_AMOUNT)}, tkey = sp.TAddress, tvalue = sp.TNat),
+        approvals = sp.big_map(l = {SENDER : sp.map(tkey = sp.TAddress, tvalue = sp.TNat)}, tkey = sp.TAddress, tvalue = sp.TMap(sp.TAddress, sp.TNat)),
+        checkpoints = sp.big_map(
+            l = {(SENDER, sp.nat(index)) : sp.record(fromBlock = sp.nat(index), balance = sp.nat(Cases.LOT_AMOUNT)) for index in range(count)},
+            tkey = sp.TPair(sp.TAddress, sp.TNat),
+            tvalue = sp.TRecord(fromBlock = sp.TNat, balance = sp.TNat).layout(("fromBlock", "balance"))
+        ),
+        numCheckpoints = sp.big_map(l = {SENDER : sp.nat(count)}, tkey = sp.TAddress, tvalue = sp.TNat),
+        totalSupply = sp.nat(Cases.LOT_AMOUNT)
+    )
+    return contract
+
+BUILDS = {
+    "amm" : amm,
+    "flat" : flat,
+    "ctez" : ctez,
+    "staking" : staking,
+    "xplenty_exchange" : xplenty_exchange,
+    "xplenty_token" : xplenty_checkpoints,
+}
+
+def parameter(case, point):
+    """Parameters written as SmartPy expressions, the others are Michelson templates of the case
+    """
+
+    if case["name"] == "amm_swap":
+        return sp.set_type_expr(
+            sp.record(tokenAmountIn = sp.nat(point["pool"] // point["trade"]), MinimumTokenOut = sp.nat(0), recipient = SENDER, requiredTokenAddress = TOKEN2, requiredTokenId = sp.nat(0)),
+            sp.TRecord(tokenAmountIn = sp.TNat, MinimumTokenOut = sp.TNat, recipient = sp.TAddress, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat)
+        )
+    if case["name"] == "flat_swap":
+        return sp.set_type_expr(
+            sp.record(minTokenOut = sp.nat(0), recipient = SENDER, tokenAmountIn = sp.nat(point["pool"] // point["trade"]), requiredTokenAddress = TOKEN2, requiredTokenId = sp.nat(0)),
+            sp.TRecord(minTokenOut = sp.TNat, recipient = sp.TAddress, tokenAmountIn = sp.TNat, requiredTokenAddress = sp.TAddress, requiredTokenId = sp.TNat)
+        )
+    if case["name"] == "xplenty_buy":
+        return sp.set_type_expr(
+            sp.record(plentyAmount = sp.nat(point["pool"] // 100), recipient = SENDER, minimumxPlentyToken = sp.nat(0)),
+            sp.TRecord(plentyAmount = sp.TNat, recipient = sp.TAddress, minimumxPlentyToken = sp.TNat)
+        )
+    if case["name"] == "staking_unstake":
+        # Last lot, in full
+        return sp.set_type_expr(
+            sp.record(MapKey = sp.nat(point["lots"] - 1), Amount = sp.nat(Cases.LOT_AMOUNT)),
+            sp.TRecord(MapKey = sp.TNat, Amount = sp.TNat)
+        )
+    raise Exception("no parameter expression for %s" % case["name"])
+
+sp.add_compilation_target("token", token())
+# Reward manager of the exchange of a point, without reward period, so getReward only checks its caller
+sp.add_compilation_target("xplenty_reward_manager", xPlentyRewardManager.RewardManager(SENDER, TOKEN1, TARGET, SENDER))
+sp.add_compilation_target("viewer", xPlentyToken.Viewer(sp.TRecord(result = sp.TNat, address = sp.TAddress, level = sp.TNat)))
+
+# Contracts of the repository
+sp.add_compilation_target("Exchange", VolatileSwap.AMM(SENDER, TOKEN1, 0, False, TOKEN2, 0, False, 1000, 1000, TOKEN1))
+sp.add_compilation_target("ExchangeEmbeddedLedger", VolatileSwap.AMM(SENDER, TOKEN1, 0, False, TOKEN2, 0, False, 1000, 1000, TOKEN1, True))
+sp.add_compilation_target("ExchangeFactory", VolatileSwapFactory.AMMFactory(SENDER))
+sp.add_compilation_target("FlatCurve", TokenToToken.FlatCurve(0, 0, 0, 0, False, False, 1, 1, TOKEN1, TOKEN2, 0, 1000, TOKEN1, SENDER))
+sp.add_compilation_target("FlatCurveEmbeddedLedger", TokenToToken.FlatCurve(0, 0, 0, 0, False, False, 1, 1, TOKEN1, TOKEN2, 0, 1000, TOKEN1, SENDER, True))
+sp.add_compilation_target("TezToCtez", TezToToken.TezToCtez(0, 0, 0, TOKEN1, 1000, TOKEN1, SENDER, SENDER))
+sp.add_compilation_target("Staking", Staking.Staking(SENDER, TOKEN1, TOKEN2, False))
+sp.add_compilation_target("Vault", Vault.Vault(SENDER, SENDER, SENDER, TOKEN1, TOKEN1, TOKEN2, 0, False, True))
+sp.add_compilation_target("PoolRegistry", PoolRegistry.PoolRegistry(SENDER))
+sp.add_compilation_target("Router", Router.Router(SENDER, SENDER))
+sp.add_compilation_target("xPlentyExchange", xPlentyExchange.SwapContract(SENDER, TOKEN1, TOKEN2))
+sp.add_compilation_target("xPlentyRewardManager", xPlentyRewardManager.RewardManager(SENDER, TOKEN1, TOKEN2, SENDER))
+sp.add_compilation_target("xPlentyToken", xplenty_token())
+
+# Storages of the benchmark points
+for build, point in Cases.builds():
+    sp.add_compilation_target(Cases.point_name(build, point), BUILDS[build](point))
+
+# Parameters of the benchmark points
+for case in Cases.CASES:
+    if "parameter" in case and case["parameter"] is None:
+        for point in Cases.points(case):
+            sp.add_expression_compilation_target(Cases.point_name(case["build"], point) + "_" + case["name"], parameter(case, point))
@@ -0,0 +1,20 @@
+# Compilation targets of the pools deployed by tools/deploy_pools.py, compiled from the repository root
+#   ~/smartpy-cli/SmartPy.sh compile deploy/targets.py <output-directory>
+# The storage fields of every pool come from the deployment manifest, the addresses and
+# fees below are placeholders replaced field by field.
+
+import smartpy as sp
+
+VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+TokenToToken = sp.io.import_script_from_url("file:StableSwap/TokenToToken.py")
+
+ADMIN = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+TOKEN1 = sp.address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+TOKEN2 = sp.address("KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd")
+# Unused LP token address of the pools holding their LP ledger, tools.deploy_pools.EMBEDDED_LP_TOKEN
+NO_LP_TOKEN = sp.address("tz1burnburnburnburnburnburnburjAYjjX")
+
+sp.add_compilation_target("Exchange", VolatileSwap.AMM(ADMIN, TOKEN1, 0, False, TOKEN2, 0, False, 1000, 1000, TOKEN1))
+sp.add_compilation_target("ExchangeEmbeddedLedger", VolatileSwap.AMM(ADMIN, TOKEN1, 0, False, TOKEN2, 0, False, 1000, 1000, NO_LP_TOKEN, True))
+sp.add_compilation_target("FlatCurve", TokenToToken.FlatCurve(0, 0, 0, 0, False, False, 1, 1, TOKEN1, TOKEN2, 0, 1000, TOKEN1, ADMIN))
+sp.add_compilation_target("FlatCurveEmbeddedLedger", TokenToToken.FlatCurve(0, 0, 0, 0, False, False, 1, 1, TOKEN1, TOKEN2, 0, 1000, NO_LP_TOKEN, ADMIN, True))
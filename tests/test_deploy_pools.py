@@ -0,0 +1,83 @@
+"""Pool storages of tools.deploy_pools, from a manifest and the storage of a compiled target
+
+tests/fixtures/deploy/ExchangeEmbeddedLedger holds the storage type and the initial storage
+of the ExchangeEmbeddedLedger target of deploy/targets.py, with a no-op code.
+test_fixture_matches_compiled_target checks them against a fresh compilation.
+"""
+
+import os
+
+import pytest
+
+from tools import smartpy_cli
+from tools.compile_cache import compile_targets
+from tools.deploy_pools import (
+    EMBEDDED_LP_TOKEN, ManifestError, Template, check_manifest, load_manifest, pool_fields, storage_fields,
+)
+from tools.michelson import Engine, same_type
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "deploy", "ExchangeEmbeddedLedger")
+
+FILES = {"contract.json": os.path.join(FIXTURE, "contract.json"), "storage.json": os.path.join(FIXTURE, "storage.json")}
+
+MANIFEST = """kind,name,embeddedLedger,admin,token1Address,token1Id,token1Check,token2Address,token2Id,token2Check,lpFee,systemFee,lpTokenAddress
+amm,plenty_ctez,true,tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN,KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b,0,false,KT1SjXiUX63QvdNMcM2m492f7kuf8JxXRLp4,3,true,500,2000,
+"""
+
+
+def manifest(tmp_path, text = MANIFEST):
+
+    path = tmp_path / "pairs.csv"
+    path.write_text(text)
+    return load_manifest(str(path))
+
+
+def test_manifest_round_trip(tmp_path):
+
+    entries = manifest(tmp_path)
+    check_manifest(entries)
+    template = Template(FILES)
+    storage = template.storage_of(pool_fields(entries[0]))
+
+    fields = {name: value for name, (_, value) in storage_fields(template.storageType, storage).items()}
+    assert fields["admin"] == {"string": "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN"}
+    assert fields["token2Address"] == {"string": "KT1SjXiUX63QvdNMcM2m492f7kuf8JxXRLp4"}
+    assert fields["token2Id"] == {"int": "3"}
+    assert fields["token2Check"] == {"prim": "True"}
+    assert fields["token1Check"] == {"prim": "False"}
+    assert (fields["lpFee"], fields["systemFee"]) == ({"int": "500"}, {"int": "2000"})
+    assert fields["lpTokenAddress"] == {"string": EMBEDDED_LP_TOKEN}
+
+    # The fields left out of the manifest keep the compiled values
+    for name in ("maxSwapLimit", "paused", "routerAddress", "balances", "approvals", "totalSupply"):
+        assert fields[name] == template.fields[name][1]
+
+    # Originating decodes the storage, which fails on a value not of the storage type
+    Engine().originate(template.code, storage)
+
+
+def test_embedded_ledger_rejects_lp_token(tmp_path):
+
+    entries = manifest(tmp_path, MANIFEST.rstrip("\n") + "KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd\n")
+    with pytest.raises(ManifestError, match = "lpTokenAddress"):
+        check_manifest(entries)
+
+
+def test_separate_lp_token_is_required(tmp_path):
+
+    entries = manifest(tmp_path, MANIFEST.replace(",true,", ",false,"))
+    with pytest.raises(ManifestError, match = "missing lpTokenAddress"):
+        check_manifest(entries)
+    assert pool_fields(entries[0]) == entries[0]
+
+
+@pytest.mark.skipif(smartpy_cli.cli_version() is None, reason = "the SmartPy CLI is not installed")
+def test_fixture_matches_compiled_target(tmp_path):
+
+    found, _ = compile_targets(["deploy/targets.py"], str(tmp_path), workers = 1)
+    compiled, fixture = Template(found["ExchangeEmbeddedLedger"]), Template(FILES)
+
+    assert sorted(compiled.fields) == sorted(fixture.fields)
+    for name, (typeNode, value) in fixture.fields.items():
+        assert same_type(compiled.fields[name][0], typeNode)
+        assert compiled.fields[name][1] == value
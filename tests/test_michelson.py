@@ -0,0 +1,363 @@
+"""Instructions of tools.michelson against the Michelson semantics, and a compiled pool run end to end
+
+Stacks are written top first, as in the Michelson documentation: run("SWAP", 1, 2) == [2, 1].
+"""
+
+import pytest
+
+from tools import michelson, smartpy_cli
+from tools.compile_cache import compile_targets
+from tools.deploy_pools import storage_fields
+from tools.michelson import (
+    Address, BigMap, Context, Engine, Left, Right, ScriptFailed, Some,
+    compile_instruction, parse_expression, parse_script, to_micheline,
+)
+from tools.pool_math import AMMPool
+
+SELF = Address("KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b")
+
+SENDER = Address(michelson.DEFAULT_SENDER)
+
+
+def run(code, *stack):
+    """Runs Michelson code on a stack given top first
+
+    Returns:
+        the resulting stack, top first
+    """
+
+    engine = Engine()
+    context = Context(engine, SELF, SENDER, SENDER, 0, michelson.GAS_LIMIT * 1000)
+    values = list(reversed(stack))
+    compile_instruction(parse_expression("{ %s }" % code))(values, context)
+    return list(reversed(values))
+
+
+# Stack
+
+def test_drop():
+
+    assert run("DROP", 1, 2, 3) == [2, 3]
+    assert run("DROP 2", 1, 2, 3) == [3]
+    assert run("DROP 0", 1, 2, 3) == [1, 2, 3]
+
+
+def test_dup():
+
+    assert run("DUP", 1, 2) == [1, 1, 2]
+    assert run("DUP 1", 1, 2) == [1, 1, 2]
+    assert run("DUP 3", 1, 2, 3) == [3, 1, 2, 3]
+
+
+def test_swap():
+
+    assert run("SWAP", 1, 2, 3) == [2, 1, 3]
+
+
+def test_dig():
+
+    assert run("DIG 0", 1, 2, 3) == [1, 2, 3]
+    assert run("DIG 1", 1, 2, 3) == [2, 1, 3]
+    assert run("DIG 3", 1, 2, 3, 4, 5) == [4, 1, 2, 3, 5]
+
+
+def test_dug():
+
+    assert run("DUG 0", 1, 2, 3) == [1, 2, 3]
+    assert run("DUG 1", 1, 2, 3) == [2, 1, 3]
+    assert run("DUG 2", 1, 2, 3, 4) == [2, 3, 1, 4]
+    assert run("DUG 3", 1, 2, 3, 4) == [2, 3, 4, 1]
+
+
+def test_dig_dug_round_trip():
+
+    for depth in range(5):
+        assert run("DIG %d ; DUG %d" % (depth, depth), 1, 2, 3, 4, 5) == [1, 2, 3, 4, 5]
+
+
+def test_dip():
+
+    assert run("DIP { DROP }", 1, 2, 3) == [1, 3]
+    assert run("DIP 2 { PUSH nat 7 }", 1, 2, 3) == [1, 2, 7, 3]
+    assert run("DIP 0 { DROP }", 1, 2, 3) == [2, 3]
+
+
+def test_push_and_unit():
+
+    assert run('PUSH (pair nat string) (Pair 1 "a")') == [(1, "a")]
+    assert run("PUSH (list nat) { 1 ; 2 }") == [[1, 2]]
+    assert run("PUSH (option int) None ; UNIT") == [(), None]
+
+
+def test_pair_and_unpair():
+
+    assert run("PAIR", 1, 2, 3) == [(1, 2), 3]
+    assert run("PAIR 3", 1, 2, 3, 4) == [(1, (2, 3)), 4]
+    assert run("UNPAIR", (1, (2, 3))) == [1, (2, 3)]
+    assert run("UNPAIR 3", (1, (2, 3))) == [1, 2, 3]
+    assert run("PAIR 4 ; UNPAIR 4", 1, 2, 3, 4) == [1, 2, 3, 4]
+    assert run("CAR", (1, 2)) == [1]
+    assert run("CDR", (1, 2)) == [2]
+
+
+def test_comb_get():
+
+    comb = (1, (2, (3, 4)))
+    assert run("GET 0", comb) == [comb]
+    assert run("GET 1", comb) == [1]
+    assert run("GET 2", comb) == [(2, (3, 4))]
+    assert run("GET 3", comb) == [2]
+    assert run("GET 5", comb) == [3]
+    assert run("GET 6", comb) == [4]
+
+
+def test_comb_update():
+
+    comb = (1, (2, 3))
+    assert run("UPDATE 0", 9, comb) == [9]
+    assert run("UPDATE 1", 9, comb) == [(9, (2, 3))]
+    assert run("UPDATE 3", 9, comb) == [(1, (9, 3))]
+    assert run("UPDATE 4", 9, comb) == [(1, (2, 9))]
+
+
+# Control
+
+def test_if():
+
+    assert run("IF { PUSH nat 1 } { PUSH nat 2 }", True, 5) == [1, 5]
+    assert run("IF { PUSH nat 1 } { PUSH nat 2 }", False, 5) == [2, 5]
+
+
+def test_if_none():
+
+    code = "IF_NONE { PUSH nat 0 } { PUSH nat 1 ; ADD }"
+    assert run(code, None) == [0]
+    assert run(code, Some(3)) == [4]
+
+
+def test_if_left():
+
+    code = "IF_LEFT { PUSH nat 1 ; ADD } { SIZE }"
+    assert run(code, Left(3)) == [4]
+    assert run(code, Right("abc")) == [3]
+
+
+def test_if_cons():
+
+    code = "IF_CONS { PAIR } { PUSH string \"empty\" }"
+    assert run(code, [1, 2, 3]) == [(1, [2, 3])]
+    assert run(code, []) == ["empty"]
+
+
+def test_loop():
+
+    # Adds n, n - 1, ..., 1 to the accumulator below n
+    code = "PUSH bool True ; LOOP { DUP ; DIP { ADD } ; PUSH int 1 ; SWAP ; SUB ; ABS ; DUP ; PUSH nat 0 ; COMPARE ; NEQ }"
+    assert run(code, 4, 0) == [0, 10]
+    assert run("LOOP { PUSH nat 1 }", False, 7) == [7]
+
+
+def test_loop_left():
+
+    code = 'LOOP_LEFT { PUSH int 1 ; SWAP ; SUB ; DUP ; GT ; IF { LEFT string } { DROP ; PUSH string "done" ; RIGHT int } }'
+    assert run(code, Left(3)) == ["done"]
+    assert run(code, Right("already")) == ["already"]
+
+
+def test_iter():
+
+    assert run("ITER { ADD }", [1, 2, 3], 10) == [16]
+    # Sets and maps are iterated in increasing key order
+    assert run("NIL nat ; SWAP ; ITER { CONS }", frozenset([3, 1, 2])) == [[3, 2, 1]]
+    assert run("NIL string ; SWAP ; ITER { CAR ; CONS }", {"b": 2, "a": 1, "c": 3}) == [["c", "b", "a"]]
+    assert run("ITER { CDR ; ADD }", {1: 10, 2: 20}, 0) == [30]
+
+
+def test_map():
+
+    assert run("MAP { PUSH nat 1 ; ADD }", [1, 2], 0) == [[2, 3], 0]
+    assert run("MAP { UNPAIR ; ADD }", {1: 10, 2: 20}) == [{1: 11, 2: 22}]
+    assert run("MAP { PUSH nat 1 ; ADD }", Some(1)) == [Some(2)]
+    assert run("MAP { PUSH nat 1 ; ADD }", None) == [None]
+
+
+def test_failwith():
+
+    with pytest.raises(ScriptFailed) as failure:
+        run('PUSH string "Not_Admin" ; FAILWITH', 1)
+    assert failure.value.value == {"string": "Not_Admin"}
+    assert failure.value.address == SELF
+
+
+def test_lambda_exec():
+
+    assert run("LAMBDA nat nat { PUSH nat 1 ; ADD } ; SWAP ; EXEC", 4) == [5]
+
+
+def test_apply():
+
+    # The applied value is the first field of the argument
+    code = "LAMBDA (pair nat nat) nat { UNPAIR ; SUB ; ABS } ; PUSH nat 10 ; APPLY ; PUSH nat 3 ; EXEC"
+    assert run(code) == [7]
+
+
+def test_lambda_rec():
+
+    factorial = (
+        "LAMBDA_REC nat nat { DUP ; PUSH nat 0 ; COMPARE ; EQ ; "
+        "IF { DROP 2 ; PUSH nat 1 } { DUP ; PUSH nat 1 ; SWAP ; SUB ; ABS ; DIG 2 ; SWAP ; EXEC ; MUL } }"
+    )
+    assert run(factorial + " ; PUSH nat 5 ; EXEC") == [120]
+
+
+# Collections
+
+def test_list():
+
+    assert run("NIL nat ; PUSH nat 2 ; CONS ; PUSH nat 1 ; CONS") == [[1, 2]]
+    assert run("SIZE", [1, 2, 3]) == [3]
+
+
+def test_set():
+
+    code = "EMPTY_SET nat ; PUSH bool True ; PUSH nat 3 ; UPDATE ; PUSH bool True ; PUSH nat 1 ; UPDATE"
+    assert run(code) == [frozenset([1, 3])]
+    assert run("PUSH bool False ; PUSH nat 3 ; UPDATE", frozenset([1, 3])) == [frozenset([1])]
+    assert run("PUSH nat 3 ; MEM", frozenset([1, 3])) == [True]
+    assert run("PUSH nat 2 ; MEM", frozenset([1, 3])) == [False]
+    assert run("SIZE", frozenset([1, 3])) == [2]
+
+
+def test_map_instructions():
+
+    assert run('EMPTY_MAP string nat ; PUSH (option nat) (Some 1) ; PUSH string "a" ; UPDATE') == [{"a": 1}]
+    assert run('PUSH string "a" ; GET', {"a": 1}) == [Some(1)]
+    assert run('PUSH string "b" ; GET', {"a": 1}) == [None]
+    assert run('PUSH string "a" ; MEM', {"a": 1}) == [True]
+    assert run('PUSH (option nat) None ; PUSH string "a" ; UPDATE', {"a": 1, "b": 2}) == [{"b": 2}]
+    assert run("SIZE", {"a": 1, "b": 2}) == [2]
+    # Maps are values, updating a copy leaves the original unchanged
+    assert run('DUP ; PUSH (option nat) (Some 5) ; PUSH string "a" ; UPDATE', {"a": 1}) == [{"a": 5}, {"a": 1}]
+
+
+def test_get_and_update():
+
+    assert run('PUSH (option nat) (Some 2) ; PUSH string "a" ; GET_AND_UPDATE', {"a": 1}) == [Some(1), {"a": 2}]
+    assert run('PUSH (option nat) None ; PUSH string "a" ; GET_AND_UPDATE', {"a": 1}) == [Some(1), {}]
+    assert run('PUSH (option nat) (Some 2) ; PUSH string "b" ; GET_AND_UPDATE', {"a": 1}) == [None, {"a": 1, "b": 2}]
+
+
+def test_big_map():
+
+    stack = run('EMPTY_BIG_MAP string nat ; PUSH (option nat) (Some 1) ; PUSH string "a" ; UPDATE ; DUP ; PUSH string "a" ; GET')
+    assert stack[0] == Some(1)
+    assert type(stack[1]) is BigMap
+
+    bigMap = BigMap(0, {}, {"a": 1, "b": 2})
+    assert run('PUSH string "b" ; MEM', bigMap) == [True]
+    assert run('PUSH string "c" ; GET', bigMap) == [None]
+    updated = run('PUSH (option nat) None ; PUSH string "a" ; UPDATE ; PUSH string "a" ; MEM', bigMap)
+    assert updated == [False]
+    # Writes go to the copy, the content of the engine is only changed by a commit
+    assert bigMap.store == {"a": 1, "b": 2}
+    old, copy = run('PUSH (option nat) (Some 3) ; PUSH string "b" ; GET_AND_UPDATE', bigMap)
+    assert old == Some(2)
+    assert copy.get("b") == 3 and bigMap.get("b") == 2
+
+
+def test_concat():
+
+    assert run("CONCAT", "ab", "cd") == ["abcd"]
+    assert run("CONCAT", b"\x01", b"\x02") == [b"\x01\x02"]
+    assert run("CONCAT", ["a", "b", "c"]) == ["abc"]
+    assert run("CONCAT", [b"\x01", b"\x02"]) == [b"\x01\x02"]
+
+
+def test_slice():
+
+    assert run("PUSH nat 3 ; PUSH nat 1 ; SLICE", "abcdef") == [Some("bcd")]
+    assert run("PUSH nat 3 ; PUSH nat 4 ; SLICE", "abcdef") == [None]
+    assert run("PUSH nat 0 ; PUSH nat 6 ; SLICE", "abcdef") == [Some("")]
+
+
+# Arithmetic, used by the loops above
+
+def test_arithmetic_operand_order():
+
+    assert run("SUB", 7, 2) == [5]
+    assert run("LSL", 1, 4) == [16]
+    assert run("COMPARE", 1, 2) == [-1]
+    assert run("EDIV", 7, 2) == [Some((3, 1))]
+    assert run("EDIV", -7, 2) == [Some((-4, 1))]
+    assert run("EDIV", 7, -2) == [Some((-3, 1))]
+    assert run("EDIV", 7, 0) == [None]
+
+
+# Engine
+
+COUNTER = """
+parameter (or (nat %add) (unit %fail));
+storage nat;
+code { UNPAIR ; IF_LEFT { ADD } { PUSH string "Failed" ; FAILWITH } ; NIL operation ; PAIR }
+"""
+
+
+def test_engine_call_and_rollback():
+
+    engine = Engine()
+    address = engine.originate(parse_script(COUNTER), {"int": "1"})
+
+    result = engine.call(address, "add", {"int": "41"})
+    assert engine.storage(address) == {"int": "42"}
+    assert result.operations[0]["entrypoint"] == "add"
+
+    with pytest.raises(ScriptFailed):
+        engine.call(address, "fail")
+    assert engine.storage(address) == {"int": "42"}
+
+    engine.call(address, "add", {"int": "1"}, commit = False)
+    assert engine.storage(address) == {"int": "42"}
+
+
+# Compiled pool of the repository
+
+def record(typeNode, **fields):
+    """Micheline of a record parameter, the fields found by their annotations
+    """
+
+    for annot in typeNode.get("annots", []):
+        if annot.startswith("%") and annot[1:] in fields:
+            return to_micheline(fields[annot[1:]])
+    return {"prim": "Pair", "args": [record(typeNode["args"][0], **fields), record(typeNode["args"][1], **fields)]}
+
+
+@pytest.mark.skipif(smartpy_cli.cli_version() is None, reason = "the SmartPy CLI is not installed")
+def test_compiled_exchange_matches_pool_math(tmp_path):
+
+    found, _ = compile_targets(["deploy/targets.py"], str(tmp_path), workers = 1)
+    files = found["ExchangeEmbeddedLedger"]
+    token1, token2 = "KT1GRSvLoikDsXujKgZPsGLX8k8VvR2Tq95b", "KT1LRboPna9yQY9BrjtQYDS1DVxhKESK4VVd"
+
+    # The tokens are not originated, their transfers are recorded without being executed
+    engine = Engine(level = 10, now = 1000, strict = False)
+    address = engine.originate_files(files["contract.json"], files["storage.json"])
+    script = engine.contracts[address]
+
+    def call(entrypoint, **fields):
+        return engine.call(address, entrypoint, record(script.entrypoints[entrypoint][1], **fields), sender = SENDER)
+
+    def reserves():
+        fields = storage_fields(script.storageType, engine.storage(address))
+        return int(fields["token1_pool"][1]["int"]), int(fields["token2_pool"][1]["int"])
+
+    call("AddLiquidity", token1_max = 1000000, token2_max = 4000000, recipient = SENDER)
+    assert reserves() == (1000000, 4000000)
+    pool = AMMPool(address, (token1, 0), (token2, 0), 1000000, 4000000, 1000, 1000)
+
+    # Paying token 1, the required token is token 2
+    result = call("Swap", tokenAmountIn = 10000, MinimumTokenOut = 0, recipient = SENDER, requiredTokenAddress = Address(token2), requiredTokenId = 0)
+
+    paid = [operation for operation in result.operations if operation["destination"] == token2]
+    assert len(paid) == 1
+    assert paid[0]["parameter"] == (address, (SENDER, pool.apply((token1, 0), 10000)))
+    assert reserves() == (pool.token1_pool, pool.token2_pool)
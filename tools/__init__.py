@@ -0,0 +1,5 @@
+"""Off-chain tooling for the Plenty smart contracts
+
+The modules in this package mirror the integer math of the contracts so that
+simulations, quotes and audits can run without a node or the SmartPy interpreter.
+"""
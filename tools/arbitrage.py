@@ -0,0 +1,256 @@
+"""Arbitrage sizing between pools trading the same pair of tokens
+
+Usage:
+    python -m tools.arbitrage <pools.json> [--workers N] [--min-profit N]
+
+A cycle sells amountIn of a token in a first pool and sells the tokens bought in a second
+pool trading the same pair. Its profit is concave in amountIn, so the best size is where
+the derivative of the cycle output, out2'(out1(x)) * out1'(x), equals 1. The derivative
+of the AMM output is analytic (both fee divisors included), the derivative of the flat
+curves is their util based marginal price after the trade. A safeguarded secant search
+on the derivative finds the size in a few iterations, and the size is then checked with
+the exact integer contract math of tools.pool_math.
+
+Every pool pair is solved in both directions, spread over a process pool.
+"""
+
+import argparse
+import copy
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.pool_math import AMMPool, SwapFailed
+from tools.router import load_pools
+
+# Iterations of the secant search
+MAX_ITERATIONS = 8
+
+# Relative width of the bracket at which the search stops
+TOLERANCE = 1e-6
+
+
+class Opportunity:
+    """Profitable cycle through two pools
+
+    Attributes:
+        first: address of the pool selling tokenIn
+        second: address of the pool buying tokenIn back
+        tokenIn: token sold and bought back
+        amountIn: amount sold to the first pool
+        amountOut: amount bought back from the second pool
+        iterations: secant iterations used
+    """
+
+    __slots__ = ("first", "second", "tokenIn", "amountIn", "amountOut", "iterations")
+
+    def __init__(self, first, second, tokenIn, amountIn, amountOut, iterations):
+
+        self.first = first
+        self.second = second
+        self.tokenIn = tokenIn
+        self.amountIn = amountIn
+        self.amountOut = amountOut
+        self.iterations = iterations
+
+    @property
+    def profit(self):
+
+        return self.amountOut - self.amountIn
+
+    def __repr__(self):
+
+        return "Opportunity(%s > %s, %d -> %d)" % (self.first, self.second, self.amountIn, self.amountOut)
+
+
+def derivative(pool, tokenIn, amountIn):
+    """Derivative of the output of a pool in its input
+
+    Args:
+        pool: tools.pool_math pool
+        tokenIn: token sold
+        amountIn: amount sold
+    Returns:
+        float, amount bought per unit sold at the margin
+    Raises:
+        SwapFailed: when the pool rejects the swap
+    """
+
+    if isinstance(pool, AMMPool):
+        # out = outPool * g x / (inPool + g x), g removing both fees
+        inPool, outPool = pool.reserves(tokenIn)
+        g = 1 - 1 / pool.lpFee - 1 / pool.systemFee
+        return outPool * inPool * g / (inPool + g * amountIn) ** 2
+
+    if amountIn == 0:
+        return pool.marginal_price(tokenIn)
+
+    # Flat curves: marginal price at the reserves after the trade
+    after = copy.copy(pool)
+    after.set(pool.swap(tokenIn, amountIn)[1])
+    return after.marginal_price(tokenIn)
+
+
+def cycle_output(first, second, tokenIn, amountIn):
+    """Exact amount of tokenIn bought back by a cycle
+
+    Returns:
+        amount bought back, None when a pool rejects the swap
+    """
+
+    try:
+        return second.quote(first.other(tokenIn), first.quote(tokenIn, amountIn))
+    except SwapFailed:
+        return None
+
+
+def upper_size(first, second, tokenIn):
+    """Largest size accepted by both pools, halving from the reserve or the swap limit of the first pool
+    """
+
+    size = first.reserves(tokenIn)[0]
+    if isinstance(first, AMMPool):
+        size = size * first.maxSwapLimit // 100
+
+    while size > 0 and cycle_output(first, second, tokenIn, size) is None:
+        size //= 2
+    return size
+
+
+def solve_cycle(first, second, tokenIn):
+    """Profit maximising size of the cycle tokenIn -> first -> second -> tokenIn
+
+    Args:
+        first: pool selling tokenIn
+        second: pool buying tokenIn back, trading the same pair
+        tokenIn: token of the cycle
+    Returns:
+        Opportunity, None when the cycle can not be profitable
+    """
+
+    tokenMid = first.other(tokenIn)
+
+    def slope(size):
+        # d(cycle output)/d(size) - 1
+        middle = first.quote(tokenIn, size)
+        return derivative(first, tokenIn, size) * derivative(second, tokenMid, middle) - 1
+
+    if first.marginal_price(tokenIn) * second.marginal_price(tokenMid) <= 1:
+        return None
+
+    high = upper_size(first, second, tokenIn)
+    if high == 0:
+        return None
+
+    low, lowSlope = 0, first.marginal_price(tokenIn) * second.marginal_price(tokenMid) - 1
+    highSlope = slope(high)
+
+    size, iterations = high, 0
+    if highSlope < 0:
+        # Illinois variant of the secant search, the bracket always holds the root
+        side = 0
+        while iterations < MAX_ITERATIONS and high - low > max(1, high * TOLERANCE):
+            iterations += 1
+            size = int(low + (high - low) * lowSlope / (lowSlope - highSlope))
+            size = min(max(size, low + 1), high - 1)
+            sizeSlope = slope(size)
+            if sizeSlope > 0:
+                low, lowSlope = size, sizeSlope
+                if side == 1:
+                    highSlope /= 2
+                side = 1
+            else:
+                high, highSlope = size, sizeSlope
+                if side == -1:
+                    lowSlope /= 2
+                side = -1
+
+    # Exact verification around the solution, the integer math is not exactly concave
+    best, bestOutput = None, None
+    for candidate in {size, low, high, max(size - 1, 1), size + 1}:
+        if candidate <= 0:
+            continue
+        amountOut = cycle_output(first, second, tokenIn, candidate)
+        if amountOut is not None and amountOut > candidate and (best is None or amountOut - candidate > bestOutput - best):
+            best, bestOutput = candidate, amountOut
+
+    if best is None:
+        return None
+    return Opportunity(first.address, second.address, tokenIn, best, bestOutput, iterations)
+
+
+def solve_pair(pools):
+    """Solves both directions of a pool pair
+
+    Args:
+        pools: (first, second) pools trading the same pair of tokens
+    Returns:
+        list of Opportunity
+    """
+
+    first, second = pools
+    opportunities = []
+    for tokenIn in first.tokens:
+        for a, b in ((first, second), (second, first)):
+            try:
+                opportunity = solve_cycle(a, b, tokenIn)
+            except SwapFailed:
+                opportunity = None
+            if opportunity is not None:
+                opportunities.append(opportunity)
+    return opportunities
+
+
+def pool_pairs(pools):
+    """Pairs of pools trading the same pair of tokens
+
+    Yields:
+        (first, second)
+    """
+
+    byPair = {}
+    for pool in pools:
+        byPair.setdefault(frozenset(pool.tokens), []).append(pool)
+    for samePair in byPair.values():
+        yield from itertools.combinations(samePair, 2)
+
+
+def find_opportunities(pools, workers = None, minProfit = 1):
+    """Solves every pool pair in parallel
+
+    Args:
+        pools: tools.pool_math pools
+        workers: processes of the pool, all cores when None, in process when 1
+        minProfit: smallest profit reported
+    Returns:
+        list of Opportunity sorted by decreasing profit
+    """
+
+    pairs = list(pool_pairs(pools))
+    if workers == 1:
+        results = map(solve_pair, pairs)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(solve_pair, pairs, chunksize = max(1, len(pairs) // 64)))
+
+    opportunities = [opportunity for result in results for opportunity in result if opportunity.profit >= minProfit]
+    opportunities.sort(key = lambda opportunity: -opportunity.profit)
+    return opportunities
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Sizes arbitrage cycles between pools trading the same pair of tokens")
+    parser.add_argument("pools", help = "JSON list of pools")
+    parser.add_argument("--workers", type = int, default = None, help = "processes used, all cores by default")
+    parser.add_argument("--min-profit", type = int, default = 1, help = "smallest profit reported")
+    arguments = parser.parse_args()
+
+    for opportunity in find_opportunities(load_pools(arguments.pools), arguments.workers, arguments.min_profit):
+        print("%s:%d %d -> %d (profit %d) via %s > %s" % (
+            opportunity.tokenIn[0], opportunity.tokenIn[1], opportunity.amountIn, opportunity.amountOut, opportunity.profit,
+            opportunity.first, opportunity.second
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Compiled size and gas benchmarks of the contracts
+
+Usage:
+    python -m tools.bench [--output benchmarks/baseline.json] [--compare benchmarks/baseline.json] [--no-gas] [--cache DIR]
+
+benchmarks/targets.py is compiled with the SmartPy CLI (tools.smartpy_cli). For every
+compilation target the binary size of the code and of the initial storage is recorded,
+with the number of Michelson instructions of the code.
+
+Gas is measured on an octez-client mockup (OCTEZ_CLIENT, octez-client on the PATH by
+default). Each case of benchmarks/cases.py sweeps pool sizes, trade sizes, Staking lots or
+xPlenty checkpoints: the storage of every point is originated, the setup of the case funds
+it and gives it allowances on the tokens, and the entrypoint is called from bootstrap1. The
+tokens are the FA1.2 xPlenty token contract of the repository, so the receipt holds the
+cost of real token transfers. The consumed gas of the calls to the benchmarked contract,
+its callbacks included, is read from the receipt, together with the gas of the whole
+operation (token transfers included), the storage size after the call and the storage
+paid by the whole operation.
+
+The results are written as JSON, keyed by target and by case and point, so two baselines
+can be diffed with --compare.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from tools import smartpy_cli
+from tools.compile_cache import compile_targets
+from tools.micheline import encoded_size, instruction_count
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = "benchmarks/targets.py"
+CASES = os.path.join(ROOT, "benchmarks", "cases.py")
+
+# Fees are not benchmarked, the burn cap only has to cover the originations
+BURN_CAP = "100"
+
+ORIGINATED = re.compile(r"New contract (KT1\w+) originated")
+OPERATION = re.compile(r"^\s*(Internal )?Transaction:")
+DESTINATION = re.compile(r"^\s*To: (\S+)")
+ENTRYPOINT = re.compile(r"^\s*Entrypoint: (\S+)")
+CONSUMED_GAS = re.compile(r"^\s*Consumed gas: ([\d.]+)")
+STORAGE_SIZE = re.compile(r"^\s*Storage size: (\d+) bytes")
+PAID_STORAGE = re.compile(r"^\s*Paid storage size diff: (\d+) bytes")
+
+
+class BenchmarkFailed(Exception):
+    pass
+
+
+def load_cases():
+    """benchmarks/cases.py, shared with the SmartPy targets
+    """
+
+    spec = importlib.util.spec_from_file_location("cases", CASES)
+    cases = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cases)
+    return cases
+
+
+def sizes(targets):
+    """Code and storage sizes of the compiled contracts
+
+    Returns:
+        dict target -> dict codeBytes, storageBytes, instructions
+    """
+
+    result = {}
+    for name, files in targets.items():
+        if "contract.json" not in files:
+            continue
+        code = smartpy_cli.code(files)
+        result[name] = {
+            "codeBytes": encoded_size(code),
+            "storageBytes": encoded_size(smartpy_cli.storage(files)),
+            "instructions": instruction_count(code),
+        }
+    return result
+
+
+class Mockup:
+    """octez-client in mockup mode, in its own base directory
+
+    Args:
+        client: octez-client executable
+        baseDirectory: directory of the mockup state
+    """
+
+    def __init__(self, client, baseDirectory):
+
+        self.client = client
+        self.baseDirectory = baseDirectory
+        self.run("create", "mockup")
+
+    def run(self, *arguments):
+
+        result = subprocess.run(
+            [self.client, "--mode", "mockup", "--base-dir", self.baseDirectory] + list(arguments),
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True
+        )
+        if result.returncode != 0:
+            raise BenchmarkFailed("octez-client %s failed:\n%s" % (" ".join(arguments[:2]), result.stdout))
+        return result.stdout
+
+    def originate(self, alias, codePath, storage):
+        """Originates a contract from bootstrap1
+
+        Returns:
+            address of the contract
+        """
+
+        output = self.run(
+            "originate", "contract", alias, "transferring", "0", "from", "bootstrap1",
+            "running", codePath, "--init", storage, "--burn-cap", BURN_CAP, "--force"
+        )
+        match = ORIGINATED.search(output)
+        if match is None:
+            raise BenchmarkFailed("no originated contract in:\n%s" % output)
+        return match.group(1)
+
+    def call(self, address, entrypoint, parameter):
+        """Calls an entrypoint from bootstrap1
+
+        Returns:
+            list of the operations of the receipt, see parse_receipt
+        """
+
+        output = self.run(
+            "transfer", "0", "from", "bootstrap1", "to", address,
+            "--entrypoint", entrypoint, "--arg", parameter, "--burn-cap", BURN_CAP
+        )
+        return parse_receipt(output)
+
+
+def parse_receipt(text):
+    """Transactions of an operation receipt, the external one first
+
+    Returns:
+        list of dict destination, entrypoint, gas, storageSize, paidStorage
+    """
+
+    operations = []
+    for line in text.splitlines():
+        if OPERATION.match(line):
+            operations.append({"destination": None, "entrypoint": "default", "gas": 0.0, "storageSize": None, "paidStorage": 0})
+        elif operations:
+            for pattern, field, convert in ((DESTINATION, "destination", str), (ENTRYPOINT, "entrypoint", str), (CONSUMED_GAS, "gas", float), (STORAGE_SIZE, "storageSize", int), (PAID_STORAGE, "paidStorage", int)):
+                match = pattern.match(line)
+                if match:
+                    operations[-1][field] = convert(match.group(1))
+    return operations
+
+
+def substitute(michelson, addresses, placeholders):
+    """Replaces the placeholder addresses of a storage or parameter by the originated ones
+    """
+
+    for role, placeholder in placeholders.items():
+        if role in addresses:
+            michelson = michelson.replace('"%s"' % placeholder, '"%s"' % addresses[role])
+    return michelson
+
+
+def measure_case(mockup, targets, cases, case, point, addresses):
+    """Originates the storage of a point, runs the setup of the case and calls the
+    benchmarked entrypoint
+
+    Returns:
+        dict gas, totalGas, storageSize, paidStorage
+    """
+
+    name = cases.point_name(case["build"], point)
+    files = targets[name]
+    target = mockup.originate(
+        "%s_%s" % (case["name"], name), files["contract.tz"],
+        substitute(smartpy_cli.michelson(files, "storage"), addresses, cases.PLACEHOLDERS)
+    )
+    values = dict(addresses, target = target, **point)
+
+    for step in case["setup"]:
+        if "originate" in step:
+            stepFiles = targets[step["originate"]]
+            values[step["role"]] = mockup.originate(
+                "%s_%s_%s" % (case["name"], name, step["role"]), stepFiles["contract.tz"],
+                substitute(smartpy_cli.michelson(stepFiles, "storage"), values, cases.PLACEHOLDERS)
+            )
+        else:
+            mockup.call(values[step["role"]], step["entrypoint"], step["parameter"].format(**values))
+
+    if case["parameter"] is None:
+        parameter = smartpy_cli.michelson(targets[name + "_" + case["name"]], "expression")
+    else:
+        parameter = case["parameter"].format(**values)
+    operations = mockup.call(target, case["entrypoint"], substitute(parameter, addresses, cases.PLACEHOLDERS))
+
+    measured = [operation for operation in operations if operation["destination"] == target]
+    if not measured or measured[0]["entrypoint"] != case["entrypoint"]:
+        raise BenchmarkFailed("no call to %s in the receipt of %s" % (case["entrypoint"], case["name"]))
+    return {
+        "gas": round(sum(operation["gas"] for operation in measured), 3),
+        "totalGas": round(sum(operation["gas"] for operation in operations), 3),
+        "storageSize": measured[-1]["storageSize"],
+        "paidStorage": sum(operation["paidStorage"] for operation in operations),
+    }
+
+
+def gas(targets, client, cases = None):
+    """Gas of every point of every case
+
+    Returns:
+        dict case -> dict point target -> dict gas, totalGas, storageSize, paidStorage
+    """
+
+    cases = cases or load_cases()
+    result = {}
+    with tempfile.TemporaryDirectory() as baseDirectory:
+        mockup = Mockup(client, os.path.join(baseDirectory, "mockup"))
+
+        # Shared contracts, originated once
+        shared = {}
+        for case in cases.CASES:
+            for role, targetName in case["roles"].items():
+                if role not in shared:
+                    files = targets[targetName]
+                    shared[role] = mockup.originate(role, files["contract.tz"], smartpy_cli.michelson(files, "storage"))
+
+        for case in cases.CASES:
+            result[case["name"]] = {}
+            for point in cases.points(case):
+                result[case["name"]][cases.point_name(case["build"], point)] = measure_case(mockup, targets, cases, case, point, shared)
+    return result
+
+
+def compare(baseline, current):
+    """Differences between two benchmark results
+
+    Returns:
+        list of (key, old value, new value), only for the values that changed
+    """
+
+    changes = []
+
+    def walk(path, old, new):
+        if isinstance(old, dict) or isinstance(new, dict):
+            old, new = old or {}, new or {}
+            for key in sorted(set(old) | set(new)):
+                walk(path + [key], old.get(key), new.get(key))
+        elif old != new:
+            changes.append(("/".join(path), old, new))
+
+    walk([], baseline, current)
+    return changes
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmarks the compiled size and the gas of the contracts")
+    parser.add_argument("--output", help = "writes the results to this JSON file")
+    parser.add_argument("--compare", help = "baseline JSON file the results are compared with")
+    parser.add_argument("--no-gas", action = "store_true", help = "only measures the compiled sizes")
+    parser.add_argument("--client", default = os.environ.get("OCTEZ_CLIENT", "octez-client"), help = "octez-client executable")
+    parser.add_argument("--build", help = "keeps the SmartPy outputs in this directory")
+    parser.add_argument("--cache", help = "compiles through the tools.compile_cache cache in this directory")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        outputDirectory = arguments.build or temporary
+        if arguments.cache:
+            targets, _ = compile_targets([TARGETS], arguments.cache)
+        else:
+            targets = smartpy_cli.compile_script(TARGETS, outputDirectory)
+        results = {"contracts": sizes(targets)}
+        if not arguments.no_gas:
+            results["gas"] = gas(targets, arguments.client)
+
+    if arguments.output:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(results, outputFile, indent = 2, sort_keys = True)
+            outputFile.write("\n")
+    elif not arguments.compare:
+        json.dump(results, sys.stdout, indent = 2, sort_keys = True)
+        print()
+
+    if arguments.compare:
+        with open(arguments.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+        if arguments.no_gas:
+            baseline.pop("gas", None)
+        for key, old, new in compare(baseline, results):
+            if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+                print("%s: %s -> %s (%+.2f%%)" % (key, old, new, 100.0 * (new - old) / old))
+            else:
+                print("%s: %s -> %s" % (key, old, new))
+
+
+if __name__ == "__main__":
+    main()
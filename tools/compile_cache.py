@@ -0,0 +1,219 @@
+"""Content addressed cache of the SmartPy compilation targets
+
+Usage:
+    python -m tools.compile_cache [SCRIPT ...] [--cache build/compile-cache] [--output DIR] [--workers N] [--error-codes]
+
+Every compilation target is keyed by the hash of its script and of the scripts it
+imports (tools.run_tests.source_hash), of the text of its sp.add_compilation_target call,
+of the compilation environment and of the SmartPy CLI version. A target found in the cache is returned without
+running SmartPy. Scripts with a missing target are compiled with SmartPy.sh compile, in
+parallel, and all their targets stored.
+
+Targets are compiled with the scenario block of their script, which defines their
+constructor arguments, so a script is the smallest unit SmartPy compiles. Scripts naming
+their targets at run time, as benchmarks/targets.py does in loops, are cached as a whole
+under one key.
+
+Without SCRIPT arguments every contract file with compilation targets is compiled.
+--output copies the outputs to <output>/<target>/.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from tools import smartpy_cli
+from tools.run_tests import discover, source_hash
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CACHE = os.path.join(ROOT, "build", "compile-cache")
+
+TARGET_CALL = re.compile(r"sp\.add_(?:expression_)?compilation_target\(")
+LITERAL_NAME = re.compile(r'\(\s*"([^"]+)"\s*,')
+
+# Name of the entry of a script cached as a whole
+WHOLE_SCRIPT = "*"
+
+
+def calls(source):
+    """Text of every compilation target call of a script, up to its closing parenthesis
+    """
+
+    found = []
+    for match in TARGET_CALL.finditer(source):
+        depth, index, quote = 0, match.end() - 1, None
+        while index < len(source):
+            character = source[index]
+            if quote:
+                if character == "\\":
+                    index += 1
+                elif character == quote:
+                    quote = None
+            elif character in "\"'":
+                quote = character
+            elif character == "(":
+                depth += 1
+            elif character == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+            index += 1
+        found.append(source[match.start():index + 1])
+    return found
+
+
+def target_keys(script, environment = None):
+    """Cache keys of the targets of a script
+
+    Returns:
+        dict target name -> key, {WHOLE_SCRIPT: key} when a target is named at run time
+    """
+
+    environment = environment or {}
+    with open(os.path.join(ROOT, script)) as sourceFile:
+        targetCalls = calls(sourceFile.read())
+    base = [script, source_hash(script), environment, smartpy_cli.cli_version()]
+
+    names = [LITERAL_NAME.match(call, call.index("(")) for call in targetCalls]
+    if not all(names):
+        return {WHOLE_SCRIPT: key_of(base + [WHOLE_SCRIPT])}
+    return {name.group(1): key_of(base + [" ".join(call.split())]) for name, call in zip(names, targetCalls)}
+
+
+def key_of(parts):
+
+    return hashlib.sha256(json.dumps(parts, sort_keys = True).encode()).hexdigest()
+
+
+class CompileCache:
+    """Directory of compiled targets, one directory per key
+
+    Args:
+        directory: root of the cache
+    """
+
+    def __init__(self, directory = DEFAULT_CACHE):
+
+        self.directory = directory
+
+    def path(self, key):
+
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, key):
+        """Output directory of a key, None on a miss
+        """
+
+        path = self.path(key)
+        return path if os.path.isdir(path) else None
+
+    def store(self, key, outputDirectory):
+        """Copies an output directory under a key, atomically
+
+        Returns:
+            the cached directory
+        """
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        staging = tempfile.mkdtemp(dir = os.path.dirname(path))
+        shutil.copytree(outputDirectory, os.path.join(staging, "entry"))
+        try:
+            os.rename(os.path.join(staging, "entry"), path)
+        except OSError:
+            # Stored meanwhile by another process
+            pass
+        shutil.rmtree(staging, ignore_errors = True)
+        return path
+
+
+def compile_into_cache(script, keys, cacheDirectory, environment):
+    """Compiles a script and stores its targets
+
+    Returns:
+        dict key -> cached directory
+    """
+
+    cache = CompileCache(cacheDirectory)
+    with tempfile.TemporaryDirectory() as outputDirectory:
+        smartpy_cli.run("compile", script, outputDirectory, environment)
+        if WHOLE_SCRIPT in keys:
+            return {keys[WHOLE_SCRIPT]: cache.store(keys[WHOLE_SCRIPT], outputDirectory)}
+        stored = {}
+        for name, key in keys.items():
+            targetDirectory = os.path.join(outputDirectory, name)
+            if not os.path.isdir(targetDirectory):
+                raise smartpy_cli.CompilationFailed("%s did not write the target %s" % (script, name))
+            stored[key] = cache.store(key, targetDirectory)
+        return stored
+
+
+def compile_targets(scripts, cacheDirectory = DEFAULT_CACHE, workers = None, environment = None):
+    """Outputs of the targets of scripts, compiling only the scripts with a missing target
+
+    Args:
+        scripts: paths relative to the repository root
+        workers: processes of the pool, all cores when None, in process when 1
+    Returns:
+        (dict target name -> dict kind -> path as tools.smartpy_cli.targets, list of the compiled scripts)
+    """
+
+    environment = environment or {}
+    cache = CompileCache(cacheDirectory)
+    keys = {script: target_keys(script, environment) for script in scripts}
+    missing = [script for script in scripts if not all(cache.lookup(key) for key in keys[script].values())]
+
+    if workers == 1:
+        for script in missing:
+            compile_into_cache(script, keys[script], cacheDirectory, environment)
+    elif missing:
+        with ProcessPoolExecutor(workers) as executor:
+            list(executor.map(
+                compile_into_cache, missing, [keys[script] for script in missing],
+                [cacheDirectory] * len(missing), [environment] * len(missing)
+            ))
+
+    found = {}
+    for script in scripts:
+        for name, key in keys[script].items():
+            if name == WHOLE_SCRIPT:
+                found.update(smartpy_cli.targets(cache.lookup(key)))
+            else:
+                found[name] = smartpy_cli.target_files(cache.lookup(key))
+    return found, missing
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Compiles the SmartPy compilation targets through a content addressed cache")
+    parser.add_argument("scripts", nargs = "*", help = "scripts relative to the repository root, every contract file by default")
+    parser.add_argument("--cache", default = DEFAULT_CACHE, help = "cache directory")
+    parser.add_argument("--output", help = "copies the outputs to this directory")
+    parser.add_argument("--workers", type = int, default = None, help = "processes used, all cores by default")
+    parser.add_argument("--error-codes", action = "store_true", help = "compiles with PLENTY_ERROR_CODES=1")
+    arguments = parser.parse_args()
+
+    scripts = arguments.scripts or [contract["script"] for contract in discover() if contract["targets"]]
+    environment = {"PLENTY_ERROR_CODES": "1"} if arguments.error_codes else {}
+    found, compiled = compile_targets(scripts, arguments.cache, arguments.workers, environment)
+
+    for script in scripts:
+        print("%-8s %s" % ("compiled" if script in compiled else "cached", script))
+    if arguments.output:
+        for name, files in found.items():
+            directory = os.path.join(arguments.output, name)
+            shutil.rmtree(directory, ignore_errors = True)
+            shutil.copytree(os.path.dirname(next(iter(files.values()))), directory)
+    else:
+        print(json.dumps(found, indent = 2, sort_keys = True))
+
+
+if __name__ == "__main__":
+    main()
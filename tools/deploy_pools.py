@@ -0,0 +1,285 @@
+"""Code and initial storages of many AMM and FlatCurve pools, from a pair manifest
+
+Usage:
+    python -m tools.deploy_pools <manifest.json|manifest.csv> <output-directory> [--cache build/compile-cache]
+
+The manifest lists one pool per entry (JSON list of objects, or CSV with a header):
+
+    kind: amm or flat
+    name: directory of the pool, <kind>_<index> by default
+    embeddedLedger: true for the exchanges holding their LP ledger
+    admin, token1Address, token1Id, token1Check, token2Address, token2Id, token2Check, lpFee,
+    and systemFee and lpTokenAddress for amm, token1Precision, token2Precision and
+    lqtAddress for flat: storage fields of the pool
+
+A pool with the embedded ledger is its own LP token, its address is only known once
+originated. Its lpTokenAddress or lqtAddress is unused by the contract, must be left out of
+the manifest and is written as EMBEDDED_LP_TOKEN, the burn address, so that it is never
+mistaken for a token.
+
+The contracts are compiled once, through tools.compile_cache, from the pool targets of
+deploy/targets.py. The storage of every pool is then written
+directly: the compiled storage of the target gives the value of every field, and the
+fields of the manifest replace theirs, encoded with the type read from the field
+annotations of the compiled storage type. Nothing is compiled per pool.
+
+The output is deterministic:
+
+    <output>/<target>/code.json, code.tz
+    <output>/<name>/storage.json
+    <output>/deployments.json, the target and files of every pool
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+
+from tools.compile_cache import DEFAULT_CACHE, compile_targets
+from tools.michelson import comb
+from tools.micheline import load
+
+TARGETS = "deploy/targets.py"
+
+# Compilation targets of the pool kinds, without and with the embedded LP ledger, and the
+# field of the address of the separate LP token, only set without the embedded ledger
+KINDS = {
+    "amm": {
+        "targets": ("Exchange", "ExchangeEmbeddedLedger"),
+        "required": ["admin", "token1Address", "token1Id", "token1Check", "token2Address", "token2Id", "token2Check", "lpFee", "systemFee"],
+        "lpToken": "lpTokenAddress",
+    },
+    "flat": {
+        "targets": ("FlatCurve", "FlatCurveEmbeddedLedger"),
+        "required": ["admin", "token1Address", "token1Id", "token1Check", "token2Address", "token2Id", "token2Check", "token1Precision", "token2Precision", "lpFee"],
+        "lpToken": "lqtAddress",
+    },
+}
+
+# Manifest columns that are not storage fields
+OPTIONS = ("kind", "name", "embeddedLedger")
+
+# LP token address of the pools with the embedded ledger, the burn address
+EMBEDDED_LP_TOKEN = "tz1burnburnburnburnburnburnburjAYjjX"
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def load_manifest(path):
+    """Entries of a JSON or CSV manifest, CSV values being strings
+    """
+
+    with open(path, newline = "") as manifestFile:
+        if path.endswith(".csv"):
+            return [dict(row) for row in csv.DictReader(manifestFile)]
+        return json.load(manifestFile)
+
+
+def parse_bool(value):
+
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ("true", "1", "yes"):
+        return True
+    if str(value).strip().lower() in ("false", "0", "no", ""):
+        return False
+    raise ManifestError("%r is not a boolean" % value)
+
+
+def pair_arguments(node):
+    """Two arguments of a Pair, nesting the pairs of more than two arguments
+    """
+
+    args = node if isinstance(node, list) else node["args"]
+    if len(args) > 2:
+        return args[0], {"prim": "Pair", "args": args[1:]}
+    return args[0], args[1]
+
+
+def storage_fields(typeNode, valueNode, found = None):
+    """Annotated fields of a storage
+
+    Args:
+        typeNode: storage type with combs (tools.michelson.comb)
+        valueNode: Micheline of the storage
+    Returns:
+        dict field -> (type, value)
+    """
+
+    found = {} if found is None else found
+    for annot in typeNode.get("annots", []):
+        if annot.startswith("%"):
+            found[annot[1:]] = (typeNode, valueNode)
+            return found
+    if typeNode["prim"] == "pair":
+        first, second = pair_arguments(valueNode)
+        storage_fields(typeNode["args"][0], first, found)
+        storage_fields(typeNode["args"][1], second, found)
+    return found
+
+
+def with_fields(typeNode, valueNode, values):
+    """Storage with the values of some fields replaced
+
+    Args:
+        values: dict field -> Micheline value
+    """
+
+    for annot in typeNode.get("annots", []):
+        if annot.startswith("%"):
+            return values.get(annot[1:], valueNode)
+    if typeNode["prim"] == "pair":
+        first, second = pair_arguments(valueNode)
+        return {"prim": "Pair", "args": [with_fields(typeNode["args"][0], first, values), with_fields(typeNode["args"][1], second, values)]}
+    return valueNode
+
+
+def encode_field(typeNode, value):
+    """Micheline of a manifest value for a field type
+    """
+
+    prim = typeNode["prim"]
+    if prim in ("nat", "int", "mutez", "timestamp"):
+        number = int(value)
+        if prim != "int" and number < 0:
+            raise ManifestError("%r is negative" % value)
+        return {"int": str(number)}
+    if prim in ("address", "string", "key_hash"):
+        return {"string": str(value)}
+    if prim == "bool":
+        return {"prim": "True" if parse_bool(value) else "False"}
+    if prim == "bytes":
+        return {"bytes": str(value)}
+    if prim == "option":
+        if str(value).lower() == "none":
+            return {"prim": "None"}
+        return {"prim": "Some", "args": [encode_field(typeNode["args"][0], value)]}
+    raise ManifestError("fields of type %s cannot be set from a manifest" % prim)
+
+
+class Template:
+    """Compiled code and reference storage of a target
+
+    Args:
+        files: outputs of the target, as tools.smartpy_cli.targets gives them
+    """
+
+    def __init__(self, files):
+
+        self.code = load(files["contract.json"])
+        self.codeText = None
+        if "contract.tz" in files:
+            with open(files["contract.tz"]) as codeFile:
+                self.codeText = codeFile.read()
+        storageSection = [section for section in self.code if section["prim"] == "storage"][0]
+        self.storageType = comb(storageSection["args"][0])
+        self.storage = load(files["storage.json"])
+        self.fields = storage_fields(self.storageType, self.storage)
+
+    def storage_of(self, entry):
+        """Storage of a pool, the fields of the entry replacing the reference ones
+        """
+
+        values = {}
+        for field, value in entry.items():
+            # Empty CSV cells keep the reference value
+            if field in OPTIONS or value is None or value == "":
+                continue
+            if field not in self.fields:
+                raise ManifestError("unknown storage field %s" % field)
+            values[field] = encode_field(self.fields[field][0], value)
+        return with_fields(self.storageType, self.storage, values)
+
+
+def pool_fields(entry):
+    """Storage fields of an entry, the LP token address of an embedded ledger pool being
+    EMBEDDED_LP_TOKEN
+    """
+
+    fields = dict(entry)
+    if parse_bool(entry.get("embeddedLedger", False)):
+        fields[KINDS[entry["kind"]]["lpToken"]] = EMBEDDED_LP_TOKEN
+    return fields
+
+
+def pool_key(entry):
+
+    return (entry["kind"], entry["token1Address"], str(entry["token1Id"]), entry["token2Address"], str(entry["token2Id"]))
+
+
+def check_manifest(entries):
+    """Raises ManifestError on unknown kinds, missing fields and duplicated pools
+    """
+
+    seen = {}
+    for index, entry in enumerate(entries):
+        kind = entry.get("kind")
+        if kind not in KINDS:
+            raise ManifestError("entry %d: unknown kind %r" % (index, kind))
+        required, lpToken = KINDS[kind]["required"], KINDS[kind]["lpToken"]
+        if not parse_bool(entry.get("embeddedLedger", False)):
+            required = required + [lpToken]
+        elif entry.get(lpToken) not in (None, ""):
+            raise ManifestError("entry %d: %s is set but the pool is its own LP token with the embedded ledger" % (index, lpToken))
+        missing = [field for field in required if entry.get(field) in (None, "")]
+        if missing:
+            raise ManifestError("entry %d: missing %s" % (index, ", ".join(missing)))
+        key = pool_key(entry)
+        if key in seen:
+            raise ManifestError("entry %d: same pool as entry %d" % (index, seen[key]))
+        seen[key] = index
+
+
+def generate(entries, output, cacheDirectory = DEFAULT_CACHE):
+    """Writes the code of the targets used and the storage of every pool
+
+    Returns:
+        list of dict name, target, code and storage paths relative to output
+    """
+
+    check_manifest(entries)
+    found, _ = compile_targets([TARGETS], cacheDirectory)
+
+    templates, deployments = {}, []
+    for index, entry in enumerate(entries):
+        kind = entry["kind"]
+        target = KINDS[kind]["targets"][1 if parse_bool(entry.get("embeddedLedger", False)) else 0]
+        if target not in templates:
+            templates[target] = Template(found[target])
+            os.makedirs(os.path.join(output, target), exist_ok = True)
+            with open(os.path.join(output, target, "code.json"), "w") as codeFile:
+                json.dump(templates[target].code, codeFile, indent = 2)
+            if templates[target].codeText is not None:
+                with open(os.path.join(output, target, "code.tz"), "w") as codeFile:
+                    codeFile.write(templates[target].codeText)
+
+        name = entry.get("name") or "%s_%03d" % (kind, index)
+        directory = os.path.join(output, name)
+        shutil.rmtree(directory, ignore_errors = True)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "storage.json"), "w") as storageFile:
+            json.dump(templates[target].storage_of(pool_fields(entry)), storageFile, indent = 2)
+        deployments.append({"name": name, "target": target, "code": target + "/code.json", "storage": name + "/storage.json"})
+
+    with open(os.path.join(output, "deployments.json"), "w") as deploymentsFile:
+        json.dump(deployments, deploymentsFile, indent = 2)
+    return deployments
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Writes the code and initial storages of the pools of a manifest")
+    parser.add_argument("manifest", help = "JSON or CSV pair manifest")
+    parser.add_argument("output", help = "output directory")
+    parser.add_argument("--cache", default = DEFAULT_CACHE, help = "tools.compile_cache directory")
+    arguments = parser.parse_args()
+
+    deployments = generate(load_manifest(arguments.manifest), arguments.output, arguments.cache)
+    print("%d pools written to %s" % (len(deployments), arguments.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Decoder table of the numeric error codes
+
+Usage:
+    python -m tools.error_codes [--json codes.json]
+    python -m tools.error_codes <contract.py> <code>
+
+Contracts compiled with PLENTY_ERROR_CODES set fail with a nat instead of a string. In
+every contract file ErrorMessages.make numbers the messages in the order of its calls,
+starting at 0 and giving a repeated message the code of its first call, so the table is
+rebuilt here from the same make("...") declarations without compiling the contracts.
+Codes are only unique within a contract file.
+"""
+
+import argparse
+import json
+import os
+import re
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prefix of the messages built by make, empty when make keeps the message as given
+PREFIX = re.compile(r'message = (?:"(\w*)" \+ )?s\n')
+
+# Declaration of an error message
+DECLARATION = re.compile(r'= *make\("((?:[^"\\]|\\.)*)"\)')
+
+
+def contract_files(root = ROOT):
+    """Contract files numbering their errors, relative to root
+    """
+
+    files = []
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith(".") and name != "tools")
+        for name in sorted(names):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                with open(path) as contractFile:
+                    if "ERROR_CODES.setdefault" in contractFile.read():
+                        files.append(os.path.relpath(path, root))
+    return files
+
+
+def error_table(path):
+    """Codes of the error messages of a contract file
+
+    Returns:
+        dict code -> message
+    """
+
+    with open(path) as contractFile:
+        source = contractFile.read()
+
+    prefix = PREFIX.search(source)
+    if prefix is None:
+        raise ValueError("%s has no ErrorMessages.make" % path)
+    prefix = prefix.group(1) or ""
+
+    codes = {}
+    for declaration in DECLARATION.finditer(source):
+        message = prefix + declaration.group(1).replace('\\"', '"')
+        codes.setdefault(message, len(codes))
+    return {code: message for message, code in codes.items()}
+
+
+def error_tables(root = ROOT):
+    """Decoder tables of every contract file
+
+    Returns:
+        dict contract file -> dict code -> message
+    """
+
+    return {path: error_table(os.path.join(root, path)) for path in contract_files(root)}
+
+
+def decode(contract, code, root = ROOT):
+    """Message of an error code of a contract file
+
+    Raises:
+        KeyError: when the contract does not use the code
+    """
+
+    return error_table(os.path.join(root, contract))[int(code)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Decodes the numeric error codes of the contracts")
+    parser.add_argument("contract", nargs = "?", help = "contract file, relative to the repository root")
+    parser.add_argument("code", nargs = "?", type = int, help = "error code to decode")
+    parser.add_argument("--json", help = "writes the tables of every contract to this file")
+    arguments = parser.parse_args()
+
+    if arguments.contract is not None:
+        if arguments.code is None:
+            parser.error("code is required with a contract")
+        print(decode(arguments.contract, arguments.code))
+        return
+
+    tables = error_tables()
+    if arguments.json:
+        with open(arguments.json, "w") as jsonFile:
+            json.dump(tables, jsonFile, indent = 2)
+        return
+
+    for contract, table in tables.items():
+        print(contract)
+        for code, message in table.items():
+            print("  %3d %s" % (code, message))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+"""Differential fuzzer of the pool math against the pool contracts
+
+Usage:
+    python -m tools.fuzz_pools [--cases 100000] [--seed 0] [--kinds amm_swap,flat_swap] [--sample 32] [--batch 8] [--workers N] [--shrink-runs 40] [--output report.json]
+
+Random swaps of AMM.Swap, FlatCurve.swap and of the tez_to_ctez and ctez_to_tez flows of
+TezToCtez are generated from a seed, with emphasis on the edges: reserves from 0 to 128
+bits and hugely imbalanced, trades of a few units or at the swap limit, extreme
+precisions, fee divisors and ctez targets. Storages are the ones the entrypoints can
+reach, AMM fee divisors are above 50 as ModifyFee requires.
+
+Every case is priced by the reference, tools.pool_math, and by the pricing paths built on
+it, the Pool classes in both token orders and tools.quote_cache, which must agree bit for
+bit: same amount bought and new reserves, or same error message. Cases are generated and
+checked in a pool of processes.
+
+--sample cases are also run through the SmartPy interpreter. A batch script holds one
+scenario per case, originating the pool with the reserves and fees of the case and
+swapping through the entrypoint, then verifying the new reserves, or the error message,
+predicted by the reference. Batches run with SmartPy.sh test in parallel, a failing batch
+is run again case by case to find its mismatches.
+
+Mismatches are shrunk to a minimal case, every field being lowered while the mismatch
+remains, and reported with the case to reproduce them. Local mismatches are counted per
+kind and pricing path and the first one of each is shrunk. The same seed gives the same
+cases.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tools import smartpy_cli
+from tools.pool_math import AMMPool, FlatCurvePool, SwapFailed, TEZ, TezToCtezPool, amm_swap, ctez_to_tez, flat_swap, tez_to_ctez
+from tools.quote_cache import QuoteCache
+
+# Cases generated and checked by one job
+CHUNK = 10000
+
+# Reference calls allowed to shrink a local mismatch
+LOCAL_SHRINK_CALLS = 10000
+
+# Largest tez reserve and amount, mutez are 63 bits
+MAX_MUTEZ = 2 ** 62
+
+# ctez target of 1, Q48 fixed point
+CTEZ_TARGET = 2 ** 48
+
+TOKEN1 = ("KT1BvoVmqhTdpNiiykSMp1Wqpuh28fKs29qQ", 0)
+TOKEN2 = ("KT1MbgHBRPe3Ak8MMiZwEfXUtPjK5sy4VdFp", 0)
+
+# Fields of the cases and the lowest value the shrinking tries, side 1 sells token2
+FIELDS = {
+    "amm_swap": [("amountIn", 0), ("inPool", 0), ("outPool", 0), ("lpFee", 51), ("systemFee", 51), ("maxSwapLimit", 0), ("side", 0)],
+    "flat_swap": [("amountIn", 0), ("inPool", 0), ("outPool", 0), ("inPrecision", 1), ("outPrecision", 1), ("lpFee", 1), ("side", 0)],
+    "tez_to_ctez": [("amountIn", 0), ("tezPool", 0), ("ctezPool", 0), ("target", 1), ("lpFee", 1)],
+    "ctez_to_tez": [("amountIn", 0), ("tezPool", 0), ("ctezPool", 0), ("target", 1), ("lpFee", 1)],
+}
+
+KINDS = list(FIELDS)
+
+# Error messages of the contracts, the other SwapFailed messages are failures of an instruction
+CONTRACT_ERRORS = ("PLentySwap_", "FlatSwap_")
+
+ZERO_TRANSFER = "FlatSwap_Zero_Amount_Transfer"
+
+
+def reserve(rng):
+
+    choice = rng.random()
+    if choice < 0.15:
+        return rng.randint(0, 1000)
+    if choice < 0.3:
+        return 10 ** rng.randint(0, 30)
+    return rng.getrandbits(rng.randint(1, 128))
+
+
+def reserves(rng):
+    """Two reserves, a quarter of them imbalanced by 3 to 30 orders of magnitude
+    """
+
+    first = reserve(rng)
+    if rng.random() < 0.25:
+        scale = 10 ** rng.randint(3, 30)
+        second = first * scale if rng.random() < 0.5 else first // scale
+    else:
+        second = reserve(rng)
+    return (first, second) if rng.random() < 0.5 else (second, first)
+
+
+def trade(rng, inPool, limit = 100):
+    """Amount sold, tiny, around the swap limit, a share of the reserve or unrelated to it
+    """
+
+    choice = rng.random()
+    if choice < 0.2:
+        return rng.randint(0, 3)
+    if choice < 0.35:
+        return max(0, inPool * limit // 100 + rng.randint(-1, 1))
+    if choice < 0.5:
+        return rng.getrandbits(rng.randint(1, 128))
+    return inPool * limit * rng.randint(1, 10 ** 6) // 10 ** 8
+
+
+def fee(rng, lowest):
+
+    choice = rng.random()
+    if choice < 0.2:
+        return lowest + rng.randint(0, 2)
+    if choice < 0.3:
+        return 10 ** rng.randint(5, 18)
+    return rng.randint(lowest, 10 ** 4)
+
+
+def precision(rng):
+
+    return 1 if rng.random() < 0.3 else 10 ** rng.randint(0, 18)
+
+
+def target(rng):
+
+    choice = rng.random()
+    if choice < 0.3:
+        return CTEZ_TARGET
+    if choice < 0.7:
+        return CTEZ_TARGET + rng.randint(-CTEZ_TARGET // 2, CTEZ_TARGET)
+    if choice < 0.8:
+        return rng.randint(1, 3)
+    return rng.getrandbits(rng.randint(1, 96)) + 1
+
+
+def generate(rng, kind):
+    """Random case of a kind
+    """
+
+    if kind == "amm_swap":
+        inPool, outPool = reserves(rng)
+        limit = rng.choice([40, 40, 0, 1, 100, rng.randint(0, 1000)])
+        return {
+            "kind": kind, "amountIn": trade(rng, inPool, limit), "inPool": inPool, "outPool": outPool,
+            "lpFee": fee(rng, 51), "systemFee": fee(rng, 51), "maxSwapLimit": limit, "side": rng.randint(0, 1),
+        }
+    if kind == "flat_swap":
+        inPool, outPool = reserves(rng)
+        return {
+            "kind": kind, "amountIn": trade(rng, inPool), "inPool": inPool, "outPool": outPool,
+            "inPrecision": precision(rng), "outPrecision": precision(rng), "lpFee": fee(rng, 1), "side": rng.randint(0, 1),
+        }
+    tezPool, ctezPool = [min(value, MAX_MUTEZ) for value in reserves(rng)]
+    inPool = tezPool if kind == "tez_to_ctez" else ctezPool
+    amountIn = trade(rng, inPool)
+    if kind == "tez_to_ctez":
+        amountIn = min(amountIn, MAX_MUTEZ)
+    return {"kind": kind, "amountIn": amountIn, "tezPool": tezPool, "ctezPool": ctezPool, "target": target(rng), "lpFee": fee(rng, 1)}
+
+
+def reference(case):
+    """Outcome of the reference, ("ok", amountOut, newInPool, newOutPool[, systemFee]) or ("fail", message)
+
+    The TezToCtez reserves are ordered as the pool of the token sold first.
+    """
+
+    kind = case["kind"]
+    try:
+        if kind == "amm_swap":
+            return ("ok",) + amm_swap(case["amountIn"], case["inPool"], case["outPool"], case["lpFee"], case["systemFee"], case["maxSwapLimit"])
+        if kind == "flat_swap":
+            return ("ok",) + flat_swap(case["amountIn"], case["inPool"], case["outPool"], case["inPrecision"], case["outPrecision"], case["lpFee"])
+        if kind == "tez_to_ctez":
+            return ("ok",) + tez_to_ctez(case["amountIn"], case["tezPool"], case["ctezPool"], case["target"], case["lpFee"])
+        amountOut, tezPool, ctezPool = ctez_to_tez(case["amountIn"], case["tezPool"], case["ctezPool"], case["target"], case["lpFee"])
+        return ("ok", amountOut, ctezPool, tezPool)
+    except SwapFailed as error:
+        return ("fail", str(error))
+
+
+def pool_of(case):
+    """Pool of a case and the token sold
+    """
+
+    kind = case["kind"]
+    if kind in ("amm_swap", "flat_swap"):
+        side = case["side"]
+        token1Pool, token2Pool = (case["inPool"], case["outPool"]) if side == 0 else (case["outPool"], case["inPool"])
+        tokenIn = (TOKEN1, TOKEN2)[side]
+        if kind == "amm_swap":
+            return AMMPool("fuzz", TOKEN1, TOKEN2, token1Pool, token2Pool, case["lpFee"], case["systemFee"], case["maxSwapLimit"]), tokenIn
+        precisions = (case["inPrecision"], case["outPrecision"]) if side == 0 else (case["outPrecision"], case["inPrecision"])
+        return FlatCurvePool("fuzz", TOKEN1, TOKEN2, token1Pool, token2Pool, precisions[0], precisions[1], case["lpFee"]), tokenIn
+    pool = TezToCtezPool("fuzz", TOKEN1, case["tezPool"], case["ctezPool"], case["lpFee"], case["target"])
+    return pool, TEZ if kind == "tez_to_ctez" else TOKEN1
+
+
+def pool_outcome(case):
+    """Outcome of Pool.swap, ordered as reference
+    """
+
+    pool, tokenIn = pool_of(case)
+    try:
+        amountOut, newReserves = pool.swap(tokenIn, case["amountIn"])
+    except SwapFailed as error:
+        return ("fail", str(error))
+    # Both Pool classes order the reserves as their tokens
+    if tokenIn == pool.tokens[0]:
+        return ("ok", amountOut) + tuple(newReserves)
+    return ("ok", amountOut, newReserves[1], newReserves[0])
+
+
+def cache_outcome(case, cache):
+    """Outcomes of a quote missing and then hitting the cache
+    """
+
+    pool, tokenIn = pool_of(case)
+    outcomes = []
+    for _ in range(2):
+        try:
+            outcomes.append(("ok", cache.quote(pool, tokenIn, case["amountIn"])))
+        except SwapFailed as error:
+            outcomes.append(("fail", str(error)))
+    return outcomes
+
+
+def local_mismatch(case, cache = None):
+    """First pricing path disagreeing with the reference
+
+    Returns:
+        None, or dict path, reference and candidate outcomes
+    """
+
+    cache = QuoteCache() if cache is None else cache
+    expected = reference(case)
+    candidates = [("pool", pool_outcome(case), expected[:4])]
+    candidates += [("cache", outcome, expected[:2]) for outcome in cache_outcome(case, cache)]
+    for path, outcome, compared in candidates:
+        if outcome != compared:
+            return {"path": path, "reference": list(expected), "candidate": list(outcome)}
+    return None
+
+
+def check_chunk(seed, chunk, count, kinds, sample):
+    """Generates and checks the cases of a chunk
+
+    Returns:
+        (dict of the mismatches, list of the cases sampled for the interpreter)
+    """
+
+    rng = random.Random("%d:%d" % (seed, chunk))
+    cache = QuoteCache()
+    cases, mismatches = [], []
+    for _ in range(count):
+        case = generate(rng, rng.choice(kinds))
+        mismatch = local_mismatch(case, cache)
+        if mismatch is not None:
+            mismatches.append(dict(mismatch, case = case))
+        cases.append(case)
+    return mismatches, rng.sample(cases, min(sample, len(cases)))
+
+
+def interpreter_outcome(case):
+    """Outcome the contracts must give in the interpreter
+
+    The reference rejects the ctez swaps buying nothing, which the callbacks do not check,
+    the pool only sends the amount, as a ctez transfer or as tez. The stub tokens of the
+    scenario and the interpreter accept them.
+    """
+
+    outcome = reference(case)
+    if case["kind"] in ("tez_to_ctez", "ctez_to_tez") and outcome == ("fail", ZERO_TRANSFER) and case["amountIn"] > 0:
+        if case["kind"] == "tez_to_ctez":
+            return ("ok", 0, case["tezPool"] + case["amountIn"], case["ctezPool"])
+        return ("ok", 0, case["ctezPool"] + case["amountIn"], case["tezPool"])
+    return outcome
+
+
+SCRIPT_HEADER = '''import smartpy as sp
+
+VolatileSwap = sp.io.import_script_from_url("file:VolatileSwap/VolatileSwap.py")
+TokenToToken = sp.io.import_script_from_url("file:StableSwap/TokenToToken.py")
+TezToToken = sp.io.import_script_from_url("file:StableSwap/TezToToken.py")
+
+class FuzzToken(sp.Contract):
+    """FA1.2 token accepting every transfer, and ctez contract answering get_target
+    """
+
+    def __init__(self, target):
+
+        self.init(target = sp.nat(target))
+
+    @sp.entry_point
+    def transfer(self, params):
+
+        sp.set_type(params, sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))))
+
+    @sp.entry_point
+    def get_target(self, callback):
+
+        sp.set_type(callback, sp.TContract(sp.TNat))
+        sp.transfer(self.data.target, sp.mutez(0), callback)
+
+USER = sp.test_account("Fuzz").address
+'''
+
+
+def scenario(name, case):
+    """SmartPy scenario running a case and verifying interpreter_outcome
+    """
+
+    kind = case["kind"]
+    outcome = interpreter_outcome(case)
+    lines = [
+        "@sp.add_test(name = %s)" % json.dumps(name),
+        "def test():",
+        "    scenario = sp.test_scenario()",
+        "    token1 = FuzzToken(%d)" % case.get("target", 0),
+        "    token2 = FuzzToken(0)",
+        "    scenario += token1",
+        "    scenario += token2",
+    ]
+
+    if kind in ("amm_swap", "flat_swap"):
+        side = case["side"]
+        pools = (case["inPool"], case["outPool"]) if side == 0 else (case["outPool"], case["inPool"])
+        required = ("token2", "token1")[side]
+        if kind == "amm_swap":
+            lines += [
+                "    pool = VolatileSwap.AMM(USER, token1.address, 0, False, token2.address, 0, False, %d, %d, token1.address)" % (case["lpFee"], case["systemFee"]),
+                "    pool.update_initial_storage(token1_pool = sp.nat(%d), token2_pool = sp.nat(%d), maxSwapLimit = sp.nat(%d))" % (pools + (case["maxSwapLimit"],)),
+                "    scenario += pool",
+                "    call = pool.Swap(tokenAmountIn = sp.nat(%d), MinimumTokenOut = sp.nat(0), recipient = USER, requiredTokenAddress = %s.address, requiredTokenId = sp.nat(0))" % (case["amountIn"], required),
+            ]
+            fields = ("token1_pool", "token2_pool", ("token1_Fee", "token2_Fee")[side])
+        else:
+            precisions = (case["inPrecision"], case["outPrecision"]) if side == 0 else (case["outPrecision"], case["inPrecision"])
+            lines += [
+                "    pool = TokenToToken.FlatCurve(%d, %d, 0, 0, False, False, %d, %d, token1.address, token2.address, 0, %d, token1.address, USER)" % (pools + precisions + (case["lpFee"],)),
+                "    scenario += pool",
+                "    call = pool.swap(minTokenOut = sp.nat(0), recipient = USER, tokenAmountIn = sp.nat(%d), requiredTokenAddress = %s.address, requiredTokenId = sp.nat(0))" % (case["amountIn"], required),
+            ]
+            fields = ("token1Pool", "token2Pool")
+        if side == 1:
+            fields = (fields[1], fields[0]) + fields[2:]
+        amount = ""
+    else:
+        lines += [
+            "    pool = TezToToken.TezToCtez(%d, %d, 0, token1.address, %d, token1.address, USER, token1.address)" % (case["tezPool"], case["ctezPool"], case["lpFee"]),
+            "    pool.set_initial_balance(sp.mutez(%d))" % case["tezPool"],
+            "    scenario += pool",
+        ]
+        if kind == "tez_to_ctez":
+            lines.append("    call = pool.tez_to_ctez(minCashBought = sp.nat(0), recipient = USER)")
+            fields, amount = ("tezPool", "ctezPool"), ", amount = sp.mutez(%d)" % case["amountIn"]
+        else:
+            lines.append("    call = pool.ctez_to_tez(cashSold = sp.nat(%d), minTezBought = sp.nat(0), recipient = USER)" % case["amountIn"])
+            fields, amount = ("ctezPool", "tezPool"), ""
+
+    if outcome[0] == "ok":
+        lines.append("    call.run(sender = USER%s)" % amount)
+        lines += ["    scenario.verify(pool.data.%s == %d)" % (field, value) for field, value in zip(fields, outcome[2:])]
+    elif outcome[1].startswith(CONTRACT_ERRORS):
+        lines.append("    call.run(sender = USER%s, valid = False, exception = %s)" % (amount, json.dumps(outcome[1])))
+    else:
+        lines.append("    call.run(sender = USER%s, valid = False)" % amount)
+    return "\n".join(lines) + "\n"
+
+
+def run_scenarios(cases, directory):
+    """Runs one scenario per case in a single SmartPy.sh test
+
+    Returns:
+        (passed, output of the CLI)
+    """
+
+    script = os.path.join(directory, "fuzz.py")
+    with open(script, "w") as scriptFile:
+        scriptFile.write(SCRIPT_HEADER)
+        for index, case in enumerate(cases):
+            scriptFile.write("\n" + scenario("fuzz_%03d" % index, case))
+    try:
+        return True, smartpy_cli.run("test", script, os.path.join(directory, "output"))
+    except smartpy_cli.CompilationFailed as error:
+        return False, str(error)
+
+
+def check_batch(cases):
+    """Cases of a batch on which the interpreter disagrees with the reference
+
+    Returns:
+        list of dict case and log
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        passed, log = run_scenarios(cases, directory)
+    if passed:
+        return []
+    if len(cases) == 1:
+        return [{"case": cases[0], "log": log}]
+    return [mismatch for case in cases for mismatch in check_batch([case])]
+
+
+def lower(value, lowest):
+    """Values below value, from lowest up to value - 1 by halving the distance
+    """
+
+    distance = value - lowest
+    while distance > 0:
+        yield value - distance
+        distance //= 2
+
+
+def shrink(case, failing, budget):
+    """Smallest case found by lowering the fields while failing(case) holds
+
+    Every field is tried at its lowest value and then ever closer to its value, until no
+    field can be lowered or budget calls of failing were made.
+
+    Returns:
+        (shrunk case, calls made)
+    """
+
+    calls, improved = 0, True
+    while improved and calls < budget:
+        improved = False
+        for field, lowest in FIELDS[case["kind"]]:
+            for candidate in lower(case[field], lowest):
+                if calls >= budget:
+                    break
+                trial = dict(case)
+                trial[field] = candidate
+                calls += 1
+                if failing(trial):
+                    case, improved = trial, True
+                    break
+    return case, calls
+
+
+def fuzz(count, seed = 0, kinds = None, sample = 0, batch = 8, workers = None, shrinkRuns = 40):
+    """Checks count random cases against the reference and sample of them in the interpreter
+
+    Args:
+        kinds: kinds of swaps, all of KINDS by default
+        sample: cases run through the SmartPy interpreter
+        batch: scenarios per SmartPy.sh test
+        workers: processes of the pools, all cores when None, in process when 1
+        shrinkRuns: interpreter runs allowed to shrink each interpreter mismatch
+    Returns:
+        dict cases, seconds, sampled and mismatches, each with its source, count, case and shrunk case
+    """
+
+    kinds = kinds or KINDS
+    chunks = [(index, min(CHUNK, count - index * CHUNK)) for index in range((count + CHUNK - 1) // CHUNK)]
+    samples = [sample * (index + 1) // len(chunks) - sample * index // len(chunks) for index in range(len(chunks))] if chunks else []
+    arguments = ([seed] * len(chunks), [index for index, _ in chunks], [size for _, size in chunks], [kinds] * len(chunks), samples)
+
+    start = time.time()
+    if workers == 1:
+        results = list(map(check_chunk, *arguments))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(check_chunk, *arguments))
+    seconds = time.time() - start
+
+    # The first local mismatch of every kind and path is shrunk, the others counted
+    mismatches, groups = [], {}
+    for mismatch in [mismatch for found, _ in results for mismatch in found]:
+        group = (mismatch["case"]["kind"], mismatch["path"])
+        if group in groups:
+            groups[group]["count"] += 1
+            continue
+        shrunk, _ = shrink(mismatch["case"], lambda case: local_mismatch(case) is not None, LOCAL_SHRINK_CALLS)
+        groups[group] = dict(mismatch, source = "local", count = 1, shrunk = shrunk, shrunkOutcome = local_mismatch(shrunk))
+        mismatches.append(groups[group])
+
+    sampled = [case for _, cases in results for case in cases]
+    batches = [sampled[index:index + batch] for index in range(0, len(sampled), batch)]
+    if workers == 1:
+        found = list(map(check_batch, batches))
+    elif batches:
+        with ProcessPoolExecutor(workers) as executor:
+            found = list(executor.map(check_batch, batches))
+    else:
+        found = []
+    for mismatch in [mismatch for mismatchList in found for mismatch in mismatchList]:
+        shrunk, _ = shrink(mismatch["case"], lambda case: bool(check_batch([case])), shrinkRuns)
+        mismatches.append(dict(mismatch, source = "interpreter", count = 1, reference = list(interpreter_outcome(mismatch["case"])), shrunk = shrunk, shrunkReference = list(interpreter_outcome(shrunk))))
+
+    return {"cases": count, "seconds": seconds, "sampled": len(sampled), "mismatches": mismatches}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Fuzzes the pool math against the pricing paths and the SmartPy interpreter")
+    parser.add_argument("--cases", type = int, default = 100000, help = "cases checked against the reference")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--kinds", default = ",".join(KINDS), help = "comma separated kinds among %s" % ", ".join(KINDS))
+    parser.add_argument("--sample", type = int, default = 0, help = "cases also run through the SmartPy interpreter")
+    parser.add_argument("--batch", type = int, default = 8, help = "scenarios per SmartPy.sh test")
+    parser.add_argument("--workers", type = int, default = None, help = "processes used, all cores by default")
+    parser.add_argument("--shrink-runs", type = int, default = 40, help = "interpreter runs to shrink each interpreter mismatch")
+    parser.add_argument("--output", help = "writes the report as JSON")
+    arguments = parser.parse_args()
+
+    kinds = arguments.kinds.split(",")
+    unknown = [kind for kind in kinds if kind not in FIELDS]
+    if unknown:
+        parser.error("unknown kinds %s" % ", ".join(unknown))
+
+    try:
+        report = fuzz(arguments.cases, arguments.seed, kinds, arguments.sample, arguments.batch, arguments.workers, arguments.shrink_runs)
+    except FileNotFoundError as error:
+        raise SystemExit(str(error))
+    if arguments.output:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(report, outputFile, indent = 2)
+
+    print("%d cases in %.1fs, %d through the interpreter, seed %d" % (report["cases"], report["seconds"], report["sampled"], arguments.seed))
+    for mismatch in report["mismatches"]:
+        print("MISMATCH %-11s %-5s x%-6d %s" % (mismatch["source"], mismatch.get("path", ""), mismatch["count"], json.dumps(mismatch["shrunk"], sort_keys = True)))
+    if report["mismatches"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Gas and storage model of the benchmarked entrypoints, for local fee estimates
+
+Usage:
+    python -m tools.gas_model fit <baseline.json> [--output benchmarks/gas_model.json]
+    python -m tools.gas_model estimate <gas_model.json> <case> [--reserve N] [--amount N] [--lots N] [--checkpoints N]
+
+fit reads the gas section of a tools.bench baseline and fits, for every case of
+benchmarks/cases.py, a linear model of the gas of the benchmarked contract (its callbacks
+included), of the gas of the whole operation and of the paid storage on the features of
+the case:
+
+    bits: bit length of the reserve, the cost of the big integer arithmetic
+    ratio: trade size relative to the reserve
+    lots: InvestMap lots of the caller
+    checkpointBits: bit length of the checkpoint count, the steps of the binary search
+
+The Newton rounds of FlatCurve and TezToCtez are a constant of the contracts, they are
+part of the intercept of the flat_swap and ctez_callback models.
+
+The benchmarks call the contracts with the FA1.2 xPlenty token contract as every token,
+so the gas of the whole operation and the paid storage include the real token transfers,
+their balance updates and checkpoints. xplenty_buy measures buy together with the
+getBalance call of PLENTY, buy_callback and the xPlenty mint.
+
+Predictions are made conservative by adding the largest underestimate of the fit and a
+SAFETY share, so the gas and storage limits built from them do not fail on the
+benchmarked points. GasModel.estimate only evaluates precomputed coefficients and runs in
+microseconds.
+"""
+
+import argparse
+import json
+import math
+import os
+
+from tools.bench import load_cases
+
+# Share added to every prediction
+SAFETY = 0.05
+
+# Storage burn, in mutez per byte
+BURN_PER_BYTE = 250
+
+# Minimal fees of the octez baker, in mutez
+MINIMAL_FEE = 100
+FEE_PER_GAS = 0.1
+FEE_PER_BYTE = 1
+
+# Features of the cases, the others are constant in the benchmark grid
+FEATURES = {
+    "amm_swap": ["bits", "ratio"],
+    "flat_swap": ["bits", "ratio"],
+    "ctez_callback": ["bits", "ratio"],
+    "staking_stake": ["lots"],
+    "staking_unstake": ["lots"],
+    "staking_get_reward": ["lots"],
+    "xplenty_buy": ["bits"],
+    "xplenty_transfer": ["checkpointBits"],
+    "xplenty_get_prior_balance": ["checkpointBits"],
+}
+
+# Predicted quantities, keys of the bench results
+TARGETS = ["gas", "totalGas", "paidStorage"]
+
+
+def features(names, reserve = 0, amount = 0, lots = 0, checkpoints = 0):
+    """Feature vector of an input, with the intercept first
+    """
+
+    values = {
+        "bits": reserve.bit_length(),
+        "ratio": amount / reserve if reserve else 0.0,
+        "lots": lots,
+        "checkpointBits": checkpoints.bit_length(),
+    }
+    return [1.0] + [float(values[name]) for name in names]
+
+
+def point_inputs(point):
+    """Inputs of a benchmark point
+    """
+
+    inputs = {}
+    if "pool" in point:
+        inputs["reserve"] = point["pool"]
+        if "trade" in point:
+            inputs["amount"] = point["pool"] // point["trade"]
+    if "lots" in point:
+        inputs["lots"] = point["lots"]
+    if "checkpoints" in point:
+        inputs["checkpoints"] = point["checkpoints"]
+    return inputs
+
+
+def least_squares(rows, values):
+    """Coefficients minimizing the squared error of rows . coefficients - values
+
+    Solved on the normal equations by Gaussian elimination, the systems have a few
+    unknowns only. Columns without variation get a zero coefficient.
+    """
+
+    size = len(rows[0])
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in range(size)] + [sum(row[i] * value for row, value in zip(rows, values))] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key = lambda index: abs(matrix[index][column]))
+        if abs(matrix[pivot][column]) < 1e-9:
+            continue
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        for index in range(size):
+            if index != column:
+                factor = matrix[index][column] / matrix[column][column]
+                matrix[index] = [a - factor * b for a, b in zip(matrix[index], matrix[column])]
+    return [matrix[i][size] / matrix[i][i] if abs(matrix[i][i]) >= 1e-9 else 0.0 for i in range(size)]
+
+
+def fit(baseline, cases = None):
+    """Models of every benchmarked case
+
+    Args:
+        baseline: tools.bench results, with their gas section
+    Returns:
+        dict case -> dict features, and for every target its coefficients and margin
+    """
+
+    cases = cases or load_cases()
+    models = {}
+    for case in cases.CASES:
+        measured = baseline.get("gas", {}).get(case["name"])
+        if not measured:
+            continue
+        names = FEATURES[case["name"]]
+        rows, results = [], []
+        for point in cases.points(case):
+            name = cases.point_name(case["build"], point)
+            if name in measured:
+                rows.append(features(names, **point_inputs(point)))
+                results.append(measured[name])
+
+        model = {"features": names}
+        for target in TARGETS:
+            values = [float(result.get(target, 0)) for result in results]
+            coefficients = least_squares(rows, values)
+            underestimates = [value - sum(c * x for c, x in zip(coefficients, row)) for row, value in zip(rows, values)]
+            model[target] = {"coefficients": coefficients, "margin": max([0.0] + underestimates)}
+        models[case["name"]] = model
+    return models
+
+
+class Estimate:
+    """Conservative gas and storage of a call
+
+    Attributes:
+        gas: gas of the benchmarked contract, its callbacks included
+        gasLimit: gas of the whole operation, the gas limit to set
+        storageLimit: paid storage bytes of the whole operation
+        burn: storage burn in mutez
+    """
+
+    __slots__ = ("gas", "gasLimit", "storageLimit", "burn")
+
+    def __init__(self, gas, gasLimit, storageLimit):
+
+        self.gas = gas
+        self.gasLimit = gasLimit
+        self.storageLimit = storageLimit
+        self.burn = storageLimit * BURN_PER_BYTE
+
+    def fee(self, operationBytes):
+        """Minimal baker fee in mutez, for an operation of this binary size
+        """
+
+        return int(math.ceil(MINIMAL_FEE + FEE_PER_GAS * self.gasLimit + FEE_PER_BYTE * operationBytes))
+
+
+class GasModel:
+    """Fitted models, see fit
+
+    Args:
+        models: dict case -> model
+    """
+
+    def __init__(self, models):
+
+        self.models = {}
+        for name, model in models.items():
+            # (features, [(coefficients, margin) of every target])
+            self.models[name] = (model["features"], [(model[target]["coefficients"], model[target]["margin"]) for target in TARGETS])
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path) as modelFile:
+            return cls(json.load(modelFile))
+
+    def cases(self):
+
+        return sorted(self.models)
+
+    def estimate(self, case, reserve = 0, amount = 0, lots = 0, checkpoints = 0):
+        """Conservative estimate of a call
+
+        Args:
+            case: benchmark case, amm_swap, flat_swap, ctez_callback, staking_stake,
+                staking_unstake, staking_get_reward, xplenty_buy, xplenty_transfer
+                or xplenty_get_prior_balance
+            reserve: reserve of the token sold, for the swaps and xPlenty buy
+            amount: amount sold
+            lots: InvestMap lots of the caller, for Staking
+            checkpoints: xPlenty checkpoints of the caller
+        Returns:
+            Estimate
+        Raises:
+            KeyError: when the case was not fitted
+        """
+
+        names, targets = self.models[case]
+        row = features(names, reserve, amount, lots, checkpoints)
+        gas, totalGas, paidStorage = [
+            max(0, int(math.ceil((1 + SAFETY) * sum(c * x for c, x in zip(coefficients, row)) + margin)))
+            for coefficients, margin in targets
+        ]
+        return Estimate(gas, max(gas, totalGas), paidStorage)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Fits and evaluates the gas model of the benchmarked entrypoints")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    fitParser = commands.add_parser("fit", help = "fits the model on a tools.bench baseline")
+    fitParser.add_argument("baseline")
+    fitParser.add_argument("--output", default = os.path.join("benchmarks", "gas_model.json"))
+
+    estimateParser = commands.add_parser("estimate", help = "estimates the gas and storage of a call")
+    estimateParser.add_argument("model")
+    estimateParser.add_argument("case")
+    for option in ("reserve", "amount", "lots", "checkpoints"):
+        estimateParser.add_argument("--" + option, type = int, default = 0)
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "fit":
+        with open(arguments.baseline) as baselineFile:
+            models = fit(json.load(baselineFile))
+        with open(arguments.output, "w") as outputFile:
+            json.dump(models, outputFile, indent = 2, sort_keys = True)
+            outputFile.write("\n")
+        print("%d cases fitted" % len(models))
+    else:
+        estimate = GasModel.load(arguments.model).estimate(arguments.case, arguments.reserve, arguments.amount, arguments.lots, arguments.checkpoints)
+        print(json.dumps({"gas": estimate.gas, "gasLimit": estimate.gasLimit, "storageLimit": estimate.storageLimit, "burn": estimate.burn}))
+
+
+if __name__ == "__main__":
+    main()
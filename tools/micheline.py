@@ -0,0 +1,113 @@
+"""Binary encoding of Micheline expressions
+
+Contracts compiled by SmartPy are written as Micheline JSON (*_contract.json and
+*_storage.json). The node stores and charges scripts in the binary encoding produced here,
+so the size of a contract is the length of encode(code) and not of the JSON or .tz text.
+"""
+
+import json
+
+# Michelson primitives in the order of their binary tags
+PRIMITIVES = [
+    "parameter", "storage", "code", "False", "Elt", "Left", "None", "Pair", "Right", "Some", "True", "Unit",
+    "PACK", "UNPACK", "BLAKE2B", "SHA256", "SHA512", "ABS", "ADD", "AMOUNT", "AND", "BALANCE", "CAR", "CDR",
+    "CHECK_SIGNATURE", "COMPARE", "CONCAT", "CONS", "CREATE_ACCOUNT", "CREATE_CONTRACT", "IMPLICIT_ACCOUNT",
+    "DIP", "DROP", "DUP", "EDIV", "EMPTY_MAP", "EMPTY_SET", "EQ", "EXEC", "FAILWITH", "GE", "GET", "GT",
+    "HASH_KEY", "IF", "IF_CONS", "IF_LEFT", "IF_NONE", "INT", "LAMBDA", "LE", "LEFT", "LOOP", "LSL", "LSR",
+    "LT", "MAP", "MEM", "MUL", "NEG", "NEQ", "NIL", "NONE", "NOT", "NOW", "OR", "PAIR", "PUSH", "RIGHT",
+    "SIZE", "SOME", "SOURCE", "SENDER", "SELF", "STEPS_TO_QUOTA", "SUB", "SWAP", "TRANSFER_TOKENS",
+    "SET_DELEGATE", "UNIT", "UPDATE", "XOR", "ITER", "LOOP_LEFT", "ADDRESS", "CONTRACT", "ISNAT", "CAST",
+    "RENAME", "bool", "contract", "int", "key", "key_hash", "lambda", "list", "map", "big_map", "nat",
+    "option", "or", "pair", "set", "signature", "string", "bytes", "mutez", "timestamp", "unit", "operation",
+    "address", "SLICE", "DIG", "DUG", "EMPTY_BIG_MAP", "APPLY", "chain_id", "CHAIN_ID", "LEVEL",
+    "SELF_ADDRESS", "never", "NEVER", "UNPAIR", "VOTING_POWER", "TOTAL_VOTING_POWER", "KECCAK", "SHA3",
+    "PAIRING_CHECK", "bls12_381_g1", "bls12_381_g2", "bls12_381_fr", "sapling_state",
+    "sapling_transaction_deprecated", "SAPLING_EMPTY_STATE", "SAPLING_VERIFY_UPDATE", "ticket",
+    "TICKET_DEPRECATED", "READ_TICKET", "SPLIT_TICKET", "JOIN_TICKETS", "GET_AND_UPDATE", "chest",
+    "chest_key", "OPEN_CHEST", "VIEW", "view", "constant", "SUB_MUTEZ", "tx_rollup_l2_address",
+    "MIN_BLOCK_TIME", "sapling_transaction", "EMIT", "Lambda_rec", "LAMBDA_REC", "TICKET", "BYTES", "NAT",
+]
+
+PRIMITIVE_TAGS = {name: tag for tag, name in enumerate(PRIMITIVES)}
+
+# Node tags of the binary encoding
+INT, STRING, SEQUENCE, PRIM_0, PRIM_0_ANNOTS, PRIM_1, PRIM_1_ANNOTS, PRIM_2, PRIM_2_ANNOTS, PRIM_N, BYTES = range(11)
+
+
+def encode_zarith(value):
+    """Signed variable length integer, 6 bits in the first byte and 7 in the next ones
+    """
+
+    sign = 0x40 if value < 0 else 0
+    value = abs(value)
+    out = bytearray([sign | (value & 0x3F)])
+    value >>= 6
+    while value:
+        out[-1] |= 0x80
+        out.append(value & 0x7F)
+        value >>= 7
+    return bytes(out)
+
+
+def sized(data):
+
+    return len(data).to_bytes(4, "big") + data
+
+
+def encode(node):
+    """Binary encoding of a Micheline JSON expression
+
+    Args:
+        node: expression as loaded from the JSON output of the compiler
+    Returns:
+        bytes
+    """
+
+    if isinstance(node, list):
+        return bytes([SEQUENCE]) + sized(b"".join(encode(item) for item in node))
+    if "int" in node:
+        return bytes([INT]) + encode_zarith(int(node["int"]))
+    if "string" in node:
+        return bytes([STRING]) + sized(node["string"].encode())
+    if "bytes" in node:
+        return bytes([BYTES]) + sized(bytes.fromhex(node["bytes"]))
+
+    try:
+        tag = PRIMITIVE_TAGS[node["prim"]]
+    except KeyError:
+        raise ValueError("unknown Michelson primitive %r" % node["prim"])
+    args = node.get("args", [])
+    annots = " ".join(node.get("annots", [])).encode()
+
+    if len(args) > 2:
+        return bytes([PRIM_N, tag]) + sized(b"".join(encode(arg) for arg in args)) + sized(annots)
+    head = bytes([PRIM_0 + 2 * len(args) + (1 if annots else 0), tag])
+    body = b"".join(encode(arg) for arg in args)
+    return head + body + (sized(annots) if annots else b"")
+
+
+def encoded_size(node):
+    """Bytes of the binary encoding of an expression
+    """
+
+    return len(encode(node))
+
+
+def load(path):
+    """Micheline expression of a JSON file
+    """
+
+    with open(path) as jsonFile:
+        return json.load(jsonFile)
+
+
+def instruction_count(node):
+    """Michelson instructions of a contract or lambda, counting every primitive written in upper case
+    """
+
+    if isinstance(node, list):
+        return sum(instruction_count(item) for item in node)
+    if "prim" not in node:
+        return 0
+    own = 1 if node["prim"].isupper() else 0
+    return own + sum(instruction_count(arg) for arg in node.get("args", []))
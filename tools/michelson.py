@@ -0,0 +1,1530 @@
+"""Offline dry-run engine of compiled Michelson contracts
+
+Usage:
+    python -m tools.michelson <contract.json> <storage.json> [--entrypoint NAME] [--parameter MICHELSON]
+                              [--amount MUTEZ] [--sender ADDRESS] [--level N] [--now SECONDS] [--balance MUTEZ]
+
+Contracts are loaded from the Micheline JSON written by SmartPy.sh compile
+(*_contract.json and *_storage.json) and compiled once into Python closures, so a call
+only runs the closures of the instructions it executes. The engine interprets the
+Michelson subset of the contracts of this repository: stack, pair, option, or, list, set,
+map and big_map instructions, arithmetic, lambdas, on-chain views, contracts and
+transfers. CREATE_CONTRACT, tickets, sapling and UNPACK are not supported.
+
+Internal operations are applied depth first as on chain, a failure anywhere reverts the
+whole call, storages, balances and big_maps included. Big maps live in the engine and
+are only copied into the storage of a contract as the keys written during the call.
+
+With strict = False (the default of the command line) transfers to contracts the engine
+does not know are recorded without being executed, so a single pool can be dry-run
+without its tokens.
+
+Gas is an estimate: every instruction is charged a constant of the protocol cost model,
+big_map and contract accesses a flat read cost, and every contract execution a base cost
+growing with the binary size of its code. It ranks entrypoints and inputs, fee
+estimates should use tools.bench measurements.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import sys
+
+from tools.micheline import encode, encoded_size, load
+
+# Gas costs in milligas
+DEFAULT_COST = 10
+COSTS = {
+    "ADD": 35, "SUB": 35, "SUB_MUTEZ": 35, "MUL": 60, "EDIV": 120, "ABS": 20, "NEG": 20, "ISNAT": 15,
+    "LSL": 30, "LSR": 30, "AND": 20, "OR": 20, "XOR": 20, "NOT": 15, "COMPARE": 35,
+    "CONCAT": 40, "SLICE": 30, "PACK": 300, "SHA256": 600, "SHA512": 800, "BLAKE2B": 450,
+    "GET": 80, "MEM": 80, "UPDATE": 120, "GET_AND_UPDATE": 150,
+    "ITER": 20, "MAP": 20, "LOOP": 15, "LOOP_LEFT": 15, "EXEC": 20, "APPLY": 50, "LAMBDA": 10,
+    "CONTRACT": 30000, "TRANSFER_TOKENS": 60, "VIEW": 1500, "IMPLICIT_ACCOUNT": 20, "SET_DELEGATE": 20,
+    "EMIT": 50, "FAILWITH": 10, "CHAIN_ID": 15, "SELF": 20, "SELF_ADDRESS": 15,
+}
+BIG_MAP_READ = 80000
+BIG_MAP_WRITE = 20000
+EXECUTION_COST = 100000
+CODE_BYTE_COST = 20
+
+# Hard gas limit of an operation, in gas
+GAS_LIMIT = 1040000
+
+MUTEZ_MAX = 2 ** 63 - 1
+
+# bootstrap1 of the octez-client mockup
+DEFAULT_SENDER = "tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx"
+
+ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+# Base58 prefixes and binary tags of the addresses
+ADDRESS_PREFIXES = {
+    "tz1": (b"\x06\xa1\x9f", b"\x00\x00"),
+    "tz2": (b"\x06\xa1\xa1", b"\x00\x01"),
+    "tz3": (b"\x06\xa1\xa4", b"\x00\x02"),
+    "KT1": (b"\x02\x5a\x79", b"\x01"),
+}
+
+INT_TYPES = ("int", "nat", "mutez")
+
+
+class MichelsonError(Exception):
+    pass
+
+
+class ScriptFailed(MichelsonError):
+    """FAILWITH of a contract
+
+    Attributes:
+        value: failed value, as Micheline
+        address: contract that failed
+    """
+
+    def __init__(self, value, address = None):
+
+        MichelsonError.__init__(self, "%s failed with %s" % (address, json.dumps(value)))
+        self.value = value
+        self.address = address
+
+
+class GasExhausted(MichelsonError):
+    pass
+
+
+class Address(str):
+    """Address value, ordered as the binary encoding: implicit accounts first
+    """
+
+    __slots__ = ()
+
+    def order(self):
+
+        return (0 if self[0] == "t" else 1, str(self))
+
+
+class Some:
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+
+        self.value = value
+
+    def __eq__(self, other):
+
+        return type(other) is Some and self.value == other.value
+
+    def __hash__(self):
+
+        return hash(("Some", self.value))
+
+    def __repr__(self):
+
+        return "Some(%r)" % (self.value,)
+
+
+class Left:
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+
+        self.value = value
+
+    def __eq__(self, other):
+
+        return type(other) is Left and self.value == other.value
+
+    def __hash__(self):
+
+        return hash(("Left", self.value))
+
+    def __repr__(self):
+
+        return "Left(%r)" % (self.value,)
+
+
+class Right:
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+
+        self.value = value
+
+    def __eq__(self, other):
+
+        return type(other) is Right and self.value == other.value
+
+    def __hash__(self):
+
+        return hash(("Right", self.value))
+
+    def __repr__(self):
+
+        return "Right(%r)" % (self.value,)
+
+
+class Contract:
+    """Typed contract value, an address and an entrypoint
+    """
+
+    __slots__ = ("address", "entrypoint")
+
+    def __init__(self, address, entrypoint = "default"):
+
+        self.address = address
+        self.entrypoint = entrypoint
+
+    def __eq__(self, other):
+
+        return type(other) is Contract and (self.address, self.entrypoint) == (other.address, other.entrypoint)
+
+    def __hash__(self):
+
+        return hash((self.address, self.entrypoint))
+
+    def __str__(self):
+
+        return self.address if self.entrypoint == "default" else "%s%%%s" % (self.address, self.entrypoint)
+
+
+class Lambda:
+    """Lambda value, its compiled code, the arguments of APPLY and its Micheline
+    """
+
+    __slots__ = ("run", "captured", "node", "recursive")
+
+    def __init__(self, run, node, captured = (), recursive = False):
+
+        self.run = run
+        self.node = node
+        self.captured = captured
+        self.recursive = recursive
+
+
+class Transfer:
+
+    __slots__ = ("sender", "destination", "amount", "parameter")
+
+    def __init__(self, sender, destination, amount, parameter):
+
+        self.sender = sender
+        self.destination = destination
+        self.amount = amount
+        self.parameter = parameter
+
+
+class Delegation:
+
+    __slots__ = ("sender", "delegate")
+
+    def __init__(self, sender, delegate):
+
+        self.sender = sender
+        self.delegate = delegate
+
+
+class Event:
+
+    __slots__ = ("sender", "tag", "payload")
+
+    def __init__(self, sender, tag, payload):
+
+        self.sender = sender
+        self.tag = tag
+        self.payload = payload
+
+
+# Written value of a key removed from a big_map, and result of reading a missing key
+REMOVED = object()
+
+# Journal entry of a big_map created by a call
+CREATED = object()
+
+
+class BigMap:
+    """big_map value: the keys written since the last commit over the content in the engine
+
+    Args:
+        id: big_map of the engine, None for a big_map created by the running call
+        changes: dict key -> value, REMOVED for removed keys
+        store: content of the big_map in the engine
+    """
+
+    __slots__ = ("id", "changes", "store")
+
+    def __init__(self, id, changes, store):
+
+        self.id = id
+        self.changes = changes
+        self.store = store
+
+    def get(self, key, default = REMOVED):
+        """Value of a key, default when the key is missing
+        """
+
+        value = self.changes.get(key, self)
+        if value is self:
+            value = self.store.get(key, REMOVED)
+        return default if value is REMOVED else value
+
+    def updated(self, key, value):
+        """Copy with a key written, value being REMOVED to remove it
+        """
+
+        changes = dict(self.changes)
+        changes[key] = value
+        return BigMap(self.id, changes, self.store)
+
+
+# Values
+
+def sort_key(value):
+    """Python key ordering values as COMPARE does
+    """
+
+    kind = type(value)
+    if kind is int or kind is str or kind is bytes or kind is bool:
+        return value
+    if kind is Address:
+        return value.order()
+    if kind is tuple:
+        return tuple(sort_key(item) for item in value)
+    if value is None:
+        return (0,)
+    if kind is Some:
+        return (1, sort_key(value.value))
+    if kind is Left:
+        return (0, sort_key(value.value))
+    if kind is Right:
+        return (1, sort_key(value.value))
+    raise MichelsonError("values of %s are not comparable" % kind.__name__)
+
+
+def compare(first, second):
+
+    if type(first) is int and type(second) is int:
+        return (first > second) - (first < second)
+    if first == second:
+        return 0
+    return -1 if sort_key(first) < sort_key(second) else 1
+
+
+def sorted_items(mapping):
+
+    return sorted(mapping.items(), key = lambda item: sort_key(item[0]))
+
+
+def b58encode_check(data):
+
+    data = data + hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4]
+    number = int.from_bytes(data, "big")
+    out = ""
+    while number:
+        number, digit = divmod(number, 58)
+        out = ALPHABET[digit] + out
+    return "1" * (len(data) - len(data.lstrip(b"\x00"))) + out
+
+
+def b58decode_check(text):
+
+    number = 0
+    for character in text:
+        number = number * 58 + ALPHABET.index(character)
+    data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    data = b"\x00" * (len(text) - len(text.lstrip("1"))) + data
+    if hashlib.sha256(hashlib.sha256(data[:-4]).digest()).digest()[:4] != data[-4:]:
+        raise MichelsonError("invalid checksum of %s" % text)
+    return data[:-4]
+
+
+def address_bytes(address):
+    """Binary encoding of an address, with its entrypoint
+    """
+
+    address, _, entrypoint = address.partition("%")
+    prefix, tag = ADDRESS_PREFIXES[address[:3]]
+    digest = b58decode_check(address)[len(prefix):]
+    body = tag + digest if tag != b"\x01" else tag + digest + b"\x00"
+    return body + entrypoint.encode()
+
+
+def address_of_bytes(data):
+
+    if data[0] == 0:
+        prefix = [prefix for prefix, tag in ADDRESS_PREFIXES.values() if tag == data[:2]][0]
+        address, rest = b58encode_check(prefix + data[2:22]), data[22:]
+    else:
+        address, rest = b58encode_check(ADDRESS_PREFIXES["KT1"][0] + data[1:21]), data[22:]
+    return Address(address + ("%" + rest.decode() if rest else ""))
+
+
+def parse_timestamp(node):
+
+    if "int" in node:
+        return int(node["int"])
+    text = node["string"].replace("Z", "+00:00")
+    return int(datetime.datetime.fromisoformat(text).timestamp())
+
+
+# Types
+
+def comb(node):
+    """Type with its pairs of more than two fields written as right combs, every node
+    telling whether it holds a big_map
+    """
+
+    if isinstance(node, list) or "prim" not in node:
+        return node
+    args = [comb(arg) for arg in node.get("args", [])]
+    if node["prim"] == "pair" and len(args) > 2:
+        args = [args[0], comb({"prim": "pair", "args": args[1:]})]
+    result = {"prim": node["prim"], "args": args}
+    if "annots" in node:
+        result["annots"] = node["annots"]
+    # Storages are only walked for their big_maps when they have some
+    result["bigMap"] = node["prim"] == "big_map" or any(arg.get("bigMap", False) for arg in args if isinstance(arg, dict))
+    return result
+
+
+def same_type(first, second):
+    """Equality of two types, annotations aside
+    """
+
+    if first["prim"] != second["prim"]:
+        return False
+    firstArgs, secondArgs = first.get("args", []), second.get("args", [])
+    return len(firstArgs) == len(secondArgs) and all(same_type(a, b) for a, b in zip(firstArgs, secondArgs))
+
+
+def field_annotation(node):
+
+    for annot in node.get("annots", []):
+        if annot.startswith("%"):
+            return annot[1:]
+    return None
+
+
+def entrypoints(parameterType):
+    """Entrypoints of a parameter type
+
+    Returns:
+        dict name -> (path of True for Left and False for Right, type)
+    """
+
+    found = {}
+
+    def walk(node, path):
+        name = field_annotation(node)
+        if name is not None:
+            found[name] = (path, node)
+        if node["prim"] == "or":
+            walk(node["args"][0], path + (True,))
+            walk(node["args"][1], path + (False,))
+
+    walk(parameterType, ())
+    if "default" not in found:
+        found["default"] = ((), parameterType)
+    return found
+
+
+def has_big_map(typeNode):
+
+    return typeNode["bigMap"]
+
+
+def decode(typeNode, node, engine = None):
+    """Value of a Micheline expression of a type
+
+    Args:
+        typeNode: type, with combs (see comb)
+        node: expression
+        engine: Engine of the big_map ids
+    """
+
+    prim = typeNode["prim"]
+    if prim in INT_TYPES:
+        return int(node["int"])
+    if prim == "string" or prim == "key" or prim == "signature" or prim == "chain_id":
+        return node["string"] if "string" in node else node["bytes"]
+    if prim == "bytes":
+        return bytes.fromhex(node["bytes"])
+    if prim == "bool":
+        return node["prim"] == "True"
+    if prim == "unit":
+        return ()
+    if prim == "timestamp":
+        return parse_timestamp(node)
+    if prim == "address" or prim == "key_hash":
+        return Address(node["string"]) if "string" in node else address_of_bytes(bytes.fromhex(node["bytes"]))
+    if prim == "contract":
+        address = Address(node["string"]) if "string" in node else address_of_bytes(bytes.fromhex(node["bytes"]))
+        address, _, entrypoint = address.partition("%")
+        return Contract(Address(address), entrypoint or "default")
+    if prim == "pair":
+        items = node if isinstance(node, list) else node["args"]
+        if len(items) > 2:
+            items = [items[0], {"prim": "Pair", "args": items[1:]}]
+        return (decode(typeNode["args"][0], items[0], engine), decode(typeNode["args"][1], items[1], engine))
+    if prim == "option":
+        return None if node["prim"] == "None" else Some(decode(typeNode["args"][0], node["args"][0], engine))
+    if prim == "or":
+        if node["prim"] == "Left":
+            return Left(decode(typeNode["args"][0], node["args"][0], engine))
+        return Right(decode(typeNode["args"][1], node["args"][0], engine))
+    if prim == "list":
+        return [decode(typeNode["args"][0], item, engine) for item in node]
+    if prim == "set":
+        return frozenset(decode(typeNode["args"][0], item, engine) for item in node)
+    if prim == "map" or prim == "big_map":
+        keyType, valueType = typeNode["args"]
+        if isinstance(node, dict) and "int" in node:
+            if prim == "map" or engine is None:
+                raise MichelsonError("big_map id %s without an engine" % node["int"])
+            return engine.big_map(int(node["int"]))
+        content = {decode(keyType, item["args"][0], engine): decode(valueType, item["args"][1], engine) for item in node}
+        return content if prim == "map" else BigMap(None, content, {})
+    if prim == "lambda":
+        return Lambda(compile_sequence(node), node)
+    raise MichelsonError("values of type %s are not supported" % prim)
+
+
+def to_micheline(value, optimized = False):
+    """Micheline expression of a value
+
+    Args:
+        optimized: addresses as bytes, as PACK writes them
+    """
+
+    kind = type(value)
+    if kind is bool:
+        return {"prim": "True" if value else "False"}
+    if kind is int:
+        return {"int": str(value)}
+    if kind is Address:
+        return {"bytes": address_bytes(value).hex()} if optimized else {"string": str(value)}
+    if kind is str:
+        return {"string": value}
+    if kind is bytes:
+        return {"bytes": value.hex()}
+    if kind is tuple:
+        if not value:
+            return {"prim": "Unit"}
+        return {"prim": "Pair", "args": [to_micheline(value[0], optimized), to_micheline(value[1], optimized)]}
+    if value is None:
+        return {"prim": "None"}
+    if kind is Some:
+        return {"prim": "Some", "args": [to_micheline(value.value, optimized)]}
+    if kind is Left:
+        return {"prim": "Left", "args": [to_micheline(value.value, optimized)]}
+    if kind is Right:
+        return {"prim": "Right", "args": [to_micheline(value.value, optimized)]}
+    if kind is list:
+        return [to_micheline(item, optimized) for item in value]
+    if kind is frozenset:
+        return [to_micheline(item, optimized) for item in sorted(value, key = sort_key)]
+    if kind is dict:
+        return [{"prim": "Elt", "args": [to_micheline(key, optimized), to_micheline(item, optimized)]} for key, item in sorted_items(value)]
+    if kind is BigMap:
+        if value.id is None or value.changes:
+            raise MichelsonError("uncommitted big_map")
+        return {"int": str(value.id)}
+    if kind is Contract:
+        return to_micheline(Address(str(value)), optimized)
+    if kind is Lambda:
+        return value.node
+    raise MichelsonError("%s values have no Micheline expression" % kind.__name__)
+
+
+def pack(value):
+
+    return b"\x05" + encode(to_micheline(value, optimized = True))
+
+
+# Compilation of the instructions into closures on a stack, top of the stack last
+
+def integer(node):
+
+    return int(node["int"])
+
+
+def count_argument(node, default):
+
+    args = node.get("args", [])
+    return integer(args[0]) if args and "int" in args[0] else default
+
+
+def annotation(node, default):
+
+    name = field_annotation(node)
+    return name if name is not None else default
+
+
+def comb_get(index):
+
+    def run(stack, context):
+        value = stack[-1]
+        for _ in range(index // 2):
+            value = value[1]
+        stack[-1] = value[0] if index % 2 else value
+    return run
+
+
+def comb_update(index):
+
+    def replace(value, depth, item):
+        if depth == 0:
+            return (item, value[1]) if index % 2 else item
+        return (value[0], replace(value[1], depth - 1, item))
+
+    def run(stack, context):
+        item = stack.pop()
+        stack[-1] = replace(stack[-1], index // 2, item)
+    return run
+
+
+def mutez(value):
+
+    if value > MUTEZ_MAX:
+        raise MichelsonError("mutez overflow")
+    return value
+
+
+def compile_instruction(node):
+    """Closure running an instruction on a stack
+    """
+
+    if isinstance(node, list):
+        return compile_sequence(node)
+
+    prim = node["prim"]
+    args = node.get("args", [])
+
+    # Stack
+    if prim == "DROP":
+        count = count_argument(node, 1)
+        def run(stack, context):
+            del stack[-count:]
+        return run if count else (lambda stack, context: None)
+    if prim == "DUP":
+        depth = count_argument(node, 1)
+        def run(stack, context):
+            stack.append(stack[-depth])
+        return run
+    if prim == "SWAP":
+        def run(stack, context):
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+        return run
+    if prim == "DIG":
+        depth = integer(args[0])
+        def run(stack, context):
+            stack.append(stack.pop(-depth - 1))
+        return run
+    if prim == "DUG":
+        depth = integer(args[0])
+        def run(stack, context):
+            value = stack.pop()
+            stack.insert(len(stack) - depth, value)
+        return run
+    if prim == "DIP":
+        depth = count_argument(node, 1)
+        body = compile_sequence(args[-1])
+        if depth == 0:
+            return body
+        def run(stack, context):
+            saved = stack[-depth:]
+            del stack[-depth:]
+            body(stack, context)
+            stack.extend(saved)
+        return run
+    if prim == "PUSH":
+        value = decode(comb(args[0]), args[1])
+        def run(stack, context):
+            stack.append(value)
+        return run
+    if prim == "UNIT":
+        return lambda stack, context: stack.append(())
+    if prim in ("CAST", "RENAME"):
+        return lambda stack, context: None
+
+    # Pairs
+    if prim == "PAIR":
+        count = count_argument(node, 2)
+        if count == 2:
+            def run(stack, context):
+                first = stack.pop()
+                stack[-1] = (first, stack[-1])
+            return run
+        # The top of the stack is the first field
+        def run(stack, context):
+            items = stack[-count:]
+            del stack[-count:]
+            result = items[0]
+            for item in items[1:]:
+                result = (item, result)
+            stack.append(result)
+        return run
+    if prim == "UNPAIR":
+        count = count_argument(node, 2)
+        def run(stack, context):
+            value = stack.pop()
+            items = []
+            for _ in range(count - 1):
+                items.append(value[0])
+                value = value[1]
+            items.append(value)
+            stack.extend(reversed(items))
+        return run
+    if prim == "CAR":
+        def run(stack, context):
+            stack[-1] = stack[-1][0]
+        return run
+    if prim == "CDR":
+        def run(stack, context):
+            stack[-1] = stack[-1][1]
+        return run
+
+    # Options, unions and lists
+    if prim == "SOME":
+        def run(stack, context):
+            stack[-1] = Some(stack[-1])
+        return run
+    if prim == "NONE":
+        return lambda stack, context: stack.append(None)
+    if prim == "LEFT":
+        def run(stack, context):
+            stack[-1] = Left(stack[-1])
+        return run
+    if prim == "RIGHT":
+        def run(stack, context):
+            stack[-1] = Right(stack[-1])
+        return run
+    if prim == "NIL":
+        return lambda stack, context: stack.append([])
+    if prim == "CONS":
+        def run(stack, context):
+            head = stack.pop()
+            stack[-1] = [head] + stack[-1]
+        return run
+    if prim == "EMPTY_SET":
+        return lambda stack, context: stack.append(frozenset())
+    if prim == "EMPTY_MAP":
+        return lambda stack, context: stack.append({})
+    if prim == "EMPTY_BIG_MAP":
+        return lambda stack, context: stack.append(BigMap(None, {}, {}))
+
+    # Control flow
+    if prim == "IF":
+        whenTrue, whenFalse = compile_sequence(args[0]), compile_sequence(args[1])
+        def run(stack, context):
+            (whenTrue if stack.pop() else whenFalse)(stack, context)
+        return run
+    if prim == "IF_NONE":
+        whenNone, whenSome = compile_sequence(args[0]), compile_sequence(args[1])
+        def run(stack, context):
+            value = stack.pop()
+            if value is None:
+                whenNone(stack, context)
+            else:
+                stack.append(value.value)
+                whenSome(stack, context)
+        return run
+    if prim == "IF_LEFT":
+        whenLeft, whenRight = compile_sequence(args[0]), compile_sequence(args[1])
+        def run(stack, context):
+            value = stack.pop()
+            stack.append(value.value)
+            (whenLeft if type(value) is Left else whenRight)(stack, context)
+        return run
+    if prim == "IF_CONS":
+        whenCons, whenNil = compile_sequence(args[0]), compile_sequence(args[1])
+        def run(stack, context):
+            value = stack.pop()
+            if value:
+                stack.append(value[1:])
+                stack.append(value[0])
+                whenCons(stack, context)
+            else:
+                whenNil(stack, context)
+        return run
+    if prim == "LOOP":
+        body = compile_sequence(args[0])
+        def run(stack, context):
+            while stack.pop():
+                context.check_gas()
+                body(stack, context)
+        return run
+    if prim == "LOOP_LEFT":
+        body = compile_sequence(args[0])
+        def run(stack, context):
+            value = stack.pop()
+            while type(value) is Left:
+                context.check_gas()
+                stack.append(value.value)
+                body(stack, context)
+                value = stack.pop()
+            stack.append(value.value)
+        return run
+    if prim == "ITER":
+        body = compile_sequence(args[0])
+        def run(stack, context):
+            collection = stack.pop()
+            if type(collection) is dict:
+                items = sorted_items(collection)
+            elif type(collection) is frozenset:
+                items = sorted(collection, key = sort_key)
+            else:
+                items = collection
+            for item in items:
+                context.check_gas()
+                stack.append(item)
+                body(stack, context)
+        return run
+    if prim == "MAP":
+        body = compile_sequence(args[0])
+        def run(stack, context):
+            collection = stack.pop()
+            if collection is None:
+                result = None
+            elif type(collection) is Some:
+                stack.append(collection.value)
+                body(stack, context)
+                result = Some(stack.pop())
+            elif type(collection) is dict:
+                result = {}
+                for key, item in sorted_items(collection):
+                    context.check_gas()
+                    stack.append((key, item))
+                    body(stack, context)
+                    result[key] = stack.pop()
+            else:
+                result = []
+                for item in collection:
+                    context.check_gas()
+                    stack.append(item)
+                    body(stack, context)
+                    result.append(stack.pop())
+            stack.append(result)
+        return run
+    if prim == "FAILWITH":
+        def run(stack, context):
+            raise ScriptFailed(to_micheline(stack[-1]), context.address)
+        return run
+    if prim == "NEVER":
+        def run(stack, context):
+            raise MichelsonError("NEVER reached")
+        return run
+
+    # Lambdas
+    if prim in ("LAMBDA", "LAMBDA_REC"):
+        value = Lambda(compile_sequence(args[2]), args[2], recursive = prim == "LAMBDA_REC")
+        def run(stack, context):
+            stack.append(value)
+        return run
+    if prim == "EXEC":
+        def run(stack, context):
+            argument = stack.pop()
+            function = stack.pop()
+            stack.append(execute(function, argument, context))
+        return run
+    if prim == "APPLY":
+        def run(stack, context):
+            argument = stack.pop()
+            function = stack[-1]
+            stack[-1] = Lambda(function.run, function.node, function.captured + (argument,), function.recursive)
+        return run
+
+    # Collections
+    if prim == "GET":
+        if args:
+            return comb_get(integer(args[0]))
+        def run(stack, context):
+            key = stack.pop()
+            collection = stack[-1]
+            if type(collection) is BigMap:
+                context.gas += BIG_MAP_READ
+            value = collection.get(key, REMOVED)
+            stack[-1] = None if value is REMOVED else Some(value)
+        return run
+    if prim == "MEM":
+        def run(stack, context):
+            key = stack.pop()
+            collection = stack[-1]
+            if type(collection) is BigMap:
+                context.gas += BIG_MAP_READ
+                stack[-1] = collection.get(key) is not REMOVED
+            else:
+                stack[-1] = key in collection
+        return run
+    if prim == "UPDATE":
+        if args:
+            return comb_update(integer(args[0]))
+        def run(stack, context):
+            key = stack.pop()
+            value = stack.pop()
+            collection = stack[-1]
+            kind = type(collection)
+            if kind is BigMap:
+                stack[-1] = collection.updated(key, REMOVED if value is None else value.value)
+            elif kind is dict:
+                collection = dict(collection)
+                if value is None:
+                    collection.pop(key, None)
+                else:
+                    collection[key] = value.value
+                stack[-1] = collection
+            else:
+                stack[-1] = collection | {key} if value else collection - {key}
+        return run
+    if prim == "GET_AND_UPDATE":
+        def run(stack, context):
+            key = stack.pop()
+            value = stack.pop()
+            collection = stack.pop()
+            if type(collection) is BigMap:
+                context.gas += BIG_MAP_READ
+                old = collection.get(key)
+                collection = collection.updated(key, REMOVED if value is None else value.value)
+            else:
+                old = collection.get(key, REMOVED)
+                collection = dict(collection)
+                if value is None:
+                    collection.pop(key, None)
+                else:
+                    collection[key] = value.value
+            stack.append(collection)
+            stack.append(None if old is REMOVED else Some(old))
+        return run
+    if prim == "SIZE":
+        def run(stack, context):
+            stack[-1] = len(stack[-1])
+        return run
+    if prim == "CONCAT":
+        def run(stack, context):
+            top = stack.pop()
+            if type(top) is list:
+                stack.append(b"".join(top) if top and type(top[0]) is bytes else "".join(top))
+            else:
+                stack[-1] = top + stack[-1]
+        return run
+    if prim == "SLICE":
+        def run(stack, context):
+            offset = stack.pop()
+            length = stack.pop()
+            text = stack[-1]
+            stack[-1] = Some(text[offset:offset + length]) if offset + length <= len(text) else None
+        return run
+
+    # Arithmetic
+    if prim == "ADD":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first + stack[-1]
+        return run
+    if prim == "SUB":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first - stack[-1]
+        return run
+    if prim == "SUB_MUTEZ":
+        def run(stack, context):
+            first = stack.pop()
+            difference = first - stack[-1]
+            stack[-1] = Some(difference) if difference >= 0 else None
+        return run
+    if prim == "MUL":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first * stack[-1]
+        return run
+    if prim == "EDIV":
+        def run(stack, context):
+            dividend = stack.pop()
+            divisor = stack[-1]
+            if divisor == 0:
+                stack[-1] = None
+            else:
+                remainder = dividend % abs(divisor)
+                stack[-1] = Some(((dividend - remainder) // divisor, remainder))
+        return run
+    if prim == "ABS":
+        def run(stack, context):
+            stack[-1] = abs(stack[-1])
+        return run
+    if prim == "ISNAT":
+        def run(stack, context):
+            stack[-1] = Some(stack[-1]) if stack[-1] >= 0 else None
+        return run
+    if prim in ("INT", "NAT"):
+        return lambda stack, context: None
+    if prim == "NEG":
+        def run(stack, context):
+            stack[-1] = -stack[-1]
+        return run
+    if prim == "LSL":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first << stack[-1]
+        return run
+    if prim == "LSR":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first >> stack[-1]
+        return run
+    if prim == "AND":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = (first and stack[-1]) if type(first) is bool else first & stack[-1]
+        return run
+    if prim == "OR":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = (first or stack[-1]) if type(first) is bool else first | stack[-1]
+        return run
+    if prim == "XOR":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = first ^ stack[-1]
+        return run
+    if prim == "NOT":
+        def run(stack, context):
+            stack[-1] = (not stack[-1]) if type(stack[-1]) is bool else ~stack[-1]
+        return run
+    if prim == "COMPARE":
+        def run(stack, context):
+            first = stack.pop()
+            stack[-1] = compare(first, stack[-1])
+        return run
+    comparisons = {
+        "EQ": lambda value: value == 0, "NEQ": lambda value: value != 0, "LT": lambda value: value < 0,
+        "GT": lambda value: value > 0, "LE": lambda value: value <= 0, "GE": lambda value: value >= 0,
+    }
+    if prim in comparisons:
+        test = comparisons[prim]
+        def run(stack, context):
+            stack[-1] = test(stack[-1])
+        return run
+
+    # Cryptography
+    if prim == "PACK":
+        def run(stack, context):
+            stack[-1] = pack(stack[-1])
+        return run
+    if prim == "SHA256":
+        def run(stack, context):
+            stack[-1] = hashlib.sha256(stack[-1]).digest()
+        return run
+    if prim == "SHA512":
+        def run(stack, context):
+            stack[-1] = hashlib.sha512(stack[-1]).digest()
+        return run
+    if prim == "BLAKE2B":
+        def run(stack, context):
+            stack[-1] = hashlib.blake2b(stack[-1], digest_size = 32).digest()
+        return run
+    if prim == "SHA3":
+        def run(stack, context):
+            stack[-1] = hashlib.sha3_256(stack[-1]).digest()
+        return run
+
+    # Blockchain
+    if prim == "AMOUNT":
+        return lambda stack, context: stack.append(context.amount)
+    if prim == "BALANCE":
+        return lambda stack, context: stack.append(context.engine.balances.get(context.address, 0))
+    if prim == "NOW":
+        return lambda stack, context: stack.append(context.now)
+    if prim == "LEVEL":
+        return lambda stack, context: stack.append(context.level)
+    if prim == "SENDER":
+        return lambda stack, context: stack.append(context.sender)
+    if prim == "SOURCE":
+        return lambda stack, context: stack.append(context.source)
+    if prim == "SELF_ADDRESS":
+        return lambda stack, context: stack.append(context.address)
+    if prim == "CHAIN_ID":
+        return lambda stack, context: stack.append(context.engine.chainId)
+    if prim == "SELF":
+        entrypoint = annotation(node, "default")
+        return lambda stack, context: stack.append(Contract(context.address, entrypoint))
+    if prim == "ADDRESS":
+        def run(stack, context):
+            stack[-1] = Address(str(stack[-1]))
+        return run
+    if prim == "IMPLICIT_ACCOUNT":
+        def run(stack, context):
+            stack[-1] = Contract(Address(stack[-1]))
+        return run
+    if prim == "CONTRACT":
+        parameterType = comb(args[0])
+        entrypoint = annotation(node, None)
+        def run(stack, context):
+            contract = context.engine.contract(stack[-1], entrypoint, parameterType)
+            stack[-1] = None if contract is None else Some(contract)
+        return run
+    if prim == "TRANSFER_TOKENS":
+        def run(stack, context):
+            parameter = stack.pop()
+            amount = stack.pop()
+            stack[-1] = Transfer(context.address, stack[-1], amount, parameter)
+        return run
+    if prim == "SET_DELEGATE":
+        def run(stack, context):
+            delegate = stack[-1]
+            stack[-1] = Delegation(context.address, None if delegate is None else delegate.value)
+        return run
+    if prim == "EMIT":
+        tag = annotation(node, None)
+        def run(stack, context):
+            stack[-1] = Event(context.address, tag, stack[-1])
+        return run
+    if prim == "VIEW":
+        name = args[0]["string"]
+        def run(stack, context):
+            argument = stack.pop()
+            stack[-1] = context.engine.run_view(context, stack[-1], name, argument)
+        return run
+
+    def unsupported(stack, context):
+        raise MichelsonError("%s is not supported" % prim)
+    return unsupported
+
+
+def instruction_cost(node):
+
+    if isinstance(node, list):
+        return 0
+    return COSTS.get(node["prim"], DEFAULT_COST)
+
+
+def compile_sequence(nodes):
+    """Closure running a sequence, charging the constant gas of its instructions
+    """
+
+    steps = tuple(compile_instruction(node) for node in nodes)
+    cost = sum(instruction_cost(node) for node in nodes)
+
+    def run(stack, context):
+        context.gas += cost
+        for step in steps:
+            step(stack, context)
+    return run
+
+
+def execute(function, argument, context):
+    """Result of a lambda on an argument
+    """
+
+    context.check_gas()
+    for captured in reversed(function.captured):
+        argument = (captured, argument)
+    stack = [function, argument] if function.recursive else [argument]
+    function.run(stack, context)
+    return stack[-1]
+
+
+class Script:
+    """Compiled contract code
+
+    Args:
+        code: Micheline of a *_contract.json, the sequence of parameter, storage, code and views
+    """
+
+    def __init__(self, code):
+
+        self.views = {}
+        for section in code:
+            prim, args = section["prim"], section.get("args", [])
+            if prim == "parameter":
+                self.parameterType = comb(args[0])
+                self.entrypoints = entrypoints(self.parameterType)
+            elif prim == "storage":
+                self.storageType = comb(args[0])
+            elif prim == "code":
+                self.run = compile_sequence(args[0])
+            elif prim == "view":
+                self.views[args[0]["string"]] = (comb(args[1]), comb(args[2]), compile_sequence(args[3]))
+        self.hasBigMap = has_big_map(self.storageType)
+        self.cost = EXECUTION_COST + CODE_BYTE_COST * encoded_size(code)
+
+
+class Context:
+    """State of one contract execution
+    """
+
+    __slots__ = ("engine", "address", "sender", "source", "amount", "now", "level", "gas", "limit")
+
+    def __init__(self, engine, address, sender, source, amount, limit):
+
+        self.engine = engine
+        self.address = address
+        self.sender = sender
+        self.source = source
+        self.amount = amount
+        self.now = engine.now
+        self.level = engine.level
+        self.gas = 0
+        self.limit = limit
+
+    def check_gas(self):
+
+        if self.gas > self.limit:
+            raise GasExhausted("gas limit of %d exceeded at %s" % (self.limit // 1000, self.address))
+
+
+class CallResult:
+    """Result of a call
+
+    Attributes:
+        operations: applied transfers, dicts sender, destination, entrypoint, amount, parameter and gas,
+            the external call first, in execution order
+        events: emitted events, dicts sender, tag and payload
+        gas: estimated gas of the whole operation
+    """
+
+    def __init__(self):
+
+        self.operations = []
+        self.events = []
+        self.gas = 0
+
+
+class Engine:
+    """Contracts, balances and big_maps of an offline chain
+
+    Args:
+        level: level of the calls
+        now: timestamp of the calls, in seconds
+        strict: fails on transfers to contracts the engine does not know, instead of
+            recording them without executing them
+    """
+
+    def __init__(self, level = 1, now = 0, strict = True):
+
+        self.level = level
+        self.now = now
+        self.strict = strict
+        self.chainId = "NetXdQprcVkpaWU"
+        self.contracts = {}
+        self.storages = {}
+        self.balances = {}
+        self.bigMaps = {}
+        self.scripts = {}
+        self.journal = None
+        self.originated = 0
+
+    # State
+
+    def big_map(self, id):
+
+        return BigMap(id, {}, self.bigMaps[id])
+
+    def commit(self, typeNode, value):
+        """Writes the big_maps of a storage to the engine
+
+        Returns:
+            the storage with committed big_maps
+        """
+
+        prim = typeNode["prim"]
+        if prim == "big_map":
+            if value.id is not None and not value.changes:
+                return value
+            id = value.id
+            if id is None:
+                id = len(self.bigMaps)
+                self.bigMaps[id] = {}
+                self.journal.append((id, CREATED, None))
+            content = self.bigMaps[id]
+            for key, item in value.changes.items():
+                self.journal.append((id, key, content.get(key, REMOVED)))
+                if item is REMOVED:
+                    content.pop(key, None)
+                else:
+                    content[key] = item
+            return BigMap(id, {}, content)
+        if not has_big_map(typeNode):
+            return value
+        if prim == "pair":
+            return (self.commit(typeNode["args"][0], value[0]), self.commit(typeNode["args"][1], value[1]))
+        if prim == "option":
+            return value if value is None else Some(self.commit(typeNode["args"][0], value.value))
+        if prim == "or":
+            if type(value) is Left:
+                return Left(self.commit(typeNode["args"][0], value.value))
+            return Right(self.commit(typeNode["args"][1], value.value))
+        if prim == "map":
+            return {key: self.commit(typeNode["args"][1], item) for key, item in value.items()}
+        if prim == "list":
+            return [self.commit(typeNode["args"][0], item) for item in value]
+        return value
+
+    def rollback(self, storages, balances):
+
+        for id, key, old in reversed(self.journal):
+            if key is CREATED:
+                del self.bigMaps[id]
+            elif old is REMOVED:
+                self.bigMaps[id].pop(key, None)
+            else:
+                self.bigMaps[id][key] = old
+        self.storages, self.balances = storages, balances
+
+    def originate(self, code, storage, balance = 0, address = None):
+        """Adds a contract
+
+        Args:
+            code: Micheline of the contract, compiled once per distinct code
+            storage: Micheline of the initial storage
+        Returns:
+            address of the contract
+        """
+
+        key = json.dumps(code, sort_keys = True)
+        if key not in self.scripts:
+            self.scripts[key] = Script(code)
+        script = self.scripts[key]
+
+        if address is None:
+            self.originated += 1
+            digest = hashlib.blake2b(self.originated.to_bytes(8, "big"), digest_size = 20).digest()
+            address = b58encode_check(ADDRESS_PREFIXES["KT1"][0] + digest)
+        address = Address(address)
+
+        self.journal = []
+        self.contracts[address] = script
+        self.storages[address] = self.commit(script.storageType, decode(script.storageType, storage, self))
+        self.balances[address] = balance
+        self.journal = None
+        return address
+
+    def originate_files(self, contractPath, storagePath, balance = 0, address = None):
+        """Adds a contract from the JSON outputs of SmartPy.sh compile
+        """
+
+        return self.originate(load(contractPath), load(storagePath), balance, address)
+
+    def storage(self, address):
+        """Micheline of the storage of a contract
+        """
+
+        return to_micheline(self.storages[Address(address)])
+
+    def big_map_get(self, id, keyType, key):
+        """Micheline of a value of a big_map, None when the key is missing
+
+        Args:
+            keyType: Micheline type of the keys
+            key: Micheline of the key
+        """
+
+        value = self.bigMaps[id].get(decode(comb(keyType), key, self), REMOVED)
+        return None if value is REMOVED else to_micheline(value)
+
+    # Instructions needing the engine
+
+    def contract(self, address, entrypoint, parameterType):
+        """CONTRACT: the typed contract of an address, None when it has no such entrypoint
+        """
+
+        address, _, suffix = address.partition("%")
+        if suffix:
+            if entrypoint is not None:
+                return None
+            entrypoint = suffix
+        entrypoint = entrypoint or "default"
+        address = Address(address)
+
+        if address[0] == "t":
+            return Contract(address) if entrypoint == "default" and parameterType["prim"] == "unit" else None
+        script = self.contracts.get(address)
+        if script is None:
+            return None if self.strict else Contract(address, entrypoint)
+        found = script.entrypoints.get(entrypoint)
+        if found is None or not same_type(found[1], parameterType):
+            return None
+        return Contract(address, entrypoint)
+
+    def run_view(self, context, address, name, argument):
+        """VIEW: Some result of the view of a contract, None when there is no such view
+        """
+
+        script = self.contracts.get(Address(address))
+        if script is None or name not in script.views:
+            return None
+        _, _, code = script.views[name]
+        viewContext = Context(self, Address(address), context.address, context.source, 0, context.limit - context.gas)
+        stack = [(argument, self.storages[Address(address)])]
+        code(stack, viewContext)
+        context.gas += viewContext.gas
+        return Some(stack[-1])
+
+    # Calls
+
+    def call(self, address, entrypoint = "default", parameter = None, amount = 0, sender = DEFAULT_SENDER, source = None, gasLimit = GAS_LIMIT, commit = True):
+        """Calls a contract and applies the operations it emits
+
+        Args:
+            address: contract called
+            entrypoint: entrypoint called
+            parameter: Micheline of the parameter of the entrypoint, Unit when None
+            amount: mutez transferred
+            sender: caller, an implicit account
+            gasLimit: gas limit of the whole operation
+            commit: keeps the resulting state, a dry-run leaves the engine unchanged
+        Returns:
+            CallResult
+        Raises:
+            ScriptFailed, GasExhausted or MichelsonError, the engine being unchanged
+        """
+
+        address = Address(address)
+        script = self.contracts.get(address)
+        if script is None:
+            raise MichelsonError("unknown contract %s" % address)
+        if entrypoint not in script.entrypoints:
+            raise MichelsonError("%s has no entrypoint %s" % (address, entrypoint))
+        parameterType = script.entrypoints[entrypoint][1]
+        value = decode(parameterType, parameter if parameter is not None else {"prim": "Unit"}, self)
+
+        result = CallResult()
+        storages, balances = dict(self.storages), dict(self.balances)
+        self.journal = []
+        context = Context(self, address, Address(sender), Address(source or sender), amount, gasLimit * 1000)
+        try:
+            pending = [Transfer(Address(sender), Contract(address, entrypoint), amount, value)]
+            while pending:
+                emitted = self.apply(pending.pop(0), context, result)
+                pending[0:0] = emitted
+        except Exception:
+            self.rollback(storages, balances)
+            self.journal = None
+            raise
+        if not commit:
+            self.rollback(storages, balances)
+        self.journal = None
+        result.gas = (context.gas + 999) // 1000
+        return result
+
+    def apply(self, operation, context, result):
+        """Applies an operation
+
+        Returns:
+            operations emitted by the contract called
+        """
+
+        if type(operation) is Event:
+            result.events.append({"sender": operation.sender, "tag": operation.tag, "payload": to_micheline(operation.payload)})
+            return []
+        if type(operation) is Delegation:
+            return []
+
+        destination = operation.destination
+        if operation.sender in self.contracts:
+            if self.balances[operation.sender] < operation.amount:
+                raise MichelsonError("balance of %s too low for %d mutez" % (operation.sender, operation.amount))
+            self.balances[operation.sender] -= operation.amount
+        self.balances[destination.address] = mutez(self.balances.get(destination.address, 0) + operation.amount)
+
+        applied = {
+            "sender": operation.sender, "destination": destination.address, "entrypoint": destination.entrypoint,
+            "amount": operation.amount, "parameter": operation.parameter, "gas": 0
+        }
+        result.operations.append(applied)
+
+        script = self.contracts.get(destination.address)
+        if script is None:
+            if destination.address[0] != "t" and self.strict:
+                raise MichelsonError("unknown contract %s" % destination.address)
+            return []
+
+        path, _ = script.entrypoints[destination.entrypoint]
+        parameter = operation.parameter
+        for isLeft in reversed(path):
+            parameter = Left(parameter) if isLeft else Right(parameter)
+
+        execution = Context(self, destination.address, operation.sender, context.source, operation.amount, context.limit - context.gas)
+        execution.gas = script.cost
+        stack = [(parameter, self.storages[destination.address])]
+        script.run(stack, execution)
+        execution.check_gas()
+        operations, storage = stack[-1]
+
+        if script.hasBigMap:
+            before = len(self.journal)
+            storage = self.commit(script.storageType, storage)
+            execution.gas += BIG_MAP_WRITE * (len(self.journal) - before)
+        self.storages[destination.address] = storage
+        context.gas += execution.gas
+        applied["gas"] = (execution.gas + 999) // 1000
+        return operations
+
+
+def parse_expression(text):
+    """Micheline of a Michelson expression, for example Pair "tz1..." 10, annotations included
+    """
+
+    from tools.profiler import Parser
+
+    def convert(node):
+        if node.kind == "seq":
+            return [convert(arg) for arg in node.args]
+        if node.kind == "int":
+            return {"int": node.value}
+        if node.kind == "string":
+            return {"string": json.loads(node.value)}
+        if node.kind == "bytes":
+            return {"bytes": node.value[2:]}
+        result = {"prim": node.value}
+        if node.args:
+            result["args"] = [convert(arg) for arg in node.args]
+        if node.annots:
+            result["annots"] = list(node.annots)
+        return result
+
+    parser = Parser(text)
+    return convert(parser.expression())
+
+
+def parse_script(text):
+    """Micheline of a Michelson script, a .tz file
+    """
+
+    return parse_expression("{" + text + "}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Dry-runs a call of a compiled contract")
+    parser.add_argument("contract", help = "*_contract.json of SmartPy")
+    parser.add_argument("storage", help = "*_storage.json of SmartPy")
+    parser.add_argument("--entrypoint", default = "default")
+    parser.add_argument("--parameter", default = "Unit", help = "Michelson expression of the parameter")
+    parser.add_argument("--amount", type = int, default = 0, help = "mutez")
+    parser.add_argument("--sender", default = DEFAULT_SENDER)
+    parser.add_argument("--level", type = int, default = 1)
+    parser.add_argument("--now", type = int, default = 0, help = "timestamp in seconds")
+    parser.add_argument("--balance", type = int, default = 0, help = "balance of the contract, in mutez")
+    arguments = parser.parse_args()
+
+    engine = Engine(arguments.level, arguments.now, strict = False)
+    address = engine.originate_files(arguments.contract, arguments.storage, arguments.balance)
+    try:
+        result = engine.call(address, arguments.entrypoint, parse_expression(arguments.parameter), arguments.amount, arguments.sender)
+    except ScriptFailed as error:
+        print(json.dumps({"failed": error.value}))
+        sys.exit(1)
+
+    operations = []
+    for operation in result.operations[1:]:
+        operation = dict(operation, parameter = to_micheline(operation["parameter"]), destination = str(operation["destination"]))
+        operations.append(operation)
+    json.dump({"storage": engine.storage(address), "operations": operations, "events": result.events, "gas": result.gas}, sys.stdout, indent = 2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+"""Exact swap math of the AMM, FlatCurve and TezToCtez pools
+
+Every quote follows the integer operations of the contracts step by step, including
+the floor divisions, the 5 rounds of the flat curve Newton and the checks that make a
+swap fail. A failing swap raises SwapFailed with the contract error message.
+
+Tokens are (address, id) tuples, tez is TEZ. Pools mirror the storage fields of
+their contract and carry a version increased on every reserve update, so quotes can
+be cached between reserve changes. When the stateVersion of the contract is known it
+is mirrored too. It is only updated from the storage reported by an indexer, swaps
+applied locally increase the local version alone.
+"""
+
+from math import isqrt
+
+# Token key of tez in the TezToCtez pools
+TEZ = ("tez", 0)
+
+# Rounds of the flat curve Newton, as in FlatCurve.swap and TezToCtez
+NEWTON_ROUNDS = 5
+
+# Default maxSwapLimit of the AMM storage
+MAX_SWAP_LIMIT = 40
+
+
+class SwapFailed(ValueError):
+    """Raised when the contract would reject the swap, with the contract error message
+    """
+
+
+def util(x, y):
+    """Flat curve utility (x + y)^8 - (x - y)^8 and its derivative in y
+
+    Args:
+        x: reserve of the token sold, scaled by its precision
+        y: reserve of the token bought, scaled by its precision
+    Returns:
+        (u, du_dy)
+    """
+
+    plus = x + y
+    minus = x - y
+    plus_2 = plus * plus
+    plus_4 = plus_2 * plus_2
+    minus_2 = minus * minus
+    minus_4 = minus_2 * minus_2
+    return abs(plus_4 * plus_4 - minus_4 * minus_4), 8 * abs(minus_4 * minus_2 * minus + plus_4 * plus_2 * plus)
+
+
+def newton_dx_to_dy(x, y, dx, rounds = NEWTON_ROUNDS):
+    """Amount bought for dx sold on the flat curve, before fees
+
+    Args:
+        x: reserve of the token sold, scaled by its precision
+        y: reserve of the token bought, scaled by its precision
+        dx: amount sold, scaled by its precision
+        rounds: Newton rounds
+    Returns:
+        dy, scaled by the precision of the token bought
+    Raises:
+        SwapFailed: on a zero derivative
+    """
+
+    u = util(x, y)[0]
+    dy = 0
+    xNew = x + dx
+    for _ in range(rounds):
+        newU, newDuDy = util(xNew, abs(y - dy))
+        if newDuDy == 0:
+            raise SwapFailed("DivisionByZero")
+        dy += abs(newU - u) // newDuDy
+    return dy
+
+
+def flat_marginal_price(x, y):
+    """Price of the flat curve for an infinitesimal trade, -du/dx / du/dy
+
+    Args:
+        x: reserve of the token sold, scaled by its precision
+        y: reserve of the token bought, scaled by its precision
+    Returns:
+        float amount bought per amount sold, both scaled
+    """
+
+    plus_7 = (x + y) ** 7
+    minus_7 = (x - y) ** 7
+    if plus_7 + minus_7 == 0:
+        return 0.0
+    return (plus_7 - minus_7) / (plus_7 + minus_7)
+
+
+def amm_swap(amountIn, inPool, outPool, lpFee, systemFee, maxSwapLimit = MAX_SWAP_LIMIT):
+    """AMM.Swap
+
+    Args:
+        amountIn: tokenAmountIn
+        inPool: reserve of the token sold
+        outPool: reserve of the token bought
+        lpFee: lpFee divisor
+        systemFee: systemFee divisor
+        maxSwapLimit: max % of the reserve of the token sold swapped at once
+    Returns:
+        (amountOut, newInPool, newOutPool, systemFeeAmount)
+    Raises:
+        SwapFailed: when AMM.Swap fails
+    """
+
+    if amountIn * 100 > inPool * maxSwapLimit:
+        raise SwapFailed("PLentySwap_SwapLimitExceed")
+
+    lpfee = amountIn // lpFee
+    systemfee = amountIn // systemFee
+
+    denominator = inPool + amountIn - (lpfee + systemfee)
+    if denominator == 0:
+        raise SwapFailed("DivisionByZero")
+    invariant = inPool * outPool // denominator
+    amountOut = outPool - invariant
+
+    if systemfee <= 0:
+        raise SwapFailed("PLentySwap_Zero System Fee")
+    if amountIn <= 0 or amountOut <= 0:
+        raise SwapFailed("PLentySwap_Zero_Amount_Transfer")
+
+    return amountOut, inPool + amountIn - systemfee, invariant, systemfee
+
+
+def amm_zap_in(amountIn, inPool, outPool, totalSupply, lpFee, systemFee, maxSwapLimit = MAX_SWAP_LIMIT):
+    """AMM.ZapIn
+
+    Args:
+        amountIn: tokenAmountIn
+        inPool: reserve of the token sent
+        outPool: reserve of the other token
+        totalSupply: LP total supply
+        lpFee: lpFee divisor
+        systemFee: systemFee divisor
+        maxSwapLimit: max % of the reserve of the token sent swapped at once
+    Returns:
+        (liquidity, swapAmount, newInPool, newOutPool, systemFeeAmount)
+    Raises:
+        SwapFailed: when AMM.ZapIn fails, minLpOut excepted
+    """
+
+    if totalSupply == 0:
+        raise SwapFailed("PLentySwap_Not_Initialized")
+    if amountIn <= 0:
+        raise SwapFailed("PLentySwap_Zero_Amount_Transfer")
+
+    feeProduct = lpFee * systemFee
+    swapFactor = feeProduct - lpFee - systemFee
+    poolFactor = systemFee - 1
+    linearTerm = inPool * systemFee * (feeProduct + swapFactor)
+    discriminant = linearTerm * linearTerm + 4 * swapFactor * poolFactor * amountIn * inPool * feeProduct * systemFee
+    swapAmount = (isqrt(discriminant) - linearTerm) // (2 * swapFactor * poolFactor)
+
+    if swapAmount * 100 > inPool * maxSwapLimit:
+        raise SwapFailed("PLentySwap_SwapLimitExceed")
+
+    lpfee = swapAmount // lpFee
+    systemfee = swapAmount // systemFee
+    if systemfee <= 0:
+        raise SwapFailed("PLentySwap_Zero System Fee")
+
+    invariant = inPool * outPool // (inPool + swapAmount - (lpfee + systemfee))
+    amountOut = outPool - invariant
+    inPool += swapAmount - systemfee
+    outPool = invariant
+
+    depositAmount = amountIn - swapAmount
+    liquidity = min(depositAmount * totalSupply // inPool, amountOut * totalSupply // outPool)
+    if liquidity <= 0:
+        raise SwapFailed("PLentySwap_Invalid_LP_Ratio")
+
+    return liquidity, swapAmount, inPool + depositAmount, outPool + amountOut, systemfee
+
+def flat_swap(amountIn, inPool, outPool, inPrecision, outPrecision, lpFee):
+    """FlatCurve.swap
+
+    Args:
+        amountIn: tokenAmountIn
+        inPool: reserve of the token sold
+        outPool: reserve of the token bought
+        inPrecision: precision of the token sold
+        outPrecision: precision of the token bought
+        lpFee: lpFee divisor
+    Returns:
+        (amountOut, newInPool, newOutPool)
+    Raises:
+        SwapFailed: when FlatCurve.swap fails
+    """
+
+    if amountIn <= 0:
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    boughtWithoutFee = newton_dx_to_dy(inPool * inPrecision, outPool * outPrecision, amountIn * inPrecision)
+    amountOut = abs(boughtWithoutFee - boughtWithoutFee // lpFee) // outPrecision
+
+    if amountOut >= outPool:
+        raise SwapFailed("FlatSwap_Cash_Bought_Exceeds_Pool")
+    if amountOut <= 0:
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    return amountOut, inPool + amountIn, outPool - amountOut
+
+
+def tez_to_ctez(tezIn, tezPool, ctezPool, target, lpFee):
+    """TezToCtez.tez_to_ctez_callback
+
+    Args:
+        tezIn: mutez sold
+        tezPool: tez reserve in mutez
+        ctezPool: ctez reserve
+        target: ctez target of the ctez contract, 48 bits fixed point
+        lpFee: lpFee divisor
+    Returns:
+        (ctezOut, newTezPool, newCtezPool)
+    Raises:
+        SwapFailed: when the swap fails
+    """
+
+    if tezIn <= 0:
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    boughtWithoutFee = newton_dx_to_dy(tezPool << 48, target * ctezPool, tezIn << 48) // target
+    ctezOut = abs(boughtWithoutFee - boughtWithoutFee // lpFee)
+
+    if ctezOut >= ctezPool:
+        raise SwapFailed("FlatSwap_Cash_Bought_Exceeds_Pool")
+    if ctezOut <= 0:
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    return ctezOut, tezPool + tezIn, ctezPool - ctezOut
+
+
+def ctez_to_tez(ctezIn, tezPool, ctezPool, target, lpFee):
+    """TezToCtez.ctez_to_tez_callback
+
+    Args:
+        ctezIn: ctez sold
+        tezPool: tez reserve in mutez
+        ctezPool: ctez reserve
+        target: ctez target of the ctez contract, 48 bits fixed point
+        lpFee: lpFee divisor
+    Returns:
+        (tezOut, newTezPool, newCtezPool)
+    Raises:
+        SwapFailed: when the swap fails
+    """
+
+    if ctezIn <= 0:
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    boughtWithoutFee = newton_dx_to_dy(target * ctezPool, tezPool << 48, target * ctezIn) >> 48
+    tezOut = abs(boughtWithoutFee - boughtWithoutFee // lpFee)
+
+    if tezOut >= tezPool:
+        raise SwapFailed("FlatSwap_Tez_Bought_Exceeds_Pool")
+    if tezOut <= 0:
+        # Empty tez transfers are rejected by the protocol
+        raise SwapFailed("FlatSwap_Zero_Amount_Transfer")
+
+    return tezOut, tezPool - tezOut, ctezPool + ctezIn
+
+
+class Pool:
+    """Common interface of the pools
+
+    Subclasses define tokens and implement swap(tokenIn, amountIn) returning the amount
+    out and the new reserves, set(reserves), reserves(tokenIn) and marginal_price(tokenIn).
+    """
+
+    __slots__ = ()
+
+    curve = None
+
+    def other(self, tokenIn):
+        """Token bought when selling tokenIn
+
+        Raises:
+            SwapFailed: when tokenIn is not traded by the pool
+        """
+
+        token1, token2 = self.tokens
+        if tokenIn == token1:
+            return token2
+        if tokenIn == token2:
+            return token1
+        raise SwapFailed("Invalid_Pair")
+
+    def quote(self, tokenIn, amountIn):
+        """Amount bought by selling amountIn of tokenIn, the pool is unchanged
+
+        Raises:
+            SwapFailed: when the contract would reject the swap
+        """
+
+        return self.swap(tokenIn, amountIn)[0]
+
+    def apply(self, tokenIn, amountIn):
+        """Applies a swap to the reserves
+
+        Returns:
+            amount bought
+        Raises:
+            SwapFailed: when the contract would reject the swap, the pool is then unchanged
+        """
+
+        amountOut, reserves = self.swap(tokenIn, amountIn)
+        self.set(reserves)
+        return amountOut
+
+    def update(self, **fields):
+        """Updates storage fields of the pool, for example reserves reported by an indexer
+        """
+
+        for name, value in fields.items():
+            setattr(self, name, int(value))
+        self.version += 1
+
+    def set(self, reserves):
+
+        raise NotImplementedError
+
+    def state(self):
+        """Hashable snapshot of the fields used by the pool math
+        """
+
+        return tuple(getattr(self, name) for name in self.STATE)
+
+    def snapshot(self):
+        """Freshness key of the pool, the on-chain stateVersion and the local version when
+        stateVersion is known, state() otherwise
+        """
+
+        if self.stateVersion is not None:
+            return (self.stateVersion, self.version)
+        return self.state()
+
+
+class AMMPool(Pool):
+    """Volatile Swap AMM pool
+    """
+
+    curve = "AMM"
+
+    STATE = ("token1_pool", "token2_pool", "lpFee", "systemFee", "maxSwapLimit")
+
+    __slots__ = ("address", "tokens") + STATE + ("version", "stateVersion")
+
+    def __init__(self, address, token1, token2, token1_pool, token2_pool, lpFee, systemFee, maxSwapLimit = MAX_SWAP_LIMIT, stateVersion = None):
+
+        self.address = address
+        self.tokens = (tuple(token1), tuple(token2))
+        self.token1_pool = int(token1_pool)
+        self.token2_pool = int(token2_pool)
+        self.lpFee = int(lpFee)
+        self.systemFee = int(systemFee)
+        self.maxSwapLimit = int(maxSwapLimit)
+        self.version = 0
+        self.stateVersion = None if stateVersion is None else int(stateVersion)
+
+    def swap(self, tokenIn, amountIn):
+
+        if self.other(tokenIn) == self.tokens[0]:
+            amountOut, inPool, outPool, _ = amm_swap(amountIn, self.token2_pool, self.token1_pool, self.lpFee, self.systemFee, self.maxSwapLimit)
+            return amountOut, (outPool, inPool)
+        amountOut, inPool, outPool, _ = amm_swap(amountIn, self.token1_pool, self.token2_pool, self.lpFee, self.systemFee, self.maxSwapLimit)
+        return amountOut, (inPool, outPool)
+
+    def set(self, reserves):
+
+        self.token1_pool, self.token2_pool = reserves
+        self.version += 1
+
+    def reserves(self, tokenIn):
+        """(reserve of tokenIn, reserve of the token bought)
+        """
+
+        if self.other(tokenIn) == self.tokens[0]:
+            return self.token2_pool, self.token1_pool
+        return self.token1_pool, self.token2_pool
+
+    def marginal_price(self, tokenIn):
+
+        inPool, outPool = self.reserves(tokenIn)
+        if inPool == 0:
+            return 0.0
+        return outPool / inPool * (1 - 1 / self.lpFee - 1 / self.systemFee)
+
+
+class FlatCurvePool(Pool):
+    """StableSwap FlatCurve pool
+    """
+
+    curve = "FlatCurve"
+
+    STATE = ("token1Pool", "token2Pool", "token1Precision", "token2Precision", "lpFee")
+
+    __slots__ = ("address", "tokens") + STATE + ("version", "stateVersion")
+
+    def __init__(self, address, token1, token2, token1Pool, token2Pool, token1Precision, token2Precision, lpFee, stateVersion = None):
+
+        self.address = address
+        self.tokens = (tuple(token1), tuple(token2))
+        self.token1Pool = int(token1Pool)
+        self.token2Pool = int(token2Pool)
+        self.token1Precision = int(token1Precision)
+        self.token2Precision = int(token2Precision)
+        self.lpFee = int(lpFee)
+        self.version = 0
+        self.stateVersion = None if stateVersion is None else int(stateVersion)
+
+    def swap(self, tokenIn, amountIn):
+
+        if self.other(tokenIn) == self.tokens[0]:
+            amountOut, inPool, outPool = flat_swap(amountIn, self.token2Pool, self.token1Pool, self.token2Precision, self.token1Precision, self.lpFee)
+            return amountOut, (outPool, inPool)
+        amountOut, inPool, outPool = flat_swap(amountIn, self.token1Pool, self.token2Pool, self.token1Precision, self.token2Precision, self.lpFee)
+        return amountOut, (inPool, outPool)
+
+    def set(self, reserves):
+
+        self.token1Pool, self.token2Pool = reserves
+        self.version += 1
+
+    def reserves(self, tokenIn):
+        """(reserve of tokenIn, reserve of the token bought), unscaled
+        """
+
+        if self.other(tokenIn) == self.tokens[0]:
+            return self.token2Pool, self.token1Pool
+        return self.token1Pool, self.token2Pool
+
+    def marginal_price(self, tokenIn):
+
+        if self.other(tokenIn) == self.tokens[0]:
+            x, y, inPrecision, outPrecision = self.token2Pool * self.token2Precision, self.token1Pool * self.token1Precision, self.token2Precision, self.token1Precision
+        else:
+            x, y, inPrecision, outPrecision = self.token1Pool * self.token1Precision, self.token2Pool * self.token2Precision, self.token1Precision, self.token2Precision
+        return flat_marginal_price(x, y) * inPrecision / outPrecision * (1 - 1 / self.lpFee)
+
+
+class TezToCtezPool(Pool):
+    """StableSwap TezToCtez pool, target is read from the ctez contract
+    """
+
+    curve = "TezToCtez"
+
+    STATE = ("tezPool", "ctezPool", "lpFee", "target")
+
+    __slots__ = ("address", "tokens") + STATE + ("version", "stateVersion")
+
+    def __init__(self, address, ctezToken, tezPool, ctezPool, lpFee, target, stateVersion = None):
+
+        self.address = address
+        self.tokens = (TEZ, tuple(ctezToken))
+        self.tezPool = int(tezPool)
+        self.ctezPool = int(ctezPool)
+        self.lpFee = int(lpFee)
+        self.target = int(target)
+        self.version = 0
+        self.stateVersion = None if stateVersion is None else int(stateVersion)
+
+    def swap(self, tokenIn, amountIn):
+
+        if self.other(tokenIn) == TEZ:
+            amountOut, tezPool, ctezPool = ctez_to_tez(amountIn, self.tezPool, self.ctezPool, self.target, self.lpFee)
+        else:
+            amountOut, tezPool, ctezPool = tez_to_ctez(amountIn, self.tezPool, self.ctezPool, self.target, self.lpFee)
+        return amountOut, (tezPool, ctezPool)
+
+    def set(self, reserves):
+
+        self.tezPool, self.ctezPool = reserves
+        self.version += 1
+
+    def reserves(self, tokenIn):
+        """(reserve of tokenIn, reserve of the token bought)
+        """
+
+        if self.other(tokenIn) == TEZ:
+            return self.ctezPool, self.tezPool
+        return self.tezPool, self.ctezPool
+
+    def marginal_price(self, tokenIn):
+
+        if self.other(tokenIn) == TEZ:
+            return flat_marginal_price(self.target * self.ctezPool, self.tezPool << 48) * self.target / (1 << 48) * (1 - 1 / self.lpFee)
+        return flat_marginal_price(self.tezPool << 48, self.target * self.ctezPool) * (1 << 48) / self.target * (1 - 1 / self.lpFee)
+
+
+def token_key(value):
+    """Parses a token given as "tez", "address" or "address:id" into a token key
+    """
+
+    if isinstance(value, (list, tuple)):
+        return (value[0], int(value[1]))
+    if value == "tez":
+        return TEZ
+    address, _, tokenId = value.partition(":")
+    return (address, int(tokenId or 0))
+
+
+def pool_from_dict(data):
+    """Builds a pool from its JSON description
+
+    {"curve": "AMM", "address", "token1", "token2", "token1_pool", "token2_pool", "lpFee", "systemFee", "maxSwapLimit"}
+    {"curve": "FlatCurve", "address", "token1", "token2", "token1Pool", "token2Pool", "token1Precision", "token2Precision", "lpFee"}
+    {"curve": "TezToCtez", "address", "ctezAddress", "tezPool", "ctezPool", "lpFee", "target"}
+
+    Tokens are "address:id" strings or [address, id] pairs. Every curve takes an optional
+    "stateVersion", the value of the getStateVersion view of the pool.
+    """
+
+    curve = data["curve"]
+    if curve == "AMM":
+        return AMMPool(
+            data["address"], token_key(data["token1"]), token_key(data["token2"]), data["token1_pool"], data["token2_pool"],
+            data["lpFee"], data["systemFee"], data.get("maxSwapLimit", MAX_SWAP_LIMIT), data.get("stateVersion")
+        )
+    if curve == "FlatCurve":
+        return FlatCurvePool(
+            data["address"], token_key(data["token1"]), token_key(data["token2"]), data["token1Pool"], data["token2Pool"],
+            data.get("token1Precision", 1), data.get("token2Precision", 1), data["lpFee"], data.get("stateVersion")
+        )
+    if curve == "TezToCtez":
+        return TezToCtezPool(
+            data["address"], token_key(data["ctezAddress"]), data["tezPool"], data["ctezPool"], data["lpFee"], data["target"],
+            data.get("stateVersion")
+        )
+    raise ValueError("Unknown curve %s" % curve)
@@ -0,0 +1,494 @@
+"""Per block gas profiler of compiled contracts
+
+Usage:
+    python -m tools.profiler <contract.tz> <scenario.json> [--json profile.json] [--top N]
+    python -m tools.profiler <contract.tz> --static
+
+The .tz output of SmartPy keeps the source of every statement as a comment on its own
+line, above the instructions compiled from it (and "# == name ==" above every
+entrypoint). The script is parsed with these comments, every instruction is numbered with
+the Micheline location used by the Michelson interpreter and tagged with the statement
+and entrypoint it was compiled from. The statements are then matched to the lines of the
+Python sources of the repository, where their text is close enough.
+
+A scenario runs calls with octez-client run script --trace-stack on a mockup (OCTEZ_CLIENT,
+octez-client on the PATH by default). The gas of every traced step is attributed to the
+statement of its location, so the report shows where an entrypoint spends its gas: the
+util polynomials, the square_root loop, big_map reads or the final storage serialization,
+reported as unattributed when the trace gives the total gas. --static only counts the
+compiled instructions of every statement.
+
+scenario.json:
+    {"storage": "<Michelson>", "calls": [{"entrypoint": "Swap", "parameter": "<Michelson>",
+     "amount": "0", "level": 10, "now": "2022-01-01T00:00:00Z", "source": "tz1..."}]}
+storage defaults to the *_storage.tz next to the contract, every call starts from it.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Statements are matched to source lines at least this similar
+MATCH_RATIO = 0.75
+
+TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<bytes>0x[0-9a-fA-F]*)
+  | (?P<int>-?\d+)
+  | (?P<annot>[%@:][\w.%@]*)
+  | (?P<name>[A-Za-z_][\w]*)
+  | (?P<punct>[{}();])
+''', re.X | re.S)
+
+ENTRYPOINT_COMMENT = re.compile(r"^==\s*(\w+)\s*==$")
+TRACE_CONSUMED = re.compile(r"- location: (\d+) \(just consumed gas: ([\d.]+)")
+TRACE_REMAINING = re.compile(r"- location: (\d+) \(remaining gas: ([\d.]+) units remaining\)")
+GAS_REMAINING = re.compile(r"^Gas remaining: ([\d.]+) units remaining", re.M)
+GAS_LIMIT = re.compile(r"^Gas limit: ([\d.]+)", re.M)
+
+
+class Node:
+    """Micheline node of a parsed script
+
+    Attributes:
+        kind: prim, seq, int, string or bytes
+        value: primitive name or literal
+        args: child nodes
+        annots: annotations of a primitive
+        location: Micheline location, preorder index from the root of the script
+        entrypoint: entrypoint whose code holds the node, None outside of them
+        statement: source statement the node was compiled from, None when unknown
+    """
+
+    __slots__ = ("kind", "value", "args", "annots", "location", "entrypoint", "statement")
+
+    def __init__(self, kind, value, args, entrypoint, statement):
+
+        self.kind = kind
+        self.value = value
+        self.args = args
+        self.annots = []
+        self.location = None
+        self.entrypoint = entrypoint
+        self.statement = statement
+
+    def is_instruction(self):
+
+        return self.kind == "prim" and self.value.isupper()
+
+
+def tokenize(text):
+    """Tokens of Michelson text, with the comment written on its own line before each one
+
+    Returns:
+        list of (kind, value, lineComment) where lineComment is the text of a comment
+        standing on its own line, only set on comment tokens
+    """
+
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise ValueError("unexpected character %r at offset %d" % (text[position], position))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "comment":
+            lineStart = text.rfind("\n", 0, position) + 1
+            if not text[lineStart:position].strip():
+                tokens.append(("comment", value[1:].strip(), True))
+        elif kind not in ("space", "block_comment"):
+            tokens.append((kind, value, False))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """Parser of Michelson text keeping the statement comments of SmartPy
+
+    Statement and entrypoint comments apply to the instructions that follow them up to
+    the end of their sequence.
+    """
+
+    def __init__(self, text):
+
+        self.tokens = tokenize(text)
+        self.index = 0
+        self.entrypoint = None
+        self.statement = None
+
+    def peek(self):
+
+        self.skip_comments()
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None, False)
+
+    def skip_comments(self):
+
+        while self.index < len(self.tokens) and self.tokens[self.index][0] == "comment":
+            comment = self.tokens[self.index][1]
+            entrypoint = ENTRYPOINT_COMMENT.match(comment)
+            if entrypoint:
+                self.entrypoint = entrypoint.group(1)
+                self.statement = None
+            elif comment and not comment.startswith("@"):
+                # Without the stack annotation following the statement
+                self.statement = comment.split(" # @")[0].strip()
+            self.index += 1
+
+    def next(self):
+
+        token = self.peek()
+        self.index += 1
+        return token
+
+    def expect(self, value):
+
+        kind, found, _ = self.next()
+        if found != value:
+            raise ValueError("expected %r, found %r" % (value, found))
+
+    def script(self):
+        """Root sequence of a script, parameter; storage; code; without braces
+        """
+
+        root = Node("seq", None, [], None, None)
+        while self.peek()[0] is not None:
+            root.args.append(self.expression())
+            if self.peek()[1] == ";":
+                self.next()
+        return root
+
+    def sequence(self):
+
+        saved = (self.entrypoint, self.statement)
+        self.expect("{")
+        node = Node("seq", None, [], self.entrypoint, self.statement)
+        while self.peek()[1] != "}":
+            node.args.append(self.expression())
+            if self.peek()[1] == ";":
+                self.next()
+        self.next()
+        self.entrypoint, self.statement = saved
+        return node
+
+    def atom(self):
+
+        kind, value, _ = self.peek()
+        if value == "{":
+            return self.sequence()
+        if value == "(":
+            self.next()
+            node = self.expression()
+            self.expect(")")
+            return node
+        self.next()
+        if kind == "name":
+            node = Node("prim", value, [], self.entrypoint, self.statement)
+            while self.peek()[0] == "annot":
+                node.annots.append(self.next()[1])
+            return node
+        if kind in ("int", "string", "bytes"):
+            return Node(kind, value, [], self.entrypoint, self.statement)
+        raise ValueError("unexpected token %r" % value)
+
+    def expression(self):
+
+        kind, value, _ = self.peek()
+        if kind != "name":
+            return self.atom()
+        node = self.atom()
+        while True:
+            kind, value, _ = self.peek()
+            if kind is None or value in (";", "}", ")"):
+                return node
+            node.args.append(self.atom())
+
+
+def number(root):
+    """Sets the Micheline locations, in preorder from 0 at the root
+
+    Returns:
+        dict location -> node
+    """
+
+    nodes = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node.location = len(nodes)
+        nodes[node.location] = node
+        stack.extend(reversed(node.args))
+    return nodes
+
+
+def parse_script(text):
+    """Parsed script and its nodes by location
+    """
+
+    root = Parser(text).script()
+    return root, number(root)
+
+
+class SourceIndex:
+    """Python lines of the contracts, for matching the statements of the compiled code
+
+    Args:
+        root: directory searched for .py files, tools excepted
+    """
+
+    def __init__(self, root = ROOT):
+
+        self.lines = []
+        for directory, subdirectories, names in os.walk(root):
+            subdirectories[:] = sorted(name for name in subdirectories if not name.startswith(".") and name not in ("tools", "benchmarks"))
+            for name in sorted(names):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    with open(path) as sourceFile:
+                        for lineNumber, line in enumerate(sourceFile, 1):
+                            normalized = normalize(line)
+                            if normalized and not line.lstrip().startswith("#"):
+                                self.lines.append((os.path.relpath(path, root), lineNumber, normalized))
+        self.cache = {}
+
+    def locate(self, statement):
+        """Best matching source line of a statement
+
+        Returns:
+            "path:line", None when no line is similar enough
+        """
+
+        if statement not in self.cache:
+            target = normalize(statement)
+            best, bestRatio = None, MATCH_RATIO
+            matcher = difflib.SequenceMatcher(autojunk = False)
+            matcher.set_seq2(target)
+            for path, lineNumber, normalized in self.lines:
+                matcher.set_seq1(normalized)
+                if matcher.real_quick_ratio() < bestRatio or matcher.quick_ratio() < bestRatio:
+                    continue
+                ratio = matcher.ratio()
+                if ratio > bestRatio:
+                    best, bestRatio = "%s:%d" % (path, lineNumber), ratio
+            self.cache[statement] = best
+        return self.cache[statement]
+
+
+def normalize(text):
+    """Statement text without spacing, quoted strings or error message names
+    """
+
+    text = re.sub(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', "S", text)
+    text = re.sub(r"\b(?:ErrorMessages|FA12_Error)\.\w+", "S", text)
+    text = re.sub(r"\bmessage\s*=\s*", "", text)
+    return re.sub(r"\s+", "", text)
+
+
+def static_profile(nodes):
+    """Compiled instructions of every statement
+
+    Returns:
+        dict (entrypoint, statement) -> instruction count
+    """
+
+    counts = {}
+    for node in nodes.values():
+        if node.is_instruction():
+            key = (node.entrypoint, node.statement)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def parse_trace(text):
+    """Gas of the steps of a --trace-stack output
+
+    Returns:
+        list of (location, gas)
+    """
+
+    steps = [(int(location), float(gas)) for location, gas in TRACE_CONSUMED.findall(text)]
+    if steps:
+        return steps
+
+    # Older clients print the remaining gas after every step
+    remaining = [(int(location), float(gas)) for location, gas in TRACE_REMAINING.findall(text)]
+    steps = []
+    for index, (location, gas) in enumerate(remaining):
+        steps.append((location, remaining[index - 1][1] - gas if index else 0.0))
+    return steps
+
+
+def run_traced(client, baseDirectory, scriptPath, storage, call):
+    """Runs one call with octez-client run script --trace-stack
+
+    Returns:
+        (list of (location, gas), total gas or None)
+    """
+
+    arguments = [
+        client, "--mode", "mockup", "--base-dir", baseDirectory,
+        "run", "script", scriptPath, "on", "storage", storage, "and", "input", call.get("parameter", "Unit"),
+        "--trace-stack"
+    ]
+    if "entrypoint" in call:
+        arguments += ["--entrypoint", call["entrypoint"]]
+    for option in ("amount", "level", "now", "source", "payer", "balance"):
+        if option in call:
+            arguments += ["--" + option, str(call[option])]
+
+    result = subprocess.run(arguments, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    if result.returncode != 0:
+        raise RuntimeError("run script failed:\n%s" % result.stdout)
+
+    total = None
+    limit, remaining = GAS_LIMIT.search(result.stdout), GAS_REMAINING.search(result.stdout)
+    if limit and remaining:
+        total = float(limit.group(1)) - float(remaining.group(1))
+    return parse_trace(result.stdout), total
+
+
+class Profile:
+    """Executed instructions and gas by statement, summed over the calls of a scenario
+    """
+
+    def __init__(self, nodes, sources = None):
+
+        self.nodes = nodes
+        self.sources = sources
+        self.blocks = {}
+        self.unattributed = 0.0
+        self.calls = 0
+
+    def add(self, steps, total = None):
+
+        self.calls += 1
+        traced = 0.0
+        for location, gas in steps:
+            node = self.nodes.get(location)
+            key = (node.entrypoint, node.statement) if node is not None else (None, None)
+            block = self.blocks.setdefault(key, {"instructions": 0, "gas": 0.0})
+            block["instructions"] += 1
+            block["gas"] += gas
+            traced += gas
+        if total is not None and total > traced:
+            self.unattributed += total - traced
+
+    def rows(self):
+        """Statements by decreasing gas
+
+        Returns:
+            list of dict entrypoint, statement, source, instructions, gas, share
+        """
+
+        total = sum(block["gas"] for block in self.blocks.values()) + self.unattributed
+        rows = []
+        for (entrypoint, statement), block in self.blocks.items():
+            rows.append({
+                "entrypoint": entrypoint,
+                "statement": statement,
+                "source": self.sources.locate(statement) if self.sources is not None and statement else None,
+                "instructions": block["instructions"],
+                "gas": round(block["gas"], 3),
+                "share": block["gas"] / total if total else 0.0,
+            })
+        if self.unattributed:
+            rows.append({
+                "entrypoint": None, "statement": "storage serialization and operations (unattributed)", "source": None,
+                "instructions": 0, "gas": round(self.unattributed, 3), "share": self.unattributed / total,
+            })
+        rows.sort(key = lambda row: -row["gas"])
+        return rows
+
+
+def default_storage(scriptPath):
+    """Initial storage written by SmartPy next to a *_contract.tz
+    """
+
+    path = scriptPath.replace("_contract.tz", "_storage.tz")
+    with open(path) as storageFile:
+        return storageFile.read().strip()
+
+
+def profile(scriptPath, scenario, client = "octez-client", sources = None):
+    """Profiles the calls of a scenario
+
+    Args:
+        scriptPath: compiled contract, *_contract.tz
+        scenario: dict storage (optional) and calls
+        client: octez-client executable
+        sources: SourceIndex, None to skip the source lines
+    Returns:
+        Profile
+    """
+
+    with open(scriptPath) as scriptFile:
+        _, nodes = parse_script(scriptFile.read())
+    result = Profile(nodes, sources)
+    storage = scenario.get("storage") or default_storage(scriptPath)
+
+    with tempfile.TemporaryDirectory() as temporary:
+        baseDirectory = os.path.join(temporary, "mockup")
+        subprocess.run([client, "--mode", "mockup", "--base-dir", baseDirectory, "create", "mockup"], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+        for call in scenario["calls"]:
+            steps, total = run_traced(client, baseDirectory, scriptPath, storage, call)
+            result.add(steps, total)
+    return result
+
+
+def print_rows(rows, top = None):
+
+    for row in rows[:top]:
+        print("%6.2f%% %12.3f %6d  %-22s %-40s %s" % (
+            100 * row["share"], row["gas"], row["instructions"], row["entrypoint"] or "-",
+            row["source"] or "-", (row["statement"] or "-")[:80]
+        ))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Attributes the gas of compiled contracts to their source statements")
+    parser.add_argument("contract", help = "compiled contract, *_contract.tz of SmartPy")
+    parser.add_argument("scenario", nargs = "?", help = "JSON scenario of calls")
+    parser.add_argument("--static", action = "store_true", help = "only counts the compiled instructions of every statement")
+    parser.add_argument("--client", default = os.environ.get("OCTEZ_CLIENT", "octez-client"), help = "octez-client executable")
+    parser.add_argument("--json", help = "writes the rows to this file")
+    parser.add_argument("--top", type = int, default = None, help = "rows printed")
+    arguments = parser.parse_args()
+
+    sources = SourceIndex()
+
+    if arguments.static:
+        with open(arguments.contract) as scriptFile:
+            _, nodes = parse_script(scriptFile.read())
+        rows = [
+            {"entrypoint": entrypoint, "statement": statement, "source": sources.locate(statement) if statement else None, "instructions": count}
+            for (entrypoint, statement), count in static_profile(nodes).items()
+        ]
+        rows.sort(key = lambda row: -row["instructions"])
+        for row in rows[:arguments.top]:
+            print("%6d  %-22s %-40s %s" % (row["instructions"], row["entrypoint"] or "-", row["source"] or "-", (row["statement"] or "-")[:80]))
+    else:
+        if arguments.scenario is None:
+            parser.error("a scenario is required without --static")
+        with open(arguments.scenario) as scenarioFile:
+            scenario = json.load(scenarioFile)
+        rows = profile(arguments.contract, scenario, arguments.client, sources).rows()
+        print_rows(rows, arguments.top)
+
+    if arguments.json:
+        with open(arguments.json, "w") as jsonFile:
+            json.dump(rows, jsonFile, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Bounded LRU cache of exact pool quotes
+
+Quotes are keyed on the pool address, the snapshot of the pool (Pool.snapshot) and the
+(tokenIn, amountIn) of the swap, so a quote is never served for reserves other than the
+ones it was computed with. The snapshot is the stateVersion of the contract and the local
+version of the pool when stateVersion is known, two integers compared instead of every
+reserve and fee field, and the fields used by the pool math otherwise. When a pool is seen with a new snapshot, after an
+indexer reported new token1_pool/token2_pool or tezPool/ctezPool values or after a swap
+was applied locally, the quotes of its previous snapshot are dropped at once instead of
+waiting for the eviction.
+
+Rejected swaps are cached too and raise the same SwapFailed on a hit.
+"""
+
+from collections import OrderedDict
+
+from tools.pool_math import SwapFailed
+
+# Quotes kept before the least recently used one is evicted
+DEFAULT_SIZE = 65536
+
+
+class QuoteCache:
+    """LRU cache of pool quotes with hit and miss counters
+
+    Args:
+        maxSize: most quotes kept
+    """
+
+    def __init__(self, maxSize = DEFAULT_SIZE):
+
+        if maxSize <= 0:
+            raise ValueError("maxSize must be positive")
+
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.snapshots = {}
+        self.poolKeys = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+
+        return len(self.entries)
+
+    def quote(self, pool, tokenIn, amountIn):
+        """Amount bought by selling amountIn of tokenIn to the pool
+
+        Raises:
+            SwapFailed: when the contract would reject the swap
+        """
+
+        snapshot = pool.snapshot()
+        if self.snapshots.get(pool.address) != snapshot:
+            self.invalidate(pool.address)
+            self.snapshots[pool.address] = snapshot
+
+        key = (pool.address, snapshot, tokenIn, amountIn)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            try:
+                entry = (pool.quote(tokenIn, amountIn), None)
+            except SwapFailed as error:
+                entry = (None, str(error))
+            self.store(key, entry)
+
+        amountOut, error = entry
+        if error is not None:
+            raise SwapFailed(error)
+        return amountOut
+
+    def store(self, key, entry):
+
+        self.entries[key] = entry
+        self.poolKeys.setdefault(key[0], set()).add(key)
+        if len(self.entries) > self.maxSize:
+            evicted, _ = self.entries.popitem(last = False)
+            keys = self.poolKeys[evicted[0]]
+            keys.discard(evicted)
+            if not keys:
+                del self.poolKeys[evicted[0]]
+            self.evictions += 1
+
+    def invalidate(self, address):
+        """Drops the quotes of a pool
+        """
+
+        keys = self.poolKeys.pop(address, None)
+        self.snapshots.pop(address, None)
+        if keys:
+            for key in keys:
+                del self.entries[key]
+            self.invalidations += 1
+
+    def report(self, pool, **fields):
+        """Applies storage fields reported by an indexer to a pool
+
+        The quotes of the pool are dropped only when a reported value differs from the
+        one held, repeated reports of unchanged reserves keep them. A report carrying the
+        stateVersion already held is skipped without comparing the other fields.
+
+        Args:
+            pool: tools.pool_math pool
+            fields: storage fields, for example token1_pool and token2_pool, and stateVersion
+        Returns:
+            True when the pool changed
+        """
+
+        # The ctez target of TezToCtez is not covered by stateVersion
+        if "stateVersion" in fields and pool.stateVersion == int(fields["stateVersion"]) and "target" not in fields:
+            return False
+
+        changed = {name: int(value) for name, value in fields.items() if getattr(pool, name) != int(value)}
+        if not changed:
+            return False
+        pool.update(**changed)
+        self.invalidate(pool.address)
+        return True
+
+    def clear(self):
+
+        self.entries.clear()
+        self.snapshots.clear()
+        self.poolKeys.clear()
+
+    def stats(self):
+        """Counters for tuning the size of the cache
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxSize": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,310 @@
+"""Off-chain route optimizer over the AMM, FlatCurve and TezToCtez pools
+
+Usage:
+    python -m tools.router <pools.json> <tokenIn> <tokenOut> <amountIn> [--max-hops N] [--split N]
+
+pools.json is a list of pools in the format of tools.pool_math.pool_from_dict. Tokens are
+given as "address:id" or "tez".
+
+Quotes use the exact contract math of tools.pool_math. Paths between two tokens are
+enumerated once from a precomputed adjacency and kept until the set of pools changes.
+A path can not return more than amountIn times the product of the marginal prices of
+its pools, so paths are evaluated by decreasing bound and the search stops as soon as
+the bound falls below the best exact quote. Quotes go through a tools.quote_cache
+QuoteCache, keyed on the reserves they were computed with.
+"""
+
+import argparse
+import json
+import time
+
+from tools.pool_math import SwapFailed, pool_from_dict, token_key
+from tools.quote_cache import QuoteCache
+
+# Paths longer than this are not explored
+MAX_HOPS = 3
+
+# Margin on the marginal price bound, covering the floor divisions of the contracts
+BOUND_SLACK = 1.001
+
+# Paths with the best bounds quoted when looking for the paths of a split
+SPLIT_CANDIDATES = 32
+
+
+class Route:
+    """Exact quote of a path
+
+    Attributes:
+        path: list of (pool, tokenIn, tokenOut)
+        amountIn: amount sold to the first pool
+        amountOut: amount bought from the last pool
+    """
+
+    __slots__ = ("path", "amountIn", "amountOut")
+
+    def __init__(self, path, amountIn, amountOut):
+
+        self.path = path
+        self.amountIn = amountIn
+        self.amountOut = amountOut
+
+    def pools(self):
+
+        return [pool.address for pool, _, _ in self.path]
+
+    def __repr__(self):
+
+        return "Route(%s, %d -> %d)" % (" > ".join(self.pools()), self.amountIn, self.amountOut)
+
+
+class Router:
+    """Token graph of the pools
+
+    Args:
+        pools: iterable of tools.pool_math pools
+        maxHops: longest path explored
+        quoteCache: QuoteCache used for the pool quotes, a new one when None
+    """
+
+    def __init__(self, pools = (), maxHops = MAX_HOPS, quoteCache = None):
+
+        self.maxHops = maxHops
+        self.pools = {}
+        self.adjacency = {}
+        self.paths = {}
+        self.quoteCache = quoteCache if quoteCache is not None else QuoteCache()
+        self.prices = {}
+        self.ranked = {}
+        for pool in pools:
+            self.add_pool(pool)
+
+    def add_pool(self, pool):
+        """Adds a pool to the graph, cached paths are dropped
+        """
+
+        self.pools[pool.address] = pool
+        token1, token2 = pool.tokens
+        self.adjacency.setdefault(token1, []).append((pool, token2))
+        self.adjacency.setdefault(token2, []).append((pool, token1))
+        self.paths.clear()
+        self.ranked.clear()
+
+    def update_pool(self, address, **fields):
+        """Updates storage fields of a pool, its cached quotes and prices are dropped when a value changed
+
+        Args:
+            address: pool address
+            fields: storage fields of the pool, for example token1_pool and token2_pool
+        """
+
+        pool = self.pools[address]
+        if not self.quoteCache.report(pool, **fields):
+            return
+        for token in pool.tokens:
+            self.prices.pop((address, token), None)
+        self.ranked.clear()
+
+    def candidate_paths(self, tokenIn, tokenOut):
+        """Simple paths from tokenIn to tokenOut, each pool and token used at most once
+
+        Returns:
+            list of paths, each path a tuple of (pool, tokenIn, tokenOut)
+        """
+
+        key = (tokenIn, tokenOut)
+        if key in self.paths:
+            return self.paths[key]
+
+        paths = []
+        stack = [(tokenIn, (), {tokenIn})]
+        while stack:
+            token, path, visited = stack.pop()
+            for pool, nextToken in self.adjacency.get(token, ()):
+                hop = (pool, token, nextToken)
+                if nextToken == tokenOut:
+                    paths.append(path + (hop,))
+                elif nextToken not in visited and len(path) + 1 < self.maxHops:
+                    stack.append((nextToken, path + (hop,), visited | {nextToken}))
+
+        self.paths[key] = paths
+        return paths
+
+    def quote_pool(self, pool, tokenIn, amountIn):
+        """Cached exact quote of one pool
+
+        Returns:
+            amount bought, None when the pool rejects the swap
+        """
+
+        try:
+            return self.quoteCache.quote(pool, tokenIn, amountIn)
+        except SwapFailed:
+            return None
+
+    def quote_path(self, path, amountIn):
+        """Exact quote of a path of distinct pools
+
+        Returns:
+            amount bought from the last pool, None when a pool rejects the swap
+        """
+
+        amount = amountIn
+        for pool, token, _ in path:
+            amount = self.quote_pool(pool, token, amount)
+            if amount is None:
+                return None
+        return amount
+
+    def price(self, path):
+        """Product of the marginal prices of the pools of a path, with the slack of the bound
+        """
+
+        price = BOUND_SLACK
+        for pool, token, _ in path:
+            key = (pool.address, token)
+            if key not in self.prices:
+                self.prices[key] = pool.marginal_price(token) * BOUND_SLACK
+            price *= self.prices[key]
+        return price
+
+    def ranked_paths(self, tokenIn, tokenOut, amountIn):
+        """Candidate paths sorted by decreasing bound, the bound of a path is amountIn times its price
+
+        The order does not depend on amountIn and is kept until a pool changes.
+
+        Returns:
+            list of (bound, path)
+        """
+
+        key = (tokenIn, tokenOut)
+        if key not in self.ranked:
+            ranked = [(self.price(path), path) for path in self.candidate_paths(tokenIn, tokenOut)]
+            ranked.sort(key = lambda item: -item[0])
+            self.ranked[key] = ranked
+        return [(amountIn * price, path) for price, path in self.ranked[key]]
+
+    def best_route(self, tokenIn, tokenOut, amountIn):
+        """Path with the highest exact output
+
+        Returns:
+            Route, None when no path accepts the swap
+        """
+
+        best = None
+        for bound, path in self.ranked_paths(tokenIn, tokenOut, amountIn):
+            if best is not None and bound <= best.amountOut:
+                break
+            amountOut = self.quote_path(path, amountIn)
+            if amountOut is not None and (best is None or amountOut > best.amountOut):
+                best = Route(path, amountIn, amountOut)
+        return best
+
+    def best_split(self, tokenIn, tokenOut, amountIn, parts = 10, maxRoutes = 4):
+        """Splits an order across pool-disjoint paths
+
+        The order is cut in parts, each part goes to the path where it adds the most output.
+        Paths never share a pool, so the exact quote of each path holds for the whole split.
+        The best single path is returned when no split beats it.
+
+        Args:
+            tokenIn: token sold
+            tokenOut: token bought
+            amountIn: amount sold
+            parts: number of parts of the order
+            maxRoutes: most paths used at once
+        Returns:
+            list of Route with a nonzero amountIn, empty when no split accepts the swap
+        """
+
+        best = self.best_route(tokenIn, tokenOut, amountIn)
+        if best is None:
+            return []
+
+        # Best path for the whole order, then the best paths for one part which do not share a pool with it
+        part = amountIn // parts
+        candidates = []
+        for bound, path in self.ranked_paths(tokenIn, tokenOut, part or amountIn)[:SPLIT_CANDIDATES]:
+            amountOut = self.quote_path(path, part or amountIn)
+            if amountOut is not None:
+                candidates.append((amountOut, path))
+        candidates.sort(key = lambda item: -item[0])
+
+        chosen = [best.path]
+        usedPools = set(best.pools())
+        for _, path in candidates:
+            if len(chosen) == maxRoutes:
+                break
+            pools = {pool.address for pool, _, _ in path}
+            if not pools & usedPools:
+                chosen.append(path)
+                usedPools |= pools
+
+        # Last part takes the rounding remainder
+        sizes = [part] * (parts - 1) + [amountIn - part * (parts - 1)] if part else [amountIn]
+
+        allocated = [0] * len(chosen)
+        outputs = [0] * len(chosen)
+        for size in sizes:
+            bestIndex, bestGain = None, None
+            for index, path in enumerate(chosen):
+                amountOut = self.quote_path(path, allocated[index] + size)
+                if amountOut is not None and (bestGain is None or amountOut - outputs[index] > bestGain):
+                    bestIndex, bestGain = index, amountOut - outputs[index]
+            if bestIndex is None:
+                return [best]
+            allocated[bestIndex] += size
+            outputs[bestIndex] += bestGain
+
+        if sum(outputs) <= best.amountOut:
+            return [best]
+
+        return [Route(path, allocated[index], outputs[index]) for index, path in enumerate(chosen) if allocated[index]]
+
+
+def load_pools(path):
+    """Loads the pools of a JSON file
+
+    Returns:
+        list of tools.pool_math pools
+    """
+
+    with open(path) as poolsFile:
+        return [pool_from_dict(data) for data in json.load(poolsFile)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Finds the best route between two tokens")
+    parser.add_argument("pools", help = "JSON list of pools")
+    parser.add_argument("tokenIn", help = "token sold, address:id or tez")
+    parser.add_argument("tokenOut", help = "token bought, address:id or tez")
+    parser.add_argument("amountIn", type = int, help = "amount sold")
+    parser.add_argument("--max-hops", type = int, default = MAX_HOPS, help = "longest path explored")
+    parser.add_argument("--split", type = int, default = 0, help = "split the order in N parts across disjoint paths")
+    parser.add_argument("--stats", action = "store_true", help = "print the counters of the quote cache")
+    arguments = parser.parse_args()
+
+    router = Router(load_pools(arguments.pools), arguments.max_hops)
+    tokenIn, tokenOut = token_key(arguments.tokenIn), token_key(arguments.tokenOut)
+
+    start = time.perf_counter()
+    if arguments.split:
+        routes = router.best_split(tokenIn, tokenOut, arguments.amountIn, arguments.split)
+    else:
+        route = router.best_route(tokenIn, tokenOut, arguments.amountIn)
+        routes = [route] if route else []
+    elapsed = time.perf_counter() - start
+
+    if not routes:
+        print("No route")
+        return
+
+    for route in routes:
+        print("%d -> %d via %s" % (route.amountIn, route.amountOut, " > ".join(route.pools())))
+    print("total out %d in %.2f ms" % (sum(route.amountOut for route in routes), elapsed * 1000))
+    if arguments.stats:
+        print("quote cache %(hits)d hits, %(misses)d misses, %(evictions)d evictions, %(size)d quotes" % router.quoteCache.stats())
+
+
+if __name__ == "__main__":
+    main()
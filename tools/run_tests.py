@@ -0,0 +1,213 @@
+"""Parallel runner of the SmartPy scenarios and compilation targets of the contracts
+
+Usage:
+    python -m tools.run_tests [--output build/tests] [--workers N] [--only PATTERN] [--no-cache] [--error-codes]
+
+Every contract file declaring @sp.add_test scenarios or sp.add_compilation_target
+targets is found in the contract directories. Its scenarios are run with
+SmartPy.sh test and its targets compiled with SmartPy.sh compile (tools.smartpy_cli), one
+job per file and command, in a pool of processes using all cores by default.
+
+Outputs are collected in a results tree, one directory per contract file and command in
+which SmartPy writes one directory per scenario or target:
+
+    <output>/<directory>/<file>/test/<scenario>/...
+    <output>/<directory>/<file>/compile/<target>/...
+    <output>/<directory>/<file>/<command>.log
+    <output>/summary.json
+
+A job is keyed by the hash of its command, of the SmartPy CLI version, of the source of
+the file and of every script it imports with sp.io.import_script_from_url("file:..."),
+recursively. A job whose key
+passed in a previous run is skipped, --no-cache runs every job. The cache keeps the
+entries of the jobs not run, so --only runs do not invalidate the other files.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from tools import smartpy_cli
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directories that hold no contract
+SKIPPED = ("tools", "benchmarks", "deploy")
+
+CACHE = "cache.json"
+
+SCENARIO = re.compile(r'@sp\.add_test\(\s*name\s*=\s*"([^"]+)"')
+TARGET = re.compile(r'sp\.add_compilation_target\(\s*"([^"]+)"')
+IMPORT = re.compile(r'import_script_from_url\(\s*"file:([^"]+)"')
+
+
+def discover(root = ROOT):
+    """Contract files with scenarios or compilation targets
+
+    Returns:
+        list of dict script (path relative to the root), scenarios and targets
+    """
+
+    found = []
+    for directory in sorted(os.listdir(root)):
+        path = os.path.join(root, directory)
+        if directory.startswith(".") or directory in SKIPPED or not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".py"):
+                continue
+            with open(os.path.join(path, name)) as sourceFile:
+                source = sourceFile.read()
+            scenarios, targets = SCENARIO.findall(source), TARGET.findall(source)
+            if scenarios or targets:
+                found.append({"script": directory + "/" + name, "scenarios": scenarios, "targets": targets})
+    return found
+
+
+def source_hash(script, root = ROOT):
+    """Hash of a script and of the scripts it imports, recursively
+    """
+
+    digest = hashlib.sha256()
+    pending, seen = [script], set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(os.path.join(root, path), "rb") as sourceFile:
+            source = sourceFile.read()
+        digest.update(path.encode() + b"\0" + source + b"\0")
+        pending.extend(sorted(IMPORT.findall(source.decode())))
+    return digest.hexdigest()
+
+
+def jobs(contracts, errorCodes = False):
+    """Commands to run, a test for every file with scenarios and a compile for every file with targets
+
+    Returns:
+        list of dict script, command, key, environment
+    """
+
+    environment = {"PLENTY_ERROR_CODES": "1"} if errorCodes else {}
+    version = smartpy_cli.cli_version()
+    result = []
+    for contract in contracts:
+        sourceKey = source_hash(contract["script"])
+        for command, names in (("test", contract["scenarios"]), ("compile", contract["targets"])):
+            if names:
+                key = hashlib.sha256(json.dumps([command, sourceKey, environment, names, version], sort_keys = True).encode()).hexdigest()
+                result.append({"script": contract["script"], "command": command, "names": names, "key": key, "environment": environment})
+    return result
+
+
+def job_directory(output, job):
+
+    return os.path.join(output, job["script"][:-len(".py")], job["command"])
+
+
+def run_job(job, output):
+    """Runs one job in a clean output directory
+
+    Returns:
+        dict script, command, key, passed and the scenario or target directories written
+    """
+
+    directory = job_directory(output, job)
+    shutil.rmtree(directory, ignore_errors = True)
+    os.makedirs(directory)
+
+    passed = True
+    try:
+        log = smartpy_cli.run(job["command"], job["script"], directory, job["environment"])
+    except (smartpy_cli.CompilationFailed, FileNotFoundError) as error:
+        passed, log = False, str(error)
+    with open(directory + ".log", "w") as logFile:
+        logFile.write(log)
+
+    return {
+        "script": job["script"],
+        "command": job["command"],
+        "key": job["key"],
+        "passed": passed,
+        "outputs": sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))),
+    }
+
+
+def run_all(jobList, output, workers = None, cache = True):
+    """Runs the jobs whose key did not pass in the previous run
+
+    Args:
+        workers: processes of the pool, all cores when None, in process when 1
+    Returns:
+        list of results of run_job, cached ones having cached = True
+    """
+
+    cachePath = os.path.join(output, CACHE)
+    previous = {}
+    if os.path.isfile(cachePath):
+        with open(cachePath) as cacheFile:
+            previous = json.load(cacheFile)
+
+    results, pending = [], []
+    for job in jobList:
+        cached = previous.get(job["key"]) if cache else None
+        if cached is not None and cached["passed"] and os.path.isdir(job_directory(output, job)):
+            results.append(dict(cached, cached = True))
+        else:
+            pending.append(job)
+
+    if workers == 1:
+        results += [run_job(job, output) for job in pending]
+    elif pending:
+        with ProcessPoolExecutor(workers) as executor:
+            results += list(executor.map(run_job, pending, [output] * len(pending)))
+
+    # Jobs left out by --only keep their entries, the previous keys of the jobs run are replaced
+    ran = {(result["script"], result["command"]) for result in results}
+    merged = {key: entry for key, entry in previous.items() if (entry["script"], entry["command"]) not in ran}
+    merged.update((result["key"], dict(result, cached = False)) for result in results)
+
+    os.makedirs(output, exist_ok = True)
+    with open(cachePath, "w") as cacheFile:
+        json.dump(merged, cacheFile, indent = 2, sort_keys = True)
+    results.sort(key = lambda result: (result["script"], result["command"]))
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Runs the SmartPy scenarios and compilation targets of the contracts in parallel")
+    parser.add_argument("--output", default = os.path.join(ROOT, "build", "tests"), help = "results tree")
+    parser.add_argument("--workers", type = int, default = None, help = "processes used, all cores by default")
+    parser.add_argument("--only", help = "glob of the scripts run, for example Staking/*")
+    parser.add_argument("--no-cache", action = "store_true", help = "runs every job")
+    parser.add_argument("--error-codes", action = "store_true", help = "compiles with PLENTY_ERROR_CODES=1")
+    arguments = parser.parse_args()
+
+    contracts = discover()
+    if arguments.only:
+        contracts = [contract for contract in contracts if fnmatch.fnmatch(contract["script"], arguments.only)]
+
+    output = os.path.abspath(arguments.output)
+    results = run_all(jobs(contracts, arguments.error_codes), output, arguments.workers, not arguments.no_cache)
+    with open(os.path.join(output, "summary.json"), "w") as summaryFile:
+        json.dump(results, summaryFile, indent = 2)
+
+    for result in results:
+        print("%-6s %-7s %-40s %s" % (
+            "ok" if result["passed"] else "FAILED", result["command"], result["script"],
+            "cached" if result.get("cached") else ", ".join(result["outputs"])
+        ))
+    if not all(result["passed"] for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Thin wrapper around the SmartPy CLI
+
+The CLI is found through the SMARTPY_CLI environment variable, or at the
+~/smartpy-cli/SmartPy.sh location used in the README. Scripts are compiled from the
+repository root so their sp.io.import_script_from_url("file:...") paths resolve.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import subprocess
+
+from tools.micheline import load
+
+# Repository root, parent of the tools package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CLI = os.path.join("~", "smartpy-cli", "SmartPy.sh")
+
+# Output files of a compilation target, for example step_000_cont_0_contract.json
+OUTPUT = re.compile(r"(contract|storage|expression)\.(json|tz)$")
+
+
+class CompilationFailed(Exception):
+    pass
+
+
+def cli_path():
+    """Path of SmartPy.sh
+
+    Raises:
+        FileNotFoundError: when the CLI is not installed
+    """
+
+    path = os.path.expanduser(os.environ.get("SMARTPY_CLI", DEFAULT_CLI))
+    if not os.path.isfile(path):
+        raise FileNotFoundError("SmartPy CLI not found at %s, set SMARTPY_CLI" % path)
+    return path
+
+
+@functools.lru_cache(maxsize = None)
+def cli_version():
+    """Version of the installed CLI, part of the cache keys of the compiled outputs
+
+    Returns:
+        the output of SmartPy.sh --version, a hash of the CLI path and script when it
+        prints no version, None when the CLI is not installed
+    """
+
+    try:
+        path = cli_path()
+    except FileNotFoundError:
+        return None
+
+    result = subprocess.run([path, "--version"], cwd = ROOT, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    if result.returncode == 0 and result.stdout.strip():
+        return result.stdout.strip()
+
+    with open(path, "rb") as cliFile:
+        return hashlib.sha256(os.path.realpath(path).encode() + b"\0" + cliFile.read()).hexdigest()
+
+
+def run(command, script, outputDirectory, environment = None):
+    """Runs a SmartPy.sh command on a script
+
+    Args:
+        command: compile or test
+        script: script path, relative to the repository root
+        outputDirectory: directory receiving the outputs
+        environment: extra environment variables, for example PLENTY_ERROR_CODES
+    Raises:
+        CompilationFailed: with the output of the CLI when it fails
+    """
+
+    env = dict(os.environ)
+    env.update(environment or {})
+    result = subprocess.run(
+        [cli_path(), command, script, outputDirectory],
+        cwd = ROOT, env = env, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True
+    )
+    if result.returncode != 0:
+        raise CompilationFailed("%s %s failed:\n%s" % (command, script, result.stdout))
+    return result.stdout
+
+
+def compile_script(script, outputDirectory, environment = None):
+    """Compiles every compilation target of a script
+
+    Returns:
+        dict target name -> dict kind -> path, kinds being contract, storage and
+        expression followed by .json or .tz
+    """
+
+    run("compile", script, outputDirectory, environment)
+    return targets(outputDirectory)
+
+
+def targets(outputDirectory):
+    """Output files of the compilation targets found in an output directory
+    """
+
+    found = {}
+    for name in sorted(os.listdir(outputDirectory)):
+        directory = os.path.join(outputDirectory, name)
+        if not os.path.isdir(directory):
+            continue
+        files = target_files(directory)
+        if files:
+            found[name] = files
+    return found
+
+
+def target_files(directory):
+    """Output files of the directory of one compilation target
+    """
+
+    files = {}
+    for fileName in sorted(os.listdir(directory)):
+        match = OUTPUT.search(fileName)
+        if match:
+            files["%s.%s" % match.groups()] = os.path.join(directory, fileName)
+    return files
+
+
+def code(files):
+    """Micheline code of a compiled contract
+    """
+
+    return load(files["contract.json"])
+
+
+def storage(files):
+    """Micheline initial storage of a compiled contract
+    """
+
+    return load(files["storage.json"])
+
+
+def michelson(files, kind):
+    """Michelson text of an output, storage or expression
+    """
+
+    with open(files[kind + ".tz"]) as tzFile:
+        return tzFile.read().strip()
@@ -0,0 +1,577 @@
+"""Exact replay engine of the Staking Contract from a JSONL event log
+
+Usage:
+    python -m tools.staking_replay <events.jsonl> [--admin ADDRESS] [--checkpoint FILE] [--every N]
+                                   [--resume] [--payouts FILE] [--dump FILE] [--expect FILE] [--legacy]
+
+Every line of the log is one contract call, in chain order:
+
+    {"level": 100, "sender": "tz1...", "entrypoint": "stake", "params": {"amount": "100"}}
+
+Calls are applied with the storage semantics of Staking/staking.py: the same integer
+math, the same checks and the same error messages. A call failing a check leaves the
+storage untouched, as the chain would. AddReward calls without a streamId apply to
+stream 0, so logs of the single reward token Staking Contract replay unchanged, and
+--legacy dumps the storage with the single reward token field names.
+
+The engine state is pickled to the checkpoint file every N calls, --resume restarts
+from it. The checkpoint records the size of the payouts file, which --resume truncates
+back to, so the transfers made after the last checkpoint are not written twice. The
+final storage can be dumped to JSON and diffed against chain storage.
+"""
+
+import argparse
+import csv
+import json
+import os
+import pickle
+import sys
+
+# Constants of Staking/staking.py
+DECIMAL = 10 ** 18
+
+MULTIPLIER = 10 ** 12
+
+TOKEN_ID = 0
+
+MAX_REWARD_STREAMS = 5
+
+# Initial Staking storage
+UNSTAKE_FEE = {1 : 4, 2 : 8, 3 : 10}
+
+BLOCKS_PER_CYCLE = 4096
+
+DEFAULT_UNSTAKE_FEE = 25
+
+
+class CallFailed(Exception):
+    """Raised when a call fails one of the contract checks, the storage is left untouched
+    """
+
+
+class RewardStream:
+    """Value of the rewardStreams map
+    """
+
+    __slots__ = ("token", "tokenId", "faTwoCheck", "rewardRate", "rewardPerTokenStored", "periodFinish", "lastUpdateTime")
+
+    def __init__(self, token, tokenId = 0, faTwoCheck = False):
+
+        self.token = token
+        self.tokenId = tokenId
+        self.faTwoCheck = faTwoCheck
+        self.rewardRate = 0
+        self.rewardPerTokenStored = 0
+        self.periodFinish = 0
+        self.lastUpdateTime = 0
+
+
+class UserState:
+    """Value of the balances big_map
+
+    InvestMap values are (amount, level) tuples.
+    """
+
+    __slots__ = ("balance", "rewards", "userRewardPerTokenPaid", "counter", "InvestMap")
+
+    def __init__(self):
+
+        self.balance = 0
+        self.rewards = {}
+        self.userRewardPerTokenPaid = {}
+        self.counter = 0
+        self.InvestMap = {}
+
+
+class StakingState:
+    """Storage of the Staking Contract and its entrypoints
+
+    Args:
+        admin: admin address, sender checks are skipped when None
+        stakeToken: stake token address
+        rewardToken: reward token address of stream 0
+        faTwoToken: boolean describing whether the stake token is FA2
+        onTransfer: optional function(level, sender, receiver, amount, token, tokenId) called for every token transfer
+    """
+
+    __slots__ = (
+        "totalSupply", "rewardStreams", "streamCounter", "periodFinish", "unstakeFee", "stakeToken", "admin",
+        "balances", "paused", "blocksPerCycle", "defaultUnstakeFee", "totalFee", "faTwoToken", "onTransfer"
+    )
+
+    def __init__(self, admin = None, stakeToken = None, rewardToken = None, faTwoToken = False, onTransfer = None):
+
+        self.totalSupply = 0
+        self.rewardStreams = {0 : RewardStream(rewardToken)}
+        self.streamCounter = 1
+        self.periodFinish = 0
+        self.unstakeFee = dict(UNSTAKE_FEE)
+        self.stakeToken = stakeToken
+        self.admin = admin
+        self.balances = {}
+        self.paused = False
+        self.blocksPerCycle = BLOCKS_PER_CYCLE
+        self.defaultUnstakeFee = DEFAULT_UNSTAKE_FEE
+        self.totalFee = 0
+        self.faTwoToken = faTwoToken
+        self.onTransfer = onTransfer
+
+    def __getstate__(self):
+
+        return {name : getattr(self, name) for name in self.__slots__ if name != "onTransfer"}
+
+    def __setstate__(self, state):
+
+        self.onTransfer = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def transfer(self, level, sender, receiver, amount, token, tokenId):
+
+        if self.onTransfer is not None:
+            self.onTransfer(level, sender, receiver, amount, token, tokenId)
+
+    def verifyAdmin(self, sender, message):
+
+        if self.admin is not None and sender != self.admin:
+            raise CallFailed(message)
+
+    def UpdateReward(self, level, address):
+        """Settles every reward stream, and the rewards of address unless it is None (sp.self_address)
+        """
+
+        user = self.balances[address] if address is not None else None
+
+        for streamId, stream in self.rewardStreams.items():
+
+            lastUpdate = stream.periodFinish if level > stream.periodFinish else level
+
+            if self.totalSupply != 0:
+                stream.rewardPerTokenStored += (lastUpdate - stream.lastUpdateTime) * DECIMAL * stream.rewardRate // self.totalSupply
+
+            stream.lastUpdateTime = lastUpdate
+
+            if user is not None:
+                paid = user.userRewardPerTokenPaid.get(streamId, 0)
+                user.rewards[streamId] = user.rewards.get(streamId, 0) + user.balance * (stream.rewardPerTokenStored - paid) // DECIMAL
+                user.userRewardPerTokenPaid[streamId] = stream.rewardPerTokenStored
+
+    def GetReward(self, level, sender, params):
+
+        if sender not in self.balances:
+            raise CallFailed("User has not Staked")
+
+        self.UpdateReward(level, sender)
+
+        user = self.balances[sender]
+        for streamId, reward in user.rewards.items():
+            if reward > 0:
+                user.rewards[streamId] = 0
+                stream = self.rewardStreams[streamId]
+                self.transfer(level, None, sender, reward, stream.token, stream.tokenId)
+
+    def stake(self, level, sender, params):
+
+        amount = int(params["amount"])
+
+        if self.paused:
+            raise CallFailed("Contract is not accepting New Staking Orders")
+        if level > self.periodFinish:
+            raise CallFailed("Users can't stake after period finish")
+        if amount <= 0:
+            raise CallFailed("Cannot Stake Amount Less than 1")
+
+        if sender not in self.balances:
+            self.balances[sender] = UserState()
+        self.UpdateReward(level, sender)
+
+        self.transfer(level, sender, None, amount, self.stakeToken, TOKEN_ID)
+
+        user = self.balances[sender]
+        self.totalSupply += amount * MULTIPLIER
+        user.balance += amount * MULTIPLIER
+        user.InvestMap[user.counter] = (amount, level)
+        user.counter += 1
+
+    def unstake(self, level, sender, params):
+
+        mapKey = int(params["MapKey"])
+        amount = int(params["Amount"])
+
+        user = self.balances.get(sender)
+        if user is None:
+            raise CallFailed("Sender has not Staked any amount")
+        if mapKey not in user.InvestMap:
+            raise CallFailed("Map Key does not Exist for the User")
+        lotAmount, lotLevel = user.InvestMap[mapKey]
+        if lotAmount < amount:
+            raise CallFailed("Request Amount is greater than Lot Amount")
+
+        # changeUnstakeFee accepts blocksPerCycle = 0, the contract division then fails
+        if self.blocksPerCycle == 0:
+            raise CallFailed("DivisionByZero")
+        cycles = (level - lotLevel) // self.blocksPerCycle + 1
+        divisor = self.unstakeFee.get(cycles, self.defaultUnstakeFee)
+        if divisor == 0:
+            raise CallFailed("DivisionByZero")
+
+        self.UpdateReward(level, sender)
+
+        self.totalSupply -= amount * MULTIPLIER
+        user.balance -= amount * MULTIPLIER
+
+        if lotAmount == amount:
+            del user.InvestMap[mapKey]
+        else:
+            user.InvestMap[mapKey] = (lotAmount - amount, lotLevel)
+
+        fee = amount // divisor
+        self.totalFee += fee
+
+        self.transfer(level, None, sender, amount - fee, self.stakeToken, TOKEN_ID)
+
+    def AddReward(self, level, sender, params):
+
+        streamId = int(params.get("streamId", 0))
+        reward = int(params["reward"])
+        blocks = int(params["blocks"])
+
+        self.verifyAdmin(sender, "Invalid Account")
+        if streamId not in self.rewardStreams:
+            raise CallFailed("Reward Stream does not Exist")
+        if blocks == 0:
+            raise CallFailed("DivisionByZero")
+
+        self.UpdateReward(level, None)
+
+        stream = self.rewardStreams[streamId]
+        if level >= stream.periodFinish:
+            stream.rewardRate = reward // blocks
+        else:
+            leftOver = (stream.periodFinish - level) * stream.rewardRate
+            stream.rewardRate = (leftOver + reward) // blocks
+
+        stream.lastUpdateTime = level
+        stream.periodFinish = level + blocks
+
+        if stream.periodFinish > self.periodFinish:
+            self.periodFinish = stream.periodFinish
+
+    def AddRewardStream(self, level, sender, params):
+
+        self.verifyAdmin(sender, "Invalid Account")
+        if len(self.rewardStreams) >= MAX_REWARD_STREAMS:
+            raise CallFailed("Max Reward Streams Reached")
+
+        self.rewardStreams[self.streamCounter] = RewardStream(params.get("token"), int(params.get("tokenId", 0)), bool(params.get("faTwoCheck", False)))
+        self.streamCounter += 1
+
+    def RecoverExcessToken(self, level, sender, params):
+
+        self.verifyAdmin(sender, "Invalid Account")
+        if int(params["type"]) == 1:
+            if params["address"] == self.stakeToken and int(params["id"]) == TOKEN_ID:
+                raise CallFailed("Admin trying to recover the staked tokens")
+            self.transfer(level, None, params["address"], int(params["value"]), params["token"], int(params["id"]))
+        else:
+            if params["address"] == self.stakeToken:
+                raise CallFailed("Admin trying to recover the staked tokens")
+            self.transfer(level, None, params["address"], int(params["value"]), params["token"], 0)
+
+    def changeAdmin(self, level, sender, params):
+
+        self.verifyAdmin(sender, "Invalid User")
+        self.admin = params if isinstance(params, str) else params["address"]
+
+    def changeState(self, level, sender, params):
+
+        self.verifyAdmin(sender, "Invalid User")
+        self.paused = not self.paused
+
+    def changeUnstakeFee(self, level, sender, params):
+
+        self.verifyAdmin(sender, "Invalid User")
+        self.unstakeFee[int(params["cycles"])] = int(params["fee"])
+        self.blocksPerCycle = int(params["blocksPerCycle"])
+        self.defaultUnstakeFee = int(params["defaultFee"])
+
+    def WithdrawFee(self, level, sender, params):
+
+        if self.totalFee <= 0:
+            raise CallFailed("Fee Should be Greater than 0")
+        self.verifyAdmin(sender, "Invalid User")
+
+        amount, self.totalFee = self.totalFee, 0
+        self.transfer(level, None, sender, amount, self.stakeToken, TOKEN_ID)
+
+    ENTRYPOINTS = (
+        "GetReward", "stake", "unstake", "AddReward", "AddRewardStream", "RecoverExcessToken",
+        "changeAdmin", "changeState", "changeUnstakeFee", "WithdrawFee"
+    )
+
+    def apply(self, level, sender, entrypoint, params):
+        """Applies one call
+
+        Args:
+            level: block level of the call
+            sender: address calling the contract
+            entrypoint: entrypoint name
+            params: entrypoint parameters
+        Raises:
+            CallFailed: when the call fails a contract check, the storage is then unchanged
+        """
+
+        if entrypoint not in self.ENTRYPOINTS:
+            raise CallFailed("Unknown entrypoint %s" % entrypoint)
+        getattr(self, entrypoint)(level, sender, params)
+
+    def storage(self, legacy = False):
+        """Dumps the storage as JSON compatible data, big integers as strings
+
+        Args:
+            legacy: dump with the field names of the single reward token Staking Contract (stream 0)
+        Returns:
+            dict keyed by storage field name
+        """
+
+        def number(value):
+            return str(value)
+
+        def numbers(mapping):
+            return {str(key) : number(value) for key, value in sorted(mapping.items())}
+
+        balances = {}
+        for address, user in sorted(self.balances.items()):
+            investMap = {str(key) : {"amount" : number(amount), "level" : number(level)} for key, (amount, level) in sorted(user.InvestMap.items())}
+            balances[address] = {"balance" : number(user.balance), "counter" : number(user.counter), "InvestMap" : investMap}
+            if legacy:
+                balances[address]["rewards"] = number(user.rewards.get(0, 0))
+                balances[address]["userRewardPerTokenPaid"] = number(user.userRewardPerTokenPaid.get(0, 0))
+            else:
+                balances[address]["rewards"] = numbers(user.rewards)
+                balances[address]["userRewardPerTokenPaid"] = numbers(user.userRewardPerTokenPaid)
+
+        storage = {
+            "totalSupply" : number(self.totalSupply),
+            "periodFinish" : number(self.periodFinish),
+            "unstakeFee" : numbers(self.unstakeFee),
+            "stakeToken" : self.stakeToken,
+            "admin" : self.admin,
+            "balances" : balances,
+            "paused" : self.paused,
+            "blocksPerCycle" : number(self.blocksPerCycle),
+            "defaultUnstakeFee" : number(self.defaultUnstakeFee),
+            "totalFee" : number(self.totalFee),
+            "faTwoToken" : self.faTwoToken,
+        }
+
+        streams = {
+            str(streamId) : {
+                "token" : stream.token, "tokenId" : number(stream.tokenId), "faTwoCheck" : stream.faTwoCheck,
+                "rewardRate" : number(stream.rewardRate), "rewardPerTokenStored" : number(stream.rewardPerTokenStored),
+                "periodFinish" : number(stream.periodFinish), "lastUpdateTime" : number(stream.lastUpdateTime)
+            }
+            for streamId, stream in sorted(self.rewardStreams.items())
+        }
+
+        if legacy:
+            stream = streams["0"]
+            storage.update(
+                rewardToken = stream["token"], rewardRate = stream["rewardRate"], rewardPerTokenStored = stream["rewardPerTokenStored"],
+                lastUpdateTime = stream["lastUpdateTime"]
+            )
+        else:
+            storage.update(rewardStreams = streams, streamCounter = number(self.streamCounter))
+
+        return storage
+
+
+def read_events(path, skip = 0):
+    """Reads a JSONL event log lazily
+
+    Args:
+        path: path of the JSONL file
+        skip: number of events to skip, used when resuming from a checkpoint
+    Yields:
+        (level, sender, entrypoint, params)
+    """
+
+    with open(path) as events:
+        for line in events:
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            event = json.loads(line)
+            yield int(event["level"]), event.get("sender"), event["entrypoint"], event.get("params") or {}
+
+
+def save_checkpoint(path, state, applied, failed, payouts = None):
+    """Pickles the engine state, replacing the previous checkpoint atomically
+
+    Args:
+        path: checkpoint file
+        state: StakingState
+        applied: number of events read so far
+        failed: number of failed calls so far
+        payouts: size in bytes of the payouts file written so far, None without payouts file
+    """
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as checkpoint:
+        pickle.dump({"state" : state, "applied" : applied, "failed" : failed, "payouts" : payouts}, checkpoint, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """Loads a checkpoint written by save_checkpoint
+
+    Args:
+        path: checkpoint file
+    Returns:
+        (state, applied, failed, payouts), payouts is None for checkpoints written without payouts file
+    """
+
+    with open(path, "rb") as checkpoint:
+        data = pickle.load(checkpoint)
+    return data["state"], data["applied"], data["failed"], data.get("payouts")
+
+
+def payouts_size(payouts):
+    """Flushes the payouts file and returns its size in bytes
+
+    Args:
+        payouts: payouts file, or None
+    Returns:
+        size of the file, None without payouts file
+    """
+
+    if payouts is None:
+        return None
+    payouts.flush()
+    return payouts.tell()
+
+
+def replay(events, state, checkpoint = None, every = 100000, applied = 0, failed = 0, payouts = None):
+    """Applies an event stream to a state
+
+    Args:
+        events: iterable of (level, sender, entrypoint, params)
+        state: StakingState to apply the events to
+        checkpoint: checkpoint file, no checkpoints are written when None
+        every: number of events between two checkpoints
+        applied: number of events already applied to state
+        failed: number of failed calls already counted
+        payouts: payouts file written by state.onTransfer, its size is saved with the checkpoints
+    Returns:
+        (applied, failed)
+    """
+
+    for level, sender, entrypoint, params in events:
+        try:
+            state.apply(level, sender, entrypoint, params)
+        except CallFailed:
+            failed += 1
+        applied += 1
+        if checkpoint and applied % every == 0:
+            save_checkpoint(checkpoint, state, applied, failed, payouts_size(payouts))
+
+    if checkpoint:
+        save_checkpoint(checkpoint, state, applied, failed, payouts_size(payouts))
+
+    return applied, failed
+
+
+def diff_storage(expected, actual, path = ""):
+    """Lists the differences between two storage dumps
+
+    Only the fields present in expected are compared, numbers are compared as strings.
+
+    Args:
+        expected: storage dump, for example from chain storage
+        actual: storage dump of the engine
+        path: path of the compared values
+    Returns:
+        list of (path, expected, actual)
+    """
+
+    if isinstance(expected, dict):
+        if not isinstance(actual, dict):
+            return [(path, expected, actual)]
+        differences = []
+        for key, value in expected.items():
+            differences += diff_storage(value, actual.get(str(key)), "%s/%s" % (path, key))
+        return differences
+
+    if isinstance(expected, bool) or isinstance(actual, bool) or expected is None or actual is None:
+        return [] if expected == actual else [(path, expected, actual)]
+
+    return [] if str(expected) == str(actual) else [(path, expected, actual)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Replays Staking Contract calls from a JSONL event log")
+    parser.add_argument("events", help = "JSONL event log in chain order")
+    parser.add_argument("--admin", help = "admin address at origination, admin checks are skipped when missing")
+    parser.add_argument("--stake-token", help = "stake token address")
+    parser.add_argument("--reward-token", help = "reward token address")
+    parser.add_argument("--fa-two", action = "store_true", help = "the stake token is FA2")
+    parser.add_argument("--checkpoint", help = "checkpoint file")
+    parser.add_argument("--every", type = int, default = 100000, help = "events between two checkpoints")
+    parser.add_argument("--resume", action = "store_true", help = "resume from the checkpoint file")
+    parser.add_argument("--payouts", help = "CSV file receiving every token transfer made by the contract")
+    parser.add_argument("--dump", help = "JSON file receiving the final storage")
+    parser.add_argument("--expect", help = "JSON storage to diff the final storage against")
+    parser.add_argument("--legacy", action = "store_true", help = "use the single reward token storage layout for --dump and --expect")
+    arguments = parser.parse_args()
+
+    if arguments.resume and not arguments.checkpoint:
+        parser.error("--resume requires --checkpoint")
+
+    applied, failed, payoutsOffset = 0, 0, None
+    if arguments.resume:
+        state, applied, failed, payoutsOffset = load_checkpoint(arguments.checkpoint)
+        if arguments.payouts and payoutsOffset is None:
+            parser.error("the checkpoint was written without --payouts, the payouts file cannot be resumed")
+    else:
+        state = StakingState(arguments.admin, arguments.stake_token, arguments.reward_token, arguments.fa_two)
+
+    payoutsFile = open(arguments.payouts, "a" if arguments.resume else "w", newline = "") if arguments.payouts else None
+    if payoutsFile:
+        payouts = csv.writer(payoutsFile)
+        if arguments.resume:
+            # Rows written after the checkpoint are written again by the replay
+            payoutsFile.truncate(payoutsOffset)
+            payoutsFile.seek(payoutsOffset)
+        else:
+            payouts.writerow(["level", "from", "to", "amount", "token", "tokenId"])
+        state.onTransfer = lambda *transfer: payouts.writerow(transfer)
+
+    try:
+        applied, failed = replay(read_events(arguments.events, skip = applied), state, arguments.checkpoint, arguments.every, applied, failed, payoutsFile)
+    finally:
+        if payoutsFile:
+            payoutsFile.close()
+
+    print("%d calls replayed, %d failed" % (applied, failed))
+
+    storage = state.storage(legacy = arguments.legacy)
+    if arguments.dump:
+        with open(arguments.dump, "w") as dump:
+            json.dump(storage, dump, indent = 2)
+
+    if arguments.expect:
+        with open(arguments.expect) as expectFile:
+            differences = diff_storage(json.load(expectFile), storage)
+        for path, expected, actual in differences:
+            print("%s: expected %s, replayed %s" % (path, expected, actual))
+        if differences:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Run from the imported module so that checkpoints pickle tools.staking_replay classes
+    from tools.staking_replay import main
+    main()
@@ -0,0 +1,617 @@
+"""Vectorized simulator of the Staking Contract rewards for large user populations
+
+Usage:
+    python -m tools.staking_sim <events.jsonl> <output-directory> [--admin ADDRESS] [--blocks-per-year N]
+
+Events are read lazily from a JSONL log, one contract call per line, sorted by level:
+
+    {"level": 100, "sender": "tz1...", "entrypoint": "stake", "params": {"amount": "100"}}
+
+The calls of a block are applied in log order. Consecutive stake, unstake or GetReward
+calls are applied together as array operations over the users, while admin calls
+(AddRewardStream, AddReward, changeUnstakeFee, changeState, changeAdmin) are applied
+one at a time between these runs, so a call always sees the state left by the calls
+before it, as in tools/staking_replay.py. Balances exceed 64 bits, so the arrays hold
+Python integers and the reward math is the exact integer math of Staking/staking.py.
+
+Results are streamed to the output directory, so memory only depends on the
+number of users and lots, not on the number of blocks:
+    blocks.csv: contract state, payouts and reward yield after each block
+    payouts.csv: every reward payout made by GetReward
+    users.csv: final balances and reward estimates of every user
+"""
+
+import argparse
+import csv
+import itertools
+import os
+
+import numpy as np
+
+from tools.staking_replay import DECIMAL, MULTIPLIER, MAX_REWARD_STREAMS, UNSTAKE_FEE, BLOCKS_PER_CYCLE, DEFAULT_UNSTAKE_FEE, read_events
+
+# 30 seconds blocks
+BLOCKS_PER_YEAR = 1051200
+
+ADMIN_ENTRYPOINTS = ("AddRewardStream", "AddReward", "changeUnstakeFee", "changeState", "changeAdmin")
+
+
+def occurrence_rank(keys):
+    """Ranks every key among the previous occurrences of the same key
+
+    Args:
+        keys: integer array
+    Returns:
+        array holding 0 for the first occurrence of a key, 1 for the second one, ...
+    """
+
+    order = np.argsort(keys, kind = "stable")
+    sortedKeys = keys[order]
+    starts = np.ones(len(keys), dtype = bool)
+    starts[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    groupStart = np.maximum.accumulate(np.where(starts, np.arange(len(keys)), 0))
+    rank = np.empty(len(keys), dtype = np.int64)
+    rank[order] = np.arange(len(keys)) - groupStart
+    return rank
+
+
+def objects(values):
+    """Builds an array of Python integers
+
+    Args:
+        values: iterable of integers or integer strings
+    Returns:
+        numpy array of dtype object
+    """
+
+    result = np.empty(len(values), dtype = object)
+    result[:] = [int(value) for value in values]
+    return result
+
+
+class StakingSimulator:
+    """Staking Contract storage held as arrays indexed by user
+
+    Args:
+        capacity: number of users the arrays are allocated for, they grow when needed
+        admin: admin address, sender checks are skipped when None
+    """
+
+    def __init__(self, capacity = 1024, admin = None):
+
+        self.admin = admin
+        self.totalSupply = 0
+        self.totalFee = 0
+        self.paused = False
+        self.periodFinish = 0
+        self.unstakeFee = dict(UNSTAKE_FEE)
+        self.blocksPerCycle = BLOCKS_PER_CYCLE
+        self.defaultUnstakeFee = DEFAULT_UNSTAKE_FEE
+
+        # Reward Streams, stream 0 exists since origination
+        self.streamCount = 1
+        self.rewardRate = np.zeros(MAX_REWARD_STREAMS, dtype = object)
+        self.rewardPerTokenStored = np.zeros(MAX_REWARD_STREAMS, dtype = object)
+        self.streamPeriodFinish = np.zeros(MAX_REWARD_STREAMS, dtype = np.int64)
+        self.lastUpdateTime = np.zeros(MAX_REWARD_STREAMS, dtype = np.int64)
+
+        # Users
+        self.users = {}
+        self.addresses = []
+        self.exists = np.zeros(capacity, dtype = bool)
+        self.balance = np.zeros(capacity, dtype = object)
+        self.rewards = np.zeros((capacity, MAX_REWARD_STREAMS), dtype = object)
+        self.userRewardPerTokenPaid = np.zeros((capacity, MAX_REWARD_STREAMS), dtype = object)
+        self.counter = np.zeros(capacity, dtype = np.int64)
+
+        # Lots of every user InvestMap, the first lotCount entries of the arrays are used
+        self.lotCount = 0
+        self.lotUser = np.zeros(capacity, dtype = np.int64)
+        self.lotKey = np.zeros(capacity, dtype = np.int64)
+        self.lotAmount = np.zeros(capacity, dtype = object)
+        self.lotLevel = np.zeros(capacity, dtype = np.int64)
+        self.lotLive = np.zeros(capacity, dtype = bool)
+
+        # Sorted (user, MapKey) index of the first lotIndexed lots, later lots are searched separately
+        self.lotIndexed = 0
+        self.lotIndex = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))
+
+    def index(self, addresses):
+        """Maps addresses to user indexes, allocating new users when needed
+
+        Args:
+            addresses: list of user addresses
+        Returns:
+            array of user indexes
+        """
+
+        result = np.empty(len(addresses), dtype = np.int64)
+        for position, address in enumerate(addresses):
+            user = self.users.get(address)
+            if user is None:
+                user = len(self.addresses)
+                self.users[address] = user
+                self.addresses.append(address)
+            result[position] = user
+        self.grow(len(self.addresses))
+        return result
+
+    def grow(self, size):
+        """Grows the user arrays to hold at least size users
+
+        Args:
+            size: number of users
+        """
+
+        capacity = len(self.balance)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        extra = capacity - len(self.balance)
+        self.exists = np.concatenate([self.exists, np.zeros(extra, dtype = bool)])
+        self.balance = np.concatenate([self.balance, np.zeros(extra, dtype = object)])
+        self.rewards = np.concatenate([self.rewards, np.zeros((extra, MAX_REWARD_STREAMS), dtype = object)])
+        self.userRewardPerTokenPaid = np.concatenate([self.userRewardPerTokenPaid, np.zeros((extra, MAX_REWARD_STREAMS), dtype = object)])
+        self.counter = np.concatenate([self.counter, np.zeros(extra, dtype = np.int64)])
+
+    def add_lots(self, users, keys, amounts, level):
+        """Appends new lots to the lot arrays
+
+        Args:
+            users: array of user indexes
+            keys: array of MapKeys
+            amounts: object array of staked amounts
+            level: block level of the stake
+        """
+
+        start, end = self.lotCount, self.lotCount + len(users)
+        if end > len(self.lotUser):
+            extra = max(end, 2 * len(self.lotUser)) - len(self.lotUser)
+            self.lotUser = np.concatenate([self.lotUser, np.zeros(extra, dtype = np.int64)])
+            self.lotKey = np.concatenate([self.lotKey, np.zeros(extra, dtype = np.int64)])
+            self.lotAmount = np.concatenate([self.lotAmount, np.zeros(extra, dtype = object)])
+            self.lotLevel = np.concatenate([self.lotLevel, np.zeros(extra, dtype = np.int64)])
+            self.lotLive = np.concatenate([self.lotLive, np.zeros(extra, dtype = bool)])
+
+        self.lotUser[start:end] = users
+        self.lotKey[start:end] = keys
+        self.lotAmount[start:end] = amounts
+        self.lotLevel[start:end] = level
+        self.lotLive[start:end] = True
+        self.lotCount = end
+
+        # Re-sorting every lot each block would dominate the run time, so the index is rebuilt
+        # only once the lots added since the last build are a sizeable share of all the lots
+        if self.lotCount - self.lotIndexed > max(1024, self.lotIndexed // 4):
+            self.lotIndex = self.sort_lots(0, self.lotCount)
+            self.lotIndexed = self.lotCount
+
+    def sort_lots(self, start, end):
+        """Builds a sorted (user, MapKey) index over a range of lots
+
+        Args:
+            start: first lot of the range
+            end: lot after the last one of the range
+        Returns:
+            (sortedComposite, positions): sorted composite keys and the lot position of each one
+        """
+
+        composite = (self.lotUser[start:end] << 32) | self.lotKey[start:end]
+        order = np.argsort(composite, kind = "stable")
+        return composite[order], order + start
+
+    def find_lots(self, users, keys):
+        """Looks up lots by user and MapKey
+
+        Args:
+            users: array of user indexes
+            keys: array of MapKeys
+        Returns:
+            (found, lots): mask of existing lots and their positions in the lot arrays
+        """
+
+        query = (users << 32) | keys
+        found = np.zeros(len(users), dtype = bool)
+        lots = np.zeros(len(users), dtype = np.int64)
+
+        for sortedComposite, positions in (self.lotIndex, self.sort_lots(self.lotIndexed, self.lotCount)):
+            if len(sortedComposite) == 0:
+                continue
+            position = np.minimum(np.searchsorted(sortedComposite, query), len(sortedComposite) - 1)
+            hit = (sortedComposite[position] == query) & ~found
+            lots[hit] = positions[position[hit]]
+            found |= hit
+
+        found &= self.lotLive[lots]
+        return found, lots
+
+    def reward_per_token(self, level):
+        """Computes the reward per token of every stream at a level without updating the storage
+
+        Args:
+            level: block level
+        Returns:
+            (rewardPerToken, lastUpdate): arrays over the reward streams
+        """
+
+        streams = self.streamCount
+        lastUpdate = np.minimum(level, self.streamPeriodFinish[:streams])
+        rewardPerToken = self.rewardPerTokenStored[:streams].copy()
+        if self.totalSupply != 0:
+            elapsed = (lastUpdate - self.lastUpdateTime[:streams]).astype(object)
+            rewardPerToken += elapsed * DECIMAL * self.rewardRate[:streams] // self.totalSupply
+        return rewardPerToken, lastUpdate
+
+    def update_global(self, level):
+        """Contract level part of UpdateReward, settling every reward stream
+
+        Calling it again in the same block leaves the storage unchanged.
+
+        Args:
+            level: block level
+        """
+
+        streams = self.streamCount
+        rewardPerToken, lastUpdate = self.reward_per_token(level)
+        self.rewardPerTokenStored[:streams] = rewardPerToken
+        self.lastUpdateTime[:streams] = lastUpdate
+
+    def settle(self, users):
+        """User level part of UpdateReward for many users at once
+
+        Args:
+            users: array of user indexes
+        """
+
+        users = np.unique(users)
+        streams = self.streamCount
+        rewardPerToken = self.rewardPerTokenStored[:streams]
+        earned = self.balance[users][:, None] * (rewardPerToken[None, :] - self.userRewardPerTokenPaid[users, :streams])
+        self.rewards[users, :streams] += earned // DECIMAL
+        self.userRewardPerTokenPaid[users, :streams] = rewardPerToken
+
+    def apply_admin(self, level, sender, entrypoint, params):
+        """Applies one admin call
+
+        Args:
+            level: block level
+            sender: address calling the contract
+            entrypoint: entrypoint name
+            params: entrypoint parameters
+        Returns:
+            whether the call succeeded
+        """
+
+        if self.admin is not None and sender != self.admin:
+            return False
+
+        if entrypoint == "changeAdmin":
+            self.admin = params if isinstance(params, str) else params["address"]
+
+        elif entrypoint == "changeState":
+            self.paused = not self.paused
+
+        elif entrypoint == "changeUnstakeFee":
+            self.unstakeFee[int(params["cycles"])] = int(params["fee"])
+            self.blocksPerCycle = int(params["blocksPerCycle"])
+            self.defaultUnstakeFee = int(params["defaultFee"])
+
+        elif entrypoint == "AddRewardStream":
+            if self.streamCount >= MAX_REWARD_STREAMS:
+                return False
+            self.streamCount += 1
+
+        elif entrypoint == "AddReward":
+            streamId = int(params.get("streamId", 0))
+            reward = int(params["reward"])
+            blocks = int(params["blocks"])
+            if streamId >= self.streamCount or blocks == 0:
+                return False
+            self.update_global(level)
+            if level >= self.streamPeriodFinish[streamId]:
+                self.rewardRate[streamId] = reward // blocks
+            else:
+                leftOver = int(self.streamPeriodFinish[streamId] - level) * self.rewardRate[streamId]
+                self.rewardRate[streamId] = (leftOver + reward) // blocks
+            self.lastUpdateTime[streamId] = level
+            self.streamPeriodFinish[streamId] = level + blocks
+            self.periodFinish = max(self.periodFinish, level + blocks)
+
+        return True
+
+    def apply_stakes(self, level, users, amounts):
+        """Applies the stake calls of a block
+
+        Args:
+            level: block level
+            users: array of user indexes
+            amounts: object array of staked amounts
+        Returns:
+            number of failed calls
+        """
+
+        valid = (amounts > 0).astype(bool)
+        if self.paused or level > self.periodFinish:
+            valid[:] = False
+        users, amounts = users[valid], amounts[valid]
+        if len(users) == 0:
+            return int((~valid).sum())
+
+        self.update_global(level)
+        self.exists[users] = True
+        self.settle(users)
+
+        np.add.at(self.balance, users, amounts * MULTIPLIER)
+        self.totalSupply += int(amounts.sum()) * MULTIPLIER
+
+        keys = self.counter[users] + occurrence_rank(users)
+        np.add.at(self.counter, users, 1)
+
+        self.add_lots(users, keys, amounts, level)
+
+        return int((~valid).sum())
+
+    def fee_divisors(self, cycles):
+        """Looks up the unstake fee divisor of every cycle count
+
+        Args:
+            cycles: array of cycle counts
+        Returns:
+            array of fee divisors
+        """
+
+        largest = max(self.unstakeFee, default = 0)
+        table = np.full(largest + 2, self.defaultUnstakeFee, dtype = np.int64)
+        for cycle, fee in self.unstakeFee.items():
+            table[cycle] = fee
+        return table[np.minimum(cycles, largest + 1)]
+
+    def apply_unstakes(self, level, users, keys, amounts):
+        """Applies the unstake calls of a block
+
+        Calls hitting the same lot are applied in rounds, so a later call sees the lot
+        amount left by the earlier ones.
+
+        Args:
+            level: block level
+            users: array of user indexes
+            keys: array of MapKeys
+            amounts: object array of unstaked amounts
+        Returns:
+            (failed, unstaked, fees): failed calls, amount paid back and fee collected
+        """
+
+        failed, unstaked, fees = 0, 0, 0
+        if len(users) == 0:
+            return failed, unstaked, fees
+
+        rank = occurrence_rank((users << 32) | keys)
+        for stage in range(int(rank.max()) + 1):
+            selected = rank == stage
+            roundUsers, roundKeys, roundAmounts = users[selected], keys[selected], amounts[selected]
+
+            found, lots = self.find_lots(roundUsers, roundKeys)
+            valid = self.exists[roundUsers] & found
+            valid[valid] = (self.lotAmount[lots[valid]] >= roundAmounts[valid]).astype(bool)
+            roundUsers, lots, roundAmounts = roundUsers[valid], lots[valid], roundAmounts[valid]
+
+            # The contract division fails when changeUnstakeFee set blocksPerCycle to 0
+            if self.blocksPerCycle == 0:
+                payable = np.zeros(len(lots), dtype = bool)
+                divisors = np.zeros(len(lots), dtype = np.int64)
+            else:
+                cycles = (level - self.lotLevel[lots]) // self.blocksPerCycle + 1
+                divisors = self.fee_divisors(cycles)
+                payable = divisors != 0
+
+            failed += int((~valid).sum()) + int((~payable).sum())
+            roundUsers, lots, roundAmounts, divisors = roundUsers[payable], lots[payable], roundAmounts[payable], divisors[payable]
+            if len(roundUsers) == 0:
+                continue
+
+            self.update_global(level)
+            self.settle(roundUsers)
+
+            np.subtract.at(self.balance, roundUsers, roundAmounts * MULTIPLIER)
+            self.totalSupply -= int(roundAmounts.sum()) * MULTIPLIER
+
+            self.lotLive[lots] = self.lotAmount[lots] != roundAmounts
+            self.lotAmount[lots] = self.lotAmount[lots] - roundAmounts
+
+            fee = roundAmounts // divisors.astype(object)
+            self.totalFee += int(fee.sum())
+            fees += int(fee.sum())
+            unstaked += int((roundAmounts - fee).sum())
+
+        return failed, unstaked, fees
+
+    def apply_claims(self, level, users):
+        """Applies the GetReward calls of a block
+
+        Args:
+            level: block level
+            users: array of user indexes
+        Returns:
+            (failed, paidUsers, payouts): failed calls, users paid and their payout per stream
+        """
+
+        valid = self.exists[users]
+        paidUsers = np.unique(users[valid])
+        if len(paidUsers) == 0:
+            return int((~valid).sum()), paidUsers, np.zeros((0, self.streamCount), dtype = object)
+
+        self.update_global(level)
+        self.settle(paidUsers)
+
+        payouts = self.rewards[paidUsers, :self.streamCount].copy()
+        self.rewards[paidUsers, :self.streamCount] = 0
+
+        return int((~valid).sum()), paidUsers, payouts
+
+    def apply_block(self, level, calls):
+        """Applies all the calls of one block
+
+        Args:
+            level: block level
+            calls: list of (sender, entrypoint, params)
+        Returns:
+            dict holding the failed calls, unstaked amount, fees and reward payouts of the block
+        """
+
+        failed, unstaked, fees = 0, 0, 0
+        paidUsers, payouts = [], []
+
+        # Runs of consecutive calls to the same entrypoint, a run ends at the first call of another entrypoint
+        for entrypoint, group in itertools.groupby(calls, key = lambda call: call[1]):
+            group = list(group)
+
+            if entrypoint in ADMIN_ENTRYPOINTS:
+                for sender, _, params in group:
+                    failed += not self.apply_admin(level, sender, entrypoint, params)
+
+            elif entrypoint == "stake":
+                failed += self.apply_stakes(level, self.index([sender for sender, _, params in group]), objects([params["amount"] for _, _, params in group]))
+
+            elif entrypoint == "unstake":
+                users = self.index([sender for sender, _, params in group])
+                keys = np.array([int(params["MapKey"]) for _, _, params in group], dtype = np.int64)
+                runFailed, runUnstaked, runFees = self.apply_unstakes(level, users, keys, objects([params["Amount"] for _, _, params in group]))
+                failed, unstaked, fees = failed + runFailed, unstaked + runUnstaked, fees + runFees
+
+            elif entrypoint == "GetReward":
+                runFailed, runUsers, runPayouts = self.apply_claims(level, self.index([sender for sender, _, params in group]))
+                failed += runFailed
+                paidUsers.append(runUsers)
+                payouts.append(runPayouts)
+
+        # A stream added between two GetReward runs widens the payouts of the later runs
+        paidUsers = np.concatenate(paidUsers) if paidUsers else np.zeros(0, dtype = np.int64)
+        widened = np.zeros((len(paidUsers), self.streamCount), dtype = object)
+        row = 0
+        for runPayouts in payouts:
+            widened[row:row + len(runPayouts), :runPayouts.shape[1]] = runPayouts
+            row += len(runPayouts)
+        payouts = widened
+
+        return dict(failed = failed, unstaked = unstaked, fees = fees, paidUsers = paidUsers, payouts = payouts)
+
+    def pending_rewards(self, level):
+        """Estimates the rewards every user could claim at a level
+
+        Args:
+            level: block level
+        Returns:
+            object array of shape (users, streams)
+        """
+
+        users = len(self.addresses)
+        rewardPerToken, _ = self.reward_per_token(level)
+        earned = self.balance[:users, None] * (rewardPerToken[None, :] - self.userRewardPerTokenPaid[:users, :self.streamCount])
+        return self.rewards[:users, :self.streamCount] + earned // DECIMAL
+
+    def reward_yield(self, level, blocksPerYear = BLOCKS_PER_YEAR):
+        """Computes the yearly reward of every stream per staked token at the current rates
+
+        Args:
+            level: block level, streams past their period finish yield nothing
+            blocksPerYear: number of blocks in a year
+        Returns:
+            list of floats, reward token units per stake token unit per year
+        """
+
+        if self.totalSupply == 0:
+            return [0.0] * self.streamCount
+        return [
+            int(rate) * blocksPerYear * MULTIPLIER / self.totalSupply if level < finish else 0.0
+            for rate, finish in zip(self.rewardRate[:self.streamCount], self.streamPeriodFinish[:self.streamCount])
+        ]
+
+
+def iter_blocks(events):
+    """Groups consecutive events of the same level
+
+    Args:
+        events: iterable of (level, sender, entrypoint, params)
+    Yields:
+        (level, [(sender, entrypoint, params), ...])
+    """
+
+    for level, group in itertools.groupby(events, key = lambda event: event[0]):
+        yield level, [event[1:] for event in group]
+
+
+def run(events, outputDirectory, blocksPerYear = BLOCKS_PER_YEAR, simulator = None):
+    """Simulates an event stream, streaming the results to disk
+
+    Args:
+        events: iterable of (level, sender, entrypoint, params) sorted by level
+        outputDirectory: directory receiving blocks.csv, payouts.csv and users.csv
+        blocksPerYear: number of blocks in a year, used for the reward yield
+        simulator: StakingSimulator to start from, a freshly originated contract by default
+    Returns:
+        the StakingSimulator holding the final state
+    """
+
+    simulator = simulator or StakingSimulator()
+    os.makedirs(outputDirectory, exist_ok = True)
+
+    streamColumns = range(MAX_REWARD_STREAMS)
+    level = 0
+
+    with open(os.path.join(outputDirectory, "blocks.csv"), "w", newline = "") as blocksFile, \
+         open(os.path.join(outputDirectory, "payouts.csv"), "w", newline = "") as payoutsFile:
+
+        blocks = csv.writer(blocksFile)
+        blocks.writerow(
+            ["level", "totalSupply", "totalFee", "failed", "unstaked", "fees"]
+            + ["rewardPerToken_%d" % stream for stream in streamColumns]
+            + ["rewardRate_%d" % stream for stream in streamColumns]
+            + ["paid_%d" % stream for stream in streamColumns]
+            + ["yield_%d" % stream for stream in streamColumns]
+        )
+        payouts = csv.writer(payoutsFile)
+        payouts.writerow(["level", "address", "streamId", "amount"])
+
+        for level, calls in iter_blocks(events):
+            result = simulator.apply_block(level, calls)
+
+            paid = [int(total) for total in result["payouts"].sum(axis = 0)] if len(result["paidUsers"]) else [0] * simulator.streamCount
+            padding = [""] * (MAX_REWARD_STREAMS - simulator.streamCount)
+            blocks.writerow(
+                [level, simulator.totalSupply, simulator.totalFee, result["failed"], result["unstaked"], result["fees"]]
+                + [int(value) for value in simulator.rewardPerTokenStored[:simulator.streamCount]] + padding
+                + [int(value) for value in simulator.rewardRate[:simulator.streamCount]] + padding
+                + paid + padding
+                + simulator.reward_yield(level, blocksPerYear) + padding
+            )
+
+            for user, amounts in zip(result["paidUsers"], result["payouts"]):
+                for stream, amount in enumerate(amounts):
+                    if amount:
+                        payouts.writerow([level, simulator.addresses[user], stream, amount])
+
+    with open(os.path.join(outputDirectory, "users.csv"), "w", newline = "") as usersFile:
+        users = csv.writer(usersFile)
+        users.writerow(["address", "balance", "lots"] + ["pendingReward_%d" % stream for stream in range(simulator.streamCount)])
+        pending = simulator.pending_rewards(level)
+        for user, address in enumerate(simulator.addresses):
+            users.writerow([address, simulator.balance[user] // MULTIPLIER, simulator.counter[user]] + list(pending[user]))
+
+    return simulator
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Simulates Staking Contract rewards from a JSONL event log")
+    parser.add_argument("events", help = "JSONL event log sorted by level")
+    parser.add_argument("output", help = "directory receiving the CSV results")
+    parser.add_argument("--admin", help = "admin address at origination, admin checks are skipped when missing")
+    parser.add_argument("--blocks-per-year", type = int, default = BLOCKS_PER_YEAR)
+    arguments = parser.parse_args()
+
+    run(read_events(arguments.events), arguments.output, arguments.blocks_per_year, StakingSimulator(admin = arguments.admin))
+
+
+if __name__ == "__main__":
+    main()
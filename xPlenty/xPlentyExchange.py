@@ -1,4 +1,12 @@
-import smartpy  as sp 
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
 
 # Single Sided AMM Contract for Swapping Plenty to get xPlenty Tokens 
 
@@ -14,10 +22,13 @@ class ErrorMessages:
                 s: error message string
             
             Returns:
-                standardized error message
+                standardized error message, its nat code when PLENTY_ERROR_CODES is set
         """
 
-        return ("xPLenty_" + s)
+        message = "xPLenty_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
     
     NotAdmin = make("Not_Admin")
 
@@ -31,94 +42,12 @@ class ErrorMessages:
 
     Paused = make("Paused_State")
 
+    ZeroTransfer = make("Zero_Amount_Transfer")
 
-class ContractLibrary(sp.Contract,ErrorMessages):
-
-    """
-        Provides utility functions 
-    """
-
-    def TransferFATwoTokens(sender,receiver,amount,tokenAddress,id):
-        """
-            Transfers FA2 tokens
-        
-            Args:
-                sender: sender address
-                receiver: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the FA2 contract
-                id: id of token to be transferred
-        """
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = receiver,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(sender,reciever,amount,tokenAddress): 
-        """
-            Transfers FA1.2 tokens
-        
-            Args:
-                sender: sender address
-                reciever: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the FA1.2 contract
-        """
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = reciever, 
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
-
-    def TransferToken(sender, receiver, amount, tokenAddress,id, faTwoFlag): 
-
-        """
-            Generic function to transfer any type of tokens
-        
-            Args:
-                sender: sender address
-                reciever: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the token contract
-                id: id of token to be transfered (for FA2 tokens)
-                faTwoFlag: boolean describing whether the token contract is FA2 or not
-        """
-
-        sp.if faTwoFlag: 
-
-            ContractLibrary.TransferFATwoTokens(sender, receiver, amount , tokenAddress, id )
+    RecoverPlenty = make("Plenty_Not_Recoverable")
 
-        sp.else: 
 
-            ContractLibrary.TransferFATokens(sender, receiver, amount, tokenAddress)
-    
-
-class SwapContract(ContractLibrary): 
+class SwapContract(ErrorMessages, Library.ContractLibrary): 
 
     def __init__(self,_admin,_plentyTokenAddress,_xPlentyTokenAddress):
 
@@ -225,13 +154,13 @@ class SwapContract(ContractLibrary):
 
         # Verify Check 
 
-        sp.verify(tokenMinted.value >= self.data.minimumxPlentyToken.open_some())
+        sp.verify(tokenMinted.value >= self.data.minimumxPlentyToken.open_some(), ErrorMessages.LessPlentySwapTokens)
 
         self.data.totalSupply += tokenMinted.value
 
         # Transfer Plenty Tokens 
 
-        ContractLibrary.TransferFATokens(self.data.senderAddress.open_some(), sp.self_address, self.data.senderAmount.open_some(), self.data.plentyTokenAddress)
+        self.TransferFATokens(self.data.senderAddress.open_some(), sp.self_address, self.data.senderAmount.open_some(), self.data.plentyTokenAddress)
 
         # Mint xPlenty Tokens 
 
@@ -315,13 +244,13 @@ class SwapContract(ContractLibrary):
 
         sp.verify(sp.sender  == self.data.plentyTokenAddress, ErrorMessages.NotPlenty)
 
-        sp.verify(self.data.Locked)
+        sp.verify(self.data.Locked, ErrorMessages.LockCheck)
 
         plentyAccrued = sp.local('plentyAccrued', sp.nat(0))
 
         plentyAccrued.value = ( self.data.senderAmount.open_some() * PlentyBalance )  / self.data.totalSupply 
 
-        sp.verify(plentyAccrued.value >= self.data.minimumPlentyToken.open_some())
+        sp.verify(plentyAccrued.value >= self.data.minimumPlentyToken.open_some(), ErrorMessages.LessPlentySwapTokens)
 
         self.data.totalSupply = sp.as_nat(self.data.totalSupply - self.data.senderAmount.open_some())
 
@@ -341,7 +270,7 @@ class SwapContract(ContractLibrary):
 
         # Transfer Plenty 
 
-        ContractLibrary.TransferFATokens(sp.self_address, self.data.recipientAddress.open_some(), plentyAccrued.value, self.data.plentyTokenAddress)
+        self.TransferFATokens(sp.self_address, self.data.recipientAddress.open_some(), plentyAccrued.value, self.data.plentyTokenAddress)
 
         # Reset Values 
 
@@ -354,7 +283,7 @@ class SwapContract(ContractLibrary):
         self.data.minimumPlentyToken = sp.none 
 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def ChangeState(self): 
         """
             Admin Function to Change the State of the Contract 
@@ -365,7 +294,7 @@ class SwapContract(ContractLibrary):
 
         self.data.paused = ~ self.data.paused
     
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeAdmin(self,adminAddress): 
 
         """
@@ -378,7 +307,7 @@ class SwapContract(ContractLibrary):
 
         self.data.admin = adminAddress
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeRewardManager(self,rewardManagerAddress): 
         """"
             Admin Function to update Reward Manager Address
@@ -393,7 +322,7 @@ class SwapContract(ContractLibrary):
         self.data.rewardManagerAddress = rewardManagerAddress
 
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def RecoverExcessToken(self,params): 
         """
             Admin function to Recover any other Token received by the Contract
@@ -411,9 +340,9 @@ class SwapContract(ContractLibrary):
 
         sp.verify(sp.sender == self.data.admin, ErrorMessages.NotAdmin)
 
-        sp.verify(params.tokenAddress != self.data.plentyTokenAddress)
+        sp.verify(params.tokenAddress != self.data.plentyTokenAddress, ErrorMessages.RecoverPlenty)
 
-        ContractLibrary.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
+        self.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
 
 
 
@@ -1,4 +1,12 @@
-import smartpy as sp 
+import os
+
+import smartpy as sp
+
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
 
 # Reward Mananger for xPLENTY 
 
@@ -14,10 +22,13 @@ class ErrorMessages:
                 s: error message string
             
             Returns:
-                standardized error message
+                standardized error message, its nat code when PLENTY_ERROR_CODES is set
         """
 
-        return ("xPlenty_" + s)
+        message = "xPlenty_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
     
     NotAdmin = make("Not_Admin")
 
@@ -39,93 +50,9 @@ class ErrorMessages:
 
     LowBalance = make("Low_Plenty_Balance")
 
-class ContractLibrary(sp.Contract,ErrorMessages):
-
-    """
-        Provides utility functions 
-    """
-
-    def TransferFATwoTokens(sender,receiver,amount,tokenAddress,id):
-        """
-            Transfers FA2 tokens
-        
-            Args:
-                sender: sender address
-                receiver: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the FA2 contract
-                id: id of token to be transferred
-        """
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = receiver,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(sender,reciever,amount,tokenAddress): 
-        """
-            Transfers FA1.2 tokens
-        
-            Args:
-                sender: sender address
-                reciever: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the FA1.2 contract
-        """
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = reciever, 
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
-
-    def TransferToken(sender, receiver, amount, tokenAddress,id, faTwoFlag): 
-
-        """
-            Generic function to transfer any type of tokens
-        
-            Args:
-                sender: sender address
-                reciever: reciever address
-                amount: amount of tokens to be transferred
-                tokenAddress: address of the token contract
-                id: id of token to be transfered (for FA2 tokens)
-                faTwoFlag: boolean describing whether the token contract is FA2 or not
-        """
-
-        sp.if faTwoFlag: 
+    ZeroTransfer = make("Zero_Amount_Transfer")
 
-            ContractLibrary.TransferFATwoTokens(sender, receiver, amount , tokenAddress, id )
-
-        sp.else: 
-
-            ContractLibrary.TransferFATokens(sender, receiver, amount, tokenAddress)
-
-
-class RewardManager(ContractLibrary): 
+class RewardManager(ErrorMessages, Library.ContractLibrary): 
 
 
     def __init__(self,_admin,_plentyTokenAddress,_xPlentyExchangeAddress,_multiSigAddress):
@@ -196,7 +123,7 @@ class RewardManager(ContractLibrary):
     """
         In case of multiSig Address needs to add additional amount of rewards for distribution
     """
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def AddReward(self,params):
 
         sp.set_type(params, sp.TRecord(blocks = sp.TNat, reward = sp.TNat))
@@ -217,7 +144,7 @@ class RewardManager(ContractLibrary):
             address: account address where the systems fees will be transfered to
     """       
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def RecoverExcessToken(self,params):
 
         sp.set_type(params, sp.TRecord( tokenAddress = sp.TAddress, reciever = sp.TAddress, tokenId = sp.TNat, amount = sp.TNat, faTwoCheck = sp.TBool ))
@@ -228,9 +155,9 @@ class RewardManager(ContractLibrary):
 
             sp.verify(sp.as_nat(self.data.balance - params.amount) >= self.data.rewardRate * sp.as_nat(self.data.periodFinish - self.data.lastUpdate), ErrorMessages.LowBalance)
 
-        ContractLibrary.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
+        self.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeAdmin(self, adminAddress): 
 
         sp.set_type(adminAddress, sp.TAddress)
@@ -239,7 +166,7 @@ class RewardManager(ContractLibrary):
         
         self.data.admin = adminAddress
 
-    @sp.entry_point
+    @sp.entry_point(lazify = True)
     def changeParameters(self,params): 
 
         sp.set_type(params, sp.TRecord(rewardRate = sp.TNat, blocks = sp.TNat))
@@ -269,7 +196,7 @@ class RewardManager(ContractLibrary):
 
                 reward = sp.local('reward', self.data.rewardRate * blocksDifference.value)
                 
-                ContractLibrary.TransferFATokens(sp.self_address, self.data.xPlentyExchangeAddress, reward.value, self.data.plentyTokenAddress)
+                self.TransferFATokens(sp.self_address, self.data.xPlentyExchangeAddress, reward.value, self.data.plentyTokenAddress)
 
         self.data.lastUpdate = sp.level 
 
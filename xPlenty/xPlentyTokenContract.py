@@ -1,8 +1,16 @@
 # Fungible Assets - FA12
 # Inspired by https://gitlab.com/tzip/tzip/blob/master/A/FA1.2.md
 
+import os
+
 import smartpy as sp
 
+# Errors are compiled as nat codes instead of strings when PLENTY_ERROR_CODES is set, decoded by tools/error_codes.py
+ERROR_CODES = {} if os.environ.get("PLENTY_ERROR_CODES") else None
+
+# Shared token transfer and math helpers
+Library = sp.io.import_script_from_url("file:Library/ContractLibrary.py")
+
 DECIMAL = 1000000000000000000 # 18 Decimals 
 
 # The metadata below is just an example, it serves as a base,
@@ -23,7 +31,11 @@ TZIP16_Metadata_Base = {
 
 # A collection of error messages used in the contract.
 class FA12_Error:
-    def make(s): return ("xPlenty_" + s)
+    def make(s):
+        message = "xPlenty_" + s
+        if ERROR_CODES is None:
+            return message
+        return sp.nat(ERROR_CODES.setdefault(message, len(ERROR_CODES)))
 
     NotAdmin                        = make("NotAdmin")
     InsufficientBalance             = make("InsufficientBalance")
@@ -263,60 +275,7 @@ class FA12_core(sp.Contract, FA12_common):
     def is_administrator(self, sender):
         return sp.bool(False)
 
-class ContractLibrary(sp.Contract):
-
-
-    def TransferFATwoTokens(sender,reciever,amount,tokenAddress,id):
-
-        arg = [
-            sp.record(
-                from_ = sender,
-                txs = [
-                    sp.record(
-                        to_         = reciever,
-                        token_id    = id , 
-                        amount      = amount 
-                    )
-                ]
-            )
-        ]
-
-        transferHandle = sp.contract(
-            sp.TList(sp.TRecord(from_=sp.TAddress, txs=sp.TList(sp.TRecord(amount=sp.TNat, to_=sp.TAddress, token_id=sp.TNat).layout(("to_", ("token_id", "amount")))))), 
-            tokenAddress,
-            entry_point='transfer').open_some()
-
-        sp.transfer(arg, sp.mutez(0), transferHandle)
-
-
-    def TransferFATokens(sender,reciever,amount,tokenAddress): 
-
-        TransferParam = sp.record(
-            from_ = sender, 
-            to_ = reciever, 
-            value = amount
-        )
-
-        transferHandle = sp.contract(
-            sp.TRecord(from_ = sp.TAddress, to_ = sp.TAddress, value = sp.TNat).layout(("from_ as from", ("to_ as to", "value"))),
-            tokenAddress,
-            "transfer"
-            ).open_some()
-
-        sp.transfer(TransferParam, sp.mutez(0), transferHandle)
-
-    def TransferToken(sender, reciver, amount, tokenAddress,id, faTwoFlag): 
-
-        sp.if faTwoFlag: 
-
-            ContractLibrary.TransferFATwoTokens(sender, reciver, amount , tokenAddress, id )
-
-        sp.else: 
-
-            ContractLibrary.TransferFATokens(sender, reciver, amount, tokenAddress)
-
-    
-class FA12_mint_burn(FA12_core, ContractLibrary):
+class FA12_mint_burn(FA12_core, FA12_Error, Library.ContractLibrary):
 
     @sp.entry_point
     def mint(self,params):
@@ -382,7 +341,7 @@ class FA12_mint_burn(FA12_core, ContractLibrary):
 
         sp.verify(self.is_administrator(sp.sender), FA12_Error.NotAdmin)
 
-        ContractLibrary.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
+        self.TransferToken(sp.self_address, params.reciever, params.amount, params.tokenAddress, params.tokenId, params.faTwoCheck)
 
 class FA12_administrator(FA12_core):
     def is_administrator(self, sender):